@@ -4,6 +4,10 @@
 # send and receives messages.  All instances of Client share a single TCP socket,
 # and can also communicate amongst themselves whether the socket is connected or
 # not.
+# Set Client.connection_name before creating the first Client to connect
+# somewhere else, or to "shm:" to connect to a server on the same host through
+# shared memory, or to "mcast://group:port" to only receive the messages a
+# server publishes to a multicast group.
 #
 import gevent.queue
 import gevent.monkey
@@ -13,6 +17,9 @@ import sys
 import socket
 import time
 from msgtools.lib.messaging import Messaging
+from msgtools.lib.framer import MessageFramer
+from msgtools.lib.shm_ring import ShmSocket, socketPath
+from msgtools.lib.multicast import MulticastSocket, parseAddress
 from msgtools.sim.sim_exec import SimExec
 
 class Client:
@@ -22,6 +29,8 @@ class Client:
     # Each client blocks on reading from it's own gevent.queue
     _sock = None
     _socket_connected = False
+    # Splits data read from the socket into messages
+    _framer = None
     # A totally separate coroutine does a blocking read with infinite timeout,
     # and writes to all the Client queues.
     _rx_greenlet = None
@@ -29,7 +38,12 @@ class Client:
     _name = None
     # record particular messages the user wants to record, even if they never called recv on them
     _extra_msgs_to_record = {}
+    # rate limited and filtered subscriptions, to send again if the socket reconnects
+    _subscription_msgs = {}
     received = {}
+    # "ip:port" of the server, "shm:" or "shm://<socket path>" for shared memory,
+    # or "mcast://group:port" for multicast
+    connection_name = "127.0.0.1:5678"
     def __init__(self, name='Client', timeout=10):
         # keep a reference to Messages, for convenience of cmdline scripts
         self.Messages = Messaging.Messages
@@ -64,7 +78,7 @@ class Client:
         Client._clients.append(self)
 
     # This will be called once on startup with retry=False, and after that,
-    # will only be called from the read_msg_from_socket() greenlet thread,
+    # will only be called from the read_msgs_from_socket() greenlet thread,
     # with retry=True.  Because of that, if retry=True, we'll gevent.sleep()
     # when called with retry==True, to prevent too much network activity.
     @staticmethod
@@ -75,19 +89,32 @@ class Client:
             # isn't even running.
             gevent.sleep(0.5)
         try:
-            Client._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            Client._sock.connect(("127.0.0.1", 5678))
-            Client._sock.setblocking(True)
-            Client._sock.settimeout(None)
+            Client._framer = MessageFramer(Messaging.hdr)
+            if Client.connection_name.startswith("shm:"):
+                # works like a blocking socket
+                Client._sock = ShmSocket(socketPath(Client.connection_name))
+            elif Client.connection_name.startswith("mcast:"):
+                # also works like a blocking socket, but receive-only
+                Client._sock = MulticastSocket(*parseAddress(Client.connection_name[len("mcast:"):]))
+            else:
+                (ip, port) = Client.connection_name.rsplit(":",1)
+                Client._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                Client._sock.connect((ip if ip else "127.0.0.1", int(port) if port else 5678))
+                Client._sock.setblocking(True)
+                Client._sock.settimeout(None)
 
-            # do default subscription to get *everything*
-            subscribeMsg = Messaging.Messages.Network.MaskedSubscription()
-            Client.static_send(subscribeMsg)
+            # multicast has no server to subscribe with or connect to
+            if not Client.connection_name.startswith("mcast:"):
+                # do default subscription to get *everything*
+                subscribeMsg = Messaging.Messages.Network.MaskedSubscription()
+                Client.static_send(subscribeMsg)
+                for subMsg in Client._subscription_msgs.values():
+                    Client.static_send(subMsg)
 
-            # Send the connect message with the name
-            connectMsg = Messaging.Messages.Network.Connect()
-            connectMsg.SetName(Client._name)
-            Client.static_send(connectMsg)
+                # Send the connect message with the name
+                connectMsg = Messaging.Messages.Network.Connect()
+                connectMsg.SetName(Client._name)
+                Client.static_send(connectMsg)
             Client._socket_connected = True
         except:
             Client._socket_connected = False
@@ -123,6 +150,59 @@ class Client:
         Client.static_send(msg)
         Client.queue_for_clients(msg, self)
 
+    # Asks the server to send messages with these IDs (or classes) at most
+    # max_rate times a second, keeping the latest, or only one of every
+    # every_nth of them.  With neither, the rate limit is removed.  Limits
+    # apply to all Clients, since they share one socket.
+    # With a mask, msgIds are values that IDs & mask must match instead.
+    @staticmethod
+    def rate_limit(msgIds, max_rate=0, every_nth=0, mask=0xFFFFFFFF):
+        if not isinstance(msgIds, list):
+            msgIds = [msgIds]
+        for msgId in msgIds:
+            if hasattr(msgId, 'ID'):
+                msgId = msgId.ID
+            subMsg = Messaging.Messages.Network.RateLimitedSubscription()
+            subMsg.SetMask(mask)
+            subMsg.SetValue(msgId)
+            if every_nth:
+                subMsg.SetMode("EveryNth")
+                subMsg.SetDecimation(every_nth)
+            elif max_rate:
+                subMsg.SetMode("KeepLatest")
+                subMsg.SetMaxRate(max_rate)
+            else:
+                subMsg.SetMode("Remove")
+            key = ('rate', mask, msgId & mask)
+            if every_nth or max_rate:
+                Client._subscription_msgs[key] = subMsg
+            else:
+                Client._subscription_msgs.pop(key, None)
+            Client.static_send(subMsg)
+
+    # Asks the server to only send messages with these IDs (or classes) whose
+    # contents match filter, like "FieldB > 5 and hdr.Source == 3".  An empty
+    # filter removes it.  Filters apply to all Clients, since they share one
+    # socket.
+    # With a mask, msgIds are values that IDs & mask must match instead.
+    @staticmethod
+    def filter(msgIds, filter, mask=0xFFFFFFFF):
+        if not isinstance(msgIds, list):
+            msgIds = [msgIds]
+        for msgId in msgIds:
+            if hasattr(msgId, 'ID'):
+                msgId = msgId.ID
+            subMsg = Messaging.Messages.Network.FilteredSubscription()
+            subMsg.SetMask(mask)
+            subMsg.SetValue(msgId)
+            subMsg.SetFilter(filter)
+            key = ('filter', mask, msgId & mask)
+            if filter:
+                Client._subscription_msgs[key] = subMsg
+            else:
+                Client._subscription_msgs.pop(key, None)
+            Client.static_send(subMsg)
+
     @staticmethod
     def queue_for_clients(msg, excluded_client):
         if len(Client._clients) > 0:#1:
@@ -130,28 +210,16 @@ class Client:
                 if c != excluded_client:
                     c._rx_queue.put(msg)
 
+    # Does one read of as much data as is available, and returns a list of all
+    # the messages in it.
     @staticmethod
-    def read_msg_from_socket():
+    def read_msgs_from_socket():
         try:
-            # see if there's enough for header
-            data = Client._sock.recv(Messaging.hdr.SIZE, socket.MSG_PEEK)
-            if len(data) == Messaging.hdr.SIZE:
-                # create header based on peek'd data
-                hdr = Messaging.hdr(data)
-
-                # see if there's enough for the body, too
-                data += Client._sock.recv(hdr.GetDataLength(), socket.MSG_PEEK)
-                if len(data) != Messaging.hdr.SIZE + hdr.GetDataLength():
-                    #print("didn't get whole body, error!")
-                    return None
-
-                # read out what we peek'd.
-                data = Client._sock.recv(Messaging.hdr.SIZE + hdr.GetDataLength())
-
-                # reset the header based on appended data
-                hdr = Messaging.hdr(data)
-                msg = Messaging.MsgFactory(hdr)
-                return msg
+            framer = Client._framer
+            count = Client._sock.recv_into(framer.write_buffer(65536))
+            if count > 0:
+                framer.commit(count)
+                return [Messaging.MsgFactory(Messaging.hdr(data)) for data in framer.messages()]
             else:
                 # reopen the socket
                 Client.reconnect_socket()
@@ -161,17 +229,16 @@ class Client:
             Client.reconnect_socket()
         except socket.timeout:
             print("timeout")
-            return None
+            return []
         except BlockingIOError:
             print('blocking')
-            return None
-        return None
+            return []
+        return []
 
     @staticmethod
     def read_for_all_clients():
         while True:
-            msg = Client.read_msg_from_socket()
-            if msg:
+            for msg in Client.read_msgs_from_socket():
                 #TODO Should we put everything in the queue?
                 #TODO The client might decide to receive a message by ID
                 #TODO after it got read from the socket, in which case we'd miss it.
@@ -180,11 +247,9 @@ class Client:
                 #TODO nothing is read from the socket until the Client
                 #TODO decides to read and passes a list of msgIds.
                 Client.queue_for_clients(msg, None)
-            else:
-                # If the server disconnects we'll get to this case.
-                # That's ok because read_msg_from_socket() will attempt
-                # to reconnect.
-                pass
+            # If the server disconnects there won't be any messages.
+            # That's ok because read_msgs_from_socket() will attempt
+            # to reconnect.
 
     def recv(self, msgIds=[], timeout=None):
         # if user didn't pass a list, put the single param into a list
@@ -62,17 +62,13 @@ class InfluxDBConnection:
             if timeVal == 0.0:
                 timeVal = time.time()
             else:
-                timeInfo = Messaging.findFieldInfo(msg.hdr.fields, "Time")
+                timeInfo, timeScale = Messaging.HeaderTimeInfo(type(msg.hdr))
                 maxTime = timeInfo.maxVal
                 # if it's not big enough to be an absolute timestamp, give up on using it and just use current time
                 if maxTime != "DBL_MAX" and (maxTime == 'FLT_MAX' or float(maxTime) <= 2**32):
                     raise AttributeError
-                if timeInfo.units == "ms":
-                    timeVal = timeVal * 1.0e-3
-                elif timeInfo.units == "us":
-                    timeVal = timeVal * 1.0e-6
-                elif timeInfo.units == "ns":
-                    timeVal = timeVal * 1.0e-9
+                if timeScale:
+                    timeVal = timeVal / timeScale
             timeVal = datetime.datetime.fromtimestamp(timeVal, datetime.timezone.utc)
         except AttributeError:
             timeVal = datetime.datetime.now()
@@ -83,27 +79,29 @@ class InfluxDBConnection:
                 'fields':  {},
                 'tags': {}
             }
+        hdrValues = Messaging.unpackAll(msg.hdr)
         for fieldInfo in msg.hdr.fields:
             if len(fieldInfo.bitfieldInfo) == 0:
                 if fieldInfo.idbits == 0 and fieldInfo.name != "Time" and fieldInfo.name != "DataLength":
-                    dbJson['tags'][fieldInfo.name] = Messaging.get(msg.hdr, fieldInfo)
+                    dbJson['tags'][fieldInfo.name] = Messaging.getUnpacked(hdrValues, msg.hdr, fieldInfo)
             else:
                 for bitInfo in fieldInfo.bitfieldInfo:
                     if bitInfo.idbits == 0 and bitInfo.name != "Time" and bitInfo.name != "DataLength":
-                        dbJson['tags'][bitInfo.name] = Messaging.get(msg.hdr, bitInfo)
+                        dbJson['tags'][bitInfo.name] = Messaging.getUnpacked(hdrValues, msg.hdr, bitInfo)
         
         msgClass = type(msg)
+        values = Messaging.unpackAll(msg)
         for fieldInfo in msgClass.fields:
             if fieldInfo.count == 1:
                 if len(fieldInfo.bitfieldInfo) == 0:
-                    dbJson['fields'][fieldInfo.name] = Messaging.get(msg, fieldInfo)
+                    dbJson['fields'][fieldInfo.name] = Messaging.getUnpacked(values, msg, fieldInfo)
                 else:
                     for bitInfo in fieldInfo.bitfieldInfo:
-                        dbJson['fields'][bitInfo.name] = Messaging.get(msg, bitInfo)
+                        dbJson['fields'][bitInfo.name] = Messaging.getUnpacked(values, msg, bitInfo)
             else:
                 # flatten arrays
                 for i in range(0,fieldInfo.count):
-                    dbJson['fields'][fieldInfo.name+"_"+str(i)] = Messaging.get(msg, fieldInfo, i)
+                    dbJson['fields'][fieldInfo.name+"_"+str(i)] = Messaging.getUnpacked(values, msg, fieldInfo, i)
 
         # Can't store with no fields!  Add a boolean to indicate emptiness
         if len(dbJson['fields']) == 0:
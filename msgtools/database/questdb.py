@@ -70,17 +70,13 @@ class QuestDBConnection:
             if timeVal == 0.0:
                 timeVal = time.time()
             else:
-                timeInfo = Messaging.findFieldInfo(msg.hdr.fields, "Time")
+                timeInfo, timeScale = Messaging.HeaderTimeInfo(type(msg.hdr))
                 maxTime = timeInfo.maxVal
                 # if it's not big enough to be an absolute timestamp, give up on using it and just use current time
                 if maxTime != "DBL_MAX" and (maxTime == 'FLT_MAX' or float(maxTime) <= 2**32):
                     raise AttributeError
-                if timeInfo.units == "ms":
-                    timeVal = timeVal * 1.0e-3
-                elif timeInfo.units == "us":
-                    timeVal = timeVal * 1.0e-6
-                elif timeInfo.units == "ns":
-                    timeVal = timeVal * 1.0e-9
+                if timeScale:
+                    timeVal = timeVal / timeScale
             timeVal = datetime.datetime.fromtimestamp(timeVal, datetime.timezone.utc)
         except AttributeError:
             timeVal = datetime.datetime.now()
@@ -94,32 +90,34 @@ class QuestDBConnection:
 
             def add_msg(msg):
                 # Add header fields
+                hdrValues = Messaging.unpackAll(msg.hdr)
                 for fieldInfo in msg.hdr.fields:
                     if len(fieldInfo.bitfieldInfo) == 0:
                         if fieldInfo.idbits == 0 and fieldInfo.name != "Time" and fieldInfo.name != "DataLength":
-                            self._add_field(fieldInfo, Messaging.get(msg.hdr, fieldInfo))
+                            self._add_field(fieldInfo, Messaging.getUnpacked(hdrValues, msg.hdr, fieldInfo))
                     else:
                         for bitInfo in fieldInfo.bitfieldInfo:
                             if bitInfo.idbits == 0 and bitInfo.name != "Time" and bitInfo.name != "DataLength":
-                                self._add_field(bitInfo, Messaging.get(msg.hdr, bitInfo))
+                                self._add_field(bitInfo, Messaging.getUnpacked(hdrValues, msg.hdr, bitInfo))
                 
                 # Add body fields
                 msgClass = type(msg)
+                values = Messaging.unpackAll(msg)
                 for fieldInfo in msgClass.fields:
                     if fieldInfo.count == 1:
                         if len(fieldInfo.bitfieldInfo) == 0:
-                            self._add_field(fieldInfo.name, Messaging.get(msg, fieldInfo))
+                            self._add_field(fieldInfo.name, Messaging.getUnpacked(values, msg, fieldInfo))
                         else:
                             for bitInfo in fieldInfo.bitfieldInfo:
-                                self._add_field(bitInfo.name, Messaging.get(msg, bitInfo))
+                                self._add_field(bitInfo.name, Messaging.getUnpacked(values, msg, bitInfo))
                     else:
                         # flatten arrays
                         is_enum = len(field_info.enum) > 0
                         for i in range(0,fieldInfo.count):
                             if is_enum:
-                                self.symbols[fieldInfo.name+"_"+str(i)] = Messaging.get(msg, fieldInfo, i)
+                                self.symbols[fieldInfo.name+"_"+str(i)] = Messaging.getUnpacked(values, msg, fieldInfo, i)
                             else:
-                                self.columns[fieldInfo.name+"_"+str(i)] = Messaging.get(msg, fieldInfo, i)
+                                self.columns[fieldInfo.name+"_"+str(i)] = Messaging.getUnpacked(values, msg, fieldInfo, i)
 
                 # Can't store with no fields!  Add a boolean to indicate emptiness
                 if len(self.columns) == 0 and len(self.symbols) == 0:
@@ -0,0 +1,973 @@
+#!/usr/bin/env python3
+#
+# Micro-benchmarks for the python message library, run against the generated
+# code for the test messages in msgtools/parser/test/messages.
+# These aren't part of 'make test', run them with 'make bench', or with
+#     ./Bench.py [benchmark name ...]
+# to run a subset of them.
+#
+import sys
+import ctypes
+import struct
+import timeit
+import importlib
+import unittest.mock
+
+from msgtools.lib.messaging import Messaging
+
+MSGS_TO_TEST = ["TestCase1", "TestCase2", "TestCase3", "TestCase4"]
+
+# Returns time per call, in microseconds
+def time_per_call(fn, number=100000):
+    return min(timeit.repeat(fn, number=number, repeat=3)) * 1e6 / number
+
+def print_result(name, old_us, new_us):
+    print("%-40s %8.3f us %8.3f us %6.2fx" % (name, old_us, new_us, old_us / new_us))
+
+def print_table_header(title, old_name="old", new_name="new"):
+    print("")
+    print(title)
+    print("%-40s %11s %11s %7s" % ("", old_name, new_name, "speedup"))
+
+# Compare the generated accessors, which use precompiled module-level struct.Struct
+# objects, against the format string based struct.unpack_from/pack_into calls that
+# the code generator used to emit.
+def bench_accessors():
+    print_table_header("Field accessors", "fmt string", "Struct")
+    for msgname in MSGS_TO_TEST:
+        msgClass = Messaging.MsgClassFromName[msgname]
+        module = importlib.import_module(msgClass.__module__)
+        msg = msgClass()
+        for fieldInfo in msgClass.fields:
+            if fieldInfo.type == "string":
+                continue
+            codec = getattr(module, "_%s_%s" % (msgClass.__name__, fieldInfo.name))
+            fmt = codec.format
+            location = msgClass.MSG_OFFSET + fieldInfo.offset
+            def old_get():
+                return struct.unpack_from(fmt, msg.rawBuffer(), location)[0]
+            # the generated accessors read the buffer from the msg_buffer slot
+            def new_get():
+                return codec.unpack_from(msg.msg_buffer, location)[0]
+            def old_set():
+                struct.pack_into(fmt, msg.rawBuffer(), location, 0)
+            def new_set():
+                codec.pack_into(msg.msg_buffer, location, 0)
+            print_result("%s.Get%s" % (msgname, fieldInfo.name), time_per_call(old_get), time_per_call(new_get))
+            print_result("%s.Set%s" % (msgname, fieldInfo.name), time_per_call(old_set), time_per_call(new_set))
+
+# Compare decoding every field and bitfield with one Messaging.get() call each,
+# as the serializers used to, against a single call to the generated unpack_all().
+def bench_bulk_decode():
+    print_table_header("Decode whole message", "get()", "unpack_all")
+    for msgname in MSGS_TO_TEST:
+        msgClass = Messaging.MsgClassFromName[msgname]
+        msg = msgClass()
+        infos = []
+        for fieldInfo in msgClass.fields:
+            for info in [fieldInfo] + fieldInfo.bitfieldInfo:
+                infos.append(info)
+        def old_decode():
+            values = {}
+            for info in infos:
+                if info.count == 1:
+                    values[info.name] = Messaging.get(msg, info)
+                else:
+                    values[info.name] = [Messaging.get(msg, info, i) for i in range(info.count)]
+            return values
+        def new_decode():
+            return Messaging.unpackAll(msg)
+        print_result(msgname, time_per_call(old_decode, 10000), time_per_call(new_decode, 10000))
+
+# Compare constructing a message object from received bytes with the per-byte copy loop
+# the constructors used to have, against the single bulk copy they do now, and against
+# wrapping a writable memoryview without any copy.
+def bench_construction():
+    print_table_header("Construct from received bytes", "byte loop", "bulk copy")
+    for size in [16, 256, 4096]:
+        data = bytearray(size)
+        def byte_loop():
+            newbuf = ctypes.create_string_buffer(len(data))
+            for i in range(0, len(data)):
+                newbuf[i] = bytes(data)[i]
+            return Messaging.hdr(newbuf)
+        def bulk_copy():
+            return Messaging.hdr(data)
+        number = 100000 if size < 4096 else 100
+        print_result("%d bytes" % size, time_per_call(byte_loop, number), time_per_call(bulk_copy, number))
+    # wrapping has a fixed cost that's only worth paying for large messages
+    print_table_header("", "bulk copy", "memoryview")
+    for size in [16, 256, 4096, 65536]:
+        data = bytearray(size)
+        def bulk_copy():
+            return Messaging.hdr(data)
+        def zero_copy():
+            return Messaging.hdr(memoryview(data))
+        print_result("%d bytes" % size, time_per_call(bulk_copy), time_per_call(zero_copy))
+
+# Compare decoding every field and bitfield of 10000 logged messages one message at a
+# time with unpack_all(), against Messaging.decode_batch() and columns() for all of them.
+def bench_decode_batch():
+    print_table_header("Decode 10000 messages", "unpack_all", "batch")
+    for msgname in MSGS_TO_TEST:
+        msgClass = Messaging.MsgClassFromName[msgname]
+        msgSize = msgClass.MSG_OFFSET + msgClass.SIZE
+        log = msgClass().rawBuffer().raw * 10000
+        offsets = list(range(0, len(log), msgSize))
+        def per_message():
+            return [msgClass(log[offset:offset+msgSize]).unpack_all() for offset in offsets]
+        def batch():
+            return msgClass.columns(Messaging.decode_batch(msgClass, log, offsets))
+        print_result(msgname, time_per_call(per_message, 1), time_per_call(batch, 1))
+
+# Compare converting messages to and from JSON with reflection, as msgjson used to,
+# against the generated to_json_dict() and from_json_dict() it uses now.
+def bench_json():
+    import msgtools.lib.msgjson as msgjson
+    def reflection(fn):
+        with unittest.mock.patch.object(Messaging, "generatedFn", return_value=None):
+            return fn()
+    print_table_header("JSON", "reflection", "generated")
+    for msgname in MSGS_TO_TEST:
+        msgClass = Messaging.MsgClassFromName[msgname]
+        msg = msgClass()
+        d = msgjson.toDict(msg, includeHeader=True)
+        to_json = lambda: msgjson.toJson(msg, includeHeader=True)
+        from_dict = lambda: msgjson.dictToMsg(d)
+        print_result("%s toJson" % msgname, reflection(lambda: time_per_call(to_json, 10000)), time_per_call(to_json, 10000))
+        print_result("%s dictToMsg" % msgname, reflection(lambda: time_per_call(from_dict, 10000)), time_per_call(from_dict, 10000))
+        msg.hdr.SetDataLength(msgClass.SIZE // 2)
+        print_result("%s toJson, half length" % msgname, reflection(lambda: time_per_call(to_json, 10000)), time_per_call(to_json, 10000))
+
+# Compare converting messages to and from CSV with reflection, as msgcsv used to,
+# against the generated csv_values() and from_csv_params() it uses now.
+def bench_csv():
+    import msgtools.lib.msgcsv as msgcsv
+    def reflection(fn):
+        with unittest.mock.patch.object(Messaging, "generatedFn", return_value=None):
+            return fn()
+    print_table_header("CSV", "reflection", "generated")
+    for msgname in MSGS_TO_TEST:
+        msgClass = Messaging.MsgClassFromName[msgname]
+        msg = msgClass()
+        line = msgcsv.toCsv(msg)
+        to_csv = lambda: msgcsv.toCsv(msg, timeColumn=True)
+        from_csv = lambda: msgcsv.csvToMsg(line)
+        print_result("%s toCsv" % msgname, reflection(lambda: time_per_call(to_csv, 10000)), time_per_call(to_csv, 10000))
+        print_result("%s csvToMsg" % msgname, reflection(lambda: time_per_call(from_csv, 10000)), time_per_call(from_csv, 10000))
+    # splitting parameters used to escape quoted commas one character at a time
+    line = ", ".join(['"a,b"'] * 200)
+    def old_split():
+        ret = ""
+        quoteStarted = 0
+        for c in line:
+            if c == '"':
+                quoteStarted = not quoteStarted
+            elif c == ',':
+                if quoteStarted:
+                    ret = ret + '\\'
+            ret = ret + c
+        return list(msgcsv.csv.reader([ret], quotechar='"', delimiter=',', quoting=msgcsv.csv.QUOTE_NONE, skipinitialspace=True, escapechar='\\'))[0]
+    print_result("split 200 quoted params", time_per_call(old_split, 1000), time_per_call(lambda: msgcsv.splitParams(line), 1000))
+
+# Compare looking up the class of a received message by its hex ID string, as
+# Messaging.MsgClass used to, against the integer keyed MsgClassFromID table.
+def bench_msg_class():
+    print_table_header("Message class lookup", "hex name", "int ID")
+    from msgtools.lib.unknownmsg import UnknownMsg
+    for msgname in MSGS_TO_TEST + ["Unknown"]:
+        hdr = Messaging.hdr()
+        if msgname == "Unknown":
+            hdr.SetMessageID(0x7654321)
+        else:
+            hdr.SetMessageID(Messaging.MsgClassFromName[msgname].ID)
+        def old_lookup():
+            msgId = hex(hdr.GetMessageID())
+            if not msgId in Messaging.MsgNameFromID:
+                from msgtools.lib.unknownmsg import UnknownMsg
+                return UnknownMsg
+            return Messaging.MsgClassFromName[Messaging.MsgNameFromID[msgId]]
+        def new_lookup():
+            return Messaging.MsgClass(hdr)
+        print_result(msgname, time_per_call(old_lookup), time_per_call(new_lookup))
+
+# Compare finding fields by name with a search through every field and bitfield, as
+# Messaging.findFieldInfo used to, against the name index it uses now.
+def bench_find_field():
+    print_table_header("Find field by name", "search", "index")
+    for msgname in MSGS_TO_TEST:
+        msgClass = Messaging.MsgClassFromName[msgname]
+        lastField = msgClass.fields[-1]
+        name = (lastField.bitfieldInfo[-1] if lastField.bitfieldInfo else lastField).name
+        def old_find():
+            for fi in msgClass.fields:
+                if name == fi.name:
+                    return fi
+                for bfi in fi.bitfieldInfo:
+                    if name == bfi.name:
+                        return bfi
+            return None
+        def new_find():
+            return Messaging.findFieldInfo(msgClass.fields, name)
+        print_result("%s.%s" % (msgname, name), time_per_call(old_find), time_per_call(new_find))
+
+# Compare Messaging.get/set as they were, checking the field's type, units and count
+# on every call, against dispatching to the converters built for each field.
+def bench_get_set():
+    def old_set(msg, fieldInfo, value, index=0):
+        if("int" in fieldInfo.type or "enumeration" == fieldInfo.type):
+            if isinstance(value, str):
+                value = value.strip()
+                if value.startswith("0x"):
+                    value = int(value, 0)
+        if("int" in fieldInfo.type):
+            value = int(float(value))
+        elif("float" in fieldInfo.type):
+            value = float(value)
+        if fieldInfo.count == 1:
+            fieldInfo.set(msg, value)
+        else:
+            fieldInfo.set(msg, value, index)
+    def old_get(msg, fieldInfo, index=0):
+        try:
+            if fieldInfo.count == 1:
+                value = fieldInfo.get(msg)
+            else:
+                value = fieldInfo.get(msg, index)
+            if "hex" == fieldInfo.units.lower():
+                digits = fieldInfo.size*2
+                value = ("0x%0"+str(digits)+"X") % (value)
+        except struct.error:
+            value = "UNALLOCATED"
+        return value
+    print_table_header("Messaging.get/set", "checks", "converters")
+    for msgname in MSGS_TO_TEST:
+        msgClass = Messaging.MsgClassFromName[msgname]
+        msg = msgClass()
+        for fieldInfo in msgClass.fields:
+            if fieldInfo.type == "string":
+                continue
+            value = Messaging.get(msg, fieldInfo)
+            print_result("%s.get(%s)" % (msgname, fieldInfo.name),
+                time_per_call(lambda: old_get(msg, fieldInfo)),
+                time_per_call(lambda: Messaging.get(msg, fieldInfo)))
+            print_result("%s.set(%s)" % (msgname, fieldInfo.name),
+                time_per_call(lambda: old_set(msg, fieldInfo, value)),
+                time_per_call(lambda: Messaging.set(msg, fieldInfo, value)))
+
+# Compare reading and writing fields as attributes (msg.Field) through the
+# __getattr__/__setattr__ lookups Message used to have, against the properties
+# that are made for each field of a message class now.
+def bench_attributes():
+    from msgtools.lib.message import FieldListAccessor
+    def old_getattr(msg, attr):
+        fn_name = 'Get' + attr
+        if hasattr(type(msg), fn_name):
+            fn = getattr(msg,fn_name)
+            if callable(fn):
+                if fn.count > 1:
+                    setfn = getattr(msg,"Set"+attr)
+                    return FieldListAccessor(msg, fn, setfn)
+                else:
+                    return fn()
+    def old_setattr(msg, attr, val):
+        fn_name = 'Set' + attr
+        if (not attr.startswith('Set')) and (not attr.startswith('Get')) and fn_name in dir(type(msg)):
+            fn = getattr(msg,fn_name)
+            if callable(fn):
+                if fn.count > 1:
+                    for i in range(0,len(val)):
+                        try:
+                            fn(val[i], i)
+                        except struct.error:
+                            break
+                else:
+                    fn(val)
+    print_table_header("Field attributes", "getattr", "property")
+    msgClass = Messaging.MsgClassFromName["TestCase1"]
+    msg = msgClass()
+    print_result("msg.FieldB", time_per_call(lambda: old_getattr(msg, "FieldB")), time_per_call(lambda: msg.FieldB))
+    print_result("msg.FieldB = 1", time_per_call(lambda: old_setattr(msg, "FieldB", 1), 10000), time_per_call(lambda: setattr(msg, "FieldB", 1)))
+    print_result("msg.FieldC[1]", time_per_call(lambda: old_getattr(msg, "FieldC")[1]), time_per_call(lambda: msg.FieldC[1]))
+    print_result("msg.FieldC = [1,2,3]", time_per_call(lambda: old_setattr(msg, "FieldC", [1,2,3]), 10000), time_per_call(lambda: setattr(msg, "FieldC", [1,2,3])))
+
+# Compare CRC-16 of message bodies using the shared table driven crc16 module
+# against the byte-at-a-time loop that HeaderHelper and CanPlugin used to have,
+# and validating a whole log of messages with one vectorized call.
+def bench_crc():
+    import numpy as np
+    from msgtools.lib import crc16
+    def old_crc16(data):
+        crc = 0;
+        for i in range(0,len(data)):
+            d = struct.unpack_from('B', data, i)[0]
+            crc = (crc >> 8) | (crc << 8)
+            crc ^= d
+            crc ^= (crc & 0xff) >> 4
+            crc ^= crc << 12
+            crc = 0xFFFF & crc
+            crc ^= (crc & 0xff) << 5
+            crc = 0xFFFF & crc
+        return crc
+    print_table_header("CRC-16", "loop", "crc16")
+    for size in [16, 64, 256, 1024]:
+        data = bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+        old_us = time_per_call(lambda: old_crc16(data), 1000)
+        new_us = time_per_call(lambda: crc16.Crc16(data), 10000)
+        print_result("%d bytes" % size, old_us, new_us)
+        print("%-40s %8.1f MB/s %6.1f MB/s" % ("", size / old_us, size / new_us))
+    print_table_header("CRC-16 of 10000 64 byte messages", "Crc16 each", "Crc16Many")
+    count = 10000
+    log = bytes(range(64)) * count
+    offsets = np.arange(count) * 64
+    lengths = np.full(count, 64)
+    each = lambda: [crc16.Crc16(log[o:o+64]) for o in range(0, len(log), 64)]
+    print_result("whole log", time_per_call(each, 10), time_per_call(lambda: crc16.Crc16Many(log, offsets, lengths), 10))
+
+# Compare HeaderTranslator's precompiled plans against translating the way it
+# used to, with reflection over the corresponding fields, initialize(), a byte
+# at a time body copy and datetime.now() for time wrap detection.  Serial links
+# need serial<->network translation at 50k msg/s, 20 us per message.
+def bench_translate():
+    import datetime
+    from msgtools.lib.header_translator import HeaderTranslator
+    from headers.SerialHeader import SerialHeader
+    from headers.NetworkHeader import NetworkHeader
+    translator = HeaderTranslator(SerialHeader, NetworkHeader)
+    def old_translate(fromHdr, body, toType, fieldIndex):
+        toHdr = toType(ctypes.create_string_buffer(toType.SIZE+fromHdr.GetDataLength()))
+        toHdr.initialize()
+        for pair in translator._correspondingFields:
+            Messaging.set(toHdr, pair[1-fieldIndex], Messaging.get(fromHdr, pair[fieldIndex]))
+        if fromHdr.GetMessageID() != toHdr.GetMessageID():
+            return None
+        datetime.datetime.now()
+        try:
+            toHdr.SetTime(fromHdr.GetTime()*1.0)
+        except struct.error:
+            toHdr.SetTime(int(fromHdr.GetTime()*1.0))
+        for i in range(0,fromHdr.GetDataLength()):
+            toHdr.rawBuffer()[toHdr.SIZE+i] = body[i]
+        return toHdr
+    print_table_header("Header translation, 50k msg/s is 20 us per message", "reflection", "plan")
+    for size in [8, 64, 256]:
+        body = bytes(range(size))
+        serialHdr = SerialHeader()
+        serialHdr.SetMessageID(0x12)
+        serialHdr.SetDataLength(size)
+        networkHdr = translator.translateHdrAndBody(serialHdr, body)
+        old_us = time_per_call(lambda: old_translate(serialHdr, body, NetworkHeader, 0), 2000)
+        new_us = time_per_call(lambda: translator.translateHdrAndBody(serialHdr, body), 20000)
+        print_result("serial->network %d byte body" % size, old_us, new_us)
+        old_us = time_per_call(lambda: old_translate(networkHdr, body, SerialHeader, 1), 2000)
+        new_us = time_per_call(lambda: translator.translateHdrAndBody(networkHdr, body), 20000)
+        print_result("network->serial %d byte body" % size, old_us, new_us)
+        print("%-40s %8.0f/s %9.0f/s" % ("  network->serial msgs per second", 1e6/old_us, 1e6/new_us))
+
+# Compare splitting a stream into messages with MessageFramer against the way
+# TcpClientConnection used to, reading a header and then a body from the
+# QIODevice for each message.  A QBuffer stands in for the socket.
+def bench_framer():
+    from PyQt5 import QtCore
+    from msgtools.lib.framer import MessageFramer
+    msgs = []
+    for i in range(1000):
+        msg = Messaging.MsgClassFromName[MSGS_TO_TEST[i % len(MSGS_TO_TEST)]]()
+        msgs.append(msg.rawBuffer().raw)
+    stream = QtCore.QByteArray(b''.join(msgs))
+    device = QtCore.QBuffer(stream)
+    device.open(QtCore.QIODevice.ReadOnly)
+    hdrSize = Messaging.hdr.SIZE
+    def old_framing():
+        device.seek(0)
+        inputStream = QtCore.QDataStream(device)
+        rxBuffer = bytearray()
+        count = 0
+        while(1):
+            if len(rxBuffer) < hdrSize:
+                if device.bytesAvailable() < hdrSize:
+                    return count
+                rxBuffer += inputStream.readRawData(hdrSize - len(rxBuffer))
+            hdr = Messaging.hdr(rxBuffer)
+            bodyLen = hdr.GetDataLength()
+            if len(rxBuffer)+device.bytesAvailable() < hdrSize + bodyLen:
+                return count
+            rxBuffer += inputStream.readRawData(hdrSize + bodyLen - len(rxBuffer))
+            hdr = Messaging.hdr(rxBuffer)
+            count += 1
+            rxBuffer = bytearray()
+    framer = MessageFramer(Messaging.hdr)
+    def new_framing():
+        device.seek(0)
+        count = 0
+        framer.feed(device.readAll().data())
+        for msg_bytes in framer.messages():
+            hdr = Messaging.hdr(msg_bytes)
+            count += 1
+        return count
+    assert old_framing() == new_framing() == len(msgs)
+    print_table_header("Framing %d messages, %d bytes" % (len(msgs), stream.size()), "per msg", "framer")
+    old_us = time_per_call(old_framing, 20)
+    new_us = time_per_call(new_framing, 20)
+    print_result("whole stream", old_us, new_us)
+    print("%-40s %8.0f/s %9.0f/s" % ("  msgs per second", len(msgs)*1e6/old_us, len(msgs)*1e6/new_us))
+
+# Compare logging each message on the calling thread, with a write and flush
+# of a QFile per message, against queueing it for the background LogWriter.
+# This is the time taken from routing each message.
+def bench_log():
+    import os
+    import tempfile
+    from PyQt5 import QtCore
+    from msgtools.lib.log_writer import LogWriter
+    msgs = []
+    for i in range(1000):
+        msg = Messaging.MsgClassFromName[MSGS_TO_TEST[i % len(MSGS_TO_TEST)]]()
+        msgs.append(msg)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print_table_header("Logging %d messages, time per message" % len(msgs), "QFile", "LogWriter")
+        for fileType in ["bin", "csv", "json"]:
+            logFile = QtCore.QFile(os.path.join(tmpdir, "old." + fileType))
+            logFile.open(QtCore.QIODevice.Append)
+            loggedMsgHeader = {}
+            def old_log():
+                for msg in msgs:
+                    log = ''
+                    if fileType == "csv":
+                        if not msg.MsgName() in loggedMsgHeader:
+                            loggedMsgHeader[msg.MsgName()] = True
+                            log = msg.csvHeader(timeColumn=True)+'\n'
+                        log += msg.toCsv(timeColumn=True)+'\n'
+                        log = log.encode('utf-8')
+                    elif fileType == "json":
+                        if not msg.MsgName() in loggedMsgHeader:
+                            loggedMsgHeader[msg.MsgName()] = True
+                            log = msg.jsonHeader()
+                        log += msg.toJson(includeHeader=True)+'\n'
+                        log = log.encode('utf-8')
+                    else:
+                        log = msg.rawBuffer().raw
+                    logFile.write(log)
+                    logFile.flush()
+            # a queue big enough for every message of the benchmark, so none are dropped
+            writer = LogWriter(os.path.join(tmpdir, "new." + fileType), fileType, queueLimit=100*len(msgs))
+            def new_log():
+                for msg in msgs:
+                    writer.log(msg.rawBuffer().raw)
+            old_us = time_per_call(old_log, 10) / len(msgs)
+            new_us = time_per_call(new_log, 10) / len(msgs)
+            writer.close()
+            logFile.close()
+            assert writer.droppedMsgs == 0
+            print_result(fileType, old_us, new_us)
+
+# Compare messages routed by a msgserver between two clients connected by TCP
+# sockets, against two clients connected by shared memory.  The server runs in
+# a separate process, with its shared memory plugin loaded.
+def bench_transport():
+    import os
+    import socket
+    import subprocess
+    import tempfile
+    import time
+    from msgtools.lib.framer import MessageFramer
+    from msgtools.lib.shm_ring import ShmSocket
+    port = 56780
+    data = Messaging.MsgClassFromName["TestCase1"]().rawBuffer().raw
+    msgId = Messaging.MsgClassFromName["TestCase1"].ID
+    count = 20000
+    latencyCount = 2000
+    def connectTcp():
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+    def retry(connect):
+        # the server takes a moment to start
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                return connect()
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+    # Returns time per message sent by tx and received by rx, for one message
+    # at a time, and for many messages at a time
+    def measure(tx, rx):
+        framer = MessageFramer(Messaging.hdr)
+        def receive(n):
+            while n > 0:
+                framer.commit(rx.recv_into(framer.write_buffer(65536)))
+                for msg in framer.messages():
+                    if Messaging.hdr(msg).GetMessageID() == msgId:
+                        n -= 1
+        rx.sendall(Messaging.Messages.Network.MaskedSubscription().rawBuffer().raw)
+        # wait for the subscription to take effect
+        rx.settimeout(0.1)
+        while True:
+            tx.sendall(data)
+            try:
+                receive(1)
+                break
+            except socket.timeout:
+                pass
+        rx.settimeout(None)
+        time.sleep(0.2)
+        latencies = []
+        for i in range(latencyCount):
+            start = time.perf_counter()
+            tx.sendall(data)
+            receive(1)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        start = time.perf_counter()
+        for i in range(count):
+            tx.sendall(data)
+        receive(count)
+        bulk = time.perf_counter() - start
+        return latencies[len(latencies)//2] * 1e6, bulk * 1e6 / count
+    with tempfile.TemporaryDirectory() as tmpdir:
+        shmSocket = os.path.join(tmpdir, "msgserver")
+        env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+        server = subprocess.Popen([sys.executable, "-m", "msgtools.server.server",
+            "--port", str(port), "--metrics-port", "0", "--sharedmemory=", shmSocket],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            tcp = measure(retry(connectTcp), retry(connectTcp))
+            shm = measure(retry(lambda: ShmSocket(shmSocket)), retry(lambda: ShmSocket(shmSocket)))
+        finally:
+            server.terminate()
+            server.wait()
+    print_table_header("Messages routed through msgserver, time per message", "TCP", "shm")
+    print_result("latency, median of one at a time", tcp[0], shm[0])
+    print_result("throughput, %d at a time" % count, tcp[1], shm[1])
+
+# Compare a subscriber that gets every message and picks the ones it wants by
+# their contents, against one that asks the server to filter them, with the
+# server in a separate process.  Also compares the cost of the filter on the
+# server with the cost of checking each message in the client.
+def bench_content_filter():
+    import os
+    import socket
+    import subprocess
+    import time
+    from msgtools.lib.framer import MessageFramer
+    from msgtools.server.content_filter import parseFilter, compileFilter
+    port = 56784
+    msgClass = Messaging.MsgClassFromName["TestCase1"]
+    endClass = Messaging.MsgClassFromName["TestCase2"]
+    count = 20000
+    # one message in a hundred matches
+    msgs = []
+    for i in range(count):
+        msg = msgClass()
+        msg.SetFieldB(i % 100)
+        msgs.append(msg.rawBuffer().raw)
+    def client_check(data):
+        return Messaging.MsgFactory(Messaging.hdr(data)).GetFieldB() == 7
+    predicate = compileFilter(parseFilter("FieldB == 7"), msgClass)
+    buffers = [Messaging.hdr(data).rawBuffer() for data in msgs[:1000]]
+    assert sum(map(client_check, msgs[:1000])) == sum(map(predicate, buffers)) == 10
+    print_table_header("Checking FieldB == 7, time per message", "client", "filter")
+    print_result("decode and compare", time_per_call(lambda: [client_check(data) for data in msgs[:1000]], 20) / 1000,
+                 time_per_call(lambda: [predicate(buf) for buf in buffers], 20) / 1000)
+
+    def connect():
+        # the server takes a moment to start
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                return socket.create_connection(("127.0.0.1", port))
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+    # Returns bytes received and client CPU seconds for the subscriber to find
+    # the messages it wants
+    def measure(serverFilter):
+        tx = connect()
+        rx = connect()
+        rx.sendall(Messaging.Messages.Network.MaskedSubscription().rawBuffer().raw)
+        if serverFilter:
+            subMsg = Messaging.Messages.Network.FilteredSubscription()
+            subMsg.SetValue(msgClass.ID)
+            subMsg.SetFilter("FieldB == 7")
+            rx.sendall(subMsg.rawBuffer().raw)
+        time.sleep(0.5)
+        framer = MessageFramer(Messaging.hdr)
+        received = 0
+        wanted = 0
+        cpu = 0
+        # send in chunks, each followed by a message that marks its end, so
+        # the server doesn't have to hold back messages for the subscriber
+        chunk = 1000
+        for i in range(0, count, chunk):
+            for data in msgs[i:i+chunk]:
+                tx.sendall(data)
+            tx.sendall(endClass().rawBuffer().raw)
+            start = time.process_time()
+            done = False
+            while not done:
+                n = rx.recv_into(framer.write_buffer(65536))
+                framer.commit(n)
+                received += n
+                for data in framer.messages():
+                    id = Messaging.hdr(data).GetMessageID()
+                    if id == endClass.ID:
+                        done = True
+                    elif id == msgClass.ID and client_check(data):
+                        wanted += 1
+            cpu += time.process_time() - start
+        tx.close()
+        rx.close()
+        assert wanted == count // 100
+        return received, cpu
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    server = subprocess.Popen([sys.executable, "-m", "msgtools.server.server", "--port", str(port), "--metrics-port", "0"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        everything = measure(False)
+        filtered = measure(True)
+    finally:
+        server.terminate()
+        server.wait()
+    print_table_header("Subscriber wanting 1 of %d messages" % count, "client", "server")
+    print("%-40s %11d %11d %6.2fx" % ("bytes received", everything[0], filtered[0], everything[0] / filtered[0]))
+    print_result("client CPU per message sent", everything[1] * 1e6 / count, filtered[1] * 1e6 / count)
+
+# Compare a network bridge between two local servers sending one message at a
+# time, against packing messages into batches, with and without compression.
+# The bridge connects through a proxy that counts the bytes on the link.
+def bench_bridge():
+    import os
+    import select
+    import socket
+    import subprocess
+    import threading
+    import time
+    from msgtools.lib.framer import MessageFramer
+    portA, portB, proxyPort = 56792, 56794, 56796
+    msgClass = Messaging.MsgClassFromName["TestCase1"]
+    endClass = Messaging.MsgClassFromName["TestCase2"]
+    count = 20000
+    msgs = []
+    for i in range(count):
+        msg = msgClass()
+        msg.SetFieldB(i & 0xFFFF)
+        msg.SetFieldD(i % 100)
+        msgs.append(msg.rawBuffer().raw)
+    endMsg = endClass().rawBuffer().raw
+
+    # bytes and reads from server A to the bridge at server B
+    link = {'bytes': 0, 'reads': 0}
+    def relay(client):
+        server = socket.create_connection(("127.0.0.1", portA))
+        peers = {client: server, server: client}
+        try:
+            while True:
+                for sock in select.select(list(peers), [], [])[0]:
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    if sock is server:
+                        link['bytes'] += len(data)
+                        link['reads'] += 1
+                    peers[sock].sendall(data)
+        except OSError:
+            pass
+        finally:
+            client.close()
+            server.close()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", proxyPort))
+    listener.listen(4)
+    def accept():
+        while True:
+            try:
+                client = listener.accept()[0]
+            except OSError:
+                return
+            threading.Thread(target=relay, args=(client,), daemon=True).start()
+    threading.Thread(target=accept, daemon=True).start()
+
+    def connect(port):
+        # the server takes a moment to start
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                return socket.create_connection(("127.0.0.1", port))
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+    def startServer(port, *args):
+        env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+        return subprocess.Popen([sys.executable, "-m", "msgtools.server.server", "--port", str(port), "--metrics-port", "0"] + list(args),
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Returns (link bytes, link reads, seconds) to send everything from a
+    # client of server A to a client of server B, and the mean latency of
+    # single messages.
+    def measure(options):
+        param = "127.0.0.1:%d,rx=%s,rx=%s,tx=%s" % (proxyPort, msgClass.MsgName(), endClass.MsgName(), endClass.MsgName())
+        serverB = startServer(portB, "--networkbridge=", param + options)
+        try:
+            tx = connect(portA)
+            rx = connect(portB)
+            subMsg = Messaging.Messages.Network.SubscriptionList()
+            subMsg.SetIDs(msgClass.ID, 0)
+            subMsg.SetIDs(endClass.ID, 1)
+            rx.sendall(subMsg.rawBuffer().raw)
+            framer = MessageFramer(Messaging.hdr)
+            def waitForEnd(timeout=None):
+                rx.settimeout(timeout)
+                received = 0
+                while True:
+                    framer.commit(rx.recv_into(framer.write_buffer(65536)))
+                    for data in framer.messages():
+                        received += 1
+                        if Messaging.hdr(data).GetMessageID() == endClass.ID:
+                            return received
+            # wait for the bridge to connect and subscribe
+            while True:
+                tx.sendall(endMsg)
+                try:
+                    waitForEnd(0.2)
+                    break
+                except socket.timeout:
+                    pass
+            time.sleep(0.5)
+            while True:
+                try:
+                    waitForEnd(0.1)
+                except socket.timeout:
+                    break
+            latency = 0
+            probes = 100
+            for i in range(probes):
+                start = time.perf_counter()
+                tx.sendall(endMsg)
+                waitForEnd()
+                latency += time.perf_counter() - start
+            startBytes, startReads = link['bytes'], link['reads']
+            start = time.perf_counter()
+            # send in chunks, each followed by a message that marks its end,
+            # so the servers don't have to hold back messages
+            chunk = 1000
+            received = 0
+            for i in range(0, count, chunk):
+                tx.sendall(b''.join(msgs[i:i+chunk]) + endMsg)
+                received += waitForEnd()
+            elapsed = time.perf_counter() - start
+            assert received == count + count // chunk
+            tx.close()
+            rx.close()
+            return link['bytes'] - startBytes, link['reads'] - startReads, elapsed, latency / probes
+        finally:
+            serverB.terminate()
+            serverB.wait()
+    serverA = startServer(portA)
+    try:
+        single = measure("")
+        batched = measure(",batch")
+        compressed = measure(",batch,zlib")
+    finally:
+        serverA.terminate()
+        serverA.wait()
+        listener.close()
+    print("")
+    print("Bridge between two servers, %d messages" % count)
+    print("%-40s %11s %11s %11s" % ("", "1 at a time", "batched", "zlib"))
+    print("%-40s %11d %11d %11d" % ("  bytes on link", single[0], batched[0], compressed[0]))
+    print("%-40s %10.1f%% %10.1f%% %10.1f%%" % ("  bytes saved", 0, 100 - batched[0]*100/single[0], 100 - compressed[0]*100/single[0]))
+    print("%-40s %11d %11d %11d" % ("  reads of link", single[1], batched[1], compressed[1]))
+    print("%-40s %9.0f/s %9.0f/s %9.0f/s" % ("  msgs per second", count/single[2], count/batched[2], count/compressed[2]))
+    print("%-40s %9.2fms %9.2fms %9.2fms" % ("  latency of one message", single[3]*1e3, batched[3]*1e3, compressed[3]*1e3))
+
+# Compare publishing messages to a multicast group one per datagram, against
+# packing them into batches, received on this host through loopback.
+def bench_multicast():
+    import socket
+    import time
+    from PyQt5 import QtWidgets
+    from msgtools.lib.framer import MessageFramer
+    from msgtools.lib.multicast import MulticastSocket, DEFAULT_BATCH_SIZE
+    from msgtools.server.MulticastPlugin import MulticastConnection
+    # the publisher has widgets for the server's client list
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    group, port = "239.255.77.78", 56790
+    data = Messaging.MsgClassFromName["TestCase1"]().rawBuffer().raw
+    count = 50000
+    # send this many at a time, so the receive buffer doesn't overflow
+    chunk = 100
+    receiver = MulticastSocket(group, port)
+    receiver.settimeout(0.2)
+    framer = MessageFramer(Messaging.hdr)
+    def measure(batchSize):
+        publisher = MulticastConnection(group, port, batchSize=batchSize)
+        received = 0
+        start = time.perf_counter()
+        for i in range(0, count, chunk):
+            for j in range(chunk):
+                publisher.sendBytes(data)
+            publisher.flush()
+            expected = i + chunk
+            try:
+                while received < expected:
+                    framer.commit(receiver.recv_into(framer.write_buffer(65536)))
+                    received += sum(1 for msg in framer.messages())
+            except socket.timeout:
+                # lost, carry on with the next chunk
+                received = expected
+        elapsed = time.perf_counter() - start
+        publisher.stop()
+        return elapsed * 1e6 / count, publisher.sentDatagrams
+    try:
+        single, singleDatagrams = measure(0)
+        lostBefore = receiver.sequence.lostDatagrams
+        batched, batchedDatagrams = measure(DEFAULT_BATCH_SIZE)
+    finally:
+        receiver.close()
+    print_table_header("Multicast on loopback, %d messages, time per message" % count, "1 per dgram", "batched")
+    print_result("send and receive", single, batched)
+    print("%-40s %11d %11d" % ("  datagrams", singleDatagrams, batchedDatagrams))
+    print("%-40s %11d %11d" % ("  datagrams lost", lostBefore, receiver.sequence.lostDatagrams - lostBefore))
+    print("%-40s %8.0f/s %9.0f/s" % ("  msgs per second", 1e6/single, 1e6/batched))
+
+# Compare a websocket client getting one frame per message, against the
+# server packing the messages it has each time its event loop runs into one
+# frame, and compressing the frame, for a headless client like a browser.
+def bench_websocket():
+    import os
+    import socket
+    import subprocess
+    import time
+    from websockets.sync.client import connect as wsConnect
+    from msgtools.lib import batch
+    from msgtools.lib.framer import MessageFramer
+    port = 56798
+    msgClass = Messaging.MsgClassFromName["TestCase1"]
+    endClass = Messaging.MsgClassFromName["TestCase2"]
+    count = 20000
+    msgs = []
+    for i in range(count):
+        msg = msgClass()
+        msg.SetFieldB(i & 0xFFFF)
+        msgs.append(msg.rawBuffer().raw)
+    endMsg = endClass().rawBuffer().raw
+
+    def connect():
+        # the server takes a moment to start
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                return socket.create_connection(("127.0.0.1", port))
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+    # Returns (msgs per second, frames, bytes) for sending everything from a
+    # TCP client to a websocket client, and whether the server accepted
+    # permessage-deflate.
+    def measure(compression=None):
+        tx = connect()
+        ws = wsConnect("ws://127.0.0.1:%d" % (port+1), compression="deflate", max_size=None)
+        deflate = "permessage-deflate" in ws.response.headers.get("Sec-WebSocket-Extensions", "")
+        subMsg = Messaging.Messages.Network.SubscriptionList()
+        subMsg.SetIDs(msgClass.ID, 0)
+        subMsg.SetIDs(endClass.ID, 1)
+        ws.send(subMsg.rawBuffer().raw)
+        if compression is not None:
+            linkMsg = Messaging.Messages.Network.BatchLink()
+            linkMsg.SetMaxBytes(64*1024)
+            linkMsg.SetMaxDelay(0)
+            linkMsg.SetCompression(compression)
+            ws.send(linkMsg.rawBuffer().raw)
+        time.sleep(0.5)
+        framer = MessageFramer(Messaging.hdr)
+        frames = 0
+        size = 0
+        # Returns the number of messages received up to an end marker
+        def waitForEnd():
+            nonlocal frames, size
+            received = 0
+            while True:
+                frame = ws.recv()
+                frames += 1
+                size += len(frame)
+                framer.feed(frame)
+                for data in framer.messages():
+                    hdr = Messaging.hdr(data)
+                    if hdr.GetMessageID() == Messaging.Messages.Network.Batch.ID:
+                        hdrs = batch.unpack(data)[1]
+                    else:
+                        hdrs = [hdr]
+                    for hdr in hdrs:
+                        received += 1
+                        if hdr.GetMessageID() == endClass.ID:
+                            return received
+        start = time.perf_counter()
+        # send in chunks, each followed by a message that marks its end, so
+        # the server doesn't have to hold back messages
+        chunk = 1000
+        received = 0
+        for i in range(0, count, chunk):
+            tx.sendall(b''.join(msgs[i:i+chunk]) + endMsg)
+            received += waitForEnd()
+        elapsed = time.perf_counter() - start
+        assert received == count + count // chunk
+        tx.close()
+        ws.close()
+        return count / elapsed, frames, size, deflate
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    server = subprocess.Popen([sys.executable, "-m", "msgtools.server.server", "--port", str(port), "--metrics-port", "0"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        connect().close()
+        single = measure()
+        batched = measure(batch.UNCOMPRESSED)
+        compressed = measure(batch.ZLIB)
+    finally:
+        server.terminate()
+        server.wait()
+    print("")
+    print("Websocket client, %d messages" % count)
+    print("%-40s %11s %11s %11s" % ("", "1 per frame", "batched", "zlib"))
+    print("%-40s %9.0f/s %9.0f/s %9.0f/s" % ("  msgs per second", single[0], batched[0], compressed[0]))
+    print("%-40s %11d %11d %11d" % ("  frames", single[1], batched[1], compressed[1]))
+    print("%-40s %11d %11d %11d" % ("  bytes in frames", single[2], batched[2], compressed[2]))
+    print("%-40s %11s %11s %11s" % tuple(["  permessage-deflate accepted"] + ["yes" if result[3] else "no" for result in (single, batched, compressed)]))
+
+BENCHMARKS = {
+    "accessors": bench_accessors,
+    "attributes": bench_attributes,
+    "bridge": bench_bridge,
+    "bulk_decode": bench_bulk_decode,
+    "construction": bench_construction,
+    "content_filter": bench_content_filter,
+    "crc": bench_crc,
+    "csv": bench_csv,
+    "decode_batch": bench_decode_batch,
+    "find_field": bench_find_field,
+    "framer": bench_framer,
+    "get_set": bench_get_set,
+    "json": bench_json,
+    "log": bench_log,
+    "msg_class": bench_msg_class,
+    "multicast": bench_multicast,
+    "translate": bench_translate,
+    "transport": bench_transport,
+    "websocket": bench_websocket,
+}
+
+def main(args=None):
+    Messaging.LoadAllMessages()
+    names = sys.argv[1:]
+    if not names:
+        names = BENCHMARKS.keys()
+    for name in names:
+        BENCHMARKS[name]()
+
+# main starts here
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 import unittest
+import unittest.mock
+import os
 import traceback
+import struct
+import math
 
 from msgtools.lib.messaging import Messaging
 
@@ -25,6 +29,51 @@ class TestClass(unittest.TestCase):
     
         self.PrintDictionary()
 
+    def test_msg_class_from_id(self):
+        from msgtools.lib.unknownmsg import UnknownMsg
+        msgclass = Messaging.MsgClassFromName["TestCase1"]
+        hdr = Messaging.hdr()
+        hdr.SetMessageID(msgclass.ID)
+        self.assertEqual(msgclass, Messaging.MsgClass(hdr))
+        self.assertEqual(msgclass, Messaging.MsgClassFromID[msgclass.ID])
+        # unknown IDs are remembered, so they aren't searched for again
+        unknownId = 0x7654321
+        self.assertNotIn(hex(unknownId), Messaging.MsgNameFromID)
+        hdr.SetMessageID(unknownId)
+        self.assertEqual(UnknownMsg, Messaging.MsgClass(hdr))
+        self.assertEqual(UnknownMsg, Messaging.UnknownClassFromID[unknownId])
+        self.assertNotIn(unknownId, Messaging.MsgClassFromID)
+        self.assertEqual(UnknownMsg, type(Messaging.MsgFactory(hdr)))
+        # but only up to a limit, however many there are
+        for id in range(unknownId, unknownId + 2*Messaging.MaxUnknownIDs):
+            hdr.SetMessageID(id)
+            self.assertEqual(UnknownMsg, Messaging.MsgClass(hdr))
+        self.assertLessEqual(len(Messaging.UnknownClassFromID), Messaging.MaxUnknownIDs)
+
+    def test_find_field_info(self):
+        msgclass = Messaging.MsgClassFromName["TestCase1"]
+        for fieldInfo in msgclass.fields:
+            self.assertIs(fieldInfo, Messaging.findFieldInfo(msgclass.fields, fieldInfo.name))
+            for bitInfo in fieldInfo.bitfieldInfo:
+                self.assertIs(bitInfo, Messaging.findFieldInfo(msgclass.fields, bitInfo.name))
+        self.assertEqual(None, Messaging.findFieldInfo(msgclass.fields, "NotAField"))
+        # fields added after the index was built are found too
+        class FakeMsg:
+            fields = []
+        self.assertEqual(None, Messaging.findFieldInfo(FakeMsg.fields, "Fake"))
+        Messaging.createFakeField(FakeMsg, "Fake", units="m")
+        self.assertEqual("m", Messaging.findFieldInfo(FakeMsg.fields, "Fake").units)
+        # time info and route fields are cached per header class
+        timeInfo, timeScale = Messaging.HeaderTimeInfo(Messaging.hdr)
+        self.assertIs(timeInfo, Messaging.findFieldInfo(Messaging.hdr.fields, "Time"))
+        self.assertEqual(Messaging.TIME_SCALES.get(timeInfo.units), timeScale)
+        self.assertIs(Messaging.RouteFields(Messaging.hdr), Messaging.RouteFields(Messaging.hdr))
+        msg = msgclass()
+        route = Messaging.MsgRoute(msg)
+        self.assertEqual(len(Messaging.RouteFields(Messaging.hdr)), len(route))
+        Messaging.SetMsgRoute(msg, route)
+        self.assertEqual(route, Messaging.MsgRoute(msg))
+
     def test_accessors(self):
         msgclass = Messaging.MsgClassFromName["Network.Connect"]
         sameMsgClass = Messaging.Messages.Network.Connect
@@ -41,6 +90,55 @@ class TestClass(unittest.TestCase):
         observed=Messaging.get(testMsg, msgclass.fields[0])
         self.assertMultiLineEqual(expected, observed)
 
+    def test_get_set_conversions(self):
+        from msgtools.lib.messaging import FieldInfo
+        msgclass = Messaging.MsgClassFromName["TestCase1"]
+        msg = msgclass()
+        fieldB = Messaging.findFieldInfo(msgclass.fields, "FieldB")
+        for value, expected in [("0x10", 16), (" 12 ", 12), (3.7, 3), ("5.0", 5)]:
+            Messaging.set(msg, fieldB, value)
+            self.assertEqual(expected, msg.GetFieldB())
+        fieldE = Messaging.findFieldInfo(msgclass.fields, "FieldE")
+        Messaging.set(msg, fieldE, "2.5")
+        self.assertEqual(2.5, Messaging.get(msg, fieldE))
+        fieldC = Messaging.findFieldInfo(msgclass.fields, "FieldC")
+        Messaging.set(msg, fieldC, "0x7", 2)
+        self.assertEqual(7, Messaging.get(msg, fieldC, 2))
+        bitsB = Messaging.findFieldInfo(msgclass.fields, "BitsB")
+        Messaging.set(msg, bitsB, "0x1")
+        self.assertEqual(1, msg.GetBitsB(enumAsInt=True))
+        # hex units are formatted with two digits per byte
+        hexInfo = FieldInfo(name="FieldB", type="int", units="HEX", minVal="", maxVal="", description="",
+            get=msgclass.GetFieldB, set=msgclass.SetFieldB, count=1, bitfieldInfo=[], enum=[])
+        Messaging.set(msg, hexInfo, "0xAB")
+        self.assertEqual(("0x%0" + str(hexInfo.size*2) + "X") % 0xAB, Messaging.get(msg, hexInfo))
+
+    def test_field_attributes(self):
+        msgclass = Messaging.MsgClassFromName["TestCase1"]
+        msg = msgclass()
+        msg.FieldB = 7
+        self.assertEqual(7, msg.FieldB)
+        self.assertEqual(7, msg.GetFieldB())
+        msg.BitsC = 3
+        self.assertEqual(msg.GetBitsC(), msg.BitsC)
+        # array fields return the same view every time, and accept lists
+        self.assertIs(msg.FieldC, msg.FieldC)
+        msg.FieldC = [1, 2, 3, 4, 5]
+        msg.FieldC[4] = 9
+        self.assertEqual([1, 2, 3, 4, 9], list(msg.FieldC))
+        self.assertEqual(5, len(msg.FieldC))
+        self.assertEqual(2, msg.FieldC[1])
+        with self.assertRaises(AttributeError):
+            msg.FieldC = 1
+        # fake fields read through attributes too
+        msg.fake_fields["Computed"] = 1.5
+        self.assertEqual(1.5, msg.Computed)
+        with self.assertRaises(AttributeError):
+            msg.NotAField
+        with self.assertRaises(AttributeError):
+            msg.NotAField = 1
+        self.assertFalse(hasattr(msg, "__dict__"))
+
     def PrintDictionary(self):
         width=10
         print("")
@@ -149,6 +247,572 @@ class TestClass(unittest.TestCase):
             tcNum += 1
             #print("\n\n")
 
+    def test_generated_json(self):
+        # the generated to_json_dict/from_json_dict give the same results as reflection,
+        # for full length and short messages
+        def json(msg):
+            j = msgjson.toJson(msg, includeHeader=True)
+            msg2 = msgjson.jsonToMsg(j)
+            return (j, msg2.rawBuffer().raw, msg2.hdr.GetDataLength())
+        for msgname in ["TestCase1", "TestCase4"]:
+            msgclass = Messaging.MsgClassFromName[msgname]
+            msg = msgclass()
+            for length in range(msgclass.SIZE, -1, -1):
+                msg.hdr.SetDataLength(length)
+                generated = json(msg)
+                with unittest.mock.patch.object(Messaging, "generatedFn", return_value=None):
+                    reflection = json(msg)
+                self.assertEqual(reflection, generated, "%s length %d" % (msgname, length))
+        msgclass = Messaging.MsgClassFromName["TestCase4"]
+        self.assertIsNotNone(Messaging.generatedFn(msgclass, "to_json_dict"))
+        with self.assertRaises(KeyError):
+            msgjson.dictToMsg({"TestCase4": {"A": 1, "NotAField": 2}})
+        msg = msgjson.dictToMsg({"TestCase4": {"A": 1, "NotAField": 2}}, ignore_invalid="silent")
+        self.assertEqual(1, msg.GetA())
+
+    def test_generated_csv(self):
+        # the generated csv_values/from_csv_params give the same results as reflection,
+        # for full length and short messages, with and without terminators
+        def csv(line):
+            msg = msgcsv.csvToMsg(line)
+            return (msg.rawBuffer().raw, msg.hdr.GetDataLength())
+        for msgname in ["TestCase1", "TestCase4"]:
+            msgclass = Messaging.MsgClassFromName[msgname]
+            msg = msgclass()
+            for length in range(msgclass.SIZE, -1, -1):
+                msg.hdr.SetDataLength(length)
+                line = msgcsv.toCsv(msg)
+                terminated = line + (";" if "," in line else ", ;")
+                generated = [line, csv(line), csv(terminated)]
+                with unittest.mock.patch.object(Messaging, "generatedFn", return_value=None):
+                    reflection = [msgcsv.toCsv(msg), csv(line), csv(terminated)]
+                self.assertEqual(reflection, generated, "%s length %d" % (msgname, length))
+
+    def test_split_params(self):
+        import csv
+        for line in ['', ' ', 'a, b,c', '1, "x,y", 3;', '"a,b', 'a\\,b, c', ' 0x0102 , ;', '"",""']:
+            escaped = msgcsv.escapeCommasInQuotedString(line)
+            expected = list(csv.reader([escaped], quotechar='"', delimiter=',', quoting=csv.QUOTE_NONE, skipinitialspace=True, escapechar='\\'))[0]
+            self.assertEqual(expected, msgcsv.splitParams(line), line)
+
+    def test_crc16(self):
+        import random
+        import numpy as np
+        from msgtools.lib import crc16
+        # the byte-at-a-time algorithm that the table driven versions replaced
+        def legacyCrc16(data):
+            crc = 0;
+            for i in range(0,len(data)):
+                d = struct.unpack_from('B', data, i)[0]
+                crc = (crc >> 8) | (crc << 8)
+                crc ^= d
+                crc ^= (crc & 0xff) >> 4
+                crc ^= crc << 12
+                crc = 0xFFFF & crc
+                crc ^= (crc & 0xff) << 5
+                crc = 0xFFFF & crc
+            return crc
+        rng = random.Random(1234)
+        buffers = [bytes(rng.getrandbits(8) for _ in range(rng.randrange(200))) for _ in range(200)]
+        buffers += [b'', b'\x00', b'\xff'*64, b'123456789']
+        for data in buffers:
+            expected = legacyCrc16(data)
+            self.assertEqual(expected, crc16.Crc16(data))
+            self.assertEqual(expected, crc16.Crc16(bytearray(data)))
+            self.assertEqual(expected, crc16.Crc16Table(data))
+            # split into random chunks, like fragments of a message
+            acc = crc16.Crc16Accumulator()
+            pos = 0
+            while pos < len(data):
+                chunk = rng.randrange(1, 20)
+                acc.update(memoryview(data)[pos:pos+chunk])
+                pos += chunk
+            self.assertEqual(expected, acc.value)
+            self.assertEqual(len(data), acc.length)
+        self.assertEqual(0x31C3, crc16.Crc16(b'123456789'))
+        # all the buffers, back to back, validated in one vectorized call
+        log = b''.join(buffers)
+        lengths = [len(b) for b in buffers]
+        offsets = np.cumsum([0] + lengths[:-1])
+        crcs = crc16.Crc16Many(log, offsets, lengths)
+        self.assertEqual([legacyCrc16(b) for b in buffers], crcs.tolist())
+        self.assertEqual(0, len(crc16.Crc16Many(log, [], [])))
+        with self.assertRaises(ValueError):
+            crc16.Crc16Many(log, [len(log)-1], [2])
+
+    def test_header_translator(self):
+        from msgtools.lib.header_translator import HeaderTranslator
+        from headers.SerialHeader import SerialHeader
+        from headers.NetworkHeader import NetworkHeader
+        translator = HeaderTranslator(SerialHeader, NetworkHeader)
+        serialHdr = SerialHeader()
+        serialHdr.SetMessageID(0x12)
+        serialHdr.SetSource(3)
+        serialHdr.SetDestination(4)
+        serialHdr.SetPriority(2)
+        serialHdr.SetDataLength(5)
+        serialHdr.SetTime(60000)
+        body = bytearray(b'\x01\x02\x03\x04\x05\x06')
+        networkHdr = translator.translateHdrAndBody(serialHdr, body)
+        self.assertEqual(NetworkHeader, type(networkHdr))
+        self.assertEqual(NetworkHeader.SIZE+5, len(networkHdr.rawBuffer()))
+        self.assertEqual(b'\x01\x02\x03\x04\x05', networkHdr.rawBuffer()[NetworkHeader.SIZE:])
+        for name in ["MessageID", "Source", "Destination", "Priority", "DataLength", "Time"]:
+            self.assertEqual(getattr(serialHdr, "Get"+name)(), getattr(networkHdr, "Get"+name)(), name)
+        back = translator.translate(networkHdr)
+        self.assertEqual(serialHdr.rawBuffer().raw + bytes(body[:5]), back.rawBuffer().raw)
+        # the serial header's 16 bit time wrapping is unwrapped in the network header
+        serialHdr.SetTime(10)
+        wrapped = translator.translateHdr(serialHdr)
+        self.assertEqual(65535+10, wrapped.GetTime())
+        self.assertEqual(b'\0'*5, wrapped.rawBuffer()[NetworkHeader.SIZE:])
+        # IDs the serial header can't hold aren't translated
+        networkHdr.SetMessageID(0x12345)
+        self.assertEqual(None, translator.translateHdr(networkHdr))
+        with self.assertRaises(IndexError):
+            translator.translateHdrAndBody(serialHdr, b'\0')
+        with self.assertRaises(TypeError):
+            translator.translateHdr(Messaging.MsgClassFromName["TestCase1"]())
+
+    def test_framer(self):
+        import random
+        from msgtools.lib.framer import MessageFramer
+        from msgtools.lib.header_translator import HeaderHelper
+        from headers.SerialHeader import SerialHeader
+        rng = random.Random(99)
+        def make_msgs(hdr_class, helper=None):
+            msgs = []
+            for i in range(50):
+                length = rng.randrange(0, 300)
+                buf = hdr_class().rawBuffer().raw + bytes(rng.getrandbits(8) for _ in range(length))
+                hdr = hdr_class(bytearray(buf))
+                hdr.SetMessageID(i)
+                hdr.SetDataLength(length)
+                if helper:
+                    helper.finalize(hdr)
+                msgs.append(hdr.rawBuffer().raw)
+            return msgs
+        # messages split across reads of random sizes come out whole, however big they are
+        msgs = make_msgs(Messaging.hdr)
+        stream = b''.join(msgs)
+        framer = MessageFramer(Messaging.hdr, buffer_size=64)
+        received = []
+        pos = 0
+        while pos < len(stream):
+            chunk = rng.randrange(1, 1000)
+            framer.feed(stream[pos:pos+chunk])
+            pos += chunk
+            received += [bytes(m) for m in framer.messages()]
+        self.assertEqual(msgs, received)
+        self.assertEqual(0, len(framer))
+        # reading directly into the buffer
+        framer.write_buffer(len(stream))[:len(stream)] = stream
+        framer.commit(len(stream))
+        self.assertEqual(msgs, [bytes(m) for m in framer.messages()])
+
+        # garbage and corrupted bodies between serial messages are skipped
+        errors = []
+        helper = HeaderHelper(SerialHeader, errors.append)
+        msgs = make_msgs(SerialHeader, helper)
+        stream = b''
+        expected = []
+        for i, msg in enumerate(msgs):
+            if i % 3 == 1:
+                stream += b'\xde\xad' + bytes(rng.getrandbits(8) for _ in range(rng.randrange(1, 40)))
+            if i % 7 == 2 and len(msg) > SerialHeader.SIZE:
+                stream += msg[:-1] + bytes([msg[-1] ^ 0xff])
+            else:
+                stream += msg
+                expected.append(msg)
+        framer = MessageFramer(SerialHeader, helper)
+        received = []
+        for pos in range(0, len(stream), 100):
+            framer.feed(stream[pos:pos+100])
+            received += [bytes(m) for m in framer.messages()]
+        self.assertEqual(expected, received)
+        self.assertTrue(framer.discarded_bytes > 0)
+        self.assertEqual(len(msgs) - len(expected), framer.invalid_bodies)
+
+    def test_websocket_framing(self):
+        from PyQt5 import QtCore
+        from msgtools.lib.client_connection import ClientConnection
+        raw = Messaging.MsgClassFromName["TestCase1"]().rawBuffer().raw
+        connection = ClientConnection(Messaging.hdr)
+        received = []
+        connection.rx_hdr.connect(received.append)
+        # a frame with junk at the end doesn't garble the frames after it
+        connection._processBinaryMessage(QtCore.QByteArray(raw + b'\0\0\0'))
+        for i in range(3):
+            connection._processBinaryMessage(QtCore.QByteArray(raw))
+        self.assertEqual([raw]*4, [hdr.rawBuffer().raw for hdr in received])
+        self.assertEqual(3, connection.framer.discarded_bytes)
+
+    def test_multicast_connection_is_receive_only(self):
+        from msgtools.lib.client_connection import ClientConnection
+        connection = ClientConnection(Messaging.hdr)
+        self.assertFalse(connection.receiveOnly)
+        connection.OpenConnection("mcast://239.255.77.77:5691")
+        self.assertTrue(connection.receiveOnly)
+        self.assertEqual(-1, connection.SendMsg(Messaging.Messages.Network.Connect()))
+        self.assertEqual(-1, connection.SendMsg(Messaging.Messages.Network.Connect()))
+        connection.CloseConnection()
+
+    def test_log_writer(self):
+        import os
+        import tempfile
+        from msgtools.lib.log_writer import LogWriter
+        msgs = []
+        for i in range(10):
+            msg = Messaging.MsgClassFromName["TestCase1"]()
+            msg.SetFieldB(i)
+            msgs.append(msg)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # binary logs are the messages exactly as given
+            filename = os.path.join(tmpdir, "test.log")
+            writer = LogWriter(filename, "bin", flushInterval=0.01, fsync='close')
+            for msg in msgs:
+                self.assertTrue(writer.log(msg.rawBuffer().raw))
+            writer.close()
+            self.assertEqual(10, writer.writtenMsgs)
+            with open(filename, 'rb') as f:
+                self.assertEqual(b''.join(msg.rawBuffer().raw for msg in msgs), f.read())
+            # csv is formatted on the writer's thread, with one header per type of message
+            filename = os.path.join(tmpdir, "test.csv")
+            writer = LogWriter(filename, "csv")
+            for msg in msgs:
+                writer.log(msg.rawBuffer().raw)
+            writer.close()
+            with open(filename) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(msgs[0].csvHeader(timeColumn=True), lines[0])
+            self.assertEqual([msg.toCsv(timeColumn=True) for msg in msgs], lines[1:])
+            # messages are dropped when the queue is full, or after closing
+            writer = LogWriter(os.path.join(tmpdir, "dropped.log"), "bin", flushInterval=10, queueLimit=3)
+            results = [writer.log(msg.rawBuffer().raw) for msg in msgs[:5]]
+            self.assertEqual([True, True, True, False, False], results)
+            self.assertEqual((3, 2), (writer.queuedMsgs, writer.droppedMsgs))
+            writer.close()
+            self.assertEqual((0, 3), (writer.queuedMsgs, writer.writtenMsgs))
+            self.assertFalse(writer.log(msgs[0].rawBuffer().raw))
+            self.assertRaises(ValueError, LogWriter, filename, "txt")
+
+    def test_log_rotation(self):
+        import os
+        import json
+        import tempfile
+        import time
+        from msgtools.lib.log_writer import LogWriter, LogRotation
+        msgs = []
+        for i in range(10):
+            msg = Messaging.MsgClassFromName["TestCase1" if i % 3 else "TestCase2"]()
+            msgs.append(msg.rawBuffer().raw)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # segments end at the first message boundary at or past the size limit
+            maxBytes = len(msgs[0]) + len(msgs[1]) + 1
+            writer = LogWriter(os.path.join(tmpdir, "test.log"), "bin", flushInterval=10, rotation=LogRotation(maxBytes=maxBytes))
+            for data in msgs:
+                writer.log(data)
+            writer.close()
+            with open(os.path.join(tmpdir, "test.manifest.json")) as f:
+                manifest = json.load(f)
+            segments = manifest["segments"]
+            self.assertEqual(os.path.join(tmpdir, "test.0003.log"), writer.currentFileName)
+            self.assertEqual(["test.%04d.log" % i for i in range(4)], [s["file"] for s in segments])
+            self.assertEqual([3,3,3,1], [s["messages"] for s in segments])
+            self.assertFalse(any(s["open"] for s in segments))
+            # the ID index of each segment points at the messages in it
+            msgIndex = 0
+            for segment in segments:
+                with open(os.path.join(tmpdir, segment["file"]), 'rb') as f:
+                    contents = f.read()
+                self.assertEqual(len(contents), segment["bytes"])
+                self.assertEqual(b''.join(msgs[msgIndex:msgIndex+segment["messages"]]), contents)
+                for id, idInfo in segment["ids"].items():
+                    self.assertEqual(Messaging.MsgNameFromID[id], idInfo["name"])
+                    hdr = Messaging.hdr(contents[idInfo["last_offset"]:])
+                    self.assertEqual(id, hex(hdr.GetMessageID()))
+                self.assertEqual(segment["messages"], sum(i["count"] for i in segment["ids"].values()))
+                msgIndex += segment["messages"]
+            # rotate() starts a new segment, and each csv segment has its own header
+            writer = LogWriter(os.path.join(tmpdir, "test.csv"), "csv", flushInterval=10, rotation=LogRotation(maxSeconds=3600))
+            writer.log(msgs[1])
+            writer.rotate()
+            time.sleep(0.1)
+            writer.log(msgs[1])
+            writer.close()
+            for i in range(2):
+                with open(os.path.join(tmpdir, "test.%04d.csv" % i)) as f:
+                    self.assertEqual(2, len(f.read().splitlines()))
+            # wall-clock boundaries are aligned to local midnight
+            local = time.localtime()
+            midnight = time.mktime((local.tm_year, local.tm_mon, local.tm_mday, 0, 0, 0, 0, 0, -1))
+            rotation = LogRotation(clockInterval=3600)
+            self.assertEqual(midnight + 3*3600, rotation.endTime(midnight + 2.5*3600))
+            rotation.maxSeconds = 60
+            self.assertEqual(midnight + 2.5*3600 + 60, rotation.endTime(midnight + 2.5*3600))
+            self.assertFalse(LogRotation().enabled())
+            # settings that are zero come from the defaults, one by one
+            rotation = LogRotation(maxSeconds=60).withDefaults(LogRotation(1024, 30, 3600))
+            self.assertEqual((1024, 60, 3600), (rotation.maxBytes, rotation.maxSeconds, rotation.clockInterval))
+
+    def test_shm_ring(self):
+        import os
+        import tempfile
+        from msgtools.lib.framer import MessageFramer
+        from msgtools.lib.shm_ring import ShmRing, ShmEndpoint, socketPath, parseHandshake, DEFAULT_SOCKET
+        msgs = []
+        for i in range(10):
+            msg = Messaging.MsgClassFromName["TestCase1"]()
+            msg.SetFieldB(i)
+            msgs.append(msg.rawBuffer().raw)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "ring")
+            # a ring that holds a bit more than two messages, so messages wrap around
+            capacity = 2*len(msgs[0]) + 5
+            producer = ShmRing(path, capacity, create=True)
+            consumer = ShmRing(path)
+            self.assertEqual(capacity, consumer.capacity)
+            self.assertRaises(FileExistsError, ShmRing, path, capacity, True)
+            # writes that don't fit are partial, like a socket
+            self.assertEqual(len(msgs[0]), producer.write(msgs[0]))
+            self.assertEqual(len(msgs[1]), producer.write(msgs[1]))
+            self.assertEqual(5, producer.write(msgs[2]))
+            self.assertEqual(0, producer.write(msgs[2]))
+            self.assertEqual(capacity, consumer.available())
+            buf = bytearray(len(msgs[0]))
+            self.assertEqual(len(msgs[0]), consumer.read_into(buf))
+            self.assertEqual(msgs[0], bytes(buf))
+            # the rest of the message wraps around to the start of the ring
+            self.assertEqual(len(msgs[2]) - 5, producer.write(msgs[2][5:]))
+            self.assertEqual(len(msgs[1]), consumer.read_into(buf))
+            self.assertEqual(msgs[1], bytes(buf))
+            self.assertEqual(len(msgs[2]), consumer.read_into(buf))
+            self.assertEqual(msgs[2], bytes(buf))
+            self.assertEqual(0, consumer.read_into(buf))
+            # flags are taken once
+            consumer.setConsumerWaiting()
+            self.assertTrue(producer.takeConsumerWaiting())
+            self.assertFalse(producer.takeConsumerWaiting())
+            consumer.close()
+            producer.close()
+            # endpoints keep what doesn't fit, and the framer splits the stream back into messages
+            ring = ShmRing(os.path.join(tmpdir, "endpoint"), capacity, create=True)
+            sender = ShmEndpoint(None, ring)
+            receiver = ShmEndpoint(ShmRing(ring.path), None)
+            framer = MessageFramer(Messaging.hdr)
+            received = []
+            self.assertTrue(receiver.prepareToWait())
+            self.assertTrue(sender.send(msgs[0]))
+            self.assertFalse(receiver.prepareToWait())
+            for data in msgs[1:]:
+                sender.send(data)
+            self.assertTrue(sender.pending())
+            while len(received) < len(msgs):
+                self.assertTrue(receiver.receive(framer) or not sender.pending())
+                received.extend(bytes(data) for data in framer.messages())
+                sender.flush()
+            self.assertEqual(msgs, received)
+            ring.close()
+            receiver.rxRing.close()
+            # other files aren't mistaken for rings
+            with open(os.path.join(tmpdir, "notaring"), 'wb') as f:
+                f.write(bytes(1024))
+            self.assertRaises(ValueError, ShmRing, os.path.join(tmpdir, "notaring"))
+        self.assertEqual(DEFAULT_SOCKET, socketPath("shm:"))
+        self.assertEqual("/tmp/server", socketPath("shm:///tmp/server"))
+        self.assertEqual(("/a", "/b"), parseHandshake(b"MSGTOOLS-SHM 1 /a /b\n"))
+        self.assertRaises(ValueError, parseHandshake, b"HTTP/1.1 400\n")
+
+    def test_multicast(self):
+        from msgtools.lib.framer import MessageFramer
+        from msgtools.lib.multicast import parseAddress, packDatagram, splitDatagram, SequenceTracker, DEFAULT_GROUP, DEFAULT_PORT
+        self.assertEqual((DEFAULT_GROUP, DEFAULT_PORT), parseAddress(""))
+        self.assertEqual(("239.1.2.3", 6000), parseAddress("//239.1.2.3:6000"))
+        self.assertEqual((DEFAULT_GROUP, 6000), parseAddress(":6000"))
+        msgs = []
+        for i in range(3):
+            msg = Messaging.MsgClassFromName["TestCase1"]()
+            msg.SetFieldB(i)
+            msgs.append(msg.rawBuffer().raw)
+        datagram = packDatagram(0x100000005, msgs)
+        (sequence, data) = splitDatagram(datagram)
+        # sequence numbers wrap at 32 bits
+        self.assertEqual(5, sequence)
+        framer = MessageFramer(Messaging.hdr)
+        framer.feed(data)
+        self.assertEqual(msgs, [bytes(msg) for msg in framer.messages()])
+        # datagrams without a sequence number are passed through
+        self.assertEqual((None, msgs[0]), splitDatagram(msgs[0]))
+        tracker = SequenceTracker()
+        self.assertEqual(0, tracker.update(10))
+        self.assertEqual(0, tracker.update(11))
+        self.assertEqual(2, tracker.update(14))
+        # a late datagram isn't lost after all
+        self.assertEqual(0, tracker.update(12))
+        self.assertEqual((1, 1), (tracker.lostDatagrams, tracker.lateDatagrams))
+        # the publisher restarting isn't counted as lost or late
+        self.assertEqual(0, tracker.update(0x80000000))
+        self.assertEqual((1, 1), (tracker.lostDatagrams, tracker.lateDatagrams))
+        self.assertEqual(5, tracker.receivedDatagrams)
+        # across the wrap
+        tracker = SequenceTracker()
+        tracker.update(0xFFFFFFFF)
+        self.assertEqual(1, tracker.update(1))
+
+    def test_batch(self):
+        from msgtools.lib import batch
+        msgs = []
+        for i in range(20):
+            msg = Messaging.MsgClassFromName["TestCase1"]()
+            msg.SetFieldB(i)
+            msgs.append(msg.rawBuffer().raw)
+        for compression in (batch.UNCOMPRESSED, batch.ZLIB):
+            packed = batch.pack(msgs, (7, 8), compression)
+            hdr = Messaging.hdr(packed)
+            self.assertEqual(Messaging.Messages.Network.Batch.ID, hdr.GetMessageID())
+            self.assertEqual(len(packed), Messaging.hdrSize + hdr.GetDataLength())
+            (path, hdrs) = batch.unpack(packed)
+            self.assertEqual((7, 8), path)
+            self.assertEqual(msgs, [hdr.rawBuffer().raw for hdr in hdrs])
+        self.assertLess(len(batch.pack(msgs, (), batch.ZLIB)), len(b''.join(msgs)) // 2)
+        # compression that doesn't make it smaller isn't used
+        noise = msgs[0][:Messaging.hdrSize] + os.urandom(len(msgs[0]) - Messaging.hdrSize)
+        packed = batch.pack([noise], (), batch.ZLIB)
+        self.assertEqual(batch.UNCOMPRESSED, Messaging.Messages.Network.Batch(packed).GetCompression(enumAsInt=True))
+        self.assertRaises(ValueError, batch.unpack, packed[:-1])
+        self.assertRaises(ValueError, batch.unpack, packed[:10])
+        # batches that decompress to more than they say they hold, or say they
+        # hold too much, are rejected without decompressing all of them
+        import zlib
+        def withData(rawLength, data):
+            batchMsg = Messaging.Messages.Network.Batch()
+            batchMsg.SetCompression(batch.ZLIB)
+            batchMsg.SetRawLength(rawLength)
+            batchMsg.hdr.SetDataLength(batchMsg.SIZE + len(data))
+            return batchMsg.rawBuffer().raw[:batch.batchMsgSize()] + data
+        bomb = zlib.compress(bytes(batch.MAX_RAW_LENGTH * 2))
+        self.assertRaises(ValueError, batch.unpack, withData(len(msgs[0]), bomb))
+        self.assertRaises(ValueError, batch.unpack, withData(batch.MAX_RAW_LENGTH + 1, bomb))
+        self.assertRaises(ValueError, batch.unpack, withData(0, bomb))
+        self.assertEqual(msgs[:1], [hdr.rawBuffer().raw for hdr in batch.unpack(withData(len(msgs[0]), zlib.compress(msgs[0])))[1]])
+
+        batcher = batch.Batcher(maxBytes=len(msgs[0])*3, remoteId=5)
+        self.assertEqual([], batcher.add(msgs[0]))
+        self.assertEqual([], batcher.add(msgs[1]))
+        ready = batcher.add(msgs[2])
+        self.assertEqual(1, len(ready))
+        self.assertEqual(((batch.SERVER_ID,), msgs[:3]), (batch.path(ready[0]), [hdr.rawBuffer().raw for hdr in batch.unpack(ready[0])[1]]))
+        # messages with a different path go in a new batch
+        self.assertEqual([], batcher.add(msgs[3], (3,)))
+        ready = batcher.add(msgs[4], (4,))
+        self.assertEqual([(3, batch.SERVER_ID)], [batch.path(buf) for buf in ready])
+        # messages that came from the server the batches go to aren't sent back
+        self.assertEqual([], batcher.add(msgs[5], (4, 5)))
+        self.assertEqual(1, batcher.loopedMsgs)
+        self.assertEqual((4, batch.SERVER_ID), batch.path(batcher.flush()))
+        self.assertIsNone(batcher.flush())
+        self.assertEqual((5, 3), (batcher.msgs, batcher.batches))
+
+    def test_bulk_decode(self):
+        # NaN doesn't equal itself, so compare values as they print
+        def assertSame(expected, observed, name):
+            self.assertEqual(repr(expected), repr(observed), name)
+        for msgname in ["TestCase1", "TestCase2", "TestCase3", "TestCase4", "SignedFields", "Network.Connect"]:
+            msgclass = Messaging.MsgClassFromName[msgname]
+            # fill the body with a repeatable pattern of every byte value, so every field has a
+            # distinct value, and with all 0xff and all 0x80, so signed fields and bitfields
+            # are negative and have their sign bits set
+            patterns = [[(i*37+11) % 256 for i in range(msgclass.SIZE)], [0xff]*msgclass.SIZE, [0x80]*msgclass.SIZE]
+            for pattern in patterns:
+                msg = msgclass()
+                msg.rawBuffer()[msgclass.MSG_OFFSET:msgclass.MSG_OFFSET+msgclass.SIZE] = bytes(pattern)
+                values = Messaging.unpackAll(msg)
+                asDict = msg.as_dict()
+                elementCount = 0
+                for fieldInfo in msgclass.fields:
+                    elementCount += 1 if fieldInfo.type == "string" else fieldInfo.count
+                    if len(fieldInfo.bitfieldInfo) != 0:
+                        self.assertNotIn(fieldInfo.name, asDict)
+                    for info in [fieldInfo] + fieldInfo.bitfieldInfo:
+                        if info.count == 1:
+                            expected = Messaging.get(msg, info)
+                        else:
+                            expected = [Messaging.get(msg, info, i) for i in range(info.count)]
+                        assertSame(expected, values[info.name], msgname+"."+info.name)
+                        if info.name in asDict:
+                            assertSame(expected, asDict[info.name], msgname+"."+info.name)
+                self.assertEqual(elementCount, len(msg.as_tuple()))
+            # a truncated message can't be decoded in bulk, callers fall back to the accessors
+            msg.hdr.SetDataLength(msgclass.SIZE-1)
+            self.assertEqual(None, Messaging.unpackAll(msg))
+        # the patterns do make signed fields and bitfields negative
+        msg = Messaging.MsgClassFromName["SignedFields"]()
+        msg.rawBuffer()[msg.MSG_OFFSET:] = b'\xff' * msg.SIZE
+        self.assertEqual((-1, -1, -1, -1), (msg.GetA(), msg.GetB(0), msg.GetC1(), msg.GetD1(1)))
+        self.assertEqual(-1, msg.as_dict()["C1"])
+
+    def test_decode_batch(self):
+        for msgname in ["TestCase1", "TestCase2", "TestCase3", "TestCase4", "SignedFields"]:
+            msgclass = Messaging.MsgClassFromName[msgname]
+            msgs = []
+            log = b''
+            offsets = []
+            # patterns that cover every byte value, and messages of all 0xff and all 0x80, so
+            # signed fields and bitfields are negative and have their sign bits set
+            patterns = [[(i*37+m*11) % 256 for i in range(msgclass.SIZE)] for m in range(5)]
+            patterns += [[0xff]*msgclass.SIZE, [0x80]*msgclass.SIZE]
+            for m, pattern in enumerate(patterns):
+                msg = msgclass()
+                msg.rawBuffer()[msgclass.MSG_OFFSET:msgclass.MSG_OFFSET+msgclass.SIZE] = bytes(pattern)
+                msgs.append(msg)
+                # put some junk between messages, like other messages in a log file
+                log += b'\xff' * m
+                offsets.append(len(log))
+                log += msg.rawBuffer().raw
+            records = Messaging.decode_batch(msgclass, log, offsets)
+            self.assertEqual(len(msgs), len(records))
+            self.assertEqual(msgclass.SIZE, msgclass.DTYPE.itemsize)
+            columns = msgclass.columns(records)
+            for m in range(len(msgs)):
+                for name in columns:
+                    fieldInfo = Messaging.findFieldInfo(msgclass.fields, name)
+                    if len(fieldInfo.enum) != 0 or fieldInfo.type == "string":
+                        # enums aren't looked up, and strings aren't decoded, in columns
+                        continue
+                    # each value matches the field's own getter
+                    for i in range(fieldInfo.count):
+                        expected = Messaging.get(msgs[m], fieldInfo, i)
+                        observed = columns[name][m] if fieldInfo.count == 1 else columns[name][m][i]
+                        if math.isnan(expected):
+                            self.assertTrue(math.isnan(observed), msgname+"."+name)
+                        else:
+                            self.assertAlmostEqual(expected, observed, msg=msgname+"."+name)
+            body = b''.join(msg.rawBuffer().raw[msgclass.MSG_OFFSET:] for msg in msgs)
+            self.assertEqual(records.tobytes(), Messaging.decode_batch(msgclass, body).tobytes())
+        # messages without a body give a record for each offset
+        msgclass = Messaging.MsgClassFromName["Network.ClearLogs"]
+        self.assertEqual(0, msgclass.DTYPE.itemsize)
+        log = msgclass().rawBuffer().raw * 3
+        records = Messaging.decode_batch(msgclass, log, [i*msgclass.MSG_OFFSET for i in range(3)])
+        self.assertEqual(3, len(records))
+        self.assertEqual(0, len(Messaging.decode_batch(msgclass, log, [])))
+        self.assertRaises(ValueError, Messaging.decode_batch, msgclass, log)
+
+    def test_construct_from_buffer(self):
+        msgclass = Messaging.MsgClassFromName["TestCase4"]
+        original = msgclass(A=5)
+        data = original.rawBuffer().raw
+        for buf in [data, bytearray(data), memoryview(data), memoryview(bytearray(data))]:
+            msg = msgclass(buf)
+            self.assertEqual(data, msg.rawBuffer().raw)
+            self.assertEqual(5, msg.GetA())
+        # bytes and bytearray are copied, writable memoryviews are shared
+        buf = bytearray(data)
+        msgclass(buf).SetA(6)
+        self.assertEqual(data, bytes(buf))
+        msgclass(memoryview(buf)).SetA(7)
+        self.assertEqual(7, msgclass(buf).GetA())
+
     def test_long_substr(self):
         testData = [
          (['123', 'abc'], ''),
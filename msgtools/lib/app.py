@@ -13,6 +13,7 @@ NOT
 from PyQt5 import QtWidgets, QtCore
 from .messaging import Messaging, TimestampFixer
 from .client_connection import ClientConnection
+from .log_writer import LogWriter
 
 class App(QtWidgets.QMainWindow):
     RxMsg = QtCore.pyqtSignal(object)
@@ -39,6 +40,10 @@ class App(QtWidgets.QMainWindow):
         parser.add_argument('--msgdir', help=''''The directory to load Python message source from.''')
         parser.add_argument('--serial', action='store_true', help='Set if you want to use a SerialHeader instead of a NetworkHeader.')
         parser.add_argument('--log', help='The log file type (csv/json/bin) or complete log file name.')
+        parser.add_argument('--log-flush', type=float, default=LogWriter.defaultFlushInterval,
+            help='Maximum time in seconds that logged data is buffered before being written to the file.')
+        parser.add_argument('--log-fsync', choices=LogWriter.FSYNC_POLICIES, default=LogWriter.defaultFsync,
+            help='When logged data is forced to disk: never, after every flush, or when the log is closed.')
 
         return parser
     
@@ -110,8 +115,13 @@ class App(QtWidgets.QMainWindow):
         # object to fix timestamps of messages with no timestamp set
         self.timestamp_fixer = TimestampFixer()
 
+        if getattr(args, 'log_flush', None) is not None:
+            LogWriter.defaultFlushInterval = args.log_flush
+        if getattr(args, 'log_fsync', None) is not None:
+            LogWriter.defaultFsync = args.log_fsync
+
         self.logFileType = None
-        self.logFile = None
+        self.logWriter = None
         if args.log is not None:
             self.startLog(args.log)
 
@@ -130,9 +140,7 @@ class App(QtWidgets.QMainWindow):
         self.connection.OpenConnection(self.connectionName)
 
     def startLog(self, log_name, log_suffix=''):
-        # hash table of booleans for if each type of message has had it's header
-        # put into this log file already.
-        self.loggedMsgHeader = {}
+        self.stopLog()
         if log_name.endswith('csv'):
             self.logFileType = "csv"
         elif log_name.endswith('json'):
@@ -141,6 +149,7 @@ class App(QtWidgets.QMainWindow):
             self.logFileType = "bin"
         else:
             print("ERROR!  Invalid log type " + log_name)
+            return
         if "." in log_name:
             # if there's a ., assume they specified an exact filename to use
             logFileName = log_name
@@ -148,17 +157,22 @@ class App(QtWidgets.QMainWindow):
             # if not, generate a filename based on current date/time
             currentDateTime = QtCore.QDateTime.currentDateTime()
             logFileName = currentDateTime.toString("yyyyMMdd-hhmmss") + log_suffix + "." + self.logFileType
-        self.logFile = QtCore.QFile(logFileName)
-        self.logFile.open(QtCore.QIODevice.Append)
+        # messages are formatted and written on a background thread
+        self.logWriter = LogWriter(logFileName, self.logFileType)
 
     def stopLog(self):
-        if self.logFile is not None:
-            self.logFile.close()
-            self.logFile = None
+        if self.logWriter is not None:
+            self.logWriter.close()
+            if self.logWriter.droppedMsgs:
+                self.statusUpdate.emit("Dropped %d messages from log %s" % (self.logWriter.droppedMsgs, self.logWriter.fileName))
+            self.logWriter = None
 
     def onConnected(self):
         self.connected = True
         self.connectionChanged.emit(True)
+        if self.connection.receiveOnly:
+            # there's no server to tell who we are, or what to send us
+            return
         # send a connect message
         connectMsg = Messaging.Messages.Network.Connect()
         connectMsg.SetName(self.name)
@@ -200,23 +214,9 @@ class App(QtWidgets.QMainWindow):
         self.logMsg(msg)
 
     def logMsg(self, msg):
-        if self.logFile:
+        if self.logWriter:
+            # the timestamp is fixed now, but formatting and writing happen on
+            # the log writer's thread
             original_timestamp = self.timestamp_fixer.fix_timestamp(msg.hdr)
-            log = ''
-            if self.logFileType == "csv":
-                if not msg.MsgName() in self.loggedMsgHeader:
-                    self.loggedMsgHeader[msg.MsgName()] = True
-                    log = msg.csvHeader(timeColumn=True)+'\n'
-                log += msg.toCsv(timeColumn=True)+'\n'
-                log = log.encode('utf-8')
-            elif self.logFileType == "json":
-                if not msg.MsgName() in self.loggedMsgHeader:
-                    self.loggedMsgHeader[msg.MsgName()] = True
-                    log = msg.jsonHeader()
-                log += msg.toJson(includeHeader=True)+'\n'
-                log = log.encode('utf-8')
-            elif self.logFileType == "bin":
-                log = msg.rawBuffer().raw
-            self.logFile.write(log)
-            self.logFile.flush()
+            self.logWriter.log(msg.rawBuffer().raw)
             self.timestamp_fixer.restore_timestamp(msg.hdr, original_timestamp)
@@ -0,0 +1,184 @@
+import random
+import zlib
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+from .messaging import Messaging
+
+# Batches of messages, for bridges between servers over slow links, where one
+# message at a time is mostly header overhead and small TCP segments.
+#
+# A Network.Batch message holds many messages, each with its NetworkHeader, the
+# same as on a TCP connection, compressed with zlib or lz4 if that's asked for
+# and makes them smaller.  A server that receives a batch routes each message
+# in it as if the sender had sent it on its own.
+#
+# Each batch has the path of the servers its messages were routed by, so a
+# chain of bridges that loops back to a server doesn't keep sending messages
+# around the loop.  A server drops batches whose path has its own ID in it, and
+# a batcher drops messages that already went through the server it sends to.
+
+UNCOMPRESSED = 0
+ZLIB = 1
+LZ4 = 2
+# by the names used in options, in the same order as the BatchCompressions enum
+COMPRESSIONS = {'none': UNCOMPRESSED, 'zlib': ZLIB, 'lz4': LZ4}
+
+DEFAULT_MAX_BYTES = 16*1024
+# milliseconds
+DEFAULT_MAX_DELAY = 10
+# most servers a batch's messages can go through
+MAX_PATH = 8
+ZLIB_LEVEL = 6
+# most bytes a batch can hold before compression, so a small compressed batch
+# can't make the receiver decompress it into gigabytes.  Batches are at most
+# about half of it, so there's always room for one more message of the largest
+# size a header allows.
+MAX_RAW_LENGTH = 32*1024*1024
+
+# ID of this server, in the paths of the batches it sends.  Each server runs in
+# its own process, so the ID is made when the module is first imported.
+SERVER_ID = random.SystemRandom().randrange(1, 1 << 32)
+
+# Returns False if the compression needs a module that isn't installed.
+def available(compression):
+    return compression != LZ4 or lz4 is not None
+
+def batchMsgSize():
+    return Messaging.hdrSize + Messaging.Messages.Network.Batch.SIZE
+
+# Returns an encoded Network.Batch message holding msgs, which are already
+# encoded as bytes.  path is the IDs of the servers that routed them, ending
+# with the one sending the batch.  If compression doesn't make the messages
+# smaller, they're sent uncompressed.
+def pack(msgs, path, compression=UNCOMPRESSED):
+    raw = b''.join(msgs)
+    data = raw
+    if compression == ZLIB:
+        data = zlib.compress(raw, ZLIB_LEVEL)
+    elif compression == LZ4:
+        data = lz4.block.compress(raw, store_size=False)
+    if len(data) >= len(raw):
+        data = raw
+        compression = UNCOMPRESSED
+    batch = Messaging.Messages.Network.Batch()
+    batch.SetCompression(compression)
+    batch.SetMsgCount(len(msgs))
+    batch.SetRawLength(len(raw))
+    for i, serverId in enumerate(path[-MAX_PATH:]):
+        batch.SetPath(serverId, i)
+    batch.hdr.SetDataLength(batch.SIZE + len(data))
+    return batch.rawBuffer().raw[:batchMsgSize()] + data
+
+def _path(batch):
+    path = []
+    for i in range(MAX_PATH):
+        serverId = batch.GetPath(i)
+        if serverId == 0:
+            break
+        path.append(serverId)
+    return tuple(path)
+
+# Returns the path of an encoded Network.Batch message.
+def path(buf):
+    return _path(Messaging.Messages.Network.Batch(bytes(buf[:batchMsgSize()])))
+
+# Returns (path, hdrs) of an encoded Network.Batch message, where hdrs is a
+# header for each message in it.  Raises ValueError if the batch is invalid.
+def unpack(buf):
+    size = batchMsgSize()
+    if len(buf) < size:
+        raise ValueError("Batch of %d bytes is too short" % len(buf))
+    batch = Messaging.Messages.Network.Batch(bytes(buf[:size]))
+    data = bytes(buf[size:Messaging.hdrSize + batch.hdr.GetDataLength()])
+    compression = batch.GetCompression(enumAsInt=True)
+    rawLength = batch.GetRawLength()
+    if rawLength > MAX_RAW_LENGTH:
+        raise ValueError("Batch of %d bytes is too big" % rawLength)
+    try:
+        if compression == ZLIB:
+            # decompress no more than the batch says it holds
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(data, max(rawLength, 1))
+            if decompressor.unconsumed_tail or not decompressor.eof:
+                raise ValueError("Batch has more than %d bytes" % rawLength)
+        elif compression == LZ4:
+            if lz4 is None:
+                raise ValueError("lz4 isn't installed")
+            data = lz4.block.decompress(data, uncompressed_size=rawLength)
+        elif compression != UNCOMPRESSED:
+            raise ValueError("Unknown compression %d" % compression)
+    except (zlib.error, RuntimeError) as ex:
+        raise ValueError("Can't decompress batch: %s" % ex)
+    if len(data) != rawLength:
+        raise ValueError("Batch has %d bytes, not %d" % (len(data), rawLength))
+    hdrs = []
+    offset = 0
+    while offset < len(data):
+        hdr = Messaging.hdr(data[offset:offset+Messaging.hdrSize])
+        end = offset + Messaging.hdrSize + hdr.GetDataLength()
+        if end > len(data):
+            raise ValueError("Message %d of batch is cut off" % len(hdrs))
+        hdrs.append(Messaging.hdr(data[offset:end]))
+        offset = end
+    return _path(batch), hdrs
+
+# Collects messages into batches that are at most about maxBytes, before
+# compression.  Whoever owns it sends the batches add() returns, and calls
+# flush() to send a batch that isn't full yet when it's waited long enough.
+# A batch only has messages with the same path, so messages from different
+# bridges go in different batches.
+class Batcher:
+    def __init__(self, maxBytes=DEFAULT_MAX_BYTES, compression=UNCOMPRESSED, remoteId=0):
+        self.maxBytes = min(maxBytes, MAX_RAW_LENGTH // 2)
+        self.compression = compression
+        # ID of the server the batches go to, if it's known
+        self.remoteId = remoteId
+        self._msgs = []
+        self._size = 0
+        self._path = ()
+        self.msgs = 0
+        self.rawBytes = 0
+        self.batches = 0
+        self.sentBytes = 0
+        self.loopedMsgs = 0
+
+    # number of messages waiting in the current batch
+    def __len__(self):
+        return len(self._msgs)
+
+    # Adds an encoded message, that was routed by the servers in path before
+    # this one.  Returns a list of the batches that are ready to send.
+    def add(self, buf, path=()):
+        if (self.remoteId and self.remoteId in path) or len(path) >= MAX_PATH:
+            self.loopedMsgs += 1
+            return []
+        ready = []
+        if self._msgs and path != self._path:
+            ready.append(self.flush())
+        self._path = path
+        self._msgs.append(buf)
+        self._size += len(buf)
+        if self._size >= self.maxBytes:
+            ready.append(self.flush())
+        return ready
+
+    # Returns the current batch, or None if it's empty.
+    def flush(self):
+        if not self._msgs:
+            return None
+        batch = pack(self._msgs, self._path + (SERVER_ID,), self.compression)
+        self.msgs += len(self._msgs)
+        self.rawBytes += self._size
+        self.batches += 1
+        self.sentBytes += len(batch)
+        self._msgs = []
+        self._size = 0
+        return batch
+
+    def statusText(self):
+        percent = 100 * self.sentBytes // self.rawBytes if self.rawBytes else 100
+        return "%d msgs in %d batches, %d%% of size" % (self.msgs, self.batches, percent)
@@ -1,7 +1,13 @@
 from PyQt5 import QtCore, QtNetwork
 from .messaging import Messaging
+from .framer import MessageFramer
+from . import shm_ring
+from . import multicast
 
-# Used for TCP socket and websocket connections to a server.
+# Used for TCP socket, websocket, and shared memory connections to a server,
+# and to receive messages a server publishes to a multicast group.
+# Multicast connections are receive-only: receiveOnly is set for them, and
+# sending anything on one sends nothing and returns -1.
 class ClientConnection(QtCore.QObject):
     connection_error = QtCore.pyqtSignal(QtNetwork.QAbstractSocket.SocketError)
     on_connect = QtCore.pyqtSignal()
@@ -12,14 +18,22 @@ class ClientConnection(QtCore.QObject):
         super(ClientConnection, self).__init__(None)
         # initialize the read function to None, so it's not accidentally called
         self.readBytesFn = None
-        # rx buffer, to receive a message with multiple reads
-        self.rx_buf = bytearray()
+        # splits received data into messages
+        self.header_class = header_class
+        self.framer = MessageFramer(header_class)
         self.connection = None
+        # the rings of a shared memory connection, once it's connected
+        self.shmEndpoint = None
+        # set for connections that can't send, like multicast ones
+        self.receiveOnly = False
         if name:
             self.OpenConnection(name)
 
     def OpenConnection(self, connection_name):
         self.CloseConnection()
+        # throw away any partial message from a previous connection
+        self.framer.clear()
+        self.receiveOnly = False
 
         if "ws:" in connection_name:
             connection_name = connection_name.replace("ws://","")
@@ -37,6 +51,33 @@ class ClientConnection(QtCore.QObject):
             self.connection.open(QUrl(connection_name))
             self.connection.binaryMessageReceived.connect(self._processBinaryMessage)
             self.sendBytesFn = self.connection.sendBinaryMessage
+        elif connection_name.startswith("shm:"):
+            # a server on the same host, through rings in shared memory
+            self.connection = QtNetwork.QLocalSocket(self)
+            self.connection.error.connect(self._localSocketError)
+            self.connection.readyRead.connect(self._readShmSocket)
+            self.connection.disconnected.connect(self._closeShm)
+            self.shmEndpoint = None
+            self.shmHandshake = b''
+            self.connection.connectToServer(shm_ring.socketPath(connection_name))
+            self.sendBytesFn = self._sendShm
+        elif connection_name.startswith("mcast:"):
+            # receive only, from a multicast group
+            (group, port) = multicast.parseAddress(connection_name[len("mcast:"):])
+            self.connection = QtNetwork.QUdpSocket(self)
+            self.connection.readyRead.connect(self._readDatagrams)
+            self.multicastSequence = multicast.SequenceTracker()
+            self.receiveOnly = True
+            self.multicastSendWarned = False
+            self.sendBytesFn = self._sendMulticast
+            # the socket is ready as soon as it's joined the group, but tell
+            # whoever's listening from the event loop, like other connections
+            if (self.connection.bind(QtNetwork.QHostAddress.AnyIPv4, port, QtNetwork.QUdpSocket.ShareAddress | QtNetwork.QUdpSocket.ReuseAddressHint) and
+                    self.connection.joinMulticastGroup(QtNetwork.QHostAddress(group))):
+                self.connection.setSocketOption(QtNetwork.QAbstractSocket.ReceiveBufferSizeSocketOption, multicast.MulticastSocket.RECEIVE_BUFFER_SIZE)
+                QtCore.QTimer.singleShot(0, self.on_connect.emit)
+            else:
+                QtCore.QTimer.singleShot(0, lambda: self.connection_error.emit(self.connection.error()))
         else:
             #print("opening TCP socket %s" % (connection_name))
             (ip, port) = connection_name.rsplit(":",1)
@@ -56,13 +97,18 @@ class ClientConnection(QtCore.QObject):
             self.readBytesFn = self.connection.read
             self.sendBytesFn = self.connection.write
             #print("making connection returned", ret, "for socket", self.connection)
-        self.connection.connected.connect(self.on_connect)
+        if not connection_name.startswith(("shm:", "mcast:")):
+            # shared memory connections are connected once the rings are
+            # mapped, and multicast ones once they've joined the group
+            self.connection.connected.connect(self.on_connect)
         self.connection.disconnected.connect(self.on_disconnect)
 
     def CloseConnection(self):
         if not self.connection:
             return
 
+        self._closeShm()
+
         try:
             self.connection.close()
         except:
@@ -73,8 +119,10 @@ class ClientConnection(QtCore.QObject):
             pass
         self.connection = None
 
+    # SendHeader() and SendMsg() return the number of bytes sent, or -1 if
+    # the message couldn't be sent.
     def SendHeader(self, hdr):
-        self.sendBytesFn(hdr.rawBuffer().raw)
+        return self.sendBytesFn(hdr.rawBuffer().raw)
 
     def SendMsg(self, msg):
         bufferSize = len(msg.rawBuffer().raw)
@@ -84,9 +132,36 @@ class ClientConnection(QtCore.QObject):
             print("app.py: Truncating message %s from %d to %d bytes" % (msg.__class__.__name__, computedSize, bufferSize))
         if(computedSize < bufferSize):
             # don't send the *whole* message, just a section of it up to the specified length
-            self.sendBytesFn(msg.rawBuffer().raw[0:computedSize])
+            return self.sendBytesFn(msg.rawBuffer().raw[0:computedSize])
+        else:
+            return self.sendBytesFn(msg.rawBuffer().raw)
+
+    # Asks the server to send messages whose ID & mask == value at most
+    # maxRate times a second, keeping the latest, or only one of every
+    # everyNth of them.  With neither, the rate limit is removed.
+    def SendRateLimit(self, value, maxRate=0, everyNth=0, mask=0xFFFFFFFF):
+        subMsg = Messaging.Messages.Network.RateLimitedSubscription()
+        subMsg.SetMask(mask)
+        subMsg.SetValue(value)
+        if everyNth:
+            subMsg.SetMode("EveryNth")
+            subMsg.SetDecimation(everyNth)
+        elif maxRate:
+            subMsg.SetMode("KeepLatest")
+            subMsg.SetMaxRate(maxRate)
         else:
-            self.sendBytesFn(msg.rawBuffer().raw)
+            subMsg.SetMode("Remove")
+        self.SendMsg(subMsg)
+
+    # Asks the server to only send messages whose ID & mask == value if their
+    # contents match filter, like "FieldB > 5 and hdr.Source == 3".  An empty
+    # filter removes it.
+    def SendFilter(self, value, filter, mask=0xFFFFFFFF):
+        subMsg = Messaging.Messages.Network.FilteredSubscription()
+        subMsg.SetMask(mask)
+        subMsg.SetValue(value)
+        subMsg.SetFilter(filter)
+        self.SendMsg(subMsg)
 
     # Matches name of QAbstractSocket.isOpen()
     def isOpen(self):
@@ -94,55 +169,99 @@ class ClientConnection(QtCore.QObject):
             return self.connection.isOpen()
         return False
 
-    # Qt signal/slot based reading of websocket, or from TCP socket after assembling header and body.
+    # Qt signal/slot based reading of websocket.
     def _processBinaryMessage(self, bytes):
-        if isinstance(bytes, bytearray):
-            hdr = Messaging.hdr(bytes)
-        else:
-            # Assume this is a QByteArray from a websocket
-            hdr = Messaging.hdr(bytes.data())
-
-        # if we got this far, we have a whole message!
-        # Emit the signal as a header.
-        self.rx_hdr.emit(hdr)
-        # If anyone is connected to the rx_msg signal then construct a message object
-        # and emit that, too.
-        if self.receivers(self.rx_msg):
-            msg = Messaging.MsgFactory(hdr)
-            self.rx_msg.emit(msg)
+        # Assume this is a QByteArray from a websocket, which can hold more than one message,
+        # but no partial ones, so a bad one shouldn't affect the next one
+        self.framer.feed(bytes.data())
+        self._emitMessages()
+        self.framer.drop_partial()
+
+    def _emitMessages(self):
+        emit_msgs = self.receivers(self.rx_msg)
+        for msg_bytes in self.framer.messages():
+            # Emit the signal as a header.
+            hdr = self.header_class(msg_bytes)
+            self.rx_hdr.emit(hdr)
+            # If anyone is connected to the rx_msg signal then construct a message object
+            # and emit that, too.
+            if emit_msgs:
+                msg = Messaging.MsgFactory(hdr)
+                self.rx_msg.emit(msg)
 
     # Qt signal/slot based reading of TCP socket
     def _readRxBuffer(self):
-        input_stream = QtCore.QDataStream(self.connection)
-        while(self.connection.bytesAvailable() > 0):
-            # read the header, unless we have the header
-            if(len(self.rx_buf) < Messaging.hdrSize):
-                #print("reading", Messaging.hdrSize - len(self.rx_buf), "bytes for header")
-                self.rx_buf += input_stream.readRawData(Messaging.hdrSize - len(self.rx_buf))
-                #print("have", len(self.rx_buf), "bytes")
-            
-            # if we still don't have the header, break
-            if(len(self.rx_buf) < Messaging.hdrSize):
-                print("don't have full header, quitting")
-                return
-            
-            hdr = Messaging.hdr(self.rx_buf)
-            
-            # need to decode body len to read the body
-            bodyLen = hdr.GetDataLength()
-            
-            # read the body, unless we have the body
-            if(len(self.rx_buf) < Messaging.hdrSize + bodyLen):
-                #print("reading", Messaging.hdrSize + bodyLen - len(self.rx_buf), "bytes for body")
-                self.rx_buf += input_stream.readRawData(Messaging.hdrSize + bodyLen - len(self.rx_buf))
-            
-            # if we still don't have the body, break
-            if(len(self.rx_buf) < Messaging.hdrSize + bodyLen):
-                print("don't have full body, quitting")
+        # read everything that's available, and emit each whole message in it
+        self.framer.feed(self.connection.readAll().data())
+        self._emitMessages()
+
+    def _localSocketError(self, error):
+        if error in (QtNetwork.QLocalSocket.ConnectionRefusedError, QtNetwork.QLocalSocket.ServerNotFoundError):
+            self.connection_error.emit(QtNetwork.QAbstractSocket.ConnectionRefusedError)
+        else:
+            self.connection_error.emit(QtNetwork.QAbstractSocket.UnknownSocketError)
+
+    # The server's socket carries the shared memory handshake, and after that
+    # only wakeups, which say to check the rings.  See shm_ring.py.
+    def _readShmSocket(self):
+        data = self.connection.readAll().data()
+        if self.shmEndpoint is None:
+            self.shmHandshake += data
+            if not b'\n' in self.shmHandshake:
                 return
+            c2s, s2c = shm_ring.parseHandshake(self.shmHandshake.split(b'\n', 1)[0])
+            self.shmEndpoint = shm_ring.ShmEndpoint(shm_ring.ShmRing(s2c), shm_ring.ShmRing(c2s))
+            self.connection.write(b'OK\n')
+            self.on_connect.emit()
+        self._serviceShm()
+
+    def _serviceShm(self):
+        endpoint = self.shmEndpoint
+        if endpoint is None:
+            return
+        wake = endpoint.receive(self.framer)
+        if endpoint.pending():
+            # write what didn't fit in the ring before
+            wake = endpoint.flush() or wake
+        if wake:
+            self.connection.write(b'\x01')
+        self._emitMessages()
+        # ask for a wakeup when the server sends again, or if it already has,
+        # read more after the event loop runs
+        if self.shmEndpoint is endpoint and not endpoint.prepareToWait():
+            QtCore.QTimer.singleShot(0, self._serviceShm)
+
+    def _sendShm(self, data):
+        endpoint = self.shmEndpoint
+        if endpoint is None:
+            return -1
+        if endpoint.send(data):
+            self.connection.write(b'\x01')
+        return len(data)
+
+    def _closeShm(self):
+        endpoint = self.shmEndpoint
+        if endpoint is not None:
+            self.shmEndpoint = None
+            endpoint.close()
 
-            # Process what we assume to be a full message...            
-            self._processBinaryMessage(self.rx_buf)
+    # Each datagram holds whole messages, after its sequence number.
+    def _readDatagrams(self):
+        connection = self.connection
+        while connection.hasPendingDatagrams():
+            datagram = connection.receiveDatagram().data().data()
+            (sequence, msgs) = multicast.splitDatagram(datagram)
+            if sequence is not None:
+                self.multicastSequence.update(sequence)
+            # a bad datagram shouldn't affect the next one
+            self.framer.clear()
+            self.framer.feed(msgs)
+            self._emitMessages()
 
-            # then clear the buffer, so we start over on the next message
-            self.rx_buf = bytearray()
+    # Multicast connections only receive, so nothing is sent, which is reported
+    # once per connection.
+    def _sendMulticast(self, data):
+        if not self.multicastSendWarned:
+            self.multicastSendWarned = True
+            print("client_connection.py: Multicast connections are receive-only, not sending anything on them")
+        return -1
@@ -0,0 +1,84 @@
+import binascii
+
+import numpy as np
+
+# CRC-16 used for header and body checksums of serial, bluetooth and CAN
+# messages.  This is the CCITT polynomial (0x1021), with an initial value of 0,
+# no bit reflection and no final XOR (sometimes called CRC-16/XMODEM).
+CRC16_POLYNOMIAL = 0x1021
+
+def _table_entry(byte):
+    crc = byte << 8
+    for _ in range(8):
+        if crc & 0x8000:
+            crc = (crc << 1) ^ CRC16_POLYNOMIAL
+        else:
+            crc = crc << 1
+    return crc & 0xFFFF
+
+# CRC of each possible byte value, used to process a whole byte per step.
+CRC16_TABLE = tuple(_table_entry(b) for b in range(256))
+_NP_TABLE = np.array(CRC16_TABLE, dtype=np.uint16)
+
+# Compute the CRC-16 of data, which can be bytes, bytearray, memoryview, a
+# ctypes buffer, or anything else that supports the buffer protocol.
+# Passing the result of a previous call as crc continues that computation, so
+# Crc16(b, Crc16(a)) == Crc16(a+b).
+# binascii.crc_hqx is a table-driven C implementation of exactly this CRC.
+def Crc16(data, crc=0):
+    return binascii.crc_hqx(data, crc)
+
+# Pure python table-driven version, used as a reference and for sequences of ints.
+def Crc16Table(data, crc=0):
+    table = CRC16_TABLE
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ b]
+    return crc
+
+# Accumulates a CRC-16 over data that arrives in pieces, such as a stream
+# or the fragments of a message being reassembled.
+class Crc16Accumulator:
+    __slots__ = ('value', 'length')
+    def __init__(self, crc=0):
+        self.value = crc
+        self.length = 0
+
+    def update(self, data):
+        self.value = binascii.crc_hqx(data, self.value)
+        self.length += len(data)
+        return self.value
+
+    def reset(self, crc=0):
+        self.value = crc
+        self.length = 0
+
+# Compute CRC-16 of many regions of one buffer at once, which is useful to
+# validate every message in a log.  buffer is anything numpy can view as bytes,
+# offsets and lengths are sequences of equal length giving the start and size
+# of each region.  Returns a numpy array of uint16 CRCs, one per region.
+# All regions advance one byte per step, so cost scales with the longest region
+# rather than the number of regions.
+def Crc16Many(buffer, offsets, lengths):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if offsets.shape != lengths.shape:
+        raise ValueError("offsets and lengths must have the same shape")
+    if len(offsets) and (np.any(offsets < 0) or np.any(lengths < 0) or np.any(offsets + lengths > len(data))):
+        raise ValueError("region outside buffer")
+    crcs = np.zeros(len(offsets), dtype=np.uint16)
+    # process regions from longest to shortest, so each step works on a prefix.
+    order = np.argsort(-lengths, kind='stable')
+    sorted_offsets = offsets[order]
+    sorted_lengths = lengths[order]
+    sorted_crcs = crcs[order]
+    max_len = int(sorted_lengths[0]) if len(sorted_lengths) else 0
+    active = len(sorted_lengths)
+    for i in range(max_len):
+        while active > 0 and sorted_lengths[active-1] <= i:
+            active -= 1
+        crc = sorted_crcs[:active]
+        b = data[sorted_offsets[:active] + i]
+        sorted_crcs[:active] = (crc << 8) ^ _NP_TABLE[(crc >> 8) ^ b]
+    crcs[order] = sorted_crcs
+    return crcs
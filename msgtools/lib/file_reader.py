@@ -1,7 +1,7 @@
 from msgtools.lib.message import Message
 from msgtools.lib.messaging import Messaging
 from msgtools.lib.header_translator import HeaderHelper, HeaderTranslator
-import ctypes
+from msgtools.lib.framer import MessageFramer
 import importlib
 import json
 import math
@@ -48,59 +48,30 @@ class MessageFileReader:
             self.read_binary_file(filename)
 
     def read_binary_file(self, filename):
+        # The framer validates each header and body, and skips over invalid data
+        framer = MessageFramer(self.log_header, self.header_helper)
+        hdr_size = self.log_header.SIZE
         with open(filename, mode='rb') as f:
             while(1):
-                # If we need to translate the header, then read the header and body separately.
-                # Otherwise do a single big read and seek backwards for the next message's start, because that is ~10% faster.
-                if self.header_translator:
-                    # read bytes, create a header
-                    msg_bytes = f.read(self.log_header.SIZE)
-                    if len(msg_bytes) < self.log_header.SIZE:
-                        break
-                    hdr = self.log_header(msg_bytes)
-
-                    if not self.header_helper.header_valid(hdr):
-                        print("Invalid header!")
-                        break
-
-                    # read the body
-                    msg_body = f.read(hdr.GetDataLength())
-
-                    #if not self.header_helper.body_valid(hdr, msg.rawBuffer()[self.log_header.SIZE:]):
-                    if not self.header_helper.body_valid(hdr, msg_body):
-                        print("Invalid body!")
-                        break
-
-                    network_msg = self.header_translator.translateHdrAndBody(hdr, msg_body)
-                else:
-                    # <- read a kB of data so we do fewer (but larger) reads
-                    last_header_pos = f.tell()
-                    msg_bytes = ctypes.create_string_buffer(Messaging.hdr.SIZE+1024)
-                    length_read = f.readinto(msg_bytes)
-                    # Construct a header object
-                    hdr = Messaging.hdr(msg_bytes)
-
-                    if length_read < Messaging.hdr.SIZE:
-                        break
-
-                    if not self.header_helper.header_valid(hdr):
-                        print("Invalid header!")
-                        break
-
-                    # <- seek back to just after the last message's data (where the next header starts)
-                    f.seek(last_header_pos+Messaging.hdr.SIZE+hdr.GetDataLength())
-
-                    hdr = Messaging.hdr(msg_bytes)
-
-                    if not self.header_helper.body_valid(hdr, hdr.rawBuffer()[Messaging.hdr.SIZE:]):
-                        print("Invalid body!")
-                        break
-                    
-                    network_msg = hdr
-                
-                # Get a specifically typed message, to give to process_msg
-                msg = Messaging.MsgFactory(network_msg)
-                self.process_message(msg)
+                # do big reads, each of which will hold many messages
+                length_read = f.readinto(framer.write_buffer(65536))
+                if not length_read:
+                    break
+                framer.commit(length_read)
+                for msg_bytes in framer.messages():
+                    if self.header_translator:
+                        hdr = self.log_header(msg_bytes[:hdr_size])
+                        network_msg = self.header_translator.translateHdrAndBody(hdr, msg_bytes[hdr_size:])
+                    else:
+                        network_msg = Messaging.hdr(msg_bytes)
+
+                    # Get a specifically typed message, to give to process_msg
+                    msg = Messaging.MsgFactory(network_msg)
+                    self.process_message(msg)
+        if framer.discarded_bytes or framer.invalid_bodies:
+            print("Skipped %d bytes of invalid headers and %d messages with invalid bodies" % (framer.discarded_bytes, framer.invalid_bodies))
+        if len(framer):
+            print("Ignored %d bytes of incomplete message at end of file" % (len(framer)))
 
     def read_json_file(self, filename, ignore_invalid=False):
         with open(filename) as f:
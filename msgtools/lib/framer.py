@@ -0,0 +1,126 @@
+from .messaging import Messaging
+
+# Splits a stream of bytes into messages.
+# Bytes are added in chunks of any size, with feed(), or by reading directly
+# into the buffer returned by write_buffer() and then calling commit().
+# messages() then yields each complete message (header and body) as a read-only
+# memoryview into the receive buffer, so a single big read can produce many
+# messages without copying any of them.  The views are only valid until more
+# data is added, so anything that keeps a message needs to make a header from
+# it, like hdr_class(view), which copies it.  Don't add data while iterating
+# over messages().
+#
+# If a HeaderHelper is given, headers and bodies are validated with it.  When
+# a header is invalid, the framer resyncs by searching for the header's start
+# sequence with bytearray.find(), or if there's no start sequence, by trying
+# the next byte.  Messages with invalid bodies are dropped.
+class MessageFramer:
+    def __init__(self, hdr_class, header_helper=None, buffer_size=65536):
+        self.hdr_class = hdr_class
+        self.hdr_size = hdr_class.SIZE
+        self.header_helper = header_helper
+        # scratch header, that each header is copied into to check its length
+        # and validity, so a header object isn't made for every message
+        self._hdr = hdr_class()
+        self._hdr_buffer = self._hdr.rawBuffer()
+        self._alloc(max(buffer_size, self.hdr_size))
+        self._read = 0
+        self._write = 0
+        # byte pattern to search for when resyncing
+        self._sync = None
+        self._sync_offset = 0
+        start_sequence_field = Messaging.findFieldInfo(hdr_class.fields, "StartSequence")
+        if header_helper and start_sequence_field and start_sequence_field.size > 0:
+            offset = start_sequence_field.offset
+            self._sync = bytes(self._hdr_buffer.raw[offset:offset+start_sequence_field.size])
+            self._sync_offset = offset
+        # counts of data thrown away
+        self.discarded_bytes = 0
+        self.invalid_bodies = 0
+
+    def _alloc(self, size):
+        # A new bytearray is allocated instead of resizing the old one, because
+        # resizing isn't allowed while views of it exist.
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf).toreadonly()
+        self._write_view = memoryview(self._buf)
+
+    def __len__(self):
+        return self._write - self._read
+
+    def clear(self):
+        self._read = 0
+        self._write = 0
+
+    # For transports like websockets, where each packet holds whole messages,
+    # throws away a partial message left at the end of a packet, so it can't
+    # corrupt the next one, and counts it in discarded_bytes.  Call after
+    # taking the packet's messages().
+    def drop_partial(self):
+        self.discarded_bytes += self._write - self._read
+        self.clear()
+
+    # Returns a writable view of at least size bytes of free space at the end of
+    # the buffer, to read data into.  Call commit() with the number of bytes read.
+    def write_buffer(self, size):
+        if len(self._buf) - self._write < size:
+            pending = self._write - self._read
+            if pending + size <= len(self._buf):
+                # move pending data to the start of the buffer
+                self._buf[0:pending] = self._buf[self._read:self._write]
+            else:
+                old = self._buf
+                self._alloc(max(2*len(old), pending + size))
+                self._buf[0:pending] = old[self._read:self._write]
+            self._read = 0
+            self._write = pending
+        return self._write_view[self._write:]
+
+    def commit(self, count):
+        self._write += count
+
+    def feed(self, data):
+        count = len(data)
+        self.write_buffer(count)[:count] = data
+        self._write += count
+
+    def _resync(self):
+        start = self._read
+        if self._sync:
+            pos = self._buf.find(self._sync, start + 1 + self._sync_offset, self._write)
+            if pos < 0:
+                # keep enough bytes at the end to hold a partial start sequence
+                self._read = max(start + 1, self._write - len(self._sync) + 1 - self._sync_offset)
+            else:
+                self._read = pos - self._sync_offset
+        else:
+            self._read = start + 1
+        self.discarded_bytes += self._read - start
+
+    def messages(self):
+        hdr = self._hdr
+        hdr_buffer = self._hdr_buffer
+        hdr_size = self.hdr_size
+        helper = self.header_helper
+        buf = self._buf
+        view = self._view
+        write = self._write
+        start = self._read
+        while write - start >= hdr_size:
+            hdr_buffer[0:hdr_size] = buf[start:start+hdr_size]
+            if helper and not helper.header_valid(hdr):
+                self._resync()
+                start = self._read
+                continue
+            end = start + hdr_size + hdr.GetDataLength()
+            if end > write:
+                break
+            self._read = end
+            if helper and not helper.body_valid(hdr, view[start+hdr_size:end]):
+                self.invalid_bodies += 1
+            else:
+                yield view[start:end]
+            start = end
+        if start == write:
+            self._read = 0
+            self._write = 0
@@ -96,7 +96,7 @@ class MsgTextWidget(QtWidgets.QWidget):
         self.allowedFields = dict((fieldName,True) for fieldName in allowedFields)
         tableHeader = []
         if self.fieldAllowed("Time"):
-            timeUnits = Messaging.findFieldInfo(Messaging.hdr.fields, "Time").units
+            timeUnits = Messaging.HeaderTimeInfo(Messaging.hdr)[0].units
             if timeUnits == "ms":
                 timeUnits = "s"
             tableHeader.append("Time ("+timeUnits+")")
@@ -144,7 +144,7 @@ class MsgTextWidget(QtWidgets.QWidget):
         if self.fieldAllowed("Time"):
             try:
                 timeVal = msg.hdr.GetTime()
-                timeInfo = Messaging.findFieldInfo(msg.hdr.fields, "Time")
+                timeInfo = Messaging.HeaderTimeInfo(type(msg.hdr))[0]
                 if timeInfo.units == "ms":
                     timeVal = timeVal / 1000.0
                 timeVal = datetime.datetime.fromtimestamp(timeVal, datetime.timezone.utc)
@@ -153,39 +153,41 @@ class MsgTextWidget(QtWidgets.QWidget):
             timeVal = timeVal.strftime('%H:%M:%S.%f')[:-3]
             msgStringList.append(timeVal)
             columnAlerts.append(0)
+        values = Messaging.unpackAll(msg)
         if self.showHeader:
+            hdrValues = Messaging.unpackAll(msg.hdr)
             for fieldInfo in Messaging.hdr.fields:
                 if len(fieldInfo.bitfieldInfo) == 0:
                     if self.fieldAllowed(fieldInfo.name):
-                        fieldValue = str(Messaging.get(msg.hdr, fieldInfo))
+                        fieldValue = str(Messaging.getUnpacked(hdrValues, msg.hdr, fieldInfo))
                         msgStringList.append(fieldValue)
                 else:
                     for bitInfo in fieldInfo.bitfieldInfo:
                         if self.fieldAllowed(bitInfo.name):
-                            fieldValue = str(Messaging.get(msg.hdr, bitInfo))
+                            fieldValue = str(Messaging.getUnpacked(hdrValues, msg.hdr, bitInfo))
                             msgStringList.append(fieldValue)
         for fieldInfo in type(msg).fields:
             if(fieldInfo.count == 1):
                 if self.fieldAllowed(fieldInfo.name):
-                    fieldValue = str(Messaging.get(msg, fieldInfo))
+                    fieldValue = str(Messaging.getUnpacked(values, msg, fieldInfo))
                     msgStringList.append(fieldValue)
-                    columnAlerts.append(Messaging.getAlert(msg, fieldInfo))
+                    columnAlerts.append(Messaging.valueAlert(fieldInfo, fieldValue))
                 for bitInfo in fieldInfo.bitfieldInfo:
                     if self.fieldAllowed(bitInfo.name):
-                        fieldValue = str(Messaging.get(msg, bitInfo))
+                        fieldValue = str(Messaging.getUnpacked(values, msg, bitInfo))
                         msgStringList.append(fieldValue)
-                        columnAlerts.append(Messaging.getAlert(msg, bitInfo))
+                        columnAlerts.append(Messaging.valueAlert(bitInfo, fieldValue))
             else:
                 if self.fieldAllowed(fieldInfo.name):
                     columnText = ""
                     alert = False
                     for i in range(0,fieldInfo.count):
-                        fieldValue = str(Messaging.get(msg, fieldInfo, i))
+                        fieldValue = str(Messaging.getUnpacked(values, msg, fieldInfo, i))
                         # if the value is what is given when we go off the end of an array, break.
                         if fieldInfo.type == "int" and fieldValue == "UNALLOCATED":
                             break
                         columnText += str(fieldValue)
-                        if Messaging.getAlert(msg, fieldInfo, i):
+                        if Messaging.valueAlert(fieldInfo, fieldValue):
                             alert = True
                         if(i<fieldInfo.count-1):
                             columnText += ", "
@@ -207,7 +209,7 @@ class MsgTreeWidget(TreeWidget):
             self.showHeader = False
         # add table header, one column for each message field
         tableHeader = []
-        timeUnits = Messaging.findFieldInfo(Messaging.hdr.fields, "Time").units
+        timeUnits = Messaging.HeaderTimeInfo(Messaging.hdr)[0].units
         if timeUnits == "ms":
             timeUnits = "s"
         tableHeader.append("Time ("+timeUnits+")")
@@ -252,7 +254,7 @@ class MsgTreeWidget(TreeWidget):
         columnAlerts = []
         try:
             timeVal = msg.hdr.GetTime()
-            timeInfo = Messaging.findFieldInfo(msg.hdr.fields, "Time")
+            timeInfo = Messaging.HeaderTimeInfo(type(msg.hdr))[0]
             if timeInfo.units == "ms":
                 timeVal = timeVal / 1000.0
             timeVal = datetime.datetime.fromtimestamp(timeVal, datetime.timezone.utc)
@@ -263,30 +265,32 @@ class MsgTreeWidget(TreeWidget):
         columnAlerts.append(0)
         keyColumn = -1
         columnCounter = 1
+        values = Messaging.unpackAll(msg)
         if self.showHeader:
+            hdrValues = Messaging.unpackAll(msg.hdr)
             for fieldInfo in Messaging.hdr.fields:
                 if len(fieldInfo.bitfieldInfo) == 0:
-                    fieldValue = str(Messaging.get(msg.hdr, fieldInfo))
+                    fieldValue = str(Messaging.getUnpacked(hdrValues, msg.hdr, fieldInfo))
                     msgStringList.append(fieldValue)
                     columnCounter += 1
                 else:
                     for bitInfo in fieldInfo.bitfieldInfo:
-                        fieldValue = str(Messaging.get(msg.hdr, bitInfo))
+                        fieldValue = str(Messaging.getUnpacked(hdrValues, msg.hdr, bitInfo))
                         msgStringList.append(fieldValue)
                         columnCounter += 1
         for fieldInfo in type(msg).fields:
             if(fieldInfo.count == 1):
-                fieldValue = str(Messaging.get(msg, fieldInfo))
+                fieldValue = str(Messaging.getUnpacked(values, msg, fieldInfo))
                 msgStringList.append(fieldValue)
-                columnAlerts.append(Messaging.getAlert(msg, fieldInfo))
+                columnAlerts.append(Messaging.valueAlert(fieldInfo, fieldValue))
                 if fieldInfo.name == self.keyField:
                     keyValue = fieldValue
                     keyColumn = columnCounter
                 columnCounter += 1
                 for bitInfo in fieldInfo.bitfieldInfo:
-                    fieldValue = str(Messaging.get(msg, bitInfo))
+                    fieldValue = str(Messaging.getUnpacked(values, msg, bitInfo))
                     msgStringList.append(fieldValue)
-                    columnAlerts.append(Messaging.getAlert(msg, bitInfo))
+                    columnAlerts.append(Messaging.valueAlert(bitInfo, fieldValue))
                     if bitInfo.name == self.keyField:
                         keyValue = fieldValue
                         keyColumn = columnCounter
@@ -297,7 +301,7 @@ class MsgTreeWidget(TreeWidget):
                 if "hex" == fieldInfo.units.lower():
                     columnText = "0x"
                     for i in range(0, fieldInfo.count):
-                        fieldValue = Messaging.get(msg, fieldInfo, i).replace("0x","")
+                        fieldValue = Messaging.getUnpacked(values, msg, fieldInfo, i).replace("0x","")
                         if fieldInfo.type == "int" and fieldValue == "UNALLOCATED":
                             break
                         columnText += fieldValue
@@ -306,12 +310,12 @@ class MsgTreeWidget(TreeWidget):
                             break
                 else:
                     for i in range(0,fieldInfo.count):
-                        fieldValue = str(Messaging.get(msg, fieldInfo, i))
+                        fieldValue = str(Messaging.getUnpacked(values, msg, fieldInfo, i))
                         # if the value is what is given when we go off the end of an array, break.
                         if fieldInfo.type == "int" and fieldValue == "UNALLOCATED":
                             break
                         columnText += str(fieldValue)
-                        if Messaging.getAlert(msg, fieldInfo, i):
+                        if Messaging.valueAlert(fieldInfo, fieldValue):
                             alert = True
                         if(i<fieldInfo.count-1):
                             columnText += ", "
@@ -1,8 +1,8 @@
-from collections import namedtuple
 import ctypes
-import datetime
 import struct
+import time
 
+from .crc16 import Crc16
 from .messaging import Messaging
 
 def hexbytes(hdr):
@@ -12,19 +12,6 @@ def hexbytes(hdr):
         b = hdr
     return "0x"+":".join("{:02x}".format(c) for c in b)
 
-def Crc16(data):
-    crc = 0;
-    for i in range(0,len(data)):
-        d = struct.unpack_from('B', data, i)[0]
-        crc = (crc >> 8) | (crc << 8)
-        crc ^= d
-        crc ^= (crc & 0xff) >> 4
-        crc ^= crc << 12
-        crc = 0xFFFF & crc
-        crc ^= (crc & 0xff) << 5
-        crc = 0xFFFF & crc
-    return crc
-
 # This helps finalize and validate headers that have any of:
 # 1) A start sequence, which is a constant string of bytes that delimits
 #    the start of a header, useful for sending data across noisy datalinks
@@ -79,6 +66,94 @@ class HeaderHelper:
             msg.SetHeaderChecksum(Crc16(msg.rawBuffer()[:self._hdr_crc_region]))
             msg.SetBodyChecksum(Crc16(msg.rawBuffer()[self._hdr_class.SIZE:self._hdr_class.SIZE+msg.GetDataLength()]))
 
+# Everything needed to translate from one header type to another, worked out
+# once when the HeaderTranslator is made, so translating a message is just a
+# copy of the destination header's initial bytes, a list of field moves, and
+# a slice copy of the body.
+class TranslationPlan:
+    # how the Time field is filled in
+    TIME_NONE = 0   # destination header has no time
+    TIME_COPY = 1   # copy and scale the source's time
+    TIME_WRAP = 2   # source time is smaller and can wrap, so unwrap it
+    TIME_NOW  = 3   # source header has no time, so use current time
+
+    def __init__(self, fromType, toType, fieldPairs):
+        self.fromType = fromType
+        self.toType = toType
+        self.toSize = toType.SIZE
+        # bytes of a freshly initialized destination header, copied into
+        # each new message instead of calling initialize() every time
+        self.initialHeader = toType().rawBuffer().raw[:toType.SIZE]
+        self.moves = []
+        for fromFieldInfo, toFieldInfo in fieldPairs:
+            # Time is always set separately, below
+            if toFieldInfo.name == "Time":
+                continue
+            if TranslationPlan.isDirectMove(fromFieldInfo, toFieldInfo):
+                self.moves.append((fromFieldInfo.get, toFieldInfo.set))
+            else:
+                self.moves.append((fromFieldInfo.getValue, toFieldInfo.setValue))
+
+        fromTime = Messaging.findFieldInfo(fromType.fields, "Time")
+        toTime = Messaging.findFieldInfo(toType.fields, "Time")
+        # set once SetTime() has rejected a float, so later times are converted first
+        self.timeNeedsInt = False
+        self.timeScale = 1.0
+        self.timeMax = 0.0
+        self.sinceMidnight = False
+        self.timeToMs = False
+        if toTime == None:
+            self.timeMode = TranslationPlan.TIME_NONE
+        elif fromTime != None:
+            self.timeScale = TranslationPlan.timeScaling(fromTime.units, toTime.units)
+            # if we're converting from a header with a smaller timestamp to a header
+            # with a bigger timestamp, look for wrapping of the input timestamp
+            time_could_wrap = False
+            if not TranslationPlan.timeReallyBig(fromTime.maxVal):
+                if TranslationPlan.timeReallyBig(toTime.maxVal):
+                    time_could_wrap = True
+                else:
+                    time_could_wrap = int(fromTime.maxVal) < int(toTime.maxVal)
+            if time_could_wrap:
+                self.timeMode = TranslationPlan.TIME_WRAP
+                self.timeMax = float(fromTime.maxVal)
+            else:
+                self.timeMode = TranslationPlan.TIME_COPY
+        else:
+            self.timeMode = TranslationPlan.TIME_NOW
+            maxTime = toTime.maxVal
+            # use time since start of day, if 32-bit or smaller timestamps
+            self.sinceMidnight = maxTime != "DBL_MAX" and (maxTime == "FLT_MAX" or float(maxTime) <= 2**32)
+            self.timeToMs = toTime.units == "ms"
+
+    # Integer fields without enums can be moved with the raw accessors, because
+    # the conversions Messaging.get() and Messaging.set() do wouldn't change the value.
+    @staticmethod
+    def isDirectMove(fromFieldInfo, toFieldInfo):
+        if "int" not in fromFieldInfo.type or "int" not in toFieldInfo.type:
+            return False
+        if fromFieldInfo.enum or toFieldInfo.enum:
+            return False
+        return fromFieldInfo.count == 1 and toFieldInfo.count == 1
+
+    @staticmethod
+    def timeReallyBig(tmax):
+        if tmax == 'DBL_MAX':
+            return True
+        if tmax == 'FLT_MAX':
+            return True
+        if int(tmax) >= 2**32:
+            return True
+        return False
+
+    @staticmethod
+    def timeScaling(fromUnits, toUnits):
+        if fromUnits.lower() == 'ms' and toUnits.lower() == 's':
+            return 0.001
+        if fromUnits.lower() == 's' and toUnits.lower() == 'ms':
+            return 1000.0
+        return 1.0
+
 class HeaderTranslator:
     def __init__(self, hdr1, hdr2):
         # Make a list of fields in the headers that have matching names.
@@ -93,119 +168,103 @@ class HeaderTranslator:
                     fieldInfo2 = Messaging.findFieldInfo(hdr2.fields, bitfieldInfo1.name)
                     if fieldInfo2 != None:
                         self._correspondingFields.append([bitfieldInfo1, fieldInfo2])
-        
-        HdrInfo = namedtuple('HdrInfo', 'type infoIndex timeField')
-        self._hdr1Info = HdrInfo(hdr1, 0, Messaging.findFieldInfo(hdr1.fields, "Time"))
-        self._hdr2Info = HdrInfo(hdr2, 1, Messaging.findFieldInfo(hdr2.fields, "Time"))
+
+        self._hdr1 = hdr1
+        self._hdr2 = hdr2
+        self._plans = {
+            hdr1: TranslationPlan(hdr1, hdr2, self._correspondingFields),
+            hdr2: TranslationPlan(hdr2, hdr1, [(pair[1], pair[0]) for pair in self._correspondingFields])}
         self._timestampOffset = 0
         self._lastTimestamp = 0
+        # time.monotonic() of the last time wrap, used to tell wrapping from
+        # out-of-order messages
         self._lastWrapTime = None
 
-    def translateHdrAndBody(self, fromHdr, body):
-        toHdr = self.translateHdr(fromHdr)
-        if toHdr:
-            # copy the body
-            for i in range(0,fromHdr.GetDataLength()):
-                toHdr.rawBuffer()[toHdr.SIZE+i] = body[i]
-        return toHdr
+    def _plan(self, fromHdr):
+        try:
+            return self._plans[type(fromHdr)]
+        except KeyError:
+            pass
+        # subclasses of the header types translate like their base class
+        if isinstance(fromHdr, self._hdr1):
+            return self._plans[self._hdr1]
+        if isinstance(fromHdr, self._hdr2):
+            return self._plans[self._hdr2]
+        print("ERROR!  type %s is not %s or %s!" % (type(fromHdr), self._hdr1, self._hdr2))
+        raise TypeError
 
+    def translateHdrAndBody(self, fromHdr, body):
+        plan = self._plan(fromHdr)
+        length = fromHdr.GetDataLength()
+        body = bytes(body[:length])
+        if len(body) < length:
+            raise IndexError("body has %d bytes, but header DataLength is %d" % (len(body), length))
+        return self._translate(plan, fromHdr, ctypes.create_string_buffer(plan.initialHeader + body, plan.toSize + length))
 
     def translateHdr(self, fromHdr):
-        # figure out which direction to translate
-        if isinstance(fromHdr, self._hdr1Info.type):
-            fromHdrInfo = self._hdr1Info
-            toHdrInfo = self._hdr2Info
-        elif isinstance(fromHdr, self._hdr2Info.type):
-            fromHdrInfo = self._hdr2Info
-            toHdrInfo = self._hdr1Info
-        else:
-            print("ERROR!  type %s is not %s or %s!" % (type(fromHdr), self._hdr1Info.type, self._hdr2Info.type))
-            raise TypeError
-        
-        # allocate the message to translate to
-        toBuffer = ctypes.create_string_buffer(toHdrInfo.type.SIZE+fromHdr.GetDataLength())
-        toHdr = toHdrInfo.type(toBuffer)
-        toHdr.initialize()
-
-        # loop through fields using reflection, and transfer contents from
-        # one header to the other
-        for pair in self._correspondingFields:
-            fromFieldInfo = pair[fromHdrInfo.infoIndex]
-            toFieldInfo = pair[toHdrInfo.infoIndex]
-            Messaging.set(toHdr, toFieldInfo, Messaging.get(fromHdr, fromFieldInfo))
-        
+        plan = self._plan(fromHdr)
+        toBuffer = ctypes.create_string_buffer(plan.toSize + fromHdr.GetDataLength())
+        toBuffer[:plan.toSize] = plan.initialHeader
+        return self._translate(plan, fromHdr, toBuffer)
+
+    def _translate(self, plan, fromHdr, toBuffer):
+        toHdr = plan.toType(toBuffer)
+
+        # transfer contents from one header to the other
+        for get, set in plan.moves:
+            set(toHdr, get(fromHdr))
+
         # if the message ID can't be expressed in the new header, return None,
         # because this message isn't translatable
         if fromHdr.GetMessageID() != toHdr.GetMessageID():
             if Messaging.debug:
                 print("message ID 0x" + hex(fromHdr.GetMessageID()) + " translated to 0x" + hex(toHdr.GetMessageID()) + ", throwing away")
             return None
-        
-        # do special timestamp stuff to convert from relative to absolute time
-        if toHdrInfo.timeField != None:
-            def set_time(hdr, t):
-                # This is a bit ugly, but it's hard to tell if the Time field is a float or
-                # an int.  If it's an int and we give it a float, struct.error gets raised.
-                try:
-                    hdr.SetTime(t)
-                except struct.error:
-                    hdr.SetTime(int(t))
-            if fromHdrInfo.timeField != None:
-                def timeReallyBig(tmax):
-                    if tmax == 'DBL_MAX':
-                        return True
-                    if tmax == 'FLT_MAX':
-                        return True
-                    if int(tmax) >= 2**32:
-                        return True
-                def timeScaling(fromUnits, toUnits):
-                    if fromUnits.lower() == 'ms' and toUnits.lower() == 's':
-                        return 0.001
-                    if fromUnits.lower() == 's' and toUnits.lower() == 'ms':
-                        return 1000.0
-                    return 1.0
-                time_scale = timeScaling(fromHdrInfo.timeField.units, toHdrInfo.timeField.units)
-                # if we're converting from a header with a smaller timestamp to a header
-                # with a bigger timestamp, look for wrapping of the input timestamp
-                time_could_wrap = False
-                if not timeReallyBig(fromHdrInfo.timeField.maxVal):
-                    if timeReallyBig(toHdrInfo.timeField.maxVal):
-                        time_could_wrap = True
-                    else:
-                        time_could_wrap = int(fromHdrInfo.timeField.maxVal) < int(toHdrInfo.timeField.maxVal)
-                if time_could_wrap:
-                    # Detect time rolling
-                    thisTimestamp = fromHdr.GetTime() * time_scale
-                    thisTime = datetime.datetime.now()
-                    # if the new timestamp is less than the old one plus some margin,
-                    # do further checks to see if a wrap occurred.
-                    if thisTimestamp < self._lastTimestamp - float(fromHdrInfo.timeField.maxVal) * time_scale * 0.1:
-                        # If the check above shows the new timestamp is less than the last timestamp,
-                        # count it as wrapping only if the current system time is beyond the last time
-                        # a wrap occured by more than 0.5 times the time it should take for the
-                        # timestamp to wrap again.  The assumption is that if it's not that far beyond
-                        # the last time it wrapped, then messages were sent slightly out-of-order.
-                        if (self._lastWrapTime == None or
-                            thisTime > self._lastWrapTime + datetime.timedelta(seconds=float(fromHdrInfo.timeField.maxVal) * time_scale * 0.5)):
-                            self._lastWrapTime = thisTime
-                            self._timestampOffset += 1
-                    self._lastTimestamp = thisTimestamp
-                    # need to handle different size timestamps!
-                    set_time(toHdr, self._timestampOffset * float(fromHdrInfo.timeField.maxVal) * time_scale + thisTimestamp)
-                else:
-                    set_time(toHdr, fromHdr.GetTime()*time_scale)
-            else:
-                t = datetime.datetime.now().timestamp()
-                maxTime = toHdrInfo.timeField.maxVal
-                # use time since start of day, if 32-bit or smaller timestamps
-                if maxTime != "DBL_MAX" and (maxTime == "FLT_MAX" or float(maxTime) <= 2**32):
-                    t = (datetime.datetime.fromtimestamp(t) - datetime.datetime.fromtimestamp(t).replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
-                if toHdrInfo.timeField.units == "ms":
-                    t = t * 1000.0
-                if toHdrInfo.timeField.type == "int":
-                    t = int(t)
-                set_time(toHdr, t)
 
+        # do special timestamp stuff to convert from relative to absolute time
+        timeMode = plan.timeMode
+        if timeMode == TranslationPlan.TIME_NONE:
+            return toHdr
+        if timeMode == TranslationPlan.TIME_COPY:
+            t = fromHdr.GetTime()*plan.timeScale
+        elif timeMode == TranslationPlan.TIME_WRAP:
+            # Detect time rolling
+            time_scale = plan.timeScale
+            thisTimestamp = fromHdr.GetTime() * time_scale
+            # if the new timestamp is less than the old one plus some margin,
+            # do further checks to see if a wrap occurred.
+            if thisTimestamp < self._lastTimestamp - plan.timeMax * time_scale * 0.1:
+                # If the check above shows the new timestamp is less than the last timestamp,
+                # count it as wrapping only if the current system time is beyond the last time
+                # a wrap occured by more than 0.5 times the time it should take for the
+                # timestamp to wrap again.  The assumption is that if it's not that far beyond
+                # the last time it wrapped, then messages were sent slightly out-of-order.
+                thisTime = time.monotonic()
+                if (self._lastWrapTime == None or
+                    thisTime > self._lastWrapTime + plan.timeMax * time_scale * 0.5):
+                    self._lastWrapTime = thisTime
+                    self._timestampOffset += 1
+            self._lastTimestamp = thisTimestamp
+            # need to handle different size timestamps!
+            t = self._timestampOffset * plan.timeMax * time_scale + thisTimestamp
+        else:
+            t = time.time()
+            if plan.sinceMidnight:
+                # use wall clock time since start of day
+                lt = time.localtime(t)
+                t = lt.tm_hour * 3600 + lt.tm_min * 60 + lt.tm_sec + (t % 1.0)
+            if plan.timeToMs:
+                t = t * 1000.0
+        # It's hard to tell if the Time field is a float or an int.  If it's an int
+        # and we give it a float, struct.error gets raised.
+        if plan.timeNeedsInt:
+            toHdr.SetTime(int(t))
+        else:
+            try:
+                toHdr.SetTime(t)
+            except struct.error:
+                plan.timeNeedsInt = True
+                toHdr.SetTime(int(t))
         return toHdr
 
     def translate(self, fromHdr):
@@ -0,0 +1,294 @@
+import atexit
+import collections
+import json
+import os
+import threading
+import time
+
+from .messaging import Messaging
+
+# When a rotating log ends one file (segment) and starts the next.
+# Any combination of these can be used, zero disables each:
+#   maxBytes      - end a segment once it holds at least this many bytes.
+#   maxSeconds    - end a segment once it's this many seconds old.
+#   clockInterval - end segments at wall-clock boundaries that are multiples of
+#                   this many seconds from local midnight, like every hour on
+#                   the hour for 3600.
+class LogRotation:
+    def __init__(self, maxBytes=0, maxSeconds=0, clockInterval=0):
+        self.maxBytes = maxBytes
+        self.maxSeconds = maxSeconds
+        self.clockInterval = clockInterval
+
+    def enabled(self):
+        return bool(self.maxBytes or self.maxSeconds or self.clockInterval)
+
+    # Returns a copy with each setting that's zero taken from defaults.
+    def withDefaults(self, defaults):
+        return LogRotation(self.maxBytes or defaults.maxBytes,
+                           self.maxSeconds or defaults.maxSeconds,
+                           self.clockInterval or defaults.clockInterval)
+
+    # Time at which a segment that started at start should end, or None.
+    def endTime(self, start):
+        ends = []
+        if self.maxSeconds:
+            ends.append(start + self.maxSeconds)
+        if self.clockInterval:
+            local = time.localtime(start)
+            midnight = int(start) - (local.tm_hour*3600 + local.tm_min*60 + local.tm_sec)
+            ends.append(midnight + (int((start - midnight) // self.clockInterval) + 1) * self.clockInterval)
+        return min(ends) if ends else None
+
+# Writes a log file on a background thread, so logging doesn't slow down the
+# thread that receives and routes messages.
+# log() takes each message already encoded as bytes (with its timestamp fixed),
+# and puts it on a bounded queue.  The writer thread formats queued messages as
+# csv or json (binary logs are written as is), and writes them to the file in
+# large chunks.  Data is flushed to the OS at least every flushInterval
+# seconds, and the fsync policy decides when it's also forced to disk:
+#   never - leave it to the OS.
+#   flush - fsync after every flush.
+#   close - fsync once when each file is closed.
+# If the queue reaches queueLimit messages, new messages are dropped and counted.
+#
+# With a LogRotation, the log is split into segments named like the log file
+# with a segment number added, so log.bin is written as log.0000.bin,
+# log.0001.bin, etc.  The writer thread switches files between messages, so a
+# message is never split across files, and each csv or json segment has its
+# own headers.  Rotation happens when the writer thread processes messages, so
+# time based rotation can be up to flushInterval late.  A sidecar manifest
+# (log.manifest.json) lists each segment's time range, size, and count and
+# byte offsets of each message ID.  It's rewritten atomically each time a
+# segment starts or ends, so it's always complete and up to date with every
+# finished segment.
+class LogWriter:
+    FSYNC_POLICIES = ('never', 'flush', 'close')
+
+    # defaults for new logs, which apps set from their command line
+    defaultFlushInterval = 1.0
+    defaultFsync = 'never'
+    defaultQueueLimit = 100000
+
+    # wake up the writer early when this many messages are queued
+    BATCH_SIZE = 4096
+    # size of the file's write buffer
+    BUFFER_SIZE = 1024*1024
+
+    def __init__(self, fileName, fileType, flushInterval=None, fsync=None, queueLimit=None, rotation=None):
+        if fileType not in ('bin', 'csv', 'json'):
+            raise ValueError("Invalid log type " + str(fileType))
+        self.fileName = fileName
+        self.fileType = fileType
+        self.flushInterval = LogWriter.defaultFlushInterval if flushInterval is None else flushInterval
+        self.fsync = LogWriter.defaultFsync if fsync is None else fsync
+        if self.fsync not in LogWriter.FSYNC_POLICIES:
+            raise ValueError("Invalid fsync policy " + str(self.fsync))
+        self.queueLimit = LogWriter.defaultQueueLimit if queueLimit is None else queueLimit
+        self.rotation = rotation if rotation is not None and rotation.enabled() else None
+        self.droppedMsgs = 0
+        self.writtenMsgs = 0
+        self.error = None
+        # which types of message have had their header put into the file already
+        self._loggedMsgHeader = {}
+        # manifest entries of rotating logs, one per segment
+        self.segments = []
+        # open here rather than on the thread, so errors go to the caller
+        if self.rotation:
+            root, ext = os.path.splitext(fileName)
+            self.manifestName = root + ".manifest.json"
+            # scratch header, that each message's header is copied into to get its ID
+            self._hdr = Messaging.hdr()
+            self._startSegment(time.time())
+        else:
+            self.manifestName = None
+            self.currentFileName = fileName
+            self._file = open(fileName, 'ab', buffering=LogWriter.BUFFER_SIZE)
+        # deque append and popleft are thread safe, so the queue needs no lock
+        self._queue = collections.deque()
+        self._wake = threading.Event()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="LogWriter " + fileName, daemon=True)
+        self._thread.start()
+        # make sure queued messages get written if the program exits with the log open
+        atexit.register(self.close)
+
+    @property
+    def queuedMsgs(self):
+        return len(self._queue)
+
+    # Queues one encoded message to be logged.
+    # Returns False if it was dropped because the queue is full.
+    def log(self, data):
+        queue = self._queue
+        if len(queue) >= self.queueLimit or self._closing:
+            self.droppedMsgs += 1
+            return False
+        queue.append(data)
+        if len(queue) == LogWriter.BATCH_SIZE:
+            self._wake.set()
+        return True
+
+    # Ends the current segment of a rotating log after the messages that are
+    # already queued, and starts the next one.
+    def rotate(self):
+        if self.rotation:
+            # a marker in the queue, so the switch happens in order with the messages
+            self._queue.append(None)
+            self._wake.set()
+
+    # Writes everything that's queued, and closes the file.
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._wake.set()
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def statusText(self):
+        text = "%d queued, %d dropped" % (len(self._queue), self.droppedMsgs)
+        if self.rotation:
+            text = "segment %d, " % (len(self.segments)-1) + text
+        return text
+
+    # Returns the bytes to log for one message, starting with the header for its
+    # type if it's the first of that type in the file.
+    def _formatOne(self, data):
+        loggedMsgHeader = self._loggedMsgHeader
+        msg = Messaging.MsgFactory(Messaging.hdr(data))
+        log = ''
+        if self.fileType == "csv":
+            if not msg.MsgName() in loggedMsgHeader:
+                loggedMsgHeader[msg.MsgName()] = True
+                log = msg.csvHeader(timeColumn=True)+'\n'
+            log += msg.toCsv(timeColumn=True)+'\n'
+        else:
+            if not msg.MsgName() in loggedMsgHeader:
+                loggedMsgHeader[msg.MsgName()] = True
+                log = msg.jsonHeader()
+            log += msg.toJson(includeHeader=True)+'\n'
+        return log.encode('utf-8')
+
+    def _format(self, batch):
+        if self.fileType == "bin":
+            return b''.join(batch)
+        return b''.join([self._formatOne(data) for data in batch])
+
+    def _writeManifest(self):
+        manifest = {
+            "log": os.path.basename(self.fileName),
+            "type": self.fileType,
+            "segments": self.segments}
+        tmpName = self.manifestName + ".tmp"
+        with open(tmpName, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmpName, self.manifestName)
+
+    def _startSegment(self, now):
+        root, ext = os.path.splitext(self.fileName)
+        self.currentFileName = "%s.%04d%s" % (root, len(self.segments), ext)
+        self._file = open(self.currentFileName, 'ab', buffering=LogWriter.BUFFER_SIZE)
+        self._loggedMsgHeader = {}
+        self._segmentEnd = self.rotation.endTime(now)
+        # offsets are from the start of the file, which may not be empty
+        self._segmentStart = self._file.tell()
+        self._segment = {
+            "file": os.path.basename(self.currentFileName),
+            "start": now,
+            "end": now,
+            "messages": 0,
+            "bytes": self._segmentStart,
+            "open": True,
+            "ids": {}}
+        self.segments.append(self._segment)
+        self._writeManifest()
+
+    def _endSegment(self, now):
+        self._file.flush()
+        if self.fsync != 'never':
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment["end"] = now
+        self._segment["open"] = False
+        self._writeManifest()
+
+    def _writeRotating(self, batch, now):
+        maxBytes = self.rotation.maxBytes
+        hdr = self._hdr
+        hdrBuffer = hdr.rawBuffer()
+        hdrSize = hdr.SIZE
+        chunks = []
+        segment = self._segment
+        ids = segment["ids"]
+        offset = segment["bytes"]
+        for data in batch:
+            if data is None or (maxBytes and offset - self._segmentStart >= maxBytes):
+                self._file.write(b''.join(chunks))
+                chunks = []
+                segment["bytes"] = offset
+                self._endSegment(now)
+                self._startSegment(now)
+                segment = self._segment
+                ids = segment["ids"]
+                offset = segment["bytes"]
+                if data is None:
+                    continue
+            hdrBuffer[0:hdrSize] = data[0:hdrSize]
+            id = hex(hdr.GetMessageID())
+            log = data if self.fileType == "bin" else self._formatOne(data)
+            chunks.append(log)
+            try:
+                idInfo = ids[id]
+            except KeyError:
+                idInfo = ids[id] = {"name": Messaging.MsgNameFromID.get(id, "Unknown"), "count": 0, "first_offset": offset}
+            idInfo["count"] += 1
+            idInfo["last_offset"] = offset
+            segment["messages"] += 1
+            self.writtenMsgs += 1
+            offset += len(log)
+        self._file.write(b''.join(chunks))
+        segment["bytes"] = offset
+        segment["end"] = now
+
+    def _writeQueued(self):
+        queue = self._queue
+        if self.rotation:
+            now = time.time()
+            if self._segmentEnd is not None and now >= self._segmentEnd:
+                self._endSegment(now)
+                self._startSegment(now)
+        while queue:
+            batch = []
+            while queue and len(batch) < LogWriter.BATCH_SIZE:
+                batch.append(queue.popleft())
+            if self.rotation:
+                self._writeRotating(batch, now)
+            else:
+                self._file.write(self._format(batch))
+                self.writtenMsgs += len(batch)
+
+    def _run(self):
+        try:
+            while True:
+                self._wake.wait(self.flushInterval)
+                self._wake.clear()
+                closing = self._closing
+                self._writeQueued()
+                self._file.flush()
+                if self.fsync == 'flush':
+                    os.fsync(self._file.fileno())
+                if closing:
+                    break
+            if self.rotation:
+                self._endSegment(time.time())
+            elif self.fsync == 'close':
+                os.fsync(self._file.fileno())
+        except Exception as e:
+            # stop accepting messages, they'd only pile up
+            self.error = e
+            self._closing = True
+            self.droppedMsgs += len(self._queue)
+            self._queue.clear()
+        finally:
+            self._file.close()
@@ -2,26 +2,31 @@ import ctypes
 from msgtools.lib.messaging import *
 import msgtools.lib.msgjson as msgjson
 import msgtools.lib.msgcsv as msgcsv
-import collections
 
 # This class is used so that individual elements of array fields can be
 # accessed using array index notation [] on the field of the message.
-# __getattr__ on the Message object needs to return a FieldListAccessor
-# which can get/set individual elements of the message.
-class FieldListAccessor(collections.UserList):
+# The attribute for an array field returns a FieldListAccessor, which can
+# get/set individual elements of the message.  One is made per field of
+# each message, the first time the field is accessed, and then reused.
+class FieldListAccessor:
+    __slots__ = ('_msg', '_getfn', '_setfn')
     def __init__(self, msg, getfn, setfn):
         self._msg = msg
         self._setfn = setfn
         self._getfn = getfn
 
     def __repr__(self):
-        ret = []
-        for i in range(0, self._setfn.count):
+        return str(list(self))
+
+    def __len__(self):
+        return self._getfn.count
+
+    def __iter__(self):
+        for i in range(0, self._getfn.count):
             try:
-                ret.append(self._getfn(i))
+                yield self._getfn(i)
             except struct.error:
-                pass
-        return str(ret)
+                return
 
     def __getitem__(self, key):
         return self._getfn(key)
@@ -29,22 +34,57 @@ class FieldListAccessor(collections.UserList):
     def __setitem__(self, key, value):
         self._setfn(value, key)
 
+# Makes the attribute for a field of a message class, so that msg.Field
+# calls the field's Get and Set functions directly.
+def fieldAttribute(fieldInfo):
+    getfn = fieldInfo.get
+    setfn = fieldInfo.set
+    if fieldInfo.count == 1:
+        return property(getfn, setfn, doc=fieldInfo.description)
+    name = fieldInfo.name
+    def getList(msg):
+        try:
+            views = msg.field_views
+        except AttributeError:
+            views = msg.field_views = {}
+        try:
+            return views[name]
+        except KeyError:
+            view = FieldListAccessor(msg, getfn.__get__(msg), setfn.__get__(msg))
+            views[name] = view
+            return view
+    def setList(msg, val):
+        if not isinstance(val, list):
+            raise AttributeError('Message %s field %s needs array param, not %s' % (msg.MsgName(), name, str(val)))
+        for i in range(0,len(val)):
+            try:
+                setfn(msg, val[i], i)
+            except struct.error:
+                break
+    return property(getList, setList, doc=fieldInfo.description)
+
 class Message:
+    # Fields are class attributes made by __init_subclass__, so instances only need these.
+    # msg_buffer is the buffer the message is in, which generated accessors read directly.
+    __slots__ = ('msg_buffer', 'hdr', 'fake_fields', 'field_views')
+
+    # Adds an attribute for each field and bitfield in the reflection information of
+    # a message class, unless the class already has something with the same name.
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for fieldInfo in cls.__dict__.get('fields', []):
+            for info in [fieldInfo] + fieldInfo.bitfieldInfo:
+                if not hasattr(cls, info.name):
+                    setattr(cls, info.name, fieldAttribute(info))
+
     def __init__(self, messageBuffer=None, id=None, size=None):
         doInit = 0
         if messageBuffer == None:
             doInit = 1
             messageBuffer = ctypes.create_string_buffer(Messaging.hdrSize + size)
         else:
-            try:
-                messageBuffer.raw
-            except AttributeError:
-                newbuf = ctypes.create_string_buffer(len(messageBuffer))
-                for i in range(0, len(messageBuffer)):
-                    newbuf[i] = bytes(messageBuffer)[i]
-                messageBuffer = newbuf
-        # this is a trick to get us to store a copy of a pointer to a buffer, rather than making a copy of the buffer
-        self.msg_buffer_wrapper = { "msg_buffer": messageBuffer }
+            messageBuffer = message_buffer(messageBuffer)
+        self.msg_buffer = messageBuffer
         
         # this is a trick to allow the creation of fake fields that aren't actually in a message,
         # but that we want to act like fields of the message
@@ -57,8 +97,7 @@ class Message:
             self.hdr.SetDataLength(size)
 
     def rawBuffer(self):
-        # this is a trick to get us to store a copy of a pointer to a buffer, rather than making a copy of the buffer
-        return self.msg_buffer_wrapper["msg_buffer"]
+        return self.msg_buffer
 
     def set_fields(self, **kwargs):
         for param, value in kwargs.items():
@@ -71,43 +110,15 @@ class Message:
             else:
                 fn(value)
 
+    # Only called for attributes that aren't fields of the message, like fake fields
     def __getattr__(self, attr):
-        fn_name = 'Get' + attr
-        if hasattr(type(self), fn_name):
-            fn = getattr(self,fn_name)
-            if callable(fn):
-                if fn.count > 1:
-                    setfn = getattr(self,"Set"+attr)
-                    return FieldListAccessor(self, fn, setfn)
-                else:
-                    return fn()
-        elif attr in self.fake_fields:
-            return self.fake_fields[attr]
+        if attr not in Message.__slots__:
+            try:
+                return self.fake_fields[attr]
+            except (AttributeError, KeyError):
+                pass
         raise AttributeError('Message %s has no field %s' % (self.MsgName(), attr))
 
-    def __setattr__(self, attr, val):
-        fn_name = 'Set' + attr
-        if (not attr.startswith('Set')) and (not attr.startswith('Get')) and fn_name in dir(type(self)):
-            fn = getattr(self,fn_name)
-            if callable(fn):
-                if fn.count > 1:
-                    if not isinstance(val, list):
-                        raise AttributeError('Message %s field %s needs array param, not %s' % (self.MsgName(), attr, str(val)))
-                    for i in range(0,len(val)):
-                        try:
-                            fn(val[i], i)
-                        except struct.error:
-                            break
-                    return
-                else:
-                    fn(val)
-                    return
-        allowed_attributes = ['msg_buffer_wrapper', 'hdr', 'fake_fields']
-        if attr in allowed_attributes:
-            super(Message, self).__setattr__(attr, val)
-        else:
-            raise AttributeError('Message %s has no field %s' % (self.MsgName(), attr))
-
     @staticmethod
     def fromJson(s, ignore_invalid=False):
         return msgjson.jsonToMsg(s, ignore_invalid)
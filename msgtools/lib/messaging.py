@@ -1,6 +1,12 @@
 # for directory listing, exit function
 import os, glob, sys, struct, time, json
 
+# for message buffers
+import ctypes
+
+# for decoding many messages at once
+import numpy
+
 # for runtime module importing
 import importlib
 
@@ -56,6 +62,31 @@ def maxVal(arg):
         return fcn
     return _maxVal
 
+# A decorator to specify how many fields a generated function handles, so that it can
+# be skipped if fields were added to the class after it was generated (like fake fields)
+def fieldCount(arg):
+    def _fieldCount(fcn):
+        fcn.fieldCount = arg
+        return fcn
+    return _fieldCount
+
+# Returns a ctypes buffer holding message data, for message and header objects to use.
+# ctypes buffers are used as-is, and writable memoryviews are wrapped without a copy, so
+# the message shares memory with whatever the memoryview refers to (and that can't be
+# resized while the message exists).  Anything else, like bytes, bytearray, read-only
+# memoryviews and QByteArray, is copied in one bulk copy.
+def message_buffer(buf):
+    if isinstance(buf, ctypes.Array):
+        return buf
+    if isinstance(buf, memoryview) and not buf.readonly:
+        return (ctypes.c_char * buf.nbytes).from_buffer(buf)
+    try:
+        return (ctypes.c_char * len(buf)).from_buffer_copy(buf)
+    except TypeError:
+        # objects that can be converted to bytes, but don't support the buffer protocol
+        buf = bytes(buf)
+        return (ctypes.c_char * len(buf)).from_buffer_copy(buf)
+
 import collections
 
 # This simulates a hash table, but with lazy loading, where a module isn't
@@ -100,12 +131,7 @@ class TimestampFixer:
     def __init__(self):
         self.last_rx_time = None
         self.last_rx_timestamp = None
-        self.time_info = Messaging.findFieldInfo(Messaging.hdr.fields, "Time")
-        TIME_SCALES = {"s": 1.0, "ms": 1000.0, "us": 1000000.0, "ns": 1e9}
-        try:
-            self.time_scale = TIME_SCALES[self.time_info.units]
-        except KeyError:
-            self.time_scale = None
+        self.time_info, self.time_scale = Messaging.HeaderTimeInfo(Messaging.hdr)
     
     def restore_timestamp(self, hdr, original_timestamp):
         if original_timestamp != None:
@@ -159,6 +185,18 @@ class Messaging:
     MsgIDFromName = {}
     MsgClassFromName = MessageNameLoader()
     MsgModuleFromName = {}
+    # Message classes by integer ID, for fast lookup of received messages.  This is filled in
+    # as IDs are looked up (or as classes register).
+    MsgClassFromID = {}
+    # IDs that have no definition, mapped to UnknownMsg, so that looking them up again doesn't
+    # search for them again.  They're kept apart from MsgClassFromID, and forgotten when there
+    # are MaxUnknownIDs of them, so a stream of corrupt IDs can't grow the cache forever.
+    UnknownClassFromID = {}
+    MaxUnknownIDs = 4096
+    # Field and bitfield infos by name, for each list of fields, keyed by id() of the list.
+    # These are built when classes register or headers load, so findFieldInfo doesn't need
+    # to search through every field and bitfield.
+    FieldIndexes = {}
 
     # container for accessing message classes via attributes.
     Messages = MessageAttributeLoader("")
@@ -253,6 +291,7 @@ or specify that directory with --msgdir=PATH''')
 
         # Set the global header class
         Messaging.hdr = getattr(headerModule, headerName)
+        Messaging.IndexFields(Messaging.hdr.fields)
 
     @staticmethod
     def LoadAllMessages(loaddir=None, searchdir=None, headerName="NetworkHeader"):
@@ -282,6 +321,7 @@ or specify that directory with --msgdir=PATH''')
 
         # Set the global header class
         Messaging.hdr = getattr(headerModule, headerName)
+        Messaging.IndexFields(Messaging.hdr.fields)
 
         # specify our header size, to come from the generated header we imported
         Messaging.hdrSize = Messaging.hdr.SIZE
@@ -293,6 +333,9 @@ or specify that directory with --msgdir=PATH''')
                 Messaging.MsgNameFromID     = msglibinfo["MsgNameFromID"]
                 Messaging.MsgIDFromName     = msglibinfo["MsgIDFromName"]
                 Messaging.MsgModuleFromName = msglibinfo["MsgModuleFromName"]
+                # drop any lookups done before the cache was loaded, they may be wrong now
+                Messaging.MsgClassFromID.clear()
+                Messaging.UnknownClassFromID.clear()
                 for name in Messaging.MsgIDFromName:
                     # Initialize all class lookups to None, unless they are already set.
                     # This is a signal for MessageNameLoader to do a lookup, while
@@ -379,6 +422,9 @@ or specify that directory with --msgdir=PATH''')
             print("WARNING! Trying to define message ", name, " for ID ", hexid, ", but ", Messaging.MsgNameFromID[hexid], " already uses that ID")
         
         Messaging.MsgNameFromID[hexid] = name
+        Messaging.MsgClassFromID[id] = classDef
+        Messaging.UnknownClassFromID.pop(id, None)
+        Messaging.IndexFields(classDef.fields)
 
         Messaging.AddAlias(name, id, classDef)
 
@@ -442,48 +488,102 @@ or specify that directory with --msgdir=PATH''')
         return UnknownMsg if we can't find this message, otherwise
             a class reference to the message for the given header (by ID)
         '''
-        msgId = hex(hdr.GetMessageID())
+        msgId = hdr.GetMessageID()
+        try:
+            return Messaging.MsgClassFromID[msgId]
+        except KeyError:
+            pass
+        try:
+            return Messaging.UnknownClassFromID[msgId]
+        except KeyError:
+            pass
 
-        if not msgId in Messaging.MsgNameFromID:
-            #print("WARNING! No definition for ", msgId, "!\n")
+        hexId = hex(msgId)
+        if not hexId in Messaging.MsgNameFromID:
+            #print("WARNING! No definition for ", hexId, "!\n")
             from msgtools.lib.unknownmsg import UnknownMsg
-            msgClass = UnknownMsg
-        else:
-            msgName = Messaging.MsgNameFromID[msgId]
-            msgClass = Messaging.MsgClassFromName[msgName]
-
+            unknown = Messaging.UnknownClassFromID
+            if len(unknown) >= Messaging.MaxUnknownIDs:
+                unknown.clear()
+            unknown[msgId] = UnknownMsg
+            return UnknownMsg
+
+        msgName = Messaging.MsgNameFromID[hexId]
+        msgClass = Messaging.MsgClassFromName[msgName]
+        Messaging.MsgClassFromID[msgId] = msgClass
         return msgClass
 
+    # Value conversion (parsing hex strings, coercing to int or float, formatting hex units)
+    # and array indexing are resolved once per field, by fieldConverters() when the FieldInfo
+    # is created, so these just dispatch to the field's setValue/getValue.
     @staticmethod
     def set(msg, fieldInfo, value, index=0):
-        if("int" in fieldInfo.type or "enumeration" == fieldInfo.type):
-            if isinstance(value, str):
-                value = value.strip()
-                if value.startswith("0x"):
-                    value = int(value, 0)
-        if("int" in fieldInfo.type):
-            value = int(float(value))
-        elif("float" in fieldInfo.type):
-            value = float(value)
-        
-        if fieldInfo.count == 1:
-            fieldInfo.set(msg, value)
-        else:
-            fieldInfo.set(msg, value, index)
+        fieldInfo.setValue(msg, value, index)
 
     @staticmethod
     def get(msg, fieldInfo, index=0):
         try:
-            if fieldInfo.count == 1:
-                value = fieldInfo.get(msg)
-            else:
-                value = fieldInfo.get(msg, index)
-            if "hex" == fieldInfo.units.lower():
-                digits = fieldInfo.size*2
-                value = ("0x%0"+str(digits)+"X") % (value)
+            return fieldInfo.getValue(msg, index)
         except struct.error:
-            value = "UNALLOCATED"
-        return value
+            return "UNALLOCATED"
+
+    # Returns a dict of the value of every field and bitfield of msg by name, formatted
+    # the same as get(), decoded with a single unpack by the generated unpack_all().
+    # Returns None if the message code was generated without unpack_all(), or if the
+    # message is shorter than its full size, so callers need to fall back to get().
+    @staticmethod
+    def unpackAll(msg):
+        try:
+            unpack_all = msg.unpack_all
+        except AttributeError:
+            return None
+        if len(msg.rawBuffer()) < msg.MSG_OFFSET + msg.SIZE:
+            return None
+        # headers don't have a header of their own
+        if msg.MSG_OFFSET != 0 and msg.hdr.GetDataLength() < msg.SIZE:
+            return None
+        return unpack_all()
+
+    # Returns the generated function of a message or header class with the given name, if it
+    # has one, and it handles every field the class has.  Fields added after the code was
+    # generated, like fake fields, are only handled by reflection.
+    @staticmethod
+    def generatedFn(cls, name):
+        fn = getattr(cls, name, None)
+        if fn is not None and fn.fieldCount == len(cls.fields):
+            return fn
+        return None
+
+    # Same as get(), but uses the value from a dict returned by unpackAll() if there is one.
+    # Fields that aren't in the dict, like fake fields, are read with get().
+    @staticmethod
+    def getUnpacked(values, msg, fieldInfo, index=0):
+        if values is not None and fieldInfo.name in values:
+            if fieldInfo.count == 1:
+                return values[fieldInfo.name]
+            return values[fieldInfo.name][index]
+        return Messaging.get(msg, fieldInfo, index)
+
+    # Decodes many messages of the same class at once, into a numpy structured array of
+    # msg_class.DTYPE records.  buffer holds the messages, and offsets are where the header
+    # of each message starts in it.  If offsets is None, buffer holds back to back message
+    # bodies (or headers, for a header class) with no gaps.  Messages must be full length.
+    # msg_class.columns() turns the records into arrays of field and bitfield values.
+    @staticmethod
+    def decode_batch(msg_class, buffer, offsets=None):
+        if msg_class.DTYPE.itemsize == 0:
+            # messages without a body have nothing to decode, and numpy can't view bytes as
+            # zero size records, so without offsets there's no way to tell how many there are
+            if offsets is None:
+                raise ValueError("Can't decode a batch of %s messages, which have no body, without offsets" % msg_class.__name__)
+            return numpy.zeros(len(offsets), dtype=msg_class.DTYPE)
+        if offsets is None:
+            return numpy.frombuffer(buffer, dtype=msg_class.DTYPE)
+        data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        starts = numpy.asarray(offsets, dtype=numpy.intp) + msg_class.MSG_OFFSET
+        # gather the bytes of every message body into one contiguous array, one row per message
+        rows = data[starts[:, numpy.newaxis] + numpy.arange(msg_class.DTYPE.itemsize)]
+        return rows.view(msg_class.DTYPE).reshape(len(starts))
 
     @staticmethod
     def getFloat(msg, fieldInfo, index=0):
@@ -494,7 +594,10 @@ or specify that directory with --msgdir=PATH''')
 
     @staticmethod
     def getAlert(msg, fieldInfo, index=0):
-        value = Messaging.get(msg, fieldInfo, index)
+        return Messaging.valueAlert(fieldInfo, Messaging.get(msg, fieldInfo, index))
+
+    @staticmethod
+    def valueAlert(fieldInfo, value):
         alert = 0
         try:
             floatVal = float(value)
@@ -506,15 +609,28 @@ or specify that directory with --msgdir=PATH''')
             pass
         return alert
 
+    # Builds the dictionary of field and bitfield infos by name that findFieldInfo uses.
+    # If names repeat, the first one wins, same as searching the list would.
     @staticmethod
-    def findFieldInfo(fieldInfos, name):
+    def IndexFields(fieldInfos):
+        index = {}
         for fi in fieldInfos:
-            if name == fi.name:
-                return fi
+            index.setdefault(fi.name, fi)
             for bfi in fi.bitfieldInfo:
-                if name == bfi.name:
-                    return bfi
-        return None
+                index.setdefault(bfi.name, bfi)
+        Messaging.FieldIndexes[id(fieldInfos)] = (fieldInfos, len(fieldInfos), index)
+        return index
+
+    @staticmethod
+    def findFieldInfo(fieldInfos, name):
+        try:
+            indexedFields, indexedCount, index = Messaging.FieldIndexes[id(fieldInfos)]
+        except KeyError:
+            indexedFields = None
+        # rebuild the index if this list was never indexed, or had fields appended since
+        if indexedFields is not fieldInfos or indexedCount != len(fieldInfos):
+            index = Messaging.IndexFields(fieldInfos)
+        return index.get(name)
     
     # Create a fake field.  This is useful if we want to compute data based on an
     # existing message's fields that we want to plot or log.
@@ -548,6 +664,7 @@ or specify that directory with --msgdir=PATH''')
         setFn.count = count
         new_fi = FieldInfo(name, type="", units=units, minVal=minVal, maxVal=maxVal, description=description, get=getFn, set=setFn, count=count, bitfieldInfo=[], enum=[])
         msg_class.fields.append(new_fi)
+        Messaging.IndexFields(msg_class.fields)
 
     # This is composed of all the header fields that are not length, time, and any ID fields.
     # In some systems where one PC talks to one device, there may not be *any* fields that
@@ -562,11 +679,19 @@ or specify that directory with --msgdir=PATH''')
     # we loop through those fields.
     @staticmethod
     def HeaderRoute(hdr):
+        routeFields = Messaging.RouteFields(type(hdr))
+        # list comprehension to build the message route based on each of the route fields.
+        msg_route = [str(route_field_info.get(hdr)) for route_field_info in routeFields]
+        return msg_route
+
+    # The fields and bitfields of a header class that make up its Route, cached on the class.
+    @staticmethod
+    def RouteFields(hdrClass):
         try:
-            routeFields = type(hdr).s_routeFields
+            return hdrClass.s_routeFields
         except AttributeError:
             routeFields = []
-            for fieldInfo in hdr.fields:
+            for fieldInfo in hdrClass.fields:
                 if fieldInfo.bitfieldInfo:
                     for bitfieldInfo in fieldInfo.bitfieldInfo:
                         if Messaging.IsRouteField(bitfieldInfo):
@@ -574,10 +699,8 @@ or specify that directory with --msgdir=PATH''')
                 else:
                     if Messaging.IsRouteField(fieldInfo):
                         routeFields.append(fieldInfo)
-            type(hdr).s_routeFields = routeFields
-        # list comprehension to build the message route based on each of the route fields.
-        msg_route = [str(route_field_info.get(hdr)) for route_field_info in routeFields]
-        return msg_route
+            hdrClass.s_routeFields = routeFields
+            return routeFields
 
     @staticmethod
     def MsgRoute(msg):
@@ -588,16 +711,24 @@ or specify that directory with --msgdir=PATH''')
     #TODO swapped if the message is coming or going.
     @staticmethod
     def SetMsgRoute(msg, msg_route):
-        hdr = msg.hdr
-        i = 0
-        for fieldInfo in msg.hdr.fields:
-            if fieldInfo.bitfieldInfo:
-                for bitfieldInfo in fieldInfo.bitfieldInfo:
-                    if Messaging.IsRouteField(bitfieldInfo):
-                        Messaging.set(msg.hdr, bitfieldInfo, msg_route[i])
-            else:
-                if Messaging.IsRouteField(fieldInfo):
-                    Messaging.set(msg.hdr, fieldInfo, msg_route[i])
+        for i, routeFieldInfo in enumerate(Messaging.RouteFields(type(msg.hdr))):
+            Messaging.set(msg.hdr, routeFieldInfo, msg_route[i])
+
+    # Time field info of a header class, and the scale from seconds to the units of the Time
+    # field (or None if the units aren't a known time unit), cached on the class.
+    # The Time field info is None if the header has no Time field.
+    TIME_SCALES = {"s": 1.0, "ms": 1000.0, "us": 1000000.0, "ns": 1e9}
+    @staticmethod
+    def HeaderTimeInfo(hdrClass):
+        try:
+            return hdrClass.s_timeInfo
+        except AttributeError:
+            timeInfo = Messaging.findFieldInfo(hdrClass.fields, "Time")
+            timeScale = None
+            if timeInfo != None:
+                timeScale = Messaging.TIME_SCALES.get(timeInfo.units)
+            hdrClass.s_timeInfo = (timeInfo, timeScale)
+            return hdrClass.s_timeInfo
 
     # fields count as Route fields unless they are part of the ID,
     # have "length" in their name, or match Time or Priority.
@@ -613,6 +744,71 @@ or specify that directory with --msgdir=PATH''')
             return False
         return True
         
+# Converts a value passed to Messaging.set() to the type the field's set function takes.
+# Strings of integer fields may be hex, and floats are truncated for integer fields.
+# Ints are passed through as-is, so 64 bit values don't lose precision going through float.
+def parseInt(value):
+    if type(value) is int:
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("0x"):
+            value = int(value, 0)
+    return int(float(value))
+
+def parseEnum(value):
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("0x"):
+            value = int(value, 0)
+    return value
+
+# Builds the getValue and setValue functions of a FieldInfo or BitFieldInfo, which
+# Messaging.get() and Messaging.set() call.  Everything that depends only on the field
+# (its type, whether its units are hex, whether it's an array) is decided here, once,
+# instead of on every call.
+def fieldConverters(fieldInfo):
+    get = fieldInfo.get
+    set = fieldInfo.set
+    if "int" in fieldInfo.type:
+        convert = parseInt
+    elif "float" in fieldInfo.type:
+        convert = float
+    elif "enumeration" == fieldInfo.type:
+        convert = parseEnum
+    else:
+        convert = None
+    hexFormat = None
+    if "hex" == fieldInfo.units.lower():
+        hexFormat = "0x%0"+str(fieldInfo.size*2)+"X"
+
+    if fieldInfo.count == 1:
+        if hexFormat:
+            def getValue(msg, index=0):
+                return hexFormat % get(msg)
+        else:
+            def getValue(msg, index=0):
+                return get(msg)
+        if convert:
+            def setValue(msg, value, index=0):
+                set(msg, convert(value))
+        else:
+            def setValue(msg, value, index=0):
+                set(msg, value)
+    else:
+        # array accessors already take an index, so they can be used directly
+        if hexFormat:
+            def getValue(msg, index=0):
+                return hexFormat % get(msg, index)
+        else:
+            getValue = get
+        if convert:
+            def setValue(msg, value, index=0):
+                set(msg, convert(value), index)
+        else:
+            setValue = set
+    return getValue, setValue
+
 class BitFieldInfo(object):
     def __init__(self, name, type, units, minVal, maxVal, description, get, set, enum, idbits=0):
         self.name=name
@@ -629,6 +825,7 @@ class BitFieldInfo(object):
         # add a couple fields from decorators of the 'get' function
         self.offset = get.offset
         self.size = get.size
+        self.getValue, self.setValue = fieldConverters(self)
 
     def exists(self, msg, index=0):
         return self.parent.exists(msg, index)
@@ -653,12 +850,14 @@ class FieldInfo(object):
         # add a couple fields from decorators of the 'get' function
         self.offset = int(get.offset)
         self.size = int(get.size)
+        self.getValue, self.setValue = fieldConverters(self)
         # give our bitfields a reference to us
         for bfi in self.bitfieldInfo:
             bfi.parent = self
             # Set the count of the bitfield to our own count, so that bitfields
             # in arrays work properly.
             bfi.count = count
+            bfi.getValue, bfi.setValue = fieldConverters(bfi)
 
     def exists(self, msg, index=0):
         end_of_field = self.offset + self.size * (index+1)
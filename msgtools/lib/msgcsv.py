@@ -2,46 +2,60 @@ from .messaging import Messaging
 
 # for reading CSV
 import csv
+import struct
 
-def toCsv(msg, nameColumn=True, timeColumn=False):
-    def add_param(v):
-        if v.strip() == '':
-            v = '"%s"' % v
-        if ',' in v and not((v.startswith('"') and v.endswith('"')) or (v.startswith("'") and v.endswith("'"))):
-            v = '"%s"' % v
-        return v + ", "
-    ret = ""
-    if timeColumn:
-        t = msg.hdr.GetTime()
-        if Messaging.findFieldInfo(msg.hdr.fields, "Time").units == "ms":
-            t = t / 1000
-        ret += str(t) + ', '
-    if nameColumn:
-        ret += msg.MsgName() + ", "
-    for fieldInfo in Messaging.MsgClass(msg.hdr).fields:
+# Quotes a value for a CSV column if it's empty or has a comma in it
+def csvParam(v):
+    if v.strip() == '':
+        v = '"%s"' % v
+    if ',' in v and not((v.startswith('"') and v.endswith('"')) or (v.startswith("'") and v.endswith("'"))):
+        v = '"%s"' % v
+    return v
+
+# Values of the CSV columns of a message, using the class's generated csv_values() if it has one
+def csvValues(msg):
+    msgClass = Messaging.MsgClass(msg.hdr)
+    csv_values = Messaging.generatedFn(msgClass, "csv_values")
+    if csv_values and type(msg) is msgClass:
+        try:
+            return csv_values(msg)
+        except struct.error:
+            # buffer is shorter than the message's length, use reflection
+            pass
+    ret = []
+    values = Messaging.unpackAll(msg)
+    for fieldInfo in msgClass.fields:
         if(fieldInfo.count == 1):
             if not fieldInfo.exists(msg):
                 break
             if len(fieldInfo.bitfieldInfo) == 0:
-                columnText = add_param(str(Messaging.get(msg, fieldInfo)))
+                ret.append(Messaging.getUnpacked(values, msg, fieldInfo))
             else:
-                columnText = ""
                 for bitInfo in fieldInfo.bitfieldInfo:
-                    columnText += add_param(str(Messaging.get(msg, bitInfo)))
+                    ret.append(Messaging.getUnpacked(values, msg, bitInfo))
         else:
-            columnText = ""
             for i in range(0,fieldInfo.count):
                 if not fieldInfo.exists(msg, i):
                     break
-                columnText += add_param(str(Messaging.get(msg, fieldInfo, i)))
-        ret += columnText
-    # drop last two chars (', ') off end
-    return ret[:-2]
+                ret.append(Messaging.getUnpacked(values, msg, fieldInfo, i))
+    return ret
+
+def toCsv(msg, nameColumn=True, timeColumn=False):
+    columns = []
+    if timeColumn:
+        t = msg.hdr.GetTime()
+        if Messaging.HeaderTimeInfo(type(msg.hdr))[0].units == "ms":
+            t = t / 1000
+        columns.append(str(t))
+    if nameColumn:
+        columns.append(msg.MsgName())
+    columns += [csvParam(str(v)) for v in csvValues(msg)]
+    return ", ".join(columns)
 
 def csvHeader(msg, nameColumn=True, timeColumn=False):
     tableHeader = ''
     if timeColumn:
-        timeUnits = Messaging.findFieldInfo(msg.hdr.fields, "Time").units
+        timeUnits = Messaging.HeaderTimeInfo(type(msg.hdr))[0].units
         if timeUnits == "ms":
             timeUnits = "s"
         if timeUnits:
@@ -58,17 +72,24 @@ def csvHeader(msg, nameColumn=True, timeColumn=False):
     # drop last two chars (', ') off end
     return tableHeader[:-2]
 
+# Puts a backslash before commas that are inside quoted strings, so the CSV reader
+# doesn't split on them.  Every other piece of text between quotes is inside quotes.
 def escapeCommasInQuotedString(line):
-    ret = ""
-    quoteStarted = 0
-    for c in line:
-        if c == '"':
-            quoteStarted = not quoteStarted
-        elif c == ',':
-            if quoteStarted:
-                ret = ret + '\\'
-        ret = ret + c
-    return ret
+    pieces = line.split('"')
+    pieces[1::2] = [piece.replace(',', '\\,') for piece in pieces[1::2]]
+    return '"'.join(pieces)
+
+# Splits the parameters of a line of CSV text.  This gives the same results as the CSV reader
+# module (with skipinitialspace, and backslash as an escape character), but lines without
+# any escapes are simple enough to split directly.
+def splitParams(line):
+    if '"' in line:
+        line = escapeCommasInQuotedString(line)
+    if '\\' in line or '\r' in line or '\n' in line or '\0' in line:
+        return list(csv.reader([line], quotechar='"', delimiter=',', quoting=csv.QUOTE_NONE, skipinitialspace=True, escapechar='\\'))[0]
+    if line == '':
+        return []
+    return [param.lstrip(' ') for param in line.split(',')]
 
 def msgNameAndParams(lineOfText):
     # check for message name followed by space
@@ -82,10 +103,7 @@ def msgNameAndParams(lineOfText):
     if len(params) == 1:
         params = []
     else:
-        # escape commas that are inside quoted strings
-        line = escapeCommasInQuotedString(params[1])
-        # use CSV reader module
-        params = list(csv.reader([line], quotechar='"', delimiter=',', quoting=csv.QUOTE_NONE, skipinitialspace=True, escapechar='\\'))[0]
+        params = splitParams(params[1])
         #print("params is " + str(params))
     return msgName, params
     
@@ -95,6 +113,12 @@ def csvToMsg(lineOfText):
     msgName, params = msgNameAndParams(lineOfText)
     if msgName in Messaging.MsgClassFromName:
         msgClass = Messaging.MsgClassFromName[msgName]
+        from_csv_params = Messaging.generatedFn(msgClass, "from_csv_params")
+        if from_csv_params:
+            msg, terminationLen = from_csv_params(params)
+            if terminationLen != None:
+                msg.hdr.SetDataLength(terminationLen)
+            return msg
         msg = msgClass()
         terminateMsg = 0
         terminationLen = 0
@@ -5,34 +5,69 @@ from collections import OrderedDict
 import json
 import struct
 
+# Function that encodes the dicts from toDict() as JSON text.  A faster encoder can be
+# plugged in with setJsonEncoder(), but it must give exactly the same text as json.dumps()
+# if logs and other output are to stay the same.
+jsonEncoder = json.dumps
+
+def setJsonEncoder(encoder=None):
+    global jsonEncoder
+    if encoder is None:
+        encoder = json.dumps
+    jsonEncoder = encoder
+
+def hdrToDict(hdr):
+    to_json_dict = Messaging.generatedFn(type(hdr), "to_json_dict")
+    if to_json_dict:
+        try:
+            return to_json_dict(hdr)
+        except struct.error:
+            # header buffer is too short to unpack, use reflection
+            pass
+    hdrObj = OrderedDict()
+    hdrValues = Messaging.unpackAll(hdr)
+    for fieldInfo in hdr.fields:
+        if(fieldInfo.count == 1):
+            if len(fieldInfo.bitfieldInfo) == 0:
+                hdrObj[fieldInfo.name] = Messaging.getUnpacked(hdrValues, hdr, fieldInfo)
+            else:
+                for bitInfo in fieldInfo.bitfieldInfo:
+                    hdrObj[bitInfo.name] = Messaging.getUnpacked(hdrValues, hdr, bitInfo)
+        else:
+            arrayList = []
+            terminate = 0
+            for i in range(0,fieldInfo.count):
+                arrayList.append(Messaging.getUnpacked(hdrValues, hdr, fieldInfo, i))
+            hdrObj[fieldInfo.name] = arrayList
+    return hdrObj
+
 def toDict(msg, includeHeader=False):
-    pythonObj = OrderedDict()
+    hdrObj = None
     if includeHeader:
-        pythonObj['hdr'] = OrderedDict()
-        for fieldInfo in msg.hdr.fields:
-            if(fieldInfo.count == 1):
-                if len(fieldInfo.bitfieldInfo) == 0:
-                    pythonObj['hdr'][fieldInfo.name] = Messaging.get(msg.hdr, fieldInfo)
-                else:
-                    for bitInfo in fieldInfo.bitfieldInfo:
-                        pythonObj['hdr'][bitInfo.name] = Messaging.get(msg.hdr, bitInfo)
-            else:
-                arrayList = []
-                terminate = 0
-                for i in range(0,fieldInfo.count):
-                    arrayList.append(Messaging.get(msg.hdr, fieldInfo, i))
-                pythonObj['hdr'][fieldInfo.name] = arrayList
+        hdrObj = hdrToDict(msg.hdr)
 
     msgClass = Messaging.MsgClass(msg.hdr)
+    to_json_dict = Messaging.generatedFn(msgClass, "to_json_dict")
+    if to_json_dict and type(msg) is msgClass:
+        try:
+            return {msg.MsgName() : to_json_dict(msg, hdrObj)}
+        except struct.error:
+            # buffer is shorter than the message's length, use reflection
+            pass
+
+    pythonObj = OrderedDict()
+    if includeHeader:
+        pythonObj['hdr'] = hdrObj
+    values = Messaging.unpackAll(msg)
     for fieldInfo in msgClass.fields:
         if(fieldInfo.count == 1):
             if not fieldInfo.exists(msg):
                 break
             if len(fieldInfo.bitfieldInfo) == 0:
-                pythonObj[fieldInfo.name] = Messaging.get(msg, fieldInfo)
+                pythonObj[fieldInfo.name] = Messaging.getUnpacked(values, msg, fieldInfo)
             else:
                 for bitInfo in fieldInfo.bitfieldInfo:
-                    pythonObj[bitInfo.name] = Messaging.get(msg, bitInfo)
+                    pythonObj[bitInfo.name] = Messaging.getUnpacked(values, msg, bitInfo)
         else:
             if len(fieldInfo.bitfieldInfo) == 0:
                 arrayList = []
@@ -41,7 +76,7 @@ def toDict(msg, includeHeader=False):
                     if not fieldInfo.exists(msg, i):
                         terminate = 1
                         break
-                    arrayList.append(Messaging.get(msg, fieldInfo, i))
+                    arrayList.append(Messaging.getUnpacked(values, msg, fieldInfo, i))
                 pythonObj[fieldInfo.name] = arrayList
                 if terminate:
                     break
@@ -52,13 +87,13 @@ def toDict(msg, includeHeader=False):
                     for i in range(0,fieldInfo.count):
                         if not fieldInfo.exists(msg, i):
                             break
-                        arrayList.append(Messaging.get(msg, bitInfo, i))
+                        arrayList.append(Messaging.getUnpacked(values, msg, bitInfo, i))
                     pythonObj[bitInfo.name] = arrayList
 
     return {msg.MsgName() : pythonObj}
 
 def toJson(msg, includeHeader=False):
-    return json.dumps(toDict(msg,includeHeader))
+    return jsonEncoder(toDict(msg,includeHeader))
 
 def jsonToMsg(jsonString, ignore_invalid=False):
     d = json.loads(jsonString)
@@ -88,6 +123,10 @@ def dictToMsg(d, ignore_invalid=False):
         else:
             fieldDict = d[msgName]
             msgClass = Messaging.MsgClassFromName[msgName]
+            from_json_dict = Messaging.generatedFn(msgClass, "from_json_dict")
+            if from_json_dict:
+                msg, terminationLen = from_json_dict(fieldDict, terminationLen, ignore_invalid)
+                continue
             msg = msgClass()
             for fieldName in fieldDict:
                 if fieldName == "hdr":
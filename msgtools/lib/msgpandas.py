@@ -95,6 +95,19 @@ class PandasBinaryReader(MessageFileReader):
             self.dict_of_dataframes[msgname] = []
         self.dict_of_dataframes[msgname].append(flat)
 
+# Build a dataframe for many messages of one type at once, from a numpy structured array
+# of their records as returned by Messaging.decode_batch(), without any per-message python.
+# Columns are named the same as flatten_msg() names them, but enums are left as integers.
+def batch_to_dataframe(msg_class, records, index=None):
+    columns = OrderedDict()
+    for name, values in msg_class.columns(records).items():
+        if values.ndim == 1:
+            columns[name] = values
+        else:
+            for i in range(values.shape[1]):
+                columns[name + "[" + str(i) + "]"] = values[:, i]
+    return pd.DataFrame(columns, index=index)
+
 def load_binary(filename, serial=None):
     # if user didn't specify value for serial, set it based on filename.
     if serial == None:
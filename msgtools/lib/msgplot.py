@@ -453,7 +453,7 @@ class MsgPlot(QWidget):
                 continue
             try:
                 timestamp = msg.hdr.GetTime()
-                if Messaging.findFieldInfo(msg.hdr.fields, "Time").units == "ms":
+                if Messaging.HeaderTimeInfo(type(msg.hdr))[0].units == "ms":
                     timestamp = timestamp / 1000.0
                 newTime = float(elapsedSeconds(timestamp))
                 if newTime != 0:
@@ -0,0 +1,140 @@
+import socket
+import struct
+
+from .messaging import Messaging
+
+# UDP multicast of messages, for high-rate streams that many clients want.
+# The server's multicast plugin sends each message once to a multicast group,
+# instead of once per client, and clients join the group to receive them.
+#
+# Each datagram starts with a Network.MulticastSequence message, followed by
+# one or more whole messages, each with its NetworkHeader, the same as on a TCP
+# connection.  The sequence number goes up by one for each datagram, so
+# receivers can count datagrams that were lost, since UDP doesn't resend them.
+
+DEFAULT_GROUP = "239.255.77.77"
+DEFAULT_PORT = 5690
+# most data that fits in one ethernet frame, after the IP and UDP headers
+DEFAULT_BATCH_SIZE = 1472
+# most data that fits in one UDP datagram
+MAX_DATAGRAM_SIZE = 65507
+
+_SEQUENCE_MASK = 0xFFFFFFFF
+# a datagram more than this far behind, or ahead of the expected one, means
+# the publisher restarted
+_RESYNC_DISTANCE = 1024
+_MAX_GAP = 1 << 20
+
+# Returns (group, port) from text like "239.255.77.77:5690", with defaults for
+# anything that's left out.
+def parseAddress(text):
+    text = text.strip()
+    if text.startswith("//"):
+        text = text[2:]
+    group, sep, port = text.partition(":")
+    return (group if group else DEFAULT_GROUP, int(port) if port else DEFAULT_PORT)
+
+def sequenceMsgSize():
+    return Messaging.hdrSize + Messaging.Messages.Network.MulticastSequence.SIZE
+
+# Returns a datagram with sequence number sequence, holding msgs, which are
+# already encoded as bytes.
+def packDatagram(sequence, msgs):
+    seqMsg = Messaging.Messages.Network.MulticastSequence()
+    seqMsg.SetSequence(sequence & _SEQUENCE_MASK)
+    seqMsg.SetMsgCount(len(msgs))
+    return b''.join([seqMsg.rawBuffer().raw] + msgs)
+
+# Returns (sequence, messages) of a datagram, where messages is the data after
+# the Network.MulticastSequence message.  sequence is None if the datagram
+# doesn't start with one.
+def splitDatagram(data):
+    seqSize = sequenceMsgSize()
+    if len(data) >= seqSize:
+        hdr = Messaging.hdr(data[:Messaging.hdrSize])
+        if hdr.GetMessageID() == Messaging.Messages.Network.MulticastSequence.ID:
+            seqMsg = Messaging.Messages.Network.MulticastSequence(bytes(data[:seqSize]))
+            return seqMsg.GetSequence(), data[seqSize:]
+    return None, data
+
+# Counts datagrams that were lost or arrived late, from their sequence numbers.
+class SequenceTracker:
+    def __init__(self):
+        self.next = None
+        self.receivedDatagrams = 0
+        self.lostDatagrams = 0
+        self.lateDatagrams = 0
+
+    # Returns the number of datagrams that were lost just before this one.
+    def update(self, sequence):
+        self.receivedDatagrams += 1
+        if self.next is not None:
+            gap = (sequence - self.next) & _SEQUENCE_MASK
+            if gap == 0:
+                self.next = (sequence + 1) & _SEQUENCE_MASK
+                return 0
+            behind = (self.next - sequence) & _SEQUENCE_MASK
+            if behind <= _RESYNC_DISTANCE:
+                # it was counted as lost when a later one arrived
+                self.lateDatagrams += 1
+                if self.lostDatagrams:
+                    self.lostDatagrams -= 1
+                return 0
+            if gap <= _MAX_GAP:
+                self.lostDatagrams += gap
+                self.next = (sequence + 1) & _SEQUENCE_MASK
+                return gap
+        # first datagram, or the publisher restarted
+        self.next = (sequence + 1) & _SEQUENCE_MASK
+        return 0
+
+    def statusText(self):
+        return "%d datagrams, %d lost, %d late" % (self.receivedDatagrams, self.lostDatagrams, self.lateDatagrams)
+
+# Receives from a multicast group, and works like a blocking socket for
+# synchronous code, like the console Client.  It only receives, and send()
+# sends nothing and returns 0.
+class MulticastSocket:
+    RECEIVE_BUFFER_SIZE = 4*1024*1024
+
+    def __init__(self, group=DEFAULT_GROUP, port=DEFAULT_PORT, interface="0.0.0.0"):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # let other receivers on this host join the same group and port
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECEIVE_BUFFER_SIZE)
+        self._sock.bind(("", port))
+        membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface))
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self._datagram = bytearray(MAX_DATAGRAM_SIZE)
+        self.sequence = SequenceTracker()
+        self._sendWarned = False
+
+    # Nothing is sent, which is reported once.
+    def send(self, data):
+        if not self._sendWarned:
+            self._sendWarned = True
+            print("multicast.py: Multicast connections are receive-only, not sending anything on them")
+        return 0
+
+    def sendall(self, data):
+        self.send(data)
+
+    # Receives one datagram, and copies the messages in it into buffer, which
+    # must be big enough for a whole datagram.
+    def recv_into(self, buffer):
+        while True:
+            count = self._sock.recv_into(self._datagram)
+            sequence, msgs = splitDatagram(memoryview(self._datagram)[:count])
+            if sequence is not None:
+                self.sequence.update(sequence)
+            if len(msgs):
+                buffer[:len(msgs)] = msgs
+                return len(msgs)
+
+    def settimeout(self, timeout):
+        self._sock.settimeout(timeout)
+
+    def close(self):
+        self._sock.close()
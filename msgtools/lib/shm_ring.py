@@ -0,0 +1,296 @@
+import mmap
+import os
+import platform
+import socket
+import struct
+import tempfile
+
+# Shared memory transport between msgserver and clients on the same host.
+#
+# Each connection has two rings, one per direction, in files in /dev/shm.
+# Each ring has a single producer and a single consumer, so it needs no locks:
+# the producer only writes the tail index, the consumer only writes the head
+# index, and each only writes data the other has finished with.  Indexes only
+# ever increase, and are taken modulo the capacity to find positions.
+# The rings carry the same byte stream as a TCP connection, so messages can
+# wrap around the end of the ring, and are split back out with a MessageFramer.
+#
+# Wakeups go over a unix domain socket, which is also used to set up the
+# connection and to notice when the other side goes away.  A side that finds
+# its receive ring empty sets the ring's consumerWaiting flag before waiting on
+# the socket, and a producer that finds the flag set clears it and sends one
+# byte on the socket.  Likewise, a producer that finds the ring full sets
+# producerWaiting, and the consumer sends a byte once it has made space.
+# So while both sides are busy, no system calls are made at all.
+#
+# Python has no memory barriers, so the rings rely on the CPU making each
+# side's stores visible to the other in the order they were made.  x86 does,
+# but ARM and other weakly ordered CPUs don't, so a consumer there could see a
+# new tail index before the data it covers, and read stale bytes.  Nothing
+# can make up for that, so the transport is only supported on x86 (see
+# supported()).  Even on x86, a store can be passed by a later load, so the
+# producer and consumer can both miss each other's waiting flag and index.
+# The server checks both rings of each client on a timer, and sends any
+# wakeup that was missed that way, so a missed wakeup only costs latency, and
+# clients can simply block on the socket while they wait.
+#
+# To connect, a client connects to the server's unix socket, and the server
+# creates the rings and sends a line with their file names:
+#     MSGTOOLS-SHM 1 <client to server ring> <server to client ring>\n
+# The client maps the rings and replies "OK\n", and the server then unlinks the
+# files, so they go away when both sides are done with them.
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+# unix socket that the server listens on by default
+DEFAULT_SOCKET = os.path.join(SHM_DIR, 'msgtools-server')
+DEFAULT_CAPACITY = 4*1024*1024
+HANDSHAKE = b'MSGTOOLS-SHM 1'
+# how often the server checks for missed wakeups
+POLL_INTERVAL = 0.05
+
+# native format, so each index is copied in and out of the ring as one value
+_INDEX = struct.Struct('Q')
+_FLAG = struct.Struct('I')
+_MAGIC = 0x52485350
+# each index and flag is in its own cache line, so the two sides don't contend
+_CAPACITY_OFFSET = 8
+_HEAD_OFFSET = 64
+_TAIL_OFFSET = 128
+_CONSUMER_WAITING_OFFSET = 192
+_PRODUCER_WAITING_OFFSET = 256
+HEADER_SIZE = 320
+
+class ShmRing:
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, create=False):
+        self.path = path
+        if create:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+            try:
+                os.ftruncate(fd, HEADER_SIZE + capacity)
+                self._mmap = mmap.mmap(fd, HEADER_SIZE + capacity)
+            finally:
+                os.close(fd)
+            _FLAG.pack_into(self._mmap, _CAPACITY_OFFSET, capacity)
+            _FLAG.pack_into(self._mmap, 0, _MAGIC)
+        else:
+            fd = os.open(path, os.O_RDWR)
+            try:
+                self._mmap = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+            if len(self._mmap) < HEADER_SIZE or _FLAG.unpack_from(self._mmap, 0)[0] != _MAGIC:
+                self._mmap.close()
+                raise ValueError("%s is not a shared memory ring" % path)
+            capacity = _FLAG.unpack_from(self._mmap, _CAPACITY_OFFSET)[0]
+        self.capacity = capacity
+        self._data = memoryview(self._mmap)[HEADER_SIZE:HEADER_SIZE+capacity]
+        # Each side keeps a copy of the index only it changes, so it never has
+        # to read it back.  The producer also keeps the last head it read, since
+        # the space that's free can only grow until it writes again.
+        self._head = _INDEX.unpack_from(self._mmap, _HEAD_OFFSET)[0]
+        self._tail = _INDEX.unpack_from(self._mmap, _TAIL_OFFSET)[0]
+
+    def close(self):
+        if self._data is not None:
+            self._data.release()
+            self._data = None
+            self._mmap.close()
+
+    # Consumer: bytes that can be read
+    def available(self):
+        return _INDEX.unpack_from(self._mmap, _TAIL_OFFSET)[0] - self._head
+
+    # Producer: copies as much of data as fits into the ring, and returns the
+    # number of bytes written.
+    def write(self, data):
+        tail = self._tail
+        size = len(data)
+        if self.capacity - (tail - self._head) < size:
+            self._head = _INDEX.unpack_from(self._mmap, _HEAD_OFFSET)[0]
+        count = min(size, self.capacity - (tail - self._head))
+        if count <= 0:
+            return 0
+        pos = tail % self.capacity
+        first = min(count, self.capacity - pos)
+        self._data[pos:pos+first] = data[:first]
+        if count > first:
+            self._data[0:count-first] = data[first:count]
+        # publish the data, after it's all been copied
+        self._tail = tail + count
+        _INDEX.pack_into(self._mmap, _TAIL_OFFSET, self._tail)
+        return count
+
+    # Producer: bytes the consumer hasn't read yet
+    def unread(self):
+        self._head = _INDEX.unpack_from(self._mmap, _HEAD_OFFSET)[0]
+        return self._tail - self._head
+
+    # Consumer: copies as much data as is available and fits into buffer, and
+    # returns the number of bytes read.
+    def read_into(self, buffer):
+        head = self._head
+        count = min(len(buffer), _INDEX.unpack_from(self._mmap, _TAIL_OFFSET)[0] - head)
+        if count <= 0:
+            return 0
+        pos = head % self.capacity
+        first = min(count, self.capacity - pos)
+        buffer[:first] = self._data[pos:pos+first]
+        if count > first:
+            buffer[first:count] = self._data[0:count-first]
+        # give the space back to the producer
+        self._head = head + count
+        _INDEX.pack_into(self._mmap, _HEAD_OFFSET, self._head)
+        return count
+
+    def _setFlag(self, offset, value):
+        _FLAG.pack_into(self._mmap, offset, value)
+
+    # Clears a flag, and returns True if it was set
+    def _takeFlag(self, offset):
+        if _FLAG.unpack_from(self._mmap, offset)[0]:
+            _FLAG.pack_into(self._mmap, offset, 0)
+            return True
+        return False
+
+    def setConsumerWaiting(self):
+        self._setFlag(_CONSUMER_WAITING_OFFSET, 1)
+
+    def takeConsumerWaiting(self):
+        return self._takeFlag(_CONSUMER_WAITING_OFFSET)
+
+    def setProducerWaiting(self):
+        self._setFlag(_PRODUCER_WAITING_OFFSET, 1)
+
+    def takeProducerWaiting(self):
+        return self._takeFlag(_PRODUCER_WAITING_OFFSET)
+
+# One side of a shared memory connection, with a ring to receive from and a ring
+# to send to.  Data that doesn't fit in the send ring is kept until there's
+# room.  The methods that return True mean the other side needs to be woken up,
+# which the caller does by sending a byte on the connection's socket.
+class ShmEndpoint:
+    def __init__(self, rxRing, txRing):
+        self.rxRing = rxRing
+        self.txRing = txRing
+        # data waiting for room in txRing
+        self._pending = []
+
+    def pending(self):
+        return len(self._pending) > 0
+
+    def send(self, data):
+        if not self._pending:
+            count = self.txRing.write(data)
+            if count == len(data):
+                return self.txRing.takeConsumerWaiting()
+            data = memoryview(data)[count:]
+        self._pending.append(data)
+        return self.flush()
+
+    # Writes as much pending data as fits
+    def flush(self):
+        pending = self._pending
+        while pending:
+            count = self.txRing.write(pending[0])
+            if count < len(pending[0]):
+                pending[0] = memoryview(pending[0])[count:]
+                self.txRing.setProducerWaiting()
+                break
+            pending.pop(0)
+        return self.txRing.takeConsumerWaiting()
+
+    # Reads everything available into framer.  Returns True if the other side
+    # was waiting for room to send.
+    def receive(self, framer):
+        rxRing = self.rxRing
+        available = rxRing.available()
+        if available > 0:
+            framer.commit(rxRing.read_into(framer.write_buffer(available)))
+        return rxRing.takeProducerWaiting()
+
+    # Call before waiting for a wakeup.  Returns False if data arrived, in
+    # which case don't wait.
+    def prepareToWait(self):
+        self.rxRing.setConsumerWaiting()
+        return self.rxRing.available() == 0
+
+    def close(self):
+        self.rxRing.close()
+        self.txRing.close()
+
+# Returns True if shared memory connections work on this host, which needs
+# unix sockets and a CPU that keeps stores in order.
+def supported():
+    return os.name == 'posix' and platform.machine().lower() in ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+
+# Returns the server socket path from a connection name like "shm:" or
+# "shm:///path/to/socket".
+def socketPath(connection_name):
+    path = connection_name.split(":", 1)[1] if ":" in connection_name else ""
+    if path.startswith("//"):
+        path = path[2:]
+    return path if path else DEFAULT_SOCKET
+
+def parseHandshake(line):
+    parts = line.split()
+    if len(parts) != 4 or b' '.join(parts[0:2]) != HANDSHAKE:
+        raise ValueError("bad shared memory handshake %r" % line)
+    return parts[2].decode(), parts[3].decode()
+
+# Client side of a shared memory connection, that works like a blocking
+# socket for synchronous code, like the console Client.
+class ShmSocket:
+    def __init__(self, path=DEFAULT_SOCKET):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._sock.settimeout(None)
+        line = b''
+        while not line.endswith(b'\n'):
+            data = self._sock.recv(1024)
+            if not data:
+                raise ConnectionResetError("server closed shared memory connection")
+            line += data
+        c2s, s2c = parseHandshake(line)
+        self._endpoint = ShmEndpoint(ShmRing(s2c), ShmRing(c2s))
+        self._sock.sendall(b'OK\n')
+
+    def _wake(self):
+        self._sock.sendall(b'\x01')
+
+    # Waits for a wakeup, and returns False if the server went away
+    def _wait(self):
+        return len(self._sock.recv(4096)) > 0
+
+    def send(self, data):
+        endpoint = self._endpoint
+        if endpoint.send(data):
+            self._wake()
+        while endpoint.pending():
+            if not self._wait():
+                raise ConnectionResetError("server closed shared memory connection")
+            if endpoint.flush():
+                self._wake()
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def recv_into(self, buffer):
+        endpoint = self._endpoint
+        while True:
+            count = endpoint.rxRing.read_into(buffer)
+            if count:
+                if endpoint.rxRing.takeProducerWaiting():
+                    self._wake()
+                return count
+            if endpoint.prepareToWait() and not self._wait():
+                return 0
+
+    # Like a socket's, a timeout makes recv_into() raise socket.timeout if
+    # nothing arrives in time.
+    def settimeout(self, timeout):
+        self._sock.settimeout(timeout)
+
+    def close(self):
+        self._sock.close()
+        self._endpoint.close()
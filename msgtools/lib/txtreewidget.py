@@ -283,8 +283,8 @@ class MessageItem(QTreeWidgetItem):
         self.repaint_timer.stop()
 
     def set_msg_buffer(self, msg_buffer):
-        self.msg.msg_buffer_wrapper["msg_buffer"] = msg_buffer
-        self.msg.hdr.msg_buffer_wrapper["msg_buffer"] = msg_buffer
+        self.msg.msg_buffer = msg_buffer
+        self.msg.hdr.msg_buffer = msg_buffer
         if not self.repaint_timer.isActive():
             self.repaint_timer.start()
         #self.repaintAll()
@@ -7,16 +7,15 @@ from msgtools.lib.message import Message
 
 class UnknownMsg(Message):
     MSG_OFFSET = Messaging.hdrSize
+    __slots__ = ()
     
     def __init__(self, messageBuffer):
-        # this is a trick to get us to store a copy of a pointer to a buffer, rather than making a copy of the buffer
-        self.msg_buffer_wrapper = { "msg_buffer": messageBuffer }
+        self.msg_buffer = messageBuffer
 
         self.hdr = Messaging.hdr(messageBuffer)
 
     def rawBuffer(self):
-        # this is a trick to get us to store a copy of a pointer to a buffer, rather than making a copy of the buffer
-        return self.msg_buffer_wrapper["msg_buffer"]
+        return self.msg_buffer
 
     def MsgName(self):
         id = hex(self.hdr.GetMessageID())
@@ -33,7 +33,7 @@ class NoiseMaker(msgtools.lib.gui.Gui):
 
         msgtools.lib.gui.Gui.__init__(self, "Noise Maker 0.1", args, parent)
         
-        self.timeInfo = Messaging.findFieldInfo(Messaging.hdr.fields, "Time")
+        self.timeInfo = Messaging.HeaderTimeInfo(Messaging.hdr)[0]
         
         # event-based way of getting messages
         self.RxMsg.connect(self.ProcessMessage)
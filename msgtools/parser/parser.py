@@ -82,6 +82,10 @@ def DoReplacements(line, msg, replacements, firstTime):
     ret = optionalReplace(ret, "<FIELDINFOS>", 'fieldInfos', msg)
     ret = optionalReplace(ret, "<STRUCTUNPACKING>", 'structUnpacking', msg)
     ret = optionalReplace(ret, "<STRUCTPACKING>", 'structPacking', msg)
+    ret = optionalReplace(ret, "<BULK_DECODERS>", 'bulkDecoders', msg)
+    ret = optionalReplace(ret, "<JSON_SERIALIZERS>", 'jsonSerializers', msg)
+    ret = optionalReplace(ret, "<HEADER_JSON_SERIALIZERS>", 'headerJsonSerializers', msg)
+    ret = optionalReplace(ret, "<CSV_SERIALIZERS>", 'csvSerializers', msg)
     ret = optionalReplace(ret, "<GETMSGID>", 'getMsgID', msg)
     ret = optionalReplace(ret, "<SETMSGID>", 'setMsgID', msg)
     if "<FOREACHFIELD" in ret and ")>" in ret:
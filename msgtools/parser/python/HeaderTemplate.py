@@ -6,13 +6,19 @@
 #
 #                     AUTOGENERATED FILE, DO NOT EDIT
 import struct
+import numpy
 import ctypes
 from collections import OrderedDict
 from msgtools.lib.messaging import *
 import msgtools.lib.messaging as msg
 
+# Precompiled struct codecs, one per field and one for the whole fixed layout,
+# and a numpy dtype of the whole fixed layout
+<DECLARATIONS>
+
 class <MSGNAME> :
     SIZE = <MSGSIZE>
+    DTYPE = _<MSGNAME>_DTYPE
     MSG_OFFSET = 0
     # Enumerations
     <ENUMERATIONS>
@@ -29,15 +35,9 @@ class <MSGNAME> :
             doInit = 1
             messageBuffer = ctypes.create_string_buffer(<MSGNAME>.SIZE)
         else:
-            try:
-                messageBuffer.raw
-            except AttributeError:
-                newbuf = ctypes.create_string_buffer(len(messageBuffer))
-                for i in range(0, len(messageBuffer)):
-                    newbuf[i] = bytes(messageBuffer)[i]
-                messageBuffer = newbuf
-        # this is a trick to get us to store a copy of a pointer to a buffer, rather than making a copy of the buffer
-        self.msg_buffer_wrapper = { "msg_buffer": messageBuffer }
+            messageBuffer = message_buffer(messageBuffer)
+        # the buffer is stored, not copied, and generated accessors read it directly
+        self.msg_buffer = messageBuffer
         if doInit:
             self.initialize()
 
@@ -46,8 +46,7 @@ class <MSGNAME> :
             pass
     
     def rawBuffer(self):
-        # this is a trick to get us to store a copy of a pointer to a buffer, rather than making a copy of the buffer
-        return self.msg_buffer_wrapper["msg_buffer"]
+        return self.msg_buffer
 
     @staticmethod
     def MsgName():
@@ -91,6 +90,12 @@ class <MSGNAME> :
     # Accessors
     <ACCESSORS>
 
+    # Bulk decode of the whole message with one unpack
+    <BULK_DECODERS>
+
+    # Conversion to and from the dicts used for JSON
+    <HEADER_JSON_SERIALIZERS>
+
     # Reflection information
     fields = [ \
         <REFLECTION>\
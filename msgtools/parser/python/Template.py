@@ -6,15 +6,22 @@
 #
 #                     AUTOGENERATED FILE, DO NOT EDIT
 import struct
+import numpy
 from collections import OrderedDict
 from msgtools.lib.conversions import *
 from msgtools.lib.messaging import *
 import msgtools.lib.messaging as msg
 from msgtools.lib.message import Message
 
+# Precompiled struct codecs, one per field and one for the whole fixed layout,
+# and a numpy dtype of the whole fixed layout
+<DECLARATIONS>
+
 class <MSGNAME>(Message):
+    __slots__ = ()
     ID = <MSGID>
     SIZE = <MSGSIZE>
+    DTYPE = _<MSGNAME>_DTYPE
     MSG_OFFSET = Messaging.hdrSize
     # Enumerations
     <ENUMERATIONS>
@@ -31,8 +38,7 @@ class <MSGNAME>(Message):
             pass
 
     def rawBuffer(self):
-        # this is a trick to get us to store a copy of a pointer to a buffer, rather than making a copy of the buffer
-        return self.msg_buffer_wrapper["msg_buffer"]
+        return self.msg_buffer
 
     @staticmethod
     def MsgName():
@@ -40,6 +46,15 @@ class <MSGNAME>(Message):
     # Accessors
     <ACCESSORS>
 
+    # Bulk decode of the whole message with one unpack
+    <BULK_DECODERS>
+
+    # Conversion to and from the dicts used for JSON
+    <JSON_SERIALIZERS>
+
+    # Conversion to and from rows of CSV
+    <CSV_SERIALIZERS>
+
     # Reflection information
     fields = [ \
         <REFLECTION>\
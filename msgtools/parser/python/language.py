@@ -19,6 +19,13 @@ def fieldType(field):
     typeStr = field["Type"]
     return fieldTypeDict[typeStr]
 
+# format character without the endian prefix, for use inside a larger format string
+def fieldTypeChar(field):
+    return fieldType(field).lstrip("<>")
+
+def fieldIsAscii(field):
+    return MsgParser.fieldUnits(field) == "ASCII" and (field["Type"] == "uint8" or field["Type"] == "int8")
+
 def pythonFieldCount(field):
     count = MsgParser.fieldCount(field)
     if MsgParser.fieldUnits(field) == "ASCII" and (field["Type"] == "uint8" or field["Type"] == "int8"):
@@ -106,6 +113,93 @@ def reflection(msg):
 def fieldInfos(msg):
     pass
 
+# name of the module-level precompiled struct.Struct used by a field's accessors
+def structName(msg, field):
+    return "_" + msgName(msg) + "_" + field["Name"]
+
+# name of the module-level precompiled struct.Struct for the whole fixed layout of a message
+def layoutName(msg):
+    return "_" + msgName(msg) + "_LAYOUT"
+
+def structFormat(field):
+    if fieldIsAscii(field):
+        return str(MsgParser.fieldCount(field)) + "s"
+    return fieldType(field)
+
+# List of (location, format, size, field name) for every element of every field, sorted by location.
+# Arrays of structs are stored as parallel arrays with a stride of the struct size,
+# so their elements are interleaved with the elements of other fields.
+def layoutElements(msg):
+    elements = []
+    if "Fields" in msg:
+        for field in msg["Fields"]:
+            loc = MsgParser.fieldLocation(field)
+            if fieldIsAscii(field):
+                elements.append((loc, structFormat(field), MsgParser.fieldCount(field), field["Name"]))
+            else:
+                for i in range(MsgParser.fieldCount(field)):
+                    elements.append((loc + i*MsgParser.fieldArrayElementOffset(field), fieldTypeChar(field), MsgParser.fieldSize(field), field["Name"]))
+    elements.sort(key=lambda e: e[0])
+    return elements
+
+def layoutFormat(msg):
+    fmt = ">" if MsgParser.big_endian else "<"
+    loc = 0
+    for element in layoutElements(msg):
+        if element[0] > loc:
+            fmt += "%dx" % (element[0] - loc)
+        fmt += element[1]
+        loc = element[0] + element[2]
+    return fmt
+
+# name of the module-level numpy structured dtype for the fixed layout of a message
+def dtypeName(msg):
+    return "_" + msgName(msg) + "_DTYPE"
+
+def numpyType(field):
+    if fieldIsAscii(field):
+        return "S%d" % MsgParser.fieldCount(field)
+    numpyTypeDict = \
+    {"uint64":"u8", "uint32":"u4", "uint16": "u2", "uint8": "u1",
+      "int64":"i8",  "int32":"i4",  "int16": "i2",  "int8": "i1",
+      "float64":"f8", "float32":"f4"}
+    return (">" if MsgParser.big_endian else "<") + numpyTypeDict[field["Type"]]
+
+# Lists of names, formats and offsets of the numpy dtype of a message.
+# Arrays of structs are stored as parallel arrays with a stride of the struct size, which
+# numpy can only describe as an array of padded records, each holding the one element at
+# its offset within the struct.  The array of records starts where the struct array starts.
+def numpyFields(msg):
+    names = []
+    formats = []
+    offsets = []
+    structStart = None
+    if "Fields" in msg:
+        for field in msg["Fields"]:
+            loc = MsgParser.fieldLocation(field)
+            count = pythonFieldCount(field)
+            names.append('"%s"' % field["Name"])
+            if count == 1:
+                formats.append('"%s"' % numpyType(field))
+                offsets.append(loc)
+            elif MsgParser.fieldArrayElementOffset(field) == MsgParser.fieldSize(field):
+                formats.append('("%s", (%d,))' % (numpyType(field), count))
+                offsets.append(loc)
+            else:
+                stride = MsgParser.fieldArrayElementOffset(field)
+                if structStart is None or not (structStart <= loc < structStart + stride):
+                    structStart = loc
+                record = 'numpy.dtype({"names": ["%s"], "formats": ["%s"], "offsets": [%d], "itemsize": %d})' % (field["Name"], numpyType(field), loc - structStart, stride)
+                formats.append('(%s, (%d,))' % (record, count))
+                offsets.append(structStart)
+                continue
+            structStart = None
+    return names, formats, offsets
+
+def numpyDtype(msg):
+    names, formats, offsets = numpyFields(msg)
+    return 'numpy.dtype({"names": [%s], "formats": [%s], "offsets": [%s], "itemsize": %d})' % (", ".join(names), ", ".join(formats), ", ".join(str(o) for o in offsets), msgSize(msg))
+
 def fnHdr(field, offset, count, name):
     param = "self"
     if str.find(name, "Set") == 0:
@@ -159,18 +253,19 @@ def reverseEnumLookup(msg, field):
 
 def getFn(msg, field):
     loc = msgName(msg) + ".MSG_OFFSET + " + str(MsgParser.fieldLocation(field))
-    type = "'"+fieldType(field)+"'"
+    unpack = structName(msg, field) + ".unpack_from("
     count = MsgParser.fieldCount(field)
     cleanup = ""
     preface = ""
     if "Enum" in field:
         # find index that corresponds to string input param
         cleanup = reverseEnumLookup(msg, field)
-    if MsgParser.fieldUnits(field) == "ASCII" and (field["Type"] == "uint8" or field["Type"] == "int8"):
+    if fieldIsAscii(field):
+        # strings can be truncated by a short message, so the length of the unpack can vary.
         preface += "\n    count = " + str(count)+"\n"
-        preface += "    if count > len(self.rawBuffer())-("+loc+"):\n"
-        preface += "        count = len(self.rawBuffer())-("+loc+")\n"
-        type = "str(count)+'s'"
+        preface += "    if count > len(self.msg_buffer)-("+loc+"):\n"
+        preface += "        count = len(self.msg_buffer)-("+loc+")\n"
+        unpack = "struct.unpack_from(str(count)+'s', "
         count = 1
         cleanup = '''ascii_len = str(value).find("\\\\x00")
     value = str(value)[2:ascii_len]
@@ -185,15 +280,14 @@ def getFn(msg, field):
         cleanup += "    value = " + MsgParser.getMath("value", field, "", conversionParamNames=True)+"\n    "
     ret = '''\
 %s%s
-    value = struct.unpack_from(%s, self.rawBuffer(), %s)[0]
+    value = %sself.msg_buffer, %s)[0]
     %sreturn value
-''' % (fnHdr(field,MsgParser.fieldLocation(field),count, "Get"+field["Name"]), preface, type, loc, cleanup)
+''' % (fnHdr(field,MsgParser.fieldLocation(field),count, "Get"+field["Name"]), preface, unpack, loc, cleanup)
     return ret
 
 def setFn(msg, field):
     loc = msgName(msg) + ".MSG_OFFSET + " + str(MsgParser.fieldLocation(field))
     count = MsgParser.fieldCount(field)
-    type = fieldType(field)
     lookup = ""
     if "Enum" in field:
         # find index that corresponds to string input param
@@ -205,8 +299,7 @@ def setFn(msg, field):
     if "int" in storageType:
         lookup += "value = min(max(value, %s), %s)\n    " % (MsgParser.fieldStorageMin(storageType), MsgParser.fieldStorageMax(storageType))
     preface = ""
-    if MsgParser.fieldUnits(field) == "ASCII" and (field["Type"] == "uint8" or field["Type"] == "int8"):
-        type = str(count) + "s"
+    if fieldIsAscii(field):
         count = 1
         lookup = "value = value.encode('utf-8')\n    "
     elif count > 1:
@@ -218,8 +311,8 @@ def setFn(msg, field):
     ret  = '''\
 %s
     %s%s
-    struct.pack_into('%s', self.rawBuffer(), %s, value)
-''' % (fnHdr(field,MsgParser.fieldLocation(field),count, "Set"+field["Name"]), lookup, preface, type, loc)
+    %s.pack_into(self.msg_buffer, %s, value)
+''' % (fnHdr(field,MsgParser.fieldLocation(field),count, "Set"+field["Name"]), lookup, preface, structName(msg, field), loc)
     return ret
 
 def getBitsFn(msg, field, bits, bitOffset, numBits):
@@ -285,6 +378,452 @@ def accessors(msg):
 
     return gets+sets
 
+# Expression that decodes the raw stored value x of a field the same way its Get
+# accessor does with default arguments.
+def fieldDecode(msg, field, x):
+    if fieldIsAscii(field):
+        return 'str(%s)[2:str(%s).find("\\\\x00")]' % (x, x)
+    if fieldHasConversion(field):
+        return MsgParser.getMath(x, field, "", conversionParamNames=True)
+    if "Enum" in field:
+        return "%s.Reverse%s.get(%s, %s)" % (msgName(msg), field["Enum"], x, x)
+    return x
+
+# Expression that decodes a bitfield out of the raw stored value x of its parent field
+# the same way its Get accessor does with default arguments.
+def bitsDecode(msg, field, bits, bitOffset, x):
+    x = fieldDecode(msg, field, x)
+    mask = MsgParser.Mask(bits["NumBits"])
+    if field["Type"].startswith('i'):
+        value = "math.copysign((abs(%s) >> %s) & %s, %s)" % (x, str(bitOffset), mask, x)
+    else:
+        value = "(%s >> %s) & %s" % (x, str(bitOffset), mask)
+    if "Enum" in bits:
+        return "%s.Reverse%s.get(%s, %s)" % (msgName(msg), bits["Enum"], value, value)
+    if fieldHasConversion(bits):
+        return MsgParser.getMath(value, bits, "float", conversionParamNames=True)
+    return value
+
+# Messaging.get() formats fields with hex units as a hex string of the field's size
+def hexFormat(field, size, value):
+    if MsgParser.fieldUnits(field).lower() == "hex":
+        return '"0x%%0%dX" %% (%s)' % (size*2, value)
+    return value
+
+# Expression for the value of a field or bitfield given the indices of its parent's
+# elements in the tuple unpacked with the whole layout, decoded by the function decode.
+def bulkValue(indices, count, decode):
+    if count == 1:
+        return decode("v[%d]" % indices[0])
+    step = indices[1] - indices[0]
+    if indices != list(range(indices[0], indices[-1]+1, step)):
+        elements = "(" + ", ".join("v[%d]" % i for i in indices) + ")"
+    elif step == 1:
+        elements = "v[%d:%d]" % (indices[0], indices[-1]+1)
+    else:
+        elements = "v[%d:%d:%d]" % (indices[0], indices[-1]+1, step)
+    value = decode("x")
+    if value == "x":
+        return "list(%s)" % elements
+    return "[%s for x in %s]" % (value, elements)
+
+# List of (name, value expression, is bitfield parent) for every field and bitfield,
+# in reflection order, with values formatted the same as Messaging.get().
+def bulkValues(msg):
+    ret = []
+    indices = {}
+    for i, element in enumerate(layoutElements(msg)):
+        indices.setdefault(element[3], []).append(i)
+    if "Fields" in msg:
+        for field in msg["Fields"]:
+            count = pythonFieldCount(field)
+            size = 0 if fieldIsAscii(field) else MsgParser.fieldSize(field)
+            fieldIndices = indices[field["Name"]]
+            decode = lambda x, field=field, size=size: hexFormat(field, size, fieldDecode(msg, field, x))
+            ret.append((field["Name"], bulkValue(fieldIndices, count, decode), "Bitfields" in field))
+            bitOffset = 0
+            if "Bitfields" in field:
+                for bits in field["Bitfields"]:
+                    decode = lambda x, field=field, bits=bits, bitOffset=bitOffset: hexFormat(bits, 0, bitsDecode(msg, field, bits, bitOffset, x))
+                    ret.append((MsgParser.BitfieldName(field, bits), bulkValue(fieldIndices, count, decode), False))
+                    bitOffset += bits["NumBits"]
+    return ret
+
+# Expression that decodes a column x of raw stored values of a field the same way its Get
+# accessor decodes one value, except that enums are left as integers.
+def fieldColumn(msg, field, x):
+    if "Conversion" in field and msgtools.parser.MsgUtils.use_nonlinear_conversions:
+        return "numpy.vectorize(lambda x: %s)(%s)" % (MsgParser.getMath("x", field, "", conversionParamNames=True), x)
+    if fieldHasConversion(field):
+        # convert to float first, so scaling can't overflow the stored integer type
+        return MsgParser.getMath(x, field, "numpy.float64", conversionParamNames=True)
+    return x
+
+# Expression that decodes a bitfield out of a column x of raw stored values of its parent
+# field, the same way its Get accessor decodes one value, except that enums are left as integers.
+def bitsColumn(msg, field, bits, bitOffset, x):
+    x = fieldColumn(msg, field, x)
+    mask = MsgParser.Mask(bits["NumBits"])
+    if field["Type"].startswith('i'):
+        value = "numpy.copysign((abs(%s) >> %s) & %s, %s)" % (x, str(bitOffset), mask, x)
+    else:
+        value = "(%s >> %s) & %s" % (x, str(bitOffset), mask)
+    if "Conversion" in bits and msgtools.parser.MsgUtils.use_nonlinear_conversions:
+        return "numpy.vectorize(lambda x: %s)(%s)" % (MsgParser.getMath("x", bits, "float", conversionParamNames=True), value)
+    if fieldHasConversion(bits):
+        return MsgParser.getMath(value, bits, "numpy.float64", conversionParamNames=True)
+    return value
+
+# List of (name, column expression) for every field and bitfield, in reflection order,
+# decoded from a structured array of records of the message's dtype.
+def columnValues(msg):
+    ret = []
+    if "Fields" in msg:
+        _, formats, _ = numpyFields(msg)
+        for field, format in zip(msg["Fields"], formats):
+            column = 'records["%s"]' % field["Name"]
+            if format.startswith("(numpy.dtype"):
+                # array of padded records, for arrays of structs
+                column += '["%s"]' % field["Name"]
+            ret.append((field["Name"], fieldColumn(msg, field, column)))
+            bitOffset = 0
+            if "Bitfields" in field:
+                for bits in field["Bitfields"]:
+                    ret.append((MsgParser.BitfieldName(field, bits), bitsColumn(msg, field, bits, bitOffset, column)))
+                    bitOffset += bits["NumBits"]
+    return ret
+
+# Functions that decode the whole message with a single unpack_from of the precompiled
+# layout struct, instead of one accessor call per field.
+def bulkDecoders(msg):
+    unpack = "v = %s.unpack_from(self.msg_buffer, %s.MSG_OFFSET)" % (layoutName(msg), msgName(msg))
+    values = bulkValues(msg)
+    allValues = "".join('\n        "%s": %s,' % (name, value) for name, value, isParent in values)
+    dictValues = "".join('\n        ("%s", %s),' % (name, value) for name, value, isParent in values if not isParent)
+    columns = "".join('\n        "%s": %s,' % (name, value) for name, value in columnValues(msg))
+    ret = '''\
+def as_tuple(self):
+    """Raw values of every element of every field, in order of location"""
+    return %s.unpack_from(self.msg_buffer, %s.MSG_OFFSET)
+
+def unpack_all(self):
+    """Values of every field and bitfield by name, formatted the same as Messaging.get()"""
+    %s
+    return {%s
+    }
+
+@staticmethod
+def columns(records):
+    """Arrays of values of every field and bitfield by name, from a numpy array of DTYPE records"""
+    return {%s
+    }
+
+def as_dict(self):
+    """Values of every field, with bitfields in place of the fields that contain them, as in toDict()"""
+    %s
+    return OrderedDict([%s
+    ])
+''' % (layoutName(msg), msgName(msg), unpack, allValues, columns, unpack, dictValues)
+    return ret
+
+# Name of the function Messaging.set() uses to convert a value for a field of the given
+# reflection type before calling its Set accessor, or None if it uses the value as-is.
+def setConversion(reflectionType):
+    if "int" in reflectionType:
+        return "parseInt"
+    if "float" in reflectionType:
+        return "float"
+    if "enumeration" == reflectionType:
+        return "parseEnum"
+    return None
+
+# Code that sets one field or bitfield from a dict decoded from JSON, the same as
+# msgjson.dictToMsg() does with Messaging.set(), and tracks the length the message should
+# end at.  location and size are those of the field, or the bitfield's parent field.
+def jsonSetField(name, reflectionType, count, location, size):
+    convert = setConversion(reflectionType)
+    element = "%s(value[i])" % convert if convert else "value[i]"
+    scalar = "%s(value)" % convert if convert else "value"
+    if count > 1:
+        element += ", i"
+        scalar += ", 0"
+    if reflectionType == "string":
+        end = "%d + %d*len(value)" % (location, size)
+    else:
+        end = str(location + size)
+    return '''\
+    if "%s" in fieldDict:
+        value = fieldDict["%s"]
+        if isinstance(value, list):
+            for i in range(0,len(value)):
+                try:
+                    self.Set%s(%s)
+                except struct.error as e:
+                    print(e)
+                    break
+                if terminationLen != None:
+                    terminationLen = max(terminationLen, %d + %d*(i+1))
+        elif not isinstance(value, dict):
+            self.Set%s(%s)
+            if terminationLen != None:
+                terminationLen = max(terminationLen, %s)
+''' % (name, name, name, element, location, size, name, scalar, end)
+
+# Code that stores the value of one field or bitfield of a message that may be shorter
+# than its full size, the same as msgjson.toDict() does with Messaging.get().
+# Arrays store the first n elements.
+def jsonGetField(field, name, size, count):
+    if count == 1:
+        return '    d["%s"] = %s\n' % (name, hexFormat(field, size, "self.Get%s()" % name))
+    return '    d["%s"] = [%s for i in range(0,n)]\n' % (name, hexFormat(field, size, "self.Get%s(i)" % name))
+
+# Functions that convert the message to and from the dicts that msgjson encodes as JSON,
+# with the same results as msgjson's reflection based toDict() and dictToMsg().
+def jsonSerializers(msg):
+    name = msgName(msg)
+    size = msgSize(msg)
+    fieldCount = 0
+    names = ['"hdr"']
+    fullLength = ""
+    shortLength = ""
+    setFields = ""
+    if "Fields" in msg:
+        for fieldName, value, isParent in bulkValues(msg):
+            if not isParent:
+                fullLength += '        d["%s"] = %s\n' % (fieldName, value)
+        for field in msg["Fields"]:
+            fieldCount += 1
+            count = pythonFieldCount(field)
+            location = MsgParser.fieldLocation(field)
+            fieldSize = MsgParser.fieldSize(field)
+            names.append('"%s"' % field["Name"])
+            setFields += jsonSetField(field["Name"], reflectionInterfaceType(field), count, location, fieldSize)
+            bitfields = field.get("Bitfields", [])
+            if count == 1:
+                shortLength += "    if length < %d:\n        return d\n" % (location + fieldSize)
+            else:
+                shortLength += "    n = min(max((length - %d) // %d, 0), %d)\n" % (location, fieldSize, count)
+            if not bitfields:
+                shortLength += jsonGetField(field, field["Name"], 0 if fieldIsAscii(field) else fieldSize, count)
+                if count > 1:
+                    shortLength += "    if n < %d:\n        return d\n" % (count)
+            for bits in bitfields:
+                bitsName = MsgParser.BitfieldName(field, bits)
+                names.append('"%s"' % bitsName)
+                setFields += jsonSetField(bitsName, bitsReflectionInterfaceType(bits), count, location, fieldSize)
+                shortLength += jsonGetField(bits, bitsName, 0, count)
+    ret = '''\
+@msg.fieldCount(%d)
+def to_json_dict(self, hdr=None):
+    """Values of the fields within the message's length by name, with bitfields in place of the
+    fields that contain them, after hdr if it's given, as in msgjson.toDict()"""
+    d = OrderedDict() if hdr is None else OrderedDict(hdr=hdr)
+    length = self.hdr.GetDataLength()
+    if length >= %d and len(self.msg_buffer) >= %s.MSG_OFFSET + %d:
+        v = %s.unpack_from(self.msg_buffer, %s.MSG_OFFSET)
+%s        return d
+    # a short message ends at the first field (or array element) that doesn't fit
+%s    return d
+@classmethod
+@msg.fieldCount(%d)
+def from_json_dict(cls, fieldDict, terminationLen=None, ignore_invalid=False):
+    """Message with fields set from a dict of values by name, and the length to end the
+    message at, as in msgjson.dictToMsg()"""
+    self = cls()
+    if "hdr" in fieldDict:
+        hdrDict = fieldDict["hdr"]
+        if "Time" in hdrDict:
+            self.hdr.SetTime(hdrDict["Time"])
+        terminationLen = None
+        if "DataLength" in hdrDict:
+            terminationLen = 0 if hdrDict["DataLength"] == ";" else int(hdrDict["DataLength"])
+    invalid = fieldDict.keys() - {%s}
+    if invalid:
+        for fieldName in fieldDict:
+            if fieldName in invalid:
+                if not ignore_invalid:
+                    raise KeyError("Invalid field %%s for message %%s" %% (fieldName, self.MsgName()))
+                if ignore_invalid != "silent":
+                    print("Ignoring invalid field %%s.%%s" %% (self.MsgName(), fieldName))
+%s    return self, terminationLen
+''' % (fieldCount, size, name, size, layoutName(msg), name, fullLength, shortLength,
+       fieldCount, ", ".join(names), setFields)
+    return ret
+
+# Header version of to_json_dict(), for the header part of msgjson.toDict()
+def headerJsonSerializers(msg):
+    fieldCount = 0
+    values = ""
+    if "Fields" in msg:
+        bulk = iter(bulkValues(msg))
+        for field in msg["Fields"]:
+            fieldCount += 1
+            fieldName, value, isParent = next(bulk)
+            bitfields = [next(bulk) for bits in field.get("Bitfields", [])]
+            # arrays are stored whole, even if they have bitfields
+            if bitfields and pythonFieldCount(field) == 1:
+                for bitsName, bitsValue, isParent in bitfields:
+                    values += '        ("%s", %s),\n' % (bitsName, bitsValue)
+            else:
+                values += '        ("%s", %s),\n' % (fieldName, value)
+    ret = '''\
+@msg.fieldCount(%d)
+def to_json_dict(self):
+    """Values of every field by name, with bitfields in place of the non-array fields that
+    contain them, as in the header part of msgjson.toDict()"""
+    v = %s.unpack_from(self.msg_buffer, %s.MSG_OFFSET)
+    return OrderedDict([
+%s    ])
+''' % (fieldCount, layoutName(msg), msgName(msg), values)
+    return ret
+
+# Code that sets one field from CSV parameters, the same as msgcsv.csvToMsg() does.
+# The message ends after a value with a ';' on the end, and terminationLen is set to
+# where it ends.  Values after the first field of a bitfield or array aren't stripped.
+def csvSetField(field, location, size):
+    name = field["Name"]
+    count = pythonFieldCount(field)
+    reflectionType = reflectionInterfaceType(field)
+    convert = setConversion(reflectionType)
+    bitfields = field.get("Bitfields", [])
+    def setValue(setName, convert, index=""):
+        return "self.Set%s(%s%s)" % (setName, "%s(val)" % convert if convert else "val", index)
+    ret = "    val = params[p].strip()\n"
+    if count == 1 and not bitfields:
+        ret += '''\
+    if val.endswith(";"):
+        val = val[:-1]
+        if val == "":
+            # terminate without this field
+            return self, %d
+        # terminate after this field
+        terminationLen = %d
+''' % (location, location + size)
+        if reflectionType == "string":
+            ret += '''\
+    if val.startswith('"') and val.endswith('"'):
+        val = val.strip('"')
+    if terminationLen != None:
+        terminationLen = %d + %d*len(val)
+''' % (location, size)
+        ret += "    %s\n    p += 1\n" % setValue(name, convert)
+    elif count == 1:
+        ret += "    while True:\n"
+        for bits in bitfields:
+            bitsName = MsgParser.BitfieldName(field, bits)
+            ret += '''\
+        if val.endswith(";"):
+            val = val[:-1]
+            # terminate without anything after our parent field
+            terminationLen = %d
+            if val == "":
+                break
+        %s
+        p += 1
+        val = params[p]
+        if terminationLen != None:
+            break
+''' % (location + size, setValue(bitsName, setConversion(bitsReflectionInterfaceType(bits))))
+        ret += "        break\n"
+    else:
+        ret += '''\
+    if val.startswith("0x") and len(val) > %d:
+        if val.endswith(";"):
+            val = val[:-1]
+            terminationLen = int(%d + len(val[2:].strip())/2)
+        hexStr = val[2:].strip()
+        valArray = [hexStr[i:i+%d] for i in range(0, len(hexStr), %d)]
+        for i in range(0,len(valArray)):
+            self.Set%s(%s(int(valArray[i], 16)), i)
+        p += 1
+    else:
+        for i in range(0,%d):
+            if val.endswith(";"):
+                terminationLen = %d + %d*(i+1)
+                val = val[:-1]
+            %s
+            if terminationLen != None:
+                break
+            p += 1
+            val = params[p]
+''' % (2+2*size, location, size*2, size*2, name, convert if convert else "", count, location, size, setValue(name, convert, ", i"))
+    ret += "    if terminationLen != None:\n        return self, terminationLen\n"
+    return ret
+
+# Code that stores the CSV columns of one field, in a message that may be shorter than its
+# full size, the same as msgcsv.toCsv() does with Messaging.get().  Unlike JSON, arrays
+# continue on to the next field when they're cut short, and are stored whole even if they
+# have bitfields.
+def csvGetField(field, location, size):
+    count = pythonFieldCount(field)
+    hexSize = 0 if fieldIsAscii(field) else size
+    if count > 1:
+        return "    n = min(max((length - %d) // %d, 0), %d)\n    cols += [%s for i in range(0,n)]\n" % \
+            (location, size, count, hexFormat(field, hexSize, "self.Get%s(i)" % field["Name"]))
+    ret = "    if length < %d:\n        return cols\n" % (location + size)
+    if "Bitfields" in field:
+        for bits in field["Bitfields"]:
+            ret += "    cols.append(%s)\n" % hexFormat(bits, 0, "self.Get%s()" % MsgParser.BitfieldName(field, bits))
+    else:
+        ret += "    cols.append(%s)\n" % hexFormat(field, hexSize, "self.Get%s()" % field["Name"])
+    return ret
+
+# Functions that convert the message to and from the columns of a row of CSV text,
+# with the same results as msgcsv's reflection based toCsv() and csvToMsg().
+def csvSerializers(msg):
+    name = msgName(msg)
+    size = msgSize(msg)
+    fieldCount = 0
+    fullLength = []
+    shortLength = ""
+    setFields = ""
+    if "Fields" in msg:
+        bulk = iter(bulkValues(msg))
+        for field in msg["Fields"]:
+            fieldCount += 1
+            count = pythonFieldCount(field)
+            location = MsgParser.fieldLocation(field)
+            fieldSize = MsgParser.fieldSize(field)
+            fieldName, value, isParent = next(bulk)
+            bitfields = [next(bulk) for bits in field.get("Bitfields", [])]
+            if count > 1:
+                fullLength.append("*" + value)
+            elif bitfields:
+                fullLength += [bitsValue for bitsName, bitsValue, isParent in bitfields]
+            else:
+                fullLength.append(value)
+            shortLength += csvGetField(field, location, fieldSize)
+            setFields += csvSetField(field, location, fieldSize)
+    if not setFields:
+        setFields = "    pass\n"
+    ret = '''\
+@msg.fieldCount(%d)
+def csv_values(self):
+    """Values of the CSV columns that are within the message's length, as in msgcsv.toCsv()"""
+    length = self.hdr.GetDataLength()
+    if length >= %d and len(self.msg_buffer) >= %s.MSG_OFFSET + %d:
+        v = %s.unpack_from(self.msg_buffer, %s.MSG_OFFSET)
+        return [%s]
+    cols = []
+    # a short message ends at the first field that doesn't fit
+%s    return cols
+@classmethod
+@msg.fieldCount(%d)
+def from_csv_params(cls, params):
+    """Message with fields set from a list of CSV parameters, and the length to end the message
+    at (or None if it's not shortened), as in msgcsv.csvToMsg()"""
+    self = cls()
+    terminationLen = None
+    p = 0
+    try:
+%s    except IndexError:
+        # ran out of parameters
+        pass
+    return self, terminationLen
+''' % (fieldCount, size, name, size, layoutName(msg), name, ", ".join(fullLength), shortLength,
+       fieldCount, "\n".join(("    " + line) if line else line for line in setFields.split("\n")))
+    return ret
+
 def initField(field, messageName):
     ret = []
     if "Default" in field:
@@ -345,8 +884,17 @@ def enums(e):
         ret += fwd + back
     return ret
 
+# Module-level precompiled struct.Struct objects, so accessors don't need to
+# parse a format string on every call, and a numpy dtype for decoding many
+# messages at once.
 def declarations(msg, msg_enums):
-    return [""]
+    ret = []
+    if "Fields" in msg:
+        for field in msg["Fields"]:
+            ret.append("%s = struct.Struct('%s')" % (structName(msg, field), structFormat(field)))
+    ret.append("%s = struct.Struct('%s')" % (layoutName(msg), layoutFormat(msg)))
+    ret.append("%s = %s" % (dtypeName(msg), numpyDtype(msg)))
+    return ret
 
 def getMsgID(msg):
     return baseGetMsgID("self.", "", 0, 1, msg)
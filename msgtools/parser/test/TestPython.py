@@ -28,7 +28,7 @@ class TestPython(unittest.TestCase):
 @msg.count(1)
 def GetFieldA(self):
     \"\"\"\"\"\"
-    value = struct.unpack_from('<L', self.rawBuffer(), TestCase1.MSG_OFFSET + 0)[0]
+    value = _TestCase1_FieldA.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 0)[0]
     return value
 """)
         expected.append("""\
@@ -54,7 +54,7 @@ def GetFABitsA(self):
 @msg.count(1)
 def GetFieldB(self):
     \"\"\"\"\"\"
-    value = struct.unpack_from('<H', self.rawBuffer(), TestCase1.MSG_OFFSET + 4)[0]
+    value = _TestCase1_FieldB.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 4)[0]
     return value
 """)
         expected.append("""\
@@ -70,7 +70,7 @@ def GetFieldC(self, idx):
     if idx >= 5:
         raise struct.error('Error getting TestCase1.FieldC[%d], invalid index >= 5' % (idx))
 
-    value = struct.unpack_from('B', self.rawBuffer(), TestCase1.MSG_OFFSET + 6+idx*1)[0]
+    value = _TestCase1_FieldC.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 6+idx*1)[0]
     return value
 """)
         expected.append("""\
@@ -83,7 +83,7 @@ def GetFieldC(self, idx):
 @msg.count(1)
 def GetFieldD(self):
     \"\"\"\"\"\"
-    value = struct.unpack_from('B', self.rawBuffer(), TestCase1.MSG_OFFSET + 11)[0]
+    value = _TestCase1_FieldD.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 11)[0]
     return value
 """)
         expected.append("""\
@@ -139,7 +139,7 @@ def GetBitsC(self):
 @msg.count(1)
 def GetFieldE(self):
     \"\"\"\"\"\"
-    value = struct.unpack_from('<f', self.rawBuffer(), TestCase1.MSG_OFFSET + 12)[0]
+    value = _TestCase1_FieldE.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 12)[0]
     return value
 """)
         expected.append("""\
@@ -152,7 +152,7 @@ def GetFieldE(self):
 @msg.count(1)
 def GetFieldS1_Member1(self):
     \"\"\"\"\"\"
-    value = struct.unpack_from('<l', self.rawBuffer(), TestCase1.MSG_OFFSET + 16)[0]
+    value = _TestCase1_FieldS1_Member1.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 16)[0]
     return value
 """)
         expected.append("""\
@@ -165,7 +165,7 @@ def GetFieldS1_Member1(self):
 @msg.count(1)
 def GetFieldS1_Member2(self):
     \"\"\"\"\"\"
-    value = struct.unpack_from('<d', self.rawBuffer(), TestCase1.MSG_OFFSET + 20)[0]
+    value = _TestCase1_FieldS1_Member2.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 20)[0]
     return value
 """)
         expected.append("""\
@@ -178,7 +178,7 @@ def GetFieldS1_Member2(self):
 @msg.count(1)
 def GetFieldF(self, convertFloat=True):
     \"\"\"\"\"\"
-    value = struct.unpack_from('<H', self.rawBuffer(), TestCase1.MSG_OFFSET + 28)[0]
+    value = _TestCase1_FieldF.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 28)[0]
     if convertFloat:
         value = ((value * 2.7) + 1.828)
     return value
@@ -196,7 +196,7 @@ def GetFieldS2_Member1(self, idx):
     if idx >= 3:
         raise struct.error('Error getting TestCase1.FieldS2_Member1[%d], invalid index >= 3' % (idx))
 
-    value = struct.unpack_from('<l', self.rawBuffer(), TestCase1.MSG_OFFSET + 30+idx*12)[0]
+    value = _TestCase1_FieldS2_Member1.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 30+idx*12)[0]
     return value
 """)
         expected.append("""\
@@ -212,7 +212,7 @@ def GetFieldS2_Member2(self, idx):
     if idx >= 3:
         raise struct.error('Error getting TestCase1.FieldS2_Member2[%d], invalid index >= 3' % (idx))
 
-    value = struct.unpack_from('<d', self.rawBuffer(), TestCase1.MSG_OFFSET + 34+idx*12)[0]
+    value = _TestCase1_FieldS2_Member2.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 34+idx*12)[0]
     return value
 """)
         expected.append("""\
@@ -228,7 +228,7 @@ def GetFieldG(self, idx):
     if idx >= 3:
         raise struct.error('Error getting TestCase1.FieldG[%d], invalid index >= 3' % (idx))
 
-    value = struct.unpack_from('<H', self.rawBuffer(), TestCase1.MSG_OFFSET + 66+idx*2)[0]
+    value = _TestCase1_FieldG.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET + 66+idx*2)[0]
     return value
 """)
         expected.append("""\
@@ -271,7 +271,7 @@ def SetFieldA(self, value):
     \"\"\"\"\"\"
     value = min(max(value, 0), 4294967295)
     
-    struct.pack_into('<L', self.rawBuffer(), TestCase1.MSG_OFFSET + 0, value)
+    _TestCase1_FieldA.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 0, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -298,7 +298,7 @@ def SetFieldB(self, value):
     \"\"\"\"\"\"
     value = min(max(value, 0), 65535)
     
-    struct.pack_into('<H', self.rawBuffer(), TestCase1.MSG_OFFSET + 4, value)
+    _TestCase1_FieldB.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 4, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -316,7 +316,7 @@ def SetFieldC(self, value, idx):
         raise struct.error('Error setting TestCase1.FieldC[%d], invalid index >= 5' % (idx))
         return
 
-    struct.pack_into('B', self.rawBuffer(), TestCase1.MSG_OFFSET + 6+idx*1, value)
+    _TestCase1_FieldC.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 6+idx*1, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -330,7 +330,7 @@ def SetFieldD(self, value):
     \"\"\"\"\"\"
     value = min(max(value, 0), 255)
     
-    struct.pack_into('B', self.rawBuffer(), TestCase1.MSG_OFFSET + 11, value)
+    _TestCase1_FieldD.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 11, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -391,7 +391,7 @@ def SetBitsC(self, value):
 def SetFieldE(self, value):
     \"\"\"\"\"\"
     
-    struct.pack_into('<f', self.rawBuffer(), TestCase1.MSG_OFFSET + 12, value)
+    _TestCase1_FieldE.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 12, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -405,7 +405,7 @@ def SetFieldS1_Member1(self, value):
     \"\"\"\"\"\"
     value = min(max(value, -2147483648), 2147483647)
     
-    struct.pack_into('<l', self.rawBuffer(), TestCase1.MSG_OFFSET + 16, value)
+    _TestCase1_FieldS1_Member1.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 16, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -418,7 +418,7 @@ def SetFieldS1_Member1(self, value):
 def SetFieldS1_Member2(self, value):
     \"\"\"\"\"\"
     
-    struct.pack_into('<d', self.rawBuffer(), TestCase1.MSG_OFFSET + 20, value)
+    _TestCase1_FieldS1_Member2.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 20, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -434,7 +434,7 @@ def SetFieldF(self, value, convertFloat=True):
         value = int((value - 1.828) / 2.7)
     value = min(max(value, 0), 65535)
     
-    struct.pack_into('<H', self.rawBuffer(), TestCase1.MSG_OFFSET + 28, value)
+    _TestCase1_FieldF.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 28, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -452,7 +452,7 @@ def SetFieldS2_Member1(self, value, idx):
         raise struct.error('Error setting TestCase1.FieldS2_Member1[%d], invalid index >= 3' % (idx))
         return
 
-    struct.pack_into('<l', self.rawBuffer(), TestCase1.MSG_OFFSET + 30+idx*12, value)
+    _TestCase1_FieldS2_Member1.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 30+idx*12, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -469,7 +469,7 @@ def SetFieldS2_Member2(self, value, idx):
         raise struct.error('Error setting TestCase1.FieldS2_Member2[%d], invalid index >= 3' % (idx))
         return
 
-    struct.pack_into('<d', self.rawBuffer(), TestCase1.MSG_OFFSET + 34+idx*12, value)
+    _TestCase1_FieldS2_Member2.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 34+idx*12, value)
 """)
         expected.append("""\
 @msg.units('')
@@ -487,7 +487,7 @@ def SetFieldG(self, value, idx):
         raise struct.error('Error setting TestCase1.FieldG[%d], invalid index >= 3' % (idx))
         return
 
-    struct.pack_into('<H', self.rawBuffer(), TestCase1.MSG_OFFSET + 66+idx*2, value)
+    _TestCase1_FieldG.pack_into(self.msg_buffer, TestCase1.MSG_OFFSET + 66+idx*2, value)
 """)
         expected.append("""\
 @msg.units('m/s')
@@ -539,6 +539,60 @@ def SetBitsE(self, value, idx):
         observed = language.enums(MsgParser.Enums(self.msgDict))
         self.assertMultiLineEqual(expected, observed)
     
+    def test_declarations(self):
+        expected = []
+        expected.append("_TestCase1_FieldA = struct.Struct('<L')")
+        expected.append("_TestCase1_FieldB = struct.Struct('<H')")
+        expected.append("_TestCase1_FieldC = struct.Struct('B')")
+        expected.append("_TestCase1_FieldD = struct.Struct('B')")
+        expected.append("_TestCase1_FieldE = struct.Struct('<f')")
+        expected.append("_TestCase1_FieldS1_Member1 = struct.Struct('<l')")
+        expected.append("_TestCase1_FieldS1_Member2 = struct.Struct('<d')")
+        expected.append("_TestCase1_FieldF = struct.Struct('<H')")
+        expected.append("_TestCase1_FieldS2_Member1 = struct.Struct('<l')")
+        expected.append("_TestCase1_FieldS2_Member2 = struct.Struct('<d')")
+        expected.append("_TestCase1_FieldG = struct.Struct('<H')")
+        # array of structs elements are interleaved by location in the whole layout
+        expected.append("_TestCase1_LAYOUT = struct.Struct('<LHBBBBBBfldHldldldHHH')")
+        # arrays of structs are arrays of padded records, starting where the struct array starts
+        expected.append('_TestCase1_DTYPE = numpy.dtype({"names": ["FieldA", "FieldB", "FieldC", "FieldD", "FieldE", "FieldS1_Member1", "FieldS1_Member2", "FieldF", "FieldS2_Member1", "FieldS2_Member2", "FieldG"], '+
+            '"formats": ["<u4", "<u2", ("<u1", (5,)), "<u1", "<f4", "<i4", "<f8", "<u2", '+
+            '(numpy.dtype({"names": ["FieldS2_Member1"], "formats": ["<i4"], "offsets": [0], "itemsize": 12}), (3,)), '+
+            '(numpy.dtype({"names": ["FieldS2_Member2"], "formats": ["<f8"], "offsets": [4], "itemsize": 12}), (3,)), ("<u2", (3,))], '+
+            '"offsets": [0, 4, 6, 11, 12, 16, 20, 28, 30, 30, 66], "itemsize": 72})')
+
+        observed = language.declarations(MsgParser.Messages(self.msgDict)[0], MsgParser.Enums(self.msgDict))
+        self.assertEqual(len(expected), len(observed))
+        for i in range(len(expected)):
+            self.assertMultiLineEqual(expected[i], observed[i])
+
+    def test_bulkDecoders(self):
+        expected = """\
+def as_dict(self):
+    \"\"\"Values of every field, with bitfields in place of the fields that contain them, as in toDict()\"\"\"
+    v = _TestCase1_LAYOUT.unpack_from(self.msg_buffer, TestCase1.MSG_OFFSET)
+    return OrderedDict([
+        ("FABitsA", (v[0] >> 0) & 0x7fffffff),
+        ("FieldB", v[1]),
+        ("FieldC", list(v[2:7])),
+        ("BitsA", (float((v[7] >> 0) & 0xf) * 14.357)),
+        ("BitsB", TestCase1.ReverseEnumA.get((v[7] >> 4) & 0x7, (v[7] >> 4) & 0x7)),
+        ("BitsC", (v[7] >> 7) & 0x1),
+        ("FieldE", v[8]),
+        ("FieldS1_Member1", v[9]),
+        ("FieldS1_Member2", v[10]),
+        ("FieldF", ((v[11] * 2.7) + 1.828)),
+        ("FieldS2_Member1", list(v[12:17:2])),
+        ("FieldS2_Member2", list(v[13:18:2])),
+        ("BitsD", [(float((x >> 0) & 0xf) * 14.357) for x in v[18:21]]),
+        ("BitsE", [(x >> 4) & 0x1ff for x in v[18:21]]),
+    ])
+"""
+        observed = language.bulkDecoders(MsgParser.Messages(self.msgDict)[0])
+        self.assertIn("def as_tuple(self):", observed)
+        self.assertIn("def unpack_all(self):", observed)
+        self.assertMultiLineEqual(expected, observed[observed.index("def as_dict(self):"):])
+
     def test_initCode(self):
         expected = []
         expected.append("self.SetFieldA(1)")
@@ -3,10 +3,9 @@ from PyQt5.QtCore import QObject
 
 from msgtools.lib.messaging import Messaging
 from msgtools.lib.header_translator import HeaderTranslator
+from msgtools.lib.framer import MessageFramer
 from BluetoothHeader import BluetoothHeader
 
-BTHS = BluetoothHeader.SIZE
-
 # We require bluez, available on Windows and Linux
 import bluetooth
 import threading
@@ -43,7 +42,7 @@ class BluetoothRFCOMMConnection(QObject):
         self.socket.connect((deviceBTAddr, deviceBTPort))
         #self.socket.disconnected.connect(self.onDisconnected)
 
-        self.btsock_buffer = b''
+        self.framer = MessageFramer(BluetoothHeader)
         self.btsock_outgoing = b''
 
         self.hdrTranslator = HeaderTranslator(BluetoothHeader, Messaging.hdr)
@@ -78,26 +77,18 @@ class BluetoothRFCOMMConnection(QObject):
 
             if len(ret[0]) > 0:
                 # we've got data to read
-                self.btsock_buffer += self.socket.recv(4096)
+                self.framer.feed(self.socket.recv(4096))
 
             if len(self.btsock_outgoing)>0 and len(ret[1])>0:
                 sent = self.socket.send(self.btsock_outgoing)
                 self.btsock_outgoing = self.btsock_outgoing[sent:]
 
-            while len(self.btsock_buffer) >= BTHS:
-                hdr = BluetoothHeader(self.btsock_buffer[0:BTHS])
-                total_len = BTHS + hdr.GetDataLength()
-                if len(self.btsock_buffer) >= total_len:
-                    # we've got enough data for the whole message
-                    hdr = BluetoothHeader(self.btsock_buffer)
-                    self.btsock_buffer = self.btsock_buffer[total_len:]
-                    
-                    networkMsg = self.hdrTranslator.translate(hdr)
-                    
-                    self.messagereceived.emit(networkMsg)
-                else:
-                    # we don't quite have enough data for a whole message
-                    break
+            for msg_bytes in self.framer.messages():
+                hdr = BluetoothHeader(msg_bytes)
+
+                networkMsg = self.hdrTranslator.translate(hdr)
+
+                self.messagereceived.emit(networkMsg)
 
     def onDisconnected(self):
         print("self.disconnected.emit(self)")
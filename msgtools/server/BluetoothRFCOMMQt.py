@@ -4,6 +4,7 @@ from PyQt5.QtCore import QObject
 from msgtools.lib.messaging import Messaging
 from BluetoothHeader import BluetoothHeader
 from msgtools.lib.header_translator import HeaderTranslator
+from msgtools.lib.framer import MessageFramer
 
 # We require Qt Bluetooth support, available on Linux and Macs(?)
 
@@ -30,7 +31,7 @@ class BluetoothRFCOMMQtConnection(QObject):
 
         self.hdrTranslator = HeaderTranslator(BluetoothHeader, Messaging.hdr)
         
-        self.rxBuffer = bytearray()
+        self.framer = MessageFramer(BluetoothHeader)
 
         self.name = "Bluetooth RFCOMM " + self.socket.peerAddress().toString()
         self.statusLabel.setText(self.name)
@@ -46,32 +47,14 @@ class BluetoothRFCOMMQtConnection(QObject):
         return None
             
     def onReadyRead(self):
-        inputStream = QtCore.QDataStream(self.socket)
+        # read everything that's available, and emit each whole message in it
+        self.framer.feed(self.socket.readAll().data())
+        for msg_bytes in self.framer.messages():
+            btHdr = BluetoothHeader(msg_bytes)
 
-        while(1):
-            if len(self.rxBuffer) < BluetoothHeader.SIZE:
-                if self.socket.bytesAvailable() < BluetoothHeader.SIZE:
-                    return
-                self.rxBuffer += inputStream.readRawData(BluetoothHeader.SIZE - len(self.rxBuffer))
+            networkMsg = self.hdrTranslator.translate(btHdr)
 
-            if len(self.rxBuffer) >= BluetoothHeader.SIZE:
-                hdr = BluetoothHeader(self.rxBuffer)
-                bodyLen = hdr.GetDataLength()
-                if len(self.rxBuffer)+self.socket.bytesAvailable() < BluetoothHeader.SIZE + bodyLen:
-                    return
-
-                self.rxBuffer += inputStream.readRawData(BluetoothHeader.SIZE + bodyLen - len(self.rxBuffer))
-
-                # create a new header object with the appended body
-                btHdr = BluetoothHeader(self.rxBuffer)
-
-                # if we got this far, we have a whole message! So, emit the signal
-                networkMsg = self.hdrTranslator.translate(btHdr)
-
-                self.messagereceived.emit(networkMsg)
-
-                # then clear the buffer, so we start over on the next message
-                self.rxBuffer = bytearray()
+            self.messagereceived.emit(networkMsg)
 
     def onDisconnected(self):
         self.socket.close()
@@ -5,6 +5,7 @@ import ctypes
 
 from msgtools.lib.messaging import Messaging, FieldInfo, offset, size
 from msgtools.lib.header_translator import HeaderTranslator
+from msgtools.lib.crc16 import Crc16
 from msgtools.server import CanPortDialog
 import struct
 import sys
@@ -19,19 +20,6 @@ def hexbytes(d):
         bytes += bytes_per_line
     return ret
 
-def Crc16(data):
-    crc = 0;
-    for i in range(0,len(data)):
-        d = struct.unpack_from('B', data, i)[0]
-        crc = (crc >> 8) | (crc << 8)
-        crc ^= d
-        crc ^= (crc & 0xff) >> 4
-        crc ^= crc << 12
-        crc = 0xFFFF & crc
-        crc ^= (crc & 0xff) << 5
-        crc = 0xFFFF & crc
-    return crc
-
 class CanFragmentation(QtCore.QObject):
     statusUpdate = QtCore.pyqtSignal(str)
 
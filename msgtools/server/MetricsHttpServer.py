@@ -0,0 +1,53 @@
+from PyQt5 import QtCore, QtNetwork
+from PyQt5.QtCore import QObject
+
+# Serves the server's metrics as a Prometheus text format page, at
+# http://127.0.0.1:<port>/metrics
+# Only the local host can connect.  Each connection gets one response, and is
+# then closed.
+class MetricsHttpServer(QObject):
+    statusUpdate = QtCore.pyqtSignal(str)
+
+    # largest request that's accepted, so a client can't make us buffer forever
+    MAX_REQUEST_SIZE = 8192
+
+    def __init__(self, portNumber, metrics):
+        super(MetricsHttpServer, self).__init__(None)
+
+        self.portNumber = portNumber
+        self.metrics = metrics
+        self.tcpServer = QtNetwork.QTcpServer()
+        self.tcpServer.newConnection.connect(self.onNewConnection)
+
+    def start(self):
+        if not self.tcpServer.listen(QtNetwork.QHostAddress.LocalHost, self.portNumber):
+            self.statusUpdate.emit("Can't open metrics HTTP port "+str(self.portNumber)+"!")
+
+    def onNewConnection(self):
+        while self.tcpServer.hasPendingConnections():
+            socket = self.tcpServer.nextPendingConnection()
+            socket.request = b''
+            socket.readyRead.connect(lambda socket=socket: self.onReadyRead(socket))
+            socket.disconnected.connect(socket.deleteLater)
+
+    def onReadyRead(self, socket):
+        socket.request += socket.readAll().data()
+        if b'\r\n\r\n' not in socket.request and b'\n\n' not in socket.request:
+            if len(socket.request) > self.MAX_REQUEST_SIZE:
+                self.respond(socket, "413 Payload Too Large", "request too large\n")
+            return
+        requestLine = socket.request.split(b'\n', 1)[0].decode('latin-1').split()
+        if len(requestLine) < 2 or requestLine[0] not in ('GET', 'HEAD'):
+            self.respond(socket, "405 Method Not Allowed", "only GET is supported\n")
+        elif requestLine[1].split('?')[0] not in ('/', '/metrics'):
+            self.respond(socket, "404 Not Found", "metrics are at /metrics\n")
+        else:
+            self.respond(socket, "200 OK", self.metrics.prometheusText(), requestLine[0] == 'HEAD')
+
+    def respond(self, socket, status, body, headOnly=False):
+        body = body.encode('utf-8')
+        header = "HTTP/1.0 %s\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % (status, len(body))
+        socket.write(header.encode('latin-1'))
+        if not headOnly:
+            socket.write(body)
+        socket.disconnectFromHost()
@@ -0,0 +1,149 @@
+from PyQt5 import QtCore, QtWidgets, QtNetwork
+from PyQt5.QtCore import QObject
+
+from msgtools.lib.messaging import Messaging
+from msgtools.lib import multicast
+from msgtools.server.outbound_queue import OutboundQueue
+
+# Publishes messages to a UDP multicast group, so any number of clients can
+# receive a high-rate stream for the cost of sending it once.
+# It's a client of the server that subscribes to the messages to publish.
+# See msgtools/lib/multicast.py for the format of the datagrams.
+class MulticastConnection(QObject):
+    statusUpdate = QtCore.pyqtSignal(str)
+    messagereceived = QtCore.pyqtSignal(object)
+    disconnected = QtCore.pyqtSignal(object)
+
+    # ids is a list of message IDs to publish, or empty to publish everything.
+    # With a batchSize, messages are packed into datagrams of up to that many
+    # bytes, otherwise each message gets its own datagram.
+    def __init__(self, group=multicast.DEFAULT_GROUP, port=multicast.DEFAULT_PORT, ids=(), batchSize=0, ttl=1):
+        super(MulticastConnection, self).__init__(None)
+
+        self.removeClient = QtWidgets.QPushButton("Remove")
+        self.removeClient.pressed.connect(lambda: self.disconnected.emit(self))
+        self.statusLabel = QtWidgets.QLabel()
+        self.subscriptions = {}
+        for id in ids:
+            self.subscriptions[id] = id
+        # with no IDs, subscribe to everything
+        self.subMask = ~0 if ids else 0
+        self.subValue = 0
+        self.isHardwareLink = False
+
+        self.group = QtNetwork.QHostAddress(group)
+        self.port = port
+        self.batchSize = min(batchSize, multicast.MAX_DATAGRAM_SIZE)
+        self.sequence = 0
+        self.sentDatagrams = 0
+        self.droppedDatagrams = 0
+        self.udpSocket = QtNetwork.QUdpSocket(self)
+        self.udpSocket.setSocketOption(QtNetwork.QAbstractSocket.MulticastTtlOption, ttl)
+        # so receivers on this host get the datagrams too
+        self.udpSocket.setSocketOption(QtNetwork.QAbstractSocket.MulticastLoopbackOption, 1)
+
+        self.outboundQueue = OutboundQueue()
+        # single shot timer to send the queue when control returns to the event loop
+        self.flushTimer = QtCore.QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.setInterval(0)
+        self.flushTimer.timeout.connect(self.flush)
+
+        self.name = "Multicast %s:%d" % (group, port)
+        self.statusLabel.setText(self.name)
+        if self.batchSize:
+            self.batchLabel = QtWidgets.QLabel("%d byte datagrams" % self.batchSize)
+        else:
+            self.batchLabel = QtWidgets.QLabel("1 msg per datagram")
+        # datagrams are never held back, so there's no queue policy to choose
+        self.policyLabel = QtWidgets.QLabel("UDP")
+        self.queueLabel = QtWidgets.QLabel()
+        self.updateQueueStatus()
+
+    def widget(self, index):
+        if index == 0:
+            return self.removeClient
+        if index == 1:
+            return self.statusLabel
+        if index == 2:
+            return self.batchLabel
+        if index == 3:
+            return self.policyLabel
+        if index == 4:
+            return self.queueLabel
+        return None
+
+    def updateQueueStatus(self):
+        self.queueLabel.setText("%d datagrams sent, %d dropped" % (self.sentDatagrams, self.droppedDatagrams))
+
+    def start(self):
+        self.statusUpdate.emit("Publishing %s to %s:%d" % ("all messages" if not self.subscriptions else "%d message IDs" % len(self.subscriptions), self.group.toString(), self.port))
+
+    def stop(self):
+        self.flush()
+        self.udpSocket.close()
+
+    def sendMsg(self, hdr):
+        self.sendBytes(hdr.rawBuffer().raw, hdr.GetMessageID())
+
+    # Queues an encoded message, to be sent with the rest of the batch when
+    # control returns to the event loop.
+    def sendBytes(self, buf, id=0):
+        self.outboundQueue.put(id, buf)
+        if not self.flushTimer.isActive():
+            self.flushTimer.start()
+
+    def flush(self):
+        self.flushTimer.stop()
+        queue = self.outboundQueue
+        room = max(self.batchSize - multicast.sequenceMsgSize(), 1)
+        while queue:
+            # one message, or as many as fit in a batch
+            msgs = queue.take(room if self.batchSize else 1, fit=True)
+            datagram = multicast.packDatagram(self.sequence, msgs)
+            # the sequence number goes up even if the datagram can't be sent,
+            # so receivers see that it's missing
+            self.sequence += 1
+            if self.udpSocket.writeDatagram(datagram, self.group, self.port) < 0:
+                if self.droppedDatagrams == 0:
+                    self.statusUpdate.emit("Error sending to %s: %s" % (self.name, self.udpSocket.errorString()))
+                self.droppedDatagrams += 1
+            else:
+                self.sentDatagrams += 1
+
+# Parses the plugin's parameter, which has the group and port, followed by
+# comma separated options, and message names or IDs to publish:
+#     239.255.77.77:5690,batch,ttl=2,Network.MsgMetrics,0x12345678
+# batch packs messages into datagrams of up to 1472 bytes, or batch=SIZE sets
+# the size.  With no messages given, all are published.
+def parseParam(param):
+    items = [item.strip() for item in param.split(",")] if param else [""]
+    group, port = multicast.parseAddress(items[0])
+    ids = []
+    batchSize = 0
+    ttl = 1
+    for item in items[1:]:
+        name, sep, value = item.partition("=")
+        if name == "batch":
+            batchSize = int(value) if value else multicast.DEFAULT_BATCH_SIZE
+        elif name == "ttl":
+            ttl = int(value)
+        elif item in Messaging.MsgIDFromName:
+            ids.append(int(Messaging.MsgIDFromName[item], 16))
+        else:
+            try:
+                ids.append(int(item, 0))
+            except ValueError:
+                raise ValueError("Invalid multicast option or message " + item)
+    return group, port, ids, batchSize, ttl
+
+def PluginConnection(param=None):
+    group, port, ids, batchSize, ttl = parseParam(param)
+    return MulticastConnection(group, port, ids, batchSize, ttl)
+
+def PluginEnabled():
+    return True
+
+import collections
+PluginInfo = collections.namedtuple('PluginInfo', ['name', 'enabled', 'connect_function'])
+plugin_info = PluginInfo('Multicast', PluginEnabled, PluginConnection)
@@ -5,6 +5,7 @@ from PyQt5.QtCore import QObject
 from msgtools.lib.messaging import Messaging
 from msgtools.lib.header_translator import HeaderTranslator, HeaderHelper
 from msgtools.lib.client_connection import ClientConnection
+from msgtools.lib import batch
 
 import sys
 
@@ -13,7 +14,9 @@ class NetworkBridgeConnection(QObject):
     messagereceived = QtCore.pyqtSignal(object)
     disconnected = QtCore.pyqtSignal(object)
 
-    def __init__(self, header_class, name, bridge_name):
+    # txIds is a list of message IDs to send to the other server, and rxIds a
+    # list of IDs to receive from it.  Either can be empty for everything.
+    def __init__(self, header_class, name, bridge_name, txIds=(), rxIds=()):
         super(NetworkBridgeConnection, self).__init__(None)
         
         self.settings = QtCore.QSettings("MsgTools", "MessageServer/%s" % (name))
@@ -32,8 +35,12 @@ class NetworkBridgeConnection(QObject):
         self.status_label = QtWidgets.QLabel()
         self.rxMsgCount = 0
         self.subscriptions = {}
-        self.subMask = 0
+        for id in txIds:
+            self.subscriptions[id] = id
+        # with no IDs, send everything
+        self.subMask = ~0 if txIds else 0
         self.subValue = 0
+        self.rxIds = list(rxIds)
         self.isHardwareLink = True
         
         # if port not specified, default to last used port
@@ -145,7 +152,12 @@ class NetworkBridgeConnection(QObject):
         connectMsg.SetName(self.name)
         self.sendMsg(connectMsg.hdr)
         # send a subscription message
-        subscribeMsg = Messaging.Messages.Network.MaskedSubscription()
+        if self.rxIds:
+            subscribeMsg = Messaging.Messages.Network.SubscriptionList()
+            for i, id in enumerate(self.rxIds):
+                subscribeMsg.SetIDs(id, i)
+        else:
+            subscribeMsg = Messaging.Messages.Network.MaskedSubscription()
         self.sendMsg(subscribeMsg.hdr)
 
     def _on_disconnect(self):
@@ -154,9 +166,130 @@ class NetworkBridgeConnection(QObject):
     def _display_connect_error(self, socketError):
         self.statusUpdate.emit('Not Connected('+str(socketError)+'), '+self.network_bridge.connection.errorString())
 
+# A bridge to another msgserver that sends messages both ways packed in
+# Network.Batch messages, optionally compressed, instead of one at a time.
+# It asks the other server to batch what it sends back with a
+# Network.BatchLink message.  See msgtools/lib/batch.py.
+class BatchedBridgeConnection(NetworkBridgeConnection):
+    def __init__(self, name, bridge_name, maxBytes=batch.DEFAULT_MAX_BYTES, maxDelay=batch.DEFAULT_MAX_DELAY,
+                 compression=batch.UNCOMPRESSED, txIds=(), rxIds=()):
+        super(BatchedBridgeConnection, self).__init__(Messaging.hdr, name, bridge_name, txIds, rxIds)
+        self.maxBytes = maxBytes
+        self.compression = compression
+        self.batcher = batch.Batcher(maxBytes, compression)
+        # a batch that isn't full is sent this long after its first message
+        self.batchTimer = QtCore.QTimer(self)
+        self.batchTimer.setSingleShot(True)
+        self.batchTimer.setInterval(maxDelay)
+        self.batchTimer.timeout.connect(self.flushBatch)
+        self.batchLabel = QtWidgets.QLabel(self.batcher.statusText())
+
+    def widget(self, index):
+        if index == 4:
+            return self.batchLabel
+        return super(BatchedBridgeConnection, self).widget(index)
+
+    # Adds an encoded message to the batch.  path is the IDs of the servers
+    # that routed it before this one, for messages from another server's batch.
+    def sendBytes(self, buf, id=0, path=()):
+        for batchBuf in self.batcher.add(buf, path):
+            self.sendBatch(batchBuf)
+        if self.batcher and not self.batchTimer.isActive():
+            self.batchTimer.start()
+
+    def flushBatch(self):
+        batchBuf = self.batcher.flush()
+        if batchBuf is not None:
+            self.sendBatch(batchBuf)
+
+    def sendBatch(self, batchBuf):
+        # batches made while the bridge isn't connected are dropped
+        if self.network_bridge.isOpen():
+            self.network_bridge.sendBytesFn(batchBuf)
+        self.batchLabel.setText(self.batcher.statusText())
+
+    def stop(self):
+        self.flushBatch()
+
+    def network_bridge_rx(self, bridge_hdr):
+        # the server that sends the batches is the last one in their path
+        if bridge_hdr.GetMessageID() == Messaging.Messages.Network.Batch.ID and not self.batcher.remoteId:
+            path = batch.path(bridge_hdr.rawBuffer().raw)
+            if path:
+                self.batcher.remoteId = path[-1]
+        # the server unpacks batches, and routes each message in them
+        super(BatchedBridgeConnection, self).network_bridge_rx(bridge_hdr)
+
+    def _on_connected(self):
+        super(BatchedBridgeConnection, self)._on_connected()
+        linkMsg = Messaging.Messages.Network.BatchLink()
+        linkMsg.SetMaxBytes(self.maxBytes)
+        linkMsg.SetMaxDelay(self.batchTimer.interval())
+        linkMsg.SetCompression(self.compression)
+        linkMsg.SetServerID(batch.SERVER_ID)
+        self.sendMsg(linkMsg.hdr)
+
+    def _on_disconnect(self):
+        super(BatchedBridgeConnection, self)._on_disconnect()
+        # the server on the other end may have restarted
+        self.batcher.remoteId = 0
+
+def _msgId(text):
+    if text in Messaging.MsgIDFromName:
+        return int(Messaging.MsgIDFromName[text], 16)
+    try:
+        return int(text, 0)
+    except ValueError:
+        raise ValueError("Invalid network bridge option or message " + text)
+
+# Parses the plugin's parameter, which has the server to connect to, followed
+# by comma separated options:
+#     otherhost:5678,batch,delay=20,zlib,tx=TestCase1,tx=0x12345678,rx=Network.Note
+# batch packs messages into batches of up to 16384 bytes (batch=SIZE sets the
+# size), sent at most delay milliseconds (10 by default) after their first
+# message.  zlib or lz4 compresses the batches.  delay, zlib and lz4 imply
+# batch.  tx is the
+# name or ID of a message to send to the other server, and rx one to receive
+# from it, each given as many times as needed; without them, everything is
+# sent or received.
+def parseParam(param):
+    items = [item.strip() for item in param.split(",")] if param else [None]
+    bridgeName = items[0] if items[0] else None
+    txIds = []
+    rxIds = []
+    maxBytes = 0
+    maxDelay = None
+    compression = batch.UNCOMPRESSED
+    for item in items[1:]:
+        name, sep, value = item.partition("=")
+        if name == "batch":
+            maxBytes = int(value) if value else batch.DEFAULT_MAX_BYTES
+        elif name == "delay":
+            maxDelay = int(value)
+        elif name in batch.COMPRESSIONS:
+            compression = batch.COMPRESSIONS[name]
+            if not batch.available(compression):
+                raise ValueError("%s compression needs the %s module, which isn't installed" % (name, name))
+        elif name == "tx":
+            txIds.append(_msgId(value))
+        elif name == "rx":
+            rxIds.append(_msgId(value))
+        else:
+            raise ValueError("Invalid network bridge option " + item)
+    if len(rxIds) > Messaging.Messages.Network.SubscriptionList.GetIDs.count:
+        raise ValueError("Network bridge can receive at most %d message IDs" % Messaging.Messages.Network.SubscriptionList.GetIDs.count)
+    if (maxDelay is not None or compression != batch.UNCOMPRESSED) and not maxBytes:
+        maxBytes = batch.DEFAULT_MAX_BYTES
+    if maxDelay is None:
+        maxDelay = batch.DEFAULT_MAX_DELAY
+    return bridgeName, txIds, rxIds, maxBytes, maxDelay, compression
+
 def NetworkBridgePluginConnection(param=None):
     from NetworkHeader import NetworkHeader
-    return NetworkBridgeConnection(NetworkHeader, "NetworkBridge", param)
+    bridgeName, txIds, rxIds, maxBytes, maxDelay, compression = parseParam(param)
+    if maxBytes:
+        return BatchedBridgeConnection("NetworkBridge", bridgeName, maxBytes, maxDelay, compression, txIds, rxIds)
+    return NetworkBridgeConnection(NetworkHeader, "NetworkBridge", bridgeName, txIds, rxIds)
 
 def NetworkBridgePluginEnabled():
     return True
@@ -5,6 +5,7 @@ from PyQt5.QtSerialPort import QSerialPort
 
 from msgtools.lib.messaging import Messaging
 from msgtools.lib.header_translator import HeaderTranslator, HeaderHelper
+from msgtools.lib.framer import MessageFramer
 from msgtools.server import SerialportDialog
 
 import sys
@@ -147,35 +148,15 @@ class SerialConnection(BaseSerialConnection):
         self.hdrTranslator = HeaderTranslator(hdr, Messaging.hdr)
         self.hdrHelper = HeaderHelper(hdr, self.print_error)
 
-        self.tmpRxHdr = None
+        # the framer validates headers and bodies, and resyncs on bad data
+        self.framer = MessageFramer(hdr, self.hdrHelper)
 
     def onReadyRead(self):
-        while self.serialPort.bytesAvailable() > 0:
-            if not self.tmpRxHdr:
-                if self.serialPort.bytesAvailable() < self.hdr.SIZE:
-                    return
-                while self.serialPort.bytesAvailable() >= self.hdr.SIZE:
-                    rx_bytes = bytes(self.serialPort.peek(self.hdr.SIZE))
-                    serialHdr = self.hdr(rx_bytes)
-                    if self.hdrHelper.header_valid(serialHdr):
-                        # read now, because we only peeked before.
-                        self.tmpRxHdr = self.hdr(self.serialPort.read(self.hdr.SIZE))
-                        break
-                    else:
-                        throwAway = self.serialPort.read(1)
-
-            if self.tmpRxHdr != None:
-                bodylen = self.tmpRxHdr.GetDataLength()
-                if self.serialPort.bytesAvailable() >= bodylen:
-                    # allocate the serial message body, read from the serial port
-                    msgBody = self.serialPort.read(bodylen)
-                    
-                    if self.hdrHelper.body_valid(self.tmpRxHdr, msgBody):
-                        self.rxMsgCount+=1
-                        self.SerialMsgSlot(self.tmpRxHdr, msgBody)
-                    self.tmpRxHdr = None
-                else:
-                    break
+        # read everything that's available, and handle each valid message in it
+        self.framer.feed(self.serialPort.readAll().data())
+        for msg_bytes in self.framer.messages():
+            self.rxMsgCount+=1
+            self.SerialMsgSlot(self.hdr(msg_bytes[:self.hdr.SIZE]), msg_bytes[self.hdr.SIZE:])
 
     def SerialMsgSlot(self, serialHdr, body):
         networkMsg = self.hdrTranslator.translateHdrAndBody(serialHdr, body)
@@ -0,0 +1,270 @@
+import os
+import time
+
+from PyQt5 import QtCore, QtWidgets, QtNetwork
+from PyQt5.QtCore import QObject
+
+from msgtools.lib.messaging import Messaging
+from msgtools.lib.framer import MessageFramer
+from msgtools.lib import shm_ring
+from msgtools.lib.shm_ring import ShmRing, ShmEndpoint
+from msgtools.server.outbound_queue import OutboundQueue
+
+# A client on the same host, connected through a pair of shared memory rings.
+# See msgtools/lib/shm_ring.py for how the rings and wakeups work.
+class SharedMemoryClientConnection(QObject):
+    disconnected = QtCore.pyqtSignal(object)
+    messagereceived = QtCore.pyqtSignal(object)
+    statusUpdate = QtCore.pyqtSignal(str)
+
+    # queued messages are joined into writes of about this many bytes
+    WRITE_SIZE = 64*1024
+    # how long the block policy waits for the client to drain the queue
+    BLOCK_TIMEOUT = 1.0
+
+    def __init__(self, localSocket, ringPrefix):
+        super(SharedMemoryClientConnection, self).__init__(None)
+
+        self.removeClient = QtWidgets.QPushButton("Remove")
+        self.removeClient.pressed.connect(lambda: self.localSocket.close())
+        self.statusLabel = QtWidgets.QLabel()
+        self.subscriptions = {}
+        self.subMask = ~0
+        self.subValue = 0
+        self.isHardwareLink = False
+
+        # the rings are created before the socket is hooked up, so if that fails
+        # the caller can drop the socket without anything else to clean up
+        rxRing = ShmRing(ringPrefix + "-c2s", create=True)
+        try:
+            txRing = ShmRing(ringPrefix + "-s2c", create=True)
+        except:
+            rxRing.close()
+            os.unlink(rxRing.path)
+            raise
+        self.endpoint = ShmEndpoint(rxRing, txRing)
+        # messages aren't passed until the client has mapped the rings
+        self.connected = False
+        self.handshake = b''
+
+        self.localSocket = localSocket
+        self.localSocket.readyRead.connect(self.onReadyRead)
+        self.localSocket.disconnected.connect(self.onDisconnected)
+        self.localSocket.write(b"%s %s %s\n" % (shm_ring.HANDSHAKE, rxRing.path.encode(), txRing.path.encode()))
+
+        self.framer = MessageFramer(Messaging.hdr)
+
+        self.outboundQueue = OutboundQueue()
+        # set when the block policy gave up waiting for the client
+        self.blockTimedOut = False
+        # single shot timer to write out the queue when control returns to the event loop
+        self.flushTimer = QtCore.QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.setInterval(0)
+        self.flushTimer.timeout.connect(self.flush)
+        # single shot timer to keep reading a ring that the client keeps filling,
+        # after giving other connections a turn
+        self.readTimer = QtCore.QTimer(self)
+        self.readTimer.setSingleShot(True)
+        self.readTimer.setInterval(0)
+        self.readTimer.timeout.connect(self.readRing)
+        # sends wakeups that were missed
+        self.pollTimer = QtCore.QTimer(self)
+        self.pollTimer.setInterval(int(shm_ring.POLL_INTERVAL*1000))
+        self.pollTimer.timeout.connect(self.onPoll)
+        self.policyComboBox = QtWidgets.QComboBox()
+        self.policyComboBox.addItems(OutboundQueue.POLICIES)
+        self.policyComboBox.setCurrentText(self.outboundQueue.policy)
+        self.policyComboBox.currentTextChanged.connect(self.setQueuePolicy)
+        self.queueLabel = QtWidgets.QLabel(self.outboundQueue.statusText())
+
+        self.name = "Shared Memory Client"
+        self.hostLabel = QtWidgets.QLabel("shared memory")
+        self.statusLabel.setText(self.name)
+
+    def widget(self, index):
+        if index == 0:
+            return self.removeClient
+        if index == 1:
+            return self.statusLabel
+        if index == 2:
+            return self.hostLabel
+        if index == 3:
+            return self.policyComboBox
+        if index == 4:
+            return self.queueLabel
+        return None
+
+    def setQueuePolicy(self, policy):
+        self.outboundQueue.policy = policy
+
+    def updateQueueStatus(self):
+        self.queueLabel.setText(self.outboundQueue.statusText())
+
+    def _unlinkRings(self):
+        for ring in (self.endpoint.rxRing, self.endpoint.txRing):
+            try:
+                os.unlink(ring.path)
+            except FileNotFoundError:
+                pass
+
+    # The socket carries the client's reply to the handshake, and after that
+    # only wakeups, which say to check the rings.
+    def onReadyRead(self):
+        data = self.localSocket.readAll()
+        if not self.connected:
+            self.handshake += data.data()
+            if not b'\n' in self.handshake:
+                return
+            self._unlinkRings()
+            if self.handshake.split(b'\n', 1)[0] != b'OK':
+                self.statusUpdate.emit("Bad shared memory handshake from client, disconnecting")
+                self.localSocket.abort()
+                return
+            self.connected = True
+            self.pollTimer.start()
+        self.readRing()
+        if self.endpoint.pending():
+            # the client made room for what didn't fit
+            self.flush()
+
+    # Picks up anything a missed wakeup left behind.  Between them, readRing()
+    # and flush() wake the client if it's waiting for room to send, and this
+    # wakes it if it's waiting for data that's already in its ring.
+    def onPoll(self):
+        self.readRing()
+        if self.outboundQueue or self.endpoint.pending():
+            self.flush()
+        txRing = self.endpoint.txRing
+        if txRing.unread() and txRing.takeConsumerWaiting():
+            self._wake()
+
+    def _wake(self):
+        self.localSocket.write(b'\x01')
+
+    def readRing(self):
+        if not self.connected:
+            return
+        endpoint = self.endpoint
+        if endpoint.receive(self.framer):
+            self._wake()
+        for msg_bytes in self.framer.messages():
+            self.messagereceived.emit(Messaging.hdr(msg_bytes))
+        # ask for a wakeup when the client sends again, or if it already has,
+        # read more after the event loop runs
+        if not endpoint.prepareToWait():
+            self.readTimer.start()
+
+    def onDisconnected(self):
+        if self.connected:
+            self.connected = False
+        else:
+            # the client never got as far as replying to the handshake
+            self._unlinkRings()
+        self.flushTimer.stop()
+        self.readTimer.stop()
+        self.pollTimer.stop()
+        self.endpoint.close()
+        self.disconnected.emit(self)
+
+    def sendMsg(self, msg):
+        self.sendBytes(msg.rawBuffer().raw, msg.GetMessageID())
+
+    # Sends a message that's already encoded as bytes.  Like TCP clients,
+    # messages are queued, and written into the ring together when control
+    # returns to the event loop.
+    def sendBytes(self, buf, id=0):
+        queue = self.outboundQueue
+        if queue.policy == OutboundQueue.BLOCK and queue.full() and not self.blockTimedOut:
+            # after a wait times out, the queue's policy drops new messages
+            # without waiting again until the client makes room in the ring,
+            # so a client that stopped reading can't hold up routing to
+            # everyone else
+            self.blockTimedOut = not self.waitForQueueSpace()
+        queue.put(id, buf)
+        if not self.flushTimer.isActive():
+            self.flushTimer.start()
+
+    # Moves as much of the queue into the ring as fits.  Whatever doesn't fit
+    # stays in the queue, where its policy applies, until the client makes room
+    # and wakes us up.
+    def flush(self):
+        self.flushTimer.stop()
+        if not self.connected:
+            return
+        endpoint = self.endpoint
+        queue = self.outboundQueue
+        wake = endpoint.flush() if endpoint.pending() else False
+        while queue and not endpoint.pending():
+            wake = endpoint.send(b''.join(queue.take(self.WRITE_SIZE))) or wake
+        if not endpoint.pending():
+            # everything fit, so the client has been reading
+            self.blockTimedOut = False
+        if wake:
+            self._wake()
+
+    # For the block policy, writes out the queue and waits for the client to
+    # read it, so the sender is slowed to the client's pace.
+    # Returns False if the client didn't make room before BLOCK_TIMEOUT.
+    def waitForQueueSpace(self):
+        deadline = time.monotonic() + self.BLOCK_TIMEOUT
+        while self.outboundQueue.full() and self.connected:
+            self.flush()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # wait for the client's wakeup, checking the ring in case it was missed
+            if not self.localSocket.waitForReadyRead(int(min(remaining, shm_ring.POLL_INTERVAL)*1000)):
+                self.flush()
+        return True
+
+# Listens on a unix socket for clients on the same host that want to connect
+# through shared memory.
+class SharedMemoryServer(QObject):
+    statusUpdate = QtCore.pyqtSignal(str)
+    newConnection = QtCore.pyqtSignal(object)
+
+    def __init__(self, socketName=None):
+        super(SharedMemoryServer, self).__init__(None)
+
+        self.socketName = socketName if socketName else shm_ring.DEFAULT_SOCKET
+        self.name = "Shared Memory Server"
+        self.connectionCount = 0
+        self.localServer = QtNetwork.QLocalServer()
+        self.localServer.setSocketOptions(QtNetwork.QLocalServer.UserAccessOption)
+        self.localServer.newConnection.connect(self.onNewLocalConnection)
+
+    def start(self):
+        # a server that didn't shut down cleanly leaves its socket behind
+        QtNetwork.QLocalServer.removeServer(self.socketName)
+        if not self.localServer.listen(self.socketName):
+            self.statusUpdate.emit("Can't listen for shared memory clients on %s: %s" % (self.socketName, self.localServer.errorString()))
+        else:
+            self.statusUpdate.emit("Listening for shared memory clients on " + self.socketName)
+
+    def stop(self):
+        self.localServer.close()
+
+    def onNewLocalConnection(self):
+        while self.localServer.hasPendingConnections():
+            localSocket = self.localServer.nextPendingConnection()
+            self.connectionCount += 1
+            ringPrefix = os.path.join(shm_ring.SHM_DIR, "msgtools-%d-%d" % (os.getpid(), self.connectionCount))
+            try:
+                connection = SharedMemoryClientConnection(localSocket, ringPrefix)
+            except OSError as e:
+                self.statusUpdate.emit("Can't create shared memory for client: " + str(e))
+                localSocket.abort()
+                continue
+            connection.statusUpdate.connect(self.statusUpdate)
+            self.newConnection.emit(connection)
+
+def PluginConnection(param=None):
+    return SharedMemoryServer(param)
+
+def PluginEnabled():
+    return shm_ring.supported()
+
+import collections
+PluginInfo = collections.namedtuple('PluginInfo', ['name', 'enabled', 'connect_function'])
+plugin_info = PluginInfo('Shared Memory', PluginEnabled, PluginConnection)
@@ -1,13 +1,26 @@
+import time
+
 from PyQt5 import QtCore, QtGui, QtWidgets, QtNetwork
 from PyQt5.QtCore import QObject
 
 from msgtools.lib.messaging import Messaging
+from msgtools.lib.framer import MessageFramer
+from msgtools.lib import batch
+from msgtools.server.outbound_queue import OutboundQueue
 
 class TcpClientConnection(QObject):
     disconnected = QtCore.pyqtSignal(object)
     messagereceived = QtCore.pyqtSignal(object)
     statusUpdate = QtCore.pyqtSignal(str)
 
+    # queued messages are joined into writes of about this many bytes
+    WRITE_SIZE = 64*1024
+    # stop writing while the socket has this many bytes it hasn't sent yet,
+    # so the backlog of a slow client stays in the queue, where its policy applies
+    MAX_UNSENT = 256*1024
+    # how long the block policy waits for the client to drain the queue
+    BLOCK_TIMEOUT = 1.0
+
     def __init__(self, tcpSocket):
         super(TcpClientConnection, self).__init__(None)
 
@@ -22,8 +35,27 @@ class TcpClientConnection(QObject):
         self.tcpSocket = tcpSocket
         self.tcpSocket.readyRead.connect(self.onReadyRead)
         self.tcpSocket.disconnected.connect(self.onDisconnected)
-
-        self.rxBuffer = bytearray()
+        self.tcpSocket.bytesWritten.connect(self.onBytesWritten)
+
+        self.framer = MessageFramer(Messaging.hdr)
+
+        self.outboundQueue = OutboundQueue()
+        # set when the block policy gave up waiting for the client
+        self.blockTimedOut = False
+        # single shot timer to write out the queue when control returns to the event loop
+        self.flushTimer = QtCore.QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.setInterval(0)
+        self.flushTimer.timeout.connect(self.flush)
+        self.policyComboBox = QtWidgets.QComboBox()
+        self.policyComboBox.addItems(OutboundQueue.POLICIES)
+        self.policyComboBox.setCurrentText(self.outboundQueue.policy)
+        self.policyComboBox.currentTextChanged.connect(self.setQueuePolicy)
+        self.queueLabel = QtWidgets.QLabel(self.outboundQueue.statusText())
+
+        # packs messages into Network.Batch messages, when a bridge asks for it
+        self.batcher = None
+        self.batchTimer = None
 
         self.name = "TCP Client"
         self.hostLabel = QtWidgets.QLabel(self.tcpSocket.peerAddress().toString().replace("::ffff:",""))
@@ -36,44 +68,110 @@ class TcpClientConnection(QObject):
             return self.statusLabel
         if index == 2:
             return self.hostLabel
+        if index == 3:
+            return self.policyComboBox
+        if index == 4:
+            return self.queueLabel
         return None
+
+    def setQueuePolicy(self, policy):
+        self.outboundQueue.policy = policy
+
+    def updateQueueStatus(self):
+        text = self.outboundQueue.statusText()
+        if self.batcher is not None:
+            text += ", " + self.batcher.statusText()
+        self.queueLabel.setText(text)
+
+    # Sends messages in batches of up to maxBytes, each sent at most maxDelay
+    # milliseconds after its first message was added, for a bridge from
+    # another server, whose ID is remoteId.  The outbound queue then holds
+    # whole batches, so its policy drops whole batches.
+    def setBatching(self, maxBytes, maxDelay, compression, remoteId=0):
+        self.flushBatch()
+        self.batcher = batch.Batcher(maxBytes, compression, remoteId)
+        if self.batchTimer is None:
+            self.batchTimer = QtCore.QTimer(self)
+            self.batchTimer.setSingleShot(True)
+            self.batchTimer.timeout.connect(self.flushBatch)
+        self.batchTimer.setInterval(maxDelay)
             
     def onReadyRead(self):
-        inputStream = QtCore.QDataStream(self.tcpSocket)
-
-        while(1):
-            if len(self.rxBuffer) < Messaging.hdrSize:
-                if self.tcpSocket.bytesAvailable() < Messaging.hdrSize:
-                    return
-                self.rxBuffer += inputStream.readRawData(Messaging.hdrSize - len(self.rxBuffer))
-
-            if len(self.rxBuffer) >= Messaging.hdrSize:
-                hdr = Messaging.hdr(self.rxBuffer)
-                bodyLen = hdr.GetDataLength()
-                if len(self.rxBuffer)+self.tcpSocket.bytesAvailable() < Messaging.hdrSize + bodyLen:
-                    return
-
-                self.rxBuffer += inputStream.readRawData(Messaging.hdrSize + bodyLen - len(self.rxBuffer))
-
-                # create a new header object with the appended body
-                hdr = Messaging.hdr(self.rxBuffer)
-
-                # if we got this far, we have a whole message! So, emit the signal
-                self.messagereceived.emit(hdr)
-
-                # then clear the buffer, so we start over on the next message
-                self.rxBuffer = bytearray()
+        # read everything that's available, and emit each whole message in it
+        self.framer.feed(self.tcpSocket.readAll().data())
+        for msg_bytes in self.framer.messages():
+            self.messagereceived.emit(Messaging.hdr(msg_bytes))
 
     def onDisconnected(self):
         self.disconnected.emit(self)
 
     def sendMsg(self, msg):
-        buf = msg.rawBuffer().raw
-        while len(buf) > 0:
-            bytesWritten = self.tcpSocket.write(buf)
-            if bytesWritten == -1:
-                raise Exception('Write error (-1)')
-            buf = buf[bytesWritten:]
+        self.sendBytes(msg.rawBuffer().raw, msg.GetMessageID())
+
+    # Sends a message that's already encoded as bytes.  The server encodes each
+    # message it routes once, and passes the same bytes to every client.
+    # The message is queued, and everything queued while the server handles
+    # the current batch of input is written together when control returns to
+    # the event loop.
+    # When batching, path is the IDs of the servers that routed the message
+    # before this one, for messages that came from another server's batch.
+    def sendBytes(self, buf, id=0, path=()):
+        batcher = self.batcher
+        if batcher is not None:
+            for batchBuf in batcher.add(buf, path):
+                self.queueBytes(batchBuf, Messaging.Messages.Network.Batch.ID)
+            if batcher and not self.batchTimer.isActive():
+                self.batchTimer.start()
+            return
+        self.queueBytes(buf, id)
+
+    def queueBytes(self, buf, id):
+        queue = self.outboundQueue
+        if queue.policy == OutboundQueue.BLOCK and queue.full() and not self.blockTimedOut:
+            # after a wait times out, the queue's policy drops new messages
+            # without waiting again until the client takes more data, so a
+            # client that stopped reading can't hold up routing to everyone else
+            self.blockTimedOut = not self.waitForQueueSpace()
+        queue.put(id, buf)
+        if not self.flushTimer.isActive():
+            self.flushTimer.start()
+
+    # Queues the batch that isn't full yet, when its time is up.
+    def flushBatch(self):
+        if self.batcher is not None:
+            batchBuf = self.batcher.flush()
+            if batchBuf is not None:
+                self.queueBytes(batchBuf, Messaging.Messages.Network.Batch.ID)
+
+    def flush(self):
+        self.flushTimer.stop()
+        queue = self.outboundQueue
+        while queue and self.tcpSocket.bytesToWrite() < self.MAX_UNSENT:
+            buf = b''.join(queue.take(self.WRITE_SIZE))
+            while len(buf) > 0:
+                bytesWritten = self.tcpSocket.write(buf)
+                if bytesWritten == -1:
+                    self.statusUpdate.emit("Write error (-1) sending to " + self.name + ", dropping its queue")
+                    queue.clear()
+                    return
+                buf = buf[bytesWritten:]
+
+    def onBytesWritten(self, count):
+        self.blockTimedOut = False
+        if self.outboundQueue and not self.flushTimer.isActive():
+            self.flush()
+
+    # For the block policy, writes out the queue and waits for the client to
+    # read it, so the sender is slowed to the client's pace.
+    # Returns False if the client didn't make room before BLOCK_TIMEOUT.
+    def waitForQueueSpace(self):
+        deadline = time.monotonic() + self.BLOCK_TIMEOUT
+        while self.outboundQueue.full():
+            self.flush()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.tcpSocket.waitForBytesWritten(int(remaining*1000)):
+                return False
+        return True
     
 class TcpServer(QObject):
     statusUpdate = QtCore.pyqtSignal(str)
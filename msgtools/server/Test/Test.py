@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 import unittest
 import struct
+import time
 
 from msgtools.lib.messaging import Messaging as M
 from msgtools.lib.message import Message as Msg
 from msgtools.server.CanPlugin import CanFragmentation
+from msgtools.server.router import RoutingTable
+from msgtools.server.outbound_queue import OutboundQueue
+from msgtools.server.metrics import Metrics
+from msgtools.server import MulticastPlugin
+from msgtools.server import NetworkBridgePlugin
+from msgtools.server import rate_limit
+from msgtools.server.content_filter import ContentFilters, parseFilter, compileFilter
 
 M.LoadAllMessages()
 
@@ -73,6 +81,300 @@ class TestClass(unittest.TestCase):
                 self.assertEqual(0, 1)
             
 
+    def test_routing_table(self):
+        class FakeClient:
+            def __init__(self, subscriptions={}, subMask=~0, subValue=0, isHardwareLink=False):
+                self.subscriptions = dict(subscriptions)
+                self.subMask = subMask
+                self.subValue = subValue
+                self.isHardwareLink = isHardwareLink
+        everything = FakeClient(subMask=0)
+        listed = FakeClient(subscriptions={5:5})
+        masked = FakeClient(subMask=0xF0, subValue=0x10)
+        hardware = FakeClient(subMask=0, isHardwareLink=True)
+        idle = FakeClient()
+        # clients that can send encoded bytes get their sendBytes function routed too
+        sent = []
+        everything.sendBytes = sent.append
+        clients = {c:c for c in [everything, listed, masked, hardware, idle]}
+        private = {}
+        table = RoutingTable(clients, private)
+        def destinations(id):
+            return tuple(client for client, sendBytes, accept, limiter in table.destinations(id))
+        self.assertEqual((everything, listed, hardware), destinations(5))
+        self.assertEqual((everything, masked, hardware), destinations(0x15))
+        self.assertEqual((everything, hardware), destinations(0x25))
+        self.assertIs(table.destinations(5), table.destinations(5))
+        self.assertEqual([(everything, sent.append, None, None), (listed, None, None, None), (hardware, None, None, None)], list(table.destinations(5)))
+        # private messages only go to clients that asked for them, and hardware links
+        private[5] = [listed]
+        table.invalidate()
+        self.assertEqual((listed, hardware), destinations(5))
+        # subscription and connection changes take effect after invalidating
+        idle.subscriptions[0x25] = 0x25
+        table.invalidate()
+        self.assertEqual((everything, hardware, idle), destinations(0x25))
+        del clients[listed]
+        table.removeClient(listed)
+        self.assertEqual([], private[5])
+        self.assertEqual((hardware,), destinations(5))
+        # rate limited subscriptions add to the others, with a limiter for each ID
+        limits = rate_limit.RateLimits()
+        limits.update(0xF0, 0x20, rate_limit.EVERY_NTH, decimation=3)
+        table = RoutingTable(clients, private, {idle: limits})
+        self.assertEqual((everything, hardware, idle), destinations(0x26))
+        limiter = table.destinations(0x26)[-1][3]
+        self.assertIsInstance(limiter, rate_limit.EveryNth)
+        self.assertIsNot(limiter, table.destinations(0x25)[-1][3])
+        # and limit messages the client was already subscribed to
+        self.assertIsNotNone(table.destinations(0x25)[-1][3])
+        table.removeClient(idle)
+        self.assertEqual((everything, hardware, idle), destinations(0x25))
+        self.assertIsNone(table.destinations(0x25)[-1][3])
+        # filtered subscriptions add to the others, with a predicate for each ID
+        filters = ContentFilters()
+        filters.update(0xFFFFFFFF, 0x30, "hdr.Source == 3")
+        table = RoutingTable(clients, private, {}, {masked: filters})
+        self.assertEqual((everything, masked, hardware), destinations(0x30))
+        accept = table.destinations(0x30)[1][2]
+        hdr = M.hdr()
+        hdr.SetMessageID(0x30)
+        self.assertFalse(accept(hdr.rawBuffer()))
+        hdr.SetSource(3)
+        self.assertTrue(accept(hdr.rawBuffer()))
+
+    def test_outbound_queue(self):
+        def fill(policy):
+            # room for four 10 byte messages
+            q = OutboundQueue(highWaterMark=40, policy=policy)
+            for i in range(6):
+                q.put(i % 3, bytes([i])*10)
+            return q
+        def contents(q):
+            return [p[0] for p in q.take(1000)]
+        q = fill(OutboundQueue.DROP_OLDEST)
+        self.assertEqual((4, 40, 2), (len(q), q.queuedBytes, q.droppedMsgs))
+        self.assertEqual([2,3,4,5], contents(q))
+        q = fill(OutboundQueue.DROP_NEWEST)
+        self.assertEqual([0,1,2,3], contents(q))
+        self.assertEqual(2, q.droppedMsgs)
+        # the block policy only drops when the connection gave up waiting for space
+        q = fill(OutboundQueue.BLOCK)
+        self.assertEqual([0,1,2,3], contents(q))
+        # IDs 1 and 2 were replaced in place by messages 4 and 5
+        q = fill(OutboundQueue.LATEST_PER_ID)
+        self.assertEqual([0,4,5,3], contents(q))
+        self.assertEqual(2, q.droppedMsgs)
+        # with no queued message of the same ID, the oldest is dropped
+        q = fill(OutboundQueue.LATEST_PER_ID)
+        q.put(7, b'\x07'*10)
+        self.assertEqual([4,5,3,7], contents(q))
+        # take() coalesces messages up to the requested size
+        q = OutboundQueue(highWaterMark=1000)
+        for i in range(10):
+            q.put(i, bytes([i])*10)
+        self.assertEqual(3, len(q.take(25)))
+        self.assertEqual(7, len(q))
+        self.assertEqual(70, q.queuedBytes)
+        self.assertEqual(3, q.sentMsgs)
+        # with fit, it stops short of going past the size, but takes at least one message
+        self.assertEqual(2, len(q.take(25, fit=True)))
+        self.assertEqual(1, len(q.take(5, fit=True)))
+        # a message bigger than the high-water mark still goes on an empty queue
+        q = OutboundQueue(highWaterMark=5)
+        self.assertTrue(q.put(1, b'x'*10))
+        self.assertTrue(q.full())
+        self.assertRaises(ValueError, OutboundQueue, 10, 'drop-everything')
+
+    def test_metrics(self):
+        class FakeClient:
+            def __init__(self, name):
+                self.name = name
+        metrics = Metrics()
+        plugin = FakeClient('A "plugin"')
+        tcp = FakeClient("tcp")
+        tcp.outboundQueue = OutboundQueue()
+        for client in [plugin, tcp]:
+            metrics.addClient(client)
+        id = M.Messages.TestCase1.ID
+        t = time.monotonic()
+        metrics.sample(t)
+        # ten seconds of 100 msgs/s, of 50 bytes each
+        for i in range(10):
+            counter = metrics.message(id)
+            counter.msgs += 100
+            counter.bytes += 5000
+            counter.seconds += 100 * 2e-6
+            metrics.clients[plugin].rx.msgs += 100
+            tcp.outboundQueue.put(id, b'x'*50)
+            tcp.outboundQueue.take(1000)
+            t += 1
+            metrics.sample(t)
+        counter = metrics.message(id)
+        self.assertAlmostEqual(100, counter.msgRate, delta=15)
+        self.assertAlmostEqual(5000, counter.byteRate, delta=750)
+        self.assertAlmostEqual(2e-6, counter.secondsPerMsg)
+        self.assertAlmostEqual(1, metrics.clients[tcp].tx.msgRate, delta=0.15)
+        self.assertEqual(500, metrics.clients[tcp].tx.bytes)
+        # rates of idle messages fall to zero
+        for i in range(60):
+            t += 1
+            metrics.sample(t)
+        self.assertEqual(0, counter.msgRate)
+        self.assertEqual(1000, counter.msgs)
+        text = metrics.prometheusText()
+        self.assertIn('msgserver_messages_total{id="%s",name="TestCase1"} 1000\n' % hex(id), text)
+        self.assertIn('msgserver_client_received_messages_total{client="A \\"plugin\\""} 1000\n', text)
+        self.assertIn('msgserver_client_sent_bytes_total{client="tcp"} 500\n', text)
+        self.assertIn('msgserver_client_dropped_messages_total{client="tcp"} 0\n', text)
+        self.assertNotIn('client_dropped_messages_total{client="A', text)
+        metrics.removeClient(plugin)
+        self.assertNotIn('plugin', metrics.prometheusText())
+
+    def test_rate_limit(self):
+        limiter = rate_limit.EveryNth(3)
+        self.assertEqual([True, False, False, True, False, False, True], [limiter.offer(i, 0) for i in range(7)])
+        limiter = rate_limit.KeepLatest(10)
+        self.assertTrue(limiter.offer(1, 0.0))
+        # too soon, so the latest is held
+        self.assertFalse(limiter.offer(2, 0.02))
+        self.assertFalse(limiter.offer(3, 0.05))
+        self.assertFalse(limiter.due(0.09))
+        self.assertTrue(limiter.due(0.1))
+        self.assertEqual(3, limiter.take(0.101))
+        self.assertIsNone(limiter.held)
+        # a steady stream stays in step
+        self.assertFalse(limiter.offer(4, 0.15))
+        self.assertTrue(limiter.offer(5, 0.2))
+        self.assertIsNone(limiter.held)
+        self.assertAlmostEqual(0.3, limiter.nextTime)
+        # time spent idle isn't made up for
+        self.assertTrue(limiter.offer(6, 5.0))
+        self.assertFalse(limiter.offer(7, 5.01))
+        limits = rate_limit.RateLimits()
+        limits.update(0xFFFFFFFF, 5, rate_limit.KEEP_LATEST, maxRate=30)
+        limits.update(0xF0, 0x10, rate_limit.EVERY_NTH, decimation=10)
+        self.assertEqual(2, len(limits))
+        self.assertTrue(limits.matches(0x15))
+        self.assertFalse(limits.matches(0x25))
+        self.assertIsInstance(limits.limiter(5), rate_limit.KeepLatest)
+        self.assertIsInstance(limits.limiter(0x15), rate_limit.EveryNth)
+        self.assertIs(limits.limiter(0x15), limits.limiter(0x15))
+        self.assertIsNot(limits.limiter(0x15), limits.limiter(0x16))
+        # replacing a subscription replaces its limiters, and no limit means no limiter
+        limits.update(0xF0, 0x10, rate_limit.EVERY_NTH, decimation=1)
+        self.assertEqual(2, len(limits))
+        self.assertTrue(limits.matches(0x15))
+        self.assertIsNone(limits.limiter(0x15))
+        limits.update(0xF0, 0x10, rate_limit.REMOVE)
+        self.assertEqual(1, len(limits))
+        self.assertFalse(limits.matches(0x15))
+        self.assertRaises(ValueError, limits.update, 0, 0, 3)
+        self.assertEqual("id & 0xffffffff == 0x5 at 30 Hz", limits.description())
+
+    def test_content_filter(self):
+        msg = M.Messages.TestCase1()
+        msg.SetFieldB(7)
+        msg.SetFieldC(9, 2)
+        msg.SetBitsB("OptionB")
+        msg.SetFieldF(10)
+        msg.hdr.SetSource(3)
+        def matches(text, buf=msg.rawBuffer()):
+            return compileFilter(parseFilter(text), M.Messages.TestCase1)(buf)
+        self.assertTrue(matches("FieldB == 7"))
+        self.assertTrue(matches("FieldB >= 0x7 and FieldB < 7.5"))
+        self.assertFalse(matches("FieldB != 7"))
+        self.assertTrue(matches("FieldB > 7 or hdr.Source == 3"))
+        self.assertTrue(matches("not (FieldB > 7 or hdr.Source == 4)"))
+        self.assertTrue(matches("FieldC[2] == 9 and FieldC[1] == 3"))
+        # bitfields, enums and scaled fields go through their get functions
+        self.assertTrue(matches("BitsB == OptionB and not BitsB == OptionA"))
+        self.assertTrue(matches("FieldF > 9.9 and FieldF < 10"))
+        self.assertTrue(matches("hdr.DataLength == 72"))
+        # fields the message doesn't have, or that are past its end, don't match
+        self.assertFalse(matches("Nonexistent == 0"))
+        self.assertFalse(matches("FieldC[5] == 3"))
+        self.assertFalse(matches("BitsB == NotAnOption"))
+        self.assertFalse(matches("FieldB == 7", msg.rawBuffer().raw[:M.hdrSize+4]))
+        self.assertFalse(compileFilter(parseFilter("FieldB == 7"), None)(msg.rawBuffer()))
+        for text in ["FieldB ==", "FieldB 7", "(FieldB == 7", "FieldB == 7 7", "FieldC[-1] == 3", "FieldB == 'x'"]:
+            self.assertRaises(ValueError, parseFilter, text)
+        filters = ContentFilters()
+        filters.update(0xFFFFFFFF, msg.ID, "FieldB == 6")
+        filters.update(0xFF00, 0, "hdr.Source == 3")
+        self.assertEqual(2, len(filters))
+        self.assertTrue(filters.matches(msg.ID))
+        self.assertFalse(filters.matches(0x100))
+        # any subscription that matches the ID can accept the message
+        self.assertTrue(filters.predicate(msg.ID)(msg.rawBuffer()))
+        filters.update(0xFF00, 0, "")
+        self.assertEqual(1, len(filters))
+        self.assertFalse(filters.predicate(msg.ID)(msg.rawBuffer()))
+        self.assertRaises(ValueError, filters.update, 0xFF00, 0, "FieldB")
+        self.assertEqual("id & 0xffffffff == 0x7b where FieldB == 6", filters.description())
+
+    def test_multicast_param(self):
+        self.assertEqual(("239.255.77.77", 5690, [], 0, 1), MulticastPlugin.parseParam(None))
+        self.assertEqual(("239.1.2.3", 6000, [M.Messages.TestCase1.ID, 0x1234], 1472, 2),
+            MulticastPlugin.parseParam("239.1.2.3:6000, batch, ttl=2, TestCase1, 0x1234"))
+        self.assertEqual(512, MulticastPlugin.parseParam(":6000,batch=512")[3])
+        self.assertRaises(ValueError, MulticastPlugin.parseParam, ":6000,NotAMessage")
+
+    def test_network_bridge_param(self):
+        from msgtools.lib import batch
+        self.assertEqual((None, [], [], 0, 10, batch.UNCOMPRESSED), NetworkBridgePlugin.parseParam(None))
+        self.assertEqual(("otherhost:5678", [], [], 0, 10, batch.UNCOMPRESSED), NetworkBridgePlugin.parseParam("otherhost:5678"))
+        self.assertEqual(("otherhost:5678", [M.Messages.TestCase1.ID, 0x1234], [M.Messages.Network.Note.ID], 4096, 20, batch.ZLIB),
+            NetworkBridgePlugin.parseParam("otherhost:5678, batch=4096, delay=20, zlib, tx=TestCase1, tx=0x1234, rx=Network.Note"))
+        # compression or a delay means batches of the default size
+        self.assertEqual(16384, NetworkBridgePlugin.parseParam("otherhost:5678,zlib")[3])
+        self.assertEqual(16384, NetworkBridgePlugin.parseParam("otherhost:5678,delay=5")[3])
+        self.assertRaises(ValueError, NetworkBridgePlugin.parseParam, "otherhost:5678,tx=NotAMessage")
+        self.assertRaises(ValueError, NetworkBridgePlugin.parseParam, "otherhost:5678,fast")
+        self.assertRaises(ValueError, NetworkBridgePlugin.parseParam, "otherhost:5678," + ",".join("rx=%d" % id for id in range(1, 18)))
+
+    def test_block_policy_stalled_client(self):
+        from PyQt5 import QtNetwork, QtWidgets
+        from msgtools.server.TcpServer import TcpClientConnection
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+        listener = QtNetwork.QTcpServer()
+        self.assertTrue(listener.listen(QtNetwork.QHostAddress.LocalHost, 0))
+        def connect():
+            # the client end never reads, so its connection backs up
+            client = QtNetwork.QTcpSocket()
+            client.setSocketOption(QtNetwork.QAbstractSocket.ReceiveBufferSizeSocketOption, 4096)
+            client.connectToHost(QtNetwork.QHostAddress.LocalHost, listener.serverPort())
+            self.assertTrue(client.waitForConnected(1000))
+            self.assertTrue(listener.waitForNewConnection(1000))
+            return client, TcpClientConnection(listener.nextPendingConnection())
+        stalledClient, stalled = connect()
+        otherClient, other = connect()
+        stalled.BLOCK_TIMEOUT = 0.2
+        stalled.outboundQueue = OutboundQueue(highWaterMark=16*1024, policy=OutboundQueue.BLOCK)
+        other.outboundQueue = OutboundQueue(highWaterMark=64*1024*1024)
+        buf = bytes(1024)
+        count = 20000
+        start = time.monotonic()
+        for i in range(count):
+            stalled.sendBytes(buf, 1)
+            other.sendBytes(buf, 1)
+        elapsed = time.monotonic() - start
+        # only the first full queue waits, everything after that is dropped
+        self.assertLess(elapsed, 3*stalled.BLOCK_TIMEOUT)
+        self.assertTrue(stalled.blockTimedOut)
+        self.assertGreater(stalled.outboundQueue.droppedMsgs, 0)
+        self.assertEqual(0, other.outboundQueue.droppedMsgs)
+        self.assertEqual(count, len(other.outboundQueue) + other.outboundQueue.sentMsgs)
+        # once the client reads again, the connection goes back to waiting
+        deadline = time.monotonic() + 5
+        while stalled.blockTimedOut and time.monotonic() < deadline:
+            stalledClient.waitForReadyRead(10)
+            stalledClient.readAll()
+            app.processEvents()
+        self.assertFalse(stalled.blockTimedOut)
+        for c in (stalledClient, otherClient):
+            c.abort()
+        listener.close()
 
 def main(args=None):
     unittest.main()
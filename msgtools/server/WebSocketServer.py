@@ -4,11 +4,18 @@ from PyQt5.QtWebSockets import QWebSocket
 from PyQt5.QtWebSockets import QWebSocketServer
 
 from msgtools.lib.messaging import Messaging
+from msgtools.lib.framer import MessageFramer
+from msgtools.lib import batch
+from msgtools.server.outbound_queue import OutboundQueue
 
 class WebSocketClientConnection(QObject):
     disconnected = QtCore.pyqtSignal(object)
     messagereceived = QtCore.pyqtSignal(object)
 
+    # stop sending while this many bytes haven't been written to the socket yet,
+    # so the backlog of a slow client stays in the queue, where its policy applies
+    MAX_UNSENT = 256*1024
+
     def __init__(self, webSocket):
         super(WebSocketClientConnection, self).__init__(None)
 
@@ -23,6 +30,28 @@ class WebSocketClientConnection(QObject):
         self.webSocket = webSocket
         self.webSocket.binaryMessageReceived.connect(self.processBinaryMessage)
         self.webSocket.disconnected.connect(self.onDisconnected)
+        self.webSocket.bytesWritten.connect(self.onBytesWritten)
+        self.framer = MessageFramer(Messaging.hdr)
+
+        # QWebSocket has no way to wait for data to be written, so the block
+        # policy acts like drop-newest for websockets.
+        self.outboundQueue = OutboundQueue()
+        # single shot timer to write out the queue when control returns to the event loop
+        self.flushTimer = QtCore.QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.setInterval(0)
+        self.flushTimer.timeout.connect(self.flush)
+        self.unsentBytes = 0
+        # when batching, the most bytes of messages to pack into each frame,
+        # and how they're compressed
+        self.frameSize = 0
+        self.compression = batch.UNCOMPRESSED
+        self.sentFrames = 0
+        self.policyComboBox = QtWidgets.QComboBox()
+        self.policyComboBox.addItems(OutboundQueue.POLICIES)
+        self.policyComboBox.setCurrentText(self.outboundQueue.policy)
+        self.policyComboBox.currentTextChanged.connect(self.setQueuePolicy)
+        self.queueLabel = QtWidgets.QLabel(self.outboundQueue.statusText())
 
         self.name = "Web Client"
         self.hostLabel = QtWidgets.QLabel(self.webSocket.peerAddress().toString().replace("::ffff:",""))
@@ -35,17 +64,74 @@ class WebSocketClientConnection(QObject):
             return self.statusLabel
         if index == 2:
             return self.hostLabel
+        if index == 3:
+            return self.policyComboBox
+        if index == 4:
+            return self.queueLabel
         return None
+
+    def setQueuePolicy(self, policy):
+        self.outboundQueue.policy = policy
+
+    def updateQueueStatus(self):
+        text = self.outboundQueue.statusText()
+        if self.frameSize:
+            text += ", %d frames" % self.sentFrames
+        self.queueLabel.setText(text)
+
+    # Packs messages into frames of up to maxBytes, sent maxDelay milliseconds
+    # after the first message is queued, or each time control returns to the
+    # event loop if it's zero.  Without compression, a frame has the messages
+    # one after another, like a TCP stream.  With it, the frame is a
+    # Network.Batch message.  remoteId is only used by bridges to other servers.
+    def setBatching(self, maxBytes, maxDelay, compression, remoteId=0):
+        self.frameSize = max(maxBytes, 1)
+        self.compression = compression
+        self.flushTimer.setInterval(maxDelay)
             
     def processBinaryMessage(self, bytes):
-        hdr = Messaging.hdr(bytes.data())
-        self.messagereceived.emit(hdr)
+        # a websocket message can hold more than one message, but no partial
+        # ones, so each is split on its own
+        self.framer.feed(bytes.data())
+        for msg_bytes in self.framer.messages():
+            self.messagereceived.emit(Messaging.hdr(msg_bytes))
+        self.framer.drop_partial()
 
     def onDisconnected(self):
         self.disconnected.emit(self)
 
     def sendMsg(self, msg):
-        self.webSocket.sendBinaryMessage(msg.rawBuffer().raw)
+        self.sendBytes(msg.rawBuffer().raw, msg.GetMessageID())
+
+    # Sends a message that's already encoded as bytes.
+    # Messages are queued, and sent when control returns to the event loop.
+    def sendBytes(self, buf, id=0):
+        self.outboundQueue.put(id, buf)
+        if not self.flushTimer.isActive():
+            self.flushTimer.start()
+
+    def flush(self):
+        self.flushTimer.stop()
+        queue = self.outboundQueue
+        while queue and self.unsentBytes < self.MAX_UNSENT:
+            if self.frameSize:
+                msgs = queue.take(self.frameSize, fit=True)
+                if self.compression != batch.UNCOMPRESSED:
+                    frame = batch.pack(msgs, (batch.SERVER_ID,), self.compression)
+                else:
+                    frame = b''.join(msgs)
+                self.unsentBytes += self.webSocket.sendBinaryMessage(frame)
+                self.sentFrames += 1
+                continue
+            # each message is sent as its own websocket message
+            for buf in queue.take(1):
+                self.unsentBytes += self.webSocket.sendBinaryMessage(buf)
+
+    def onBytesWritten(self, count):
+        # bytesWritten includes websocket framing, so this is approximate
+        self.unsentBytes = max(0, self.unsentBytes - count)
+        if self.outboundQueue and not self.flushTimer.isActive():
+            self.flush()
 
 class WebSocketServer(QObject):
     statusUpdate = QtCore.pyqtSignal(str)
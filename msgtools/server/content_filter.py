@@ -0,0 +1,266 @@
+import operator
+import re
+import struct
+
+from msgtools.lib.messaging import Messaging, FieldInfo
+
+# Filters on the contents of messages, for subscriptions that only want some
+# of the messages with an ID, like the ones from one source, or the ones where
+# a field is over a limit.  Messages that don't match are dropped as they're
+# routed, instead of being sent to the client to throw away.
+#
+# A filter is comparisons of fields with values, combined with and, or, not
+# and parentheses:
+#     FieldB > 5 and (hdr.Source == 3 or not BitsB == OptionA)
+# Names are fields or bitfields of the message, or of the header if they
+# start with "hdr.", and elements of arrays are picked with [index].  Values
+# are numbers, or names of an enum of the field.  A comparison of a field a
+# message doesn't have, or that's past the end of a short message, is false.
+#
+# Filters are parsed once, when the client subscribes, and then compiled into
+# a Python function for each message class the first time a message of that
+# class is routed.  Fields whose value is stored as-is are read straight from
+# the message buffer at their offset, without making a message object.
+
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<number>-?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?))|
+    (?P<name>[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?)|
+    (?P<op>==|!=|<=|>=|<|>|\(|\)|\[|\]))''', re.VERBOSE)
+
+_COMPARISONS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+# struct formats of the numpy types of fields in message DTYPEs
+_FORMATS = {'u1': 'B', 'i1': 'b', 'u2': 'H', 'i2': 'h', 'u4': 'I', 'i4': 'i', 'u8': 'Q', 'i8': 'q', 'f4': 'f', 'f8': 'd'}
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None or match.end() == pos:
+            raise ValueError("Invalid filter at '%s'" % text[pos:].strip())
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            if re.fullmatch(r'-?0[xX][0-9a-fA-F]+', value):
+                value = int(value, 16)
+            elif re.fullmatch(r'-?\d+', value):
+                value = int(value)
+            else:
+                value = float(value)
+        elif kind == 'name' and value in ('and', 'or', 'not'):
+            kind = 'op'
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            raise ValueError("Expected %s in filter, not %s" % (value or kind, token[1] if token[1] is not None else "end"))
+        self.pos += 1
+        return token[1]
+
+    def parse(self):
+        node = self.parseOr()
+        if self.pos != len(self.tokens):
+            raise ValueError("Unexpected %s in filter" % self.peek()[1])
+        return node
+
+    def parseOr(self):
+        terms = [self.parseAnd()]
+        while self.peek() == ('op', 'or'):
+            self.take()
+            terms.append(self.parseAnd())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def parseAnd(self):
+        terms = [self.parseNot()]
+        while self.peek() == ('op', 'and'):
+            self.take()
+            terms.append(self.parseNot())
+        return terms[0] if len(terms) == 1 else ('and', terms)
+
+    def parseNot(self):
+        if self.peek() == ('op', 'not'):
+            self.take()
+            return ('not', self.parseNot())
+        if self.peek() == ('op', '('):
+            self.take()
+            node = self.parseOr()
+            self.take('op', ')')
+            return node
+        name = self.take('name')
+        index = None
+        if self.peek() == ('op', '['):
+            self.take()
+            index = self.take('number')
+            if not isinstance(index, int) or index < 0:
+                raise ValueError("Invalid index %s of %s in filter" % (index, name))
+            self.take('op', ']')
+        op = self.take('op')
+        if op not in _COMPARISONS:
+            raise ValueError("Expected comparison after %s in filter, not %s" % (name, op))
+        kind, value = self.peek()
+        if kind == 'number':
+            value = self.take()
+        else:
+            # name of an enum value
+            value = ('enum', self.take('name'))
+        return ('compare', name, index, op, value)
+
+# Returns the parsed form of a filter, for compileFilter().  Raises
+# ValueError if it's not a valid filter.
+def parseFilter(text):
+    return _Parser(text).parse()
+
+# Returns a function of a message buffer, that returns True if the message
+# matches the parsed filter, for messages of msgClass (which may be None if
+# the message isn't known).
+def compileFilter(node, msgClass):
+    namespace = {}
+    expression = _Compiler(msgClass, namespace).compile(node)
+    code = "def predicate(buf):\n    return %s\n" % expression
+    exec(compile(code, "<filter>", "exec"), namespace)
+    return namespace['predicate']
+
+class _Compiler:
+    def __init__(self, msgClass, namespace):
+        self.msgClass = msgClass
+        self.namespace = namespace
+
+    def compile(self, node):
+        kind = node[0]
+        if kind in ('and', 'or'):
+            return "(" + (" %s " % kind).join(self.compile(term) for term in node[1]) + ")"
+        if kind == 'not':
+            return "(not %s)" % self.compile(node[1])
+        return self.comparison(*node[1:])
+
+    def comparison(self, name, index, op, value):
+        if name.startswith("hdr."):
+            cls = Messaging.hdr
+            name = name[len("hdr."):]
+        else:
+            cls = self.msgClass
+        fieldInfo = Messaging.findFieldInfo(cls.fields, name) if cls is not None else None
+        if fieldInfo is None:
+            return "False"
+        if index is None:
+            index = 0
+        if index >= fieldInfo.count:
+            return "False"
+        if isinstance(value, tuple):
+            enum = fieldInfo.enum[0] if fieldInfo.enum else {}
+            if value[1] not in enum:
+                return "False"
+            value = enum[value[1]]
+        n = len(self.namespace)
+        fmt = self.rawFormat(cls, fieldInfo)
+        if fmt is not None:
+            offset = cls.MSG_OFFSET + fieldInfo.offset + fieldInfo.size * index
+            self.namespace['_f%d' % n] = struct.Struct(fmt).unpack_from
+            read = "_f%d(buf, %d)[0] %s %r" % (n, offset, op, value)
+            if cls is Messaging.hdr:
+                return "(%s)" % read
+            return "(len(buf) >= %d and %s)" % (offset + fieldInfo.size, read)
+        self.namespace['_f%d' % n] = self.fieldComparison(cls, fieldInfo, index, _COMPARISONS[op], value)
+        return "_f%d(buf)" % n
+
+    # Returns the struct format to read a field straight from the buffer, or
+    # None if it's a bitfield, scaled, or otherwise needs its get function.
+    def rawFormat(self, cls, fieldInfo):
+        if not isinstance(fieldInfo, FieldInfo) or not hasattr(cls, 'DTYPE'):
+            return None
+        try:
+            dtype = cls.DTYPE.fields[fieldInfo.name][0].base
+        except (KeyError, TypeError):
+            return None
+        fmt = _FORMATS.get(dtype.str[1:])
+        if fmt is None or dtype.itemsize != fieldInfo.size:
+            return None
+        if (dtype.kind == 'f') != (fieldInfo.type == 'float'):
+            return None
+        return ('>' if dtype.str[0] == '>' else '<') + fmt
+
+    # Compares with the field's get function, on a message made from the buffer
+    def fieldComparison(self, cls, fieldInfo, index, compare, value):
+        get = fieldInfo.get
+        kwargs = {'enumAsInt': True} if fieldInfo.enum else {}
+        args = (index,) if fieldInfo.count > 1 else ()
+        isHeader = cls is Messaging.hdr
+        def fieldCompare(buf):
+            try:
+                msg = cls(buf)
+                if not isHeader and not fieldInfo.exists(msg, index):
+                    return False
+                return compare(get(msg, *args, **kwargs), value)
+            except (struct.error, TypeError, ValueError):
+                return False
+        return fieldCompare
+
+def _msgClass(id):
+    hdr = Messaging.hdr()
+    hdr.SetMessageID(id)
+    return Messaging.MsgClass(hdr)
+
+# The filtered subscriptions of one client.
+class ContentFilters:
+    def __init__(self):
+        # (mask, value, filter text, parsed filter) tuples, in the order added
+        self.subscriptions = []
+        # predicate for each message ID, made when the ID is first routed
+        self._predicates = {}
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    # Adds a subscription, or replaces the one with the same mask and value,
+    # or removes it if the filter is empty.  Raises ValueError if the filter
+    # is invalid.
+    def update(self, mask, value, text):
+        value &= mask
+        text = text.strip()
+        subscription = (mask, value, text, parseFilter(text)) if text else None
+        for i, (oldMask, oldValue, *rest) in enumerate(self.subscriptions):
+            if (oldMask, oldValue) == (mask, value):
+                if subscription is None:
+                    del self.subscriptions[i]
+                else:
+                    self.subscriptions[i] = subscription
+                break
+        else:
+            if subscription is not None:
+                self.subscriptions.append(subscription)
+        self._predicates.clear()
+
+    def matches(self, id):
+        for mask, value, *rest in self.subscriptions:
+            if id & mask == value:
+                return True
+        return False
+
+    # Returns a function of a message buffer that's True if a message with
+    # this id matches any of the subscriptions that match its id.
+    def predicate(self, id):
+        try:
+            return self._predicates[id]
+        except KeyError:
+            pass
+        nodes = [node for mask, value, text, node in self.subscriptions if id & mask == value]
+        predicate = compileFilter(nodes[0] if len(nodes) == 1 else ('or', nodes), _msgClass(id))
+        self._predicates[id] = predicate
+        return predicate
+
+    def description(self):
+        items = ["id & %s == %s where %s" % (hex(mask), hex(value), text) for mask, value, text, node in self.subscriptions]
+        return ', '.join(items) if items else "none"
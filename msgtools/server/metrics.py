@@ -0,0 +1,145 @@
+import math
+import time
+
+from msgtools.lib.messaging import Messaging
+
+# Count of messages and bytes, with moving averages of their rates.
+# The server increments the counts of each message it routes, which is all the
+# work done per message; rates are computed once a second, by sample().
+class RateCounter:
+    __slots__ = ('msgs', 'bytes', 'seconds', 'msgRate', 'byteRate', 'secondsPerMsg', '_lastMsgs', '_lastBytes', '_lastSeconds')
+    def __init__(self):
+        self.msgs = 0
+        self.bytes = 0
+        # time spent routing the messages
+        self.seconds = 0.0
+        self.msgRate = 0.0
+        self.byteRate = 0.0
+        self.secondsPerMsg = 0.0
+        self._lastMsgs = 0
+        self._lastBytes = 0
+        self._lastSeconds = 0.0
+
+    # Updates the moving averages, with the counts since the last sample over
+    # dt seconds, given weight in the average.
+    def sample(self, dt, weight):
+        msgs = self.msgs - self._lastMsgs
+        self.msgRate += weight * (msgs / dt - self.msgRate)
+        self.byteRate += weight * ((self.bytes - self._lastBytes) / dt - self.byteRate)
+        if msgs:
+            secondsPerMsg = (self.seconds - self._lastSeconds) / msgs
+            if self._lastMsgs == 0:
+                # start the average at the first measurement, instead of zero
+                self.secondsPerMsg = secondsPerMsg
+            else:
+                self.secondsPerMsg += weight * (secondsPerMsg - self.secondsPerMsg)
+        # let idle rates reach zero, instead of decaying forever
+        if msgs == 0 and self.msgRate < 1e-3:
+            self.msgRate = 0.0
+            self.byteRate = 0.0
+        self._lastMsgs = self.msgs
+        self._lastBytes = self.bytes
+        self._lastSeconds = self.seconds
+
+# Metrics of one client connection.  rx counts messages received from the
+# client, which the server counts as it routes them.  tx counts messages
+# sent to the client, which are copied from the client's outbound queue when
+# it has one.
+class ClientMetrics:
+    __slots__ = ('rx', 'tx')
+    def __init__(self):
+        self.rx = RateCounter()
+        self.tx = RateCounter()
+
+# Counters and moving rates per message ID and per client, for the server's
+# metrics table, Network metrics messages, and Prometheus page.
+class Metrics:
+    # time constant of the moving averages, in seconds
+    AVERAGING_TIME = 5.0
+
+    def __init__(self):
+        self.messages = {}
+        self.clients = {}
+        self.startTime = time.time()
+        self._lastSample = time.monotonic()
+
+    # Returns the counter for message ID id, adding it if it's new.
+    def message(self, id):
+        counter = self.messages.get(id)
+        if counter is None:
+            counter = self.messages[id] = RateCounter()
+        return counter
+
+    def addClient(self, client):
+        metrics = self.clients[client] = ClientMetrics()
+        return metrics
+
+    def removeClient(self, client):
+        self.clients.pop(client, None)
+
+    # Computes the rates since the last call.  The server calls this once a second.
+    def sample(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        dt = now - self._lastSample
+        if dt <= 0:
+            return
+        self._lastSample = now
+        weight = 1.0 - math.exp(-dt / Metrics.AVERAGING_TIME)
+        for counter in self.messages.values():
+            counter.sample(dt, weight)
+        for client, metrics in self.clients.items():
+            queue = getattr(client, 'outboundQueue', None)
+            if queue is not None:
+                metrics.tx.msgs = queue.sentMsgs
+                metrics.tx.bytes = queue.sentBytes
+            metrics.rx.sample(dt, weight)
+            metrics.tx.sample(dt, weight)
+
+    # Returns the metrics as a Prometheus text format page.
+    def prometheusText(self):
+        lines = []
+        def metric(name, type, help, samples):
+            lines.append("# HELP msgserver_%s %s" % (name, help))
+            lines.append("# TYPE msgserver_%s %s" % (name, type))
+            for labels, value in samples:
+                lines.append("msgserver_%s{%s} %s" % (name, labels, _promValue(value)))
+        msgs = sorted(self.messages.items())
+        msgLabels = ['id="%s",name="%s"' % (hex(id), _promEscape(Messaging.MsgNameFromID.get(hex(id), "Unknown"))) for id, counter in msgs]
+        metric("messages_total", "counter", "Messages routed, by message.",
+            [(labels, counter.msgs) for labels, (id, counter) in zip(msgLabels, msgs)])
+        metric("message_bytes_total", "counter", "Bytes routed, by message.",
+            [(labels, counter.bytes) for labels, (id, counter) in zip(msgLabels, msgs)])
+        metric("message_rate", "gauge", "Moving average of messages routed per second, by message.",
+            [(labels, counter.msgRate) for labels, (id, counter) in zip(msgLabels, msgs)])
+        metric("message_route_seconds_total", "counter", "Time spent routing, by message.",
+            [(labels, counter.seconds) for labels, (id, counter) in zip(msgLabels, msgs)])
+        clients = list(self.clients.items())
+        clientLabels = ['client="%s"' % _promEscape(client.name) for client, metrics in clients]
+        metric("client_received_messages_total", "counter", "Messages received from each client.",
+            [(labels, metrics.rx.msgs) for labels, (client, metrics) in zip(clientLabels, clients)])
+        metric("client_received_bytes_total", "counter", "Bytes received from each client.",
+            [(labels, metrics.rx.bytes) for labels, (client, metrics) in zip(clientLabels, clients)])
+        metric("client_sent_messages_total", "counter", "Messages sent to each client.",
+            [(labels, metrics.tx.msgs) for labels, (client, metrics) in zip(clientLabels, clients)])
+        metric("client_sent_bytes_total", "counter", "Bytes sent to each client.",
+            [(labels, metrics.tx.bytes) for labels, (client, metrics) in zip(clientLabels, clients)])
+        queues = [(labels, client.outboundQueue) for labels, (client, metrics) in zip(clientLabels, clients) if hasattr(client, 'outboundQueue')]
+        metric("client_queued_messages", "gauge", "Messages waiting to be sent to each client.",
+            [(labels, len(queue)) for labels, queue in queues])
+        metric("client_queued_bytes", "gauge", "Bytes waiting to be sent to each client.",
+            [(labels, queue.queuedBytes) for labels, queue in queues])
+        metric("client_dropped_messages_total", "counter", "Messages dropped because a client couldn't keep up.",
+            [(labels, queue.droppedMsgs) for labels, queue in queues])
+        lines.append("# HELP msgserver_start_time_seconds Time the server started, in seconds since the epoch.")
+        lines.append("# TYPE msgserver_start_time_seconds gauge")
+        lines.append("msgserver_start_time_seconds %s" % _promValue(self.startTime))
+        return '\n'.join(lines) + '\n'
+
+def _promEscape(text):
+    return str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _promValue(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
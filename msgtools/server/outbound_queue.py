@@ -0,0 +1,112 @@
+import collections
+
+# Bounded queue of encoded messages waiting to be written to one client.
+# Messages are put on the queue as they're routed, and taken off in batches
+# that are joined into a few large writes, instead of one write per message.
+# When a client can't keep up and the queue reaches its high-water mark (in
+# bytes), the queue's policy decides what happens to new messages:
+#   block         - the connection waits for the client to drain the queue, up
+#                   to a time limit, and then drops new messages without
+#                   waiting until the queue is below its high-water mark.
+#   drop-oldest   - the oldest queued messages are dropped to make room.
+#   drop-newest   - the new message is dropped.
+#   latest-per-id - a queued message with the same ID is replaced by the new
+#                   one, so the client gets the latest value of each message;
+#                   if there isn't one, the oldest message is dropped.
+# A single message larger than the high-water mark is still queued when the
+# queue is empty, so nothing is rejected forever.
+class OutboundQueue:
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop-oldest'
+    DROP_NEWEST = 'drop-newest'
+    LATEST_PER_ID = 'latest-per-id'
+    # in the same order as the QueuePolicies enum of Network.ClientStatus
+    POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, LATEST_PER_ID)
+
+    # defaults for new connections, which the server sets from its command line
+    defaultHighWaterMark = 4*1024*1024
+    defaultPolicy = DROP_OLDEST
+
+    def __init__(self, highWaterMark=None, policy=None):
+        self.highWaterMark = OutboundQueue.defaultHighWaterMark if highWaterMark is None else highWaterMark
+        self.policy = OutboundQueue.defaultPolicy if policy is None else policy
+        if self.policy not in OutboundQueue.POLICIES:
+            raise ValueError("Invalid queue policy " + str(self.policy))
+        # each entry is a [id, payload] list, so it can be replaced in place
+        self._entries = collections.deque()
+        # newest queued entry for each ID, for the latest-per-id policy
+        self._latest = {}
+        self.queuedBytes = 0
+        self.droppedMsgs = 0
+        self.sentMsgs = 0
+        self.sentBytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def full(self):
+        return self.queuedBytes >= self.highWaterMark
+
+    def _dropOldest(self):
+        entry = self._entries.popleft()
+        if self._latest.get(entry[0]) is entry:
+            del self._latest[entry[0]]
+        self.queuedBytes -= len(entry[1])
+        self.droppedMsgs += 1
+
+    # Queues payload, the encoded message with ID id.
+    # Returns False if the message was dropped because the queue is full.
+    def put(self, id, payload):
+        size = len(payload)
+        if self._entries and self.queuedBytes + size > self.highWaterMark:
+            policy = self.policy
+            if policy == OutboundQueue.LATEST_PER_ID:
+                entry = self._latest.get(id)
+                if entry is not None:
+                    self.queuedBytes += size - len(entry[1])
+                    entry[1] = payload
+                    self.droppedMsgs += 1
+                    return True
+            elif policy != OutboundQueue.DROP_OLDEST:
+                # drop-newest, or block when the connection gave up waiting
+                self.droppedMsgs += 1
+                return False
+            while self._entries and self.queuedBytes + size > self.highWaterMark:
+                self._dropOldest()
+        entry = [id, payload]
+        self._entries.append(entry)
+        self._latest[id] = entry
+        self.queuedBytes += size
+        return True
+
+    # Removes messages from the front of the queue until at least maxBytes have
+    # been taken, or the queue is empty, and returns a list of their payloads.
+    # With fit, it stops before a message that would take it past maxBytes
+    # instead, though it always takes at least one message.
+    def take(self, maxBytes, fit=False):
+        entries = self._entries
+        latest = self._latest
+        payloads = []
+        size = 0
+        while entries and size < maxBytes:
+            if fit and payloads and size + len(entries[0][1]) > maxBytes:
+                break
+            entry = entries.popleft()
+            if latest.get(entry[0]) is entry:
+                del latest[entry[0]]
+            payloads.append(entry[1])
+            size += len(entry[1])
+        self.queuedBytes -= size
+        self.sentMsgs += len(payloads)
+        self.sentBytes += size
+        return payloads
+
+    def clear(self):
+        self.droppedMsgs += len(self._entries)
+        self._entries.clear()
+        self._latest.clear()
+        self.queuedBytes = 0
+
+    # Text to show the state of the queue in the server's client list.
+    def statusText(self):
+        return "%d msgs/%d KB queued, %d dropped" % (len(self._entries), (self.queuedBytes+1023)//1024, self.droppedMsgs)
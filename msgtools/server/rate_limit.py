@@ -0,0 +1,135 @@
+# Rate limited subscriptions, for clients that want fewer messages than the
+# server routes, like a plot that only redraws 30 times a second subscribing
+# to a 1 kHz stream.  Messages a client doesn't want are dropped as they're
+# routed, before they're encoded or queued for the client.
+#
+# Each client can have several rate limited subscriptions, each matching
+# message IDs by a mask and value, with one of these modes:
+#   KeepLatest - each ID is sent at most maxRate times a second.  A message
+#                that arrives too soon is held, replacing any message held
+#                before it, and sent when the interval is up, so the client
+#                always ends up with the latest value.
+#   EveryNth   - one of every N messages of each ID is sent.
+# Limits are kept separately for each ID that matches a subscription.
+
+# in the same order as the RateLimitModes enum of Network.RateLimitedSubscription
+KEEP_LATEST = 0
+EVERY_NTH = 1
+REMOVE = 2
+
+class KeepLatest:
+    def __init__(self, maxRate):
+        self.interval = 1.0 / maxRate
+        self.nextTime = 0
+        # message waiting for the interval to be up
+        self.held = None
+
+    # Returns True if hdr can be sent at time now (in seconds), or otherwise
+    # holds on to it, for the server to send when due() returns True.
+    def offer(self, hdr, now):
+        if now >= self.nextTime:
+            # anything held is older than hdr
+            self.held = None
+            self._advance(now)
+            return True
+        self.held = hdr
+        return False
+
+    def due(self, now):
+        return now >= self.nextTime
+
+    # Returns the held message, which is being sent at time now.
+    def take(self, now):
+        hdr = self.held
+        self.held = None
+        self._advance(now)
+        return hdr
+
+    def _advance(self, now):
+        # stay in step with a steady stream, without making up for time
+        # spent idle
+        if now - self.nextTime < self.interval:
+            self.nextTime += self.interval
+        else:
+            self.nextTime = now + self.interval
+
+class EveryNth:
+    # messages are never held
+    held = None
+
+    def __init__(self, n):
+        self.n = n
+        self.count = 0
+
+    def offer(self, hdr, now):
+        send = self.count == 0
+        self.count += 1
+        if self.count == self.n:
+            self.count = 0
+        return send
+
+# The rate limited subscriptions of one client.
+class RateLimits:
+    def __init__(self):
+        # (mask, value, mode, maxRate, decimation) tuples, in the order added
+        self.subscriptions = []
+        # limiter for each message ID, made when the ID is first routed
+        self._limiters = {}
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    # Adds a subscription, or replaces or removes the one with the same mask
+    # and value.  Returns the limiters that were in use, which are replaced.
+    def update(self, mask, value, mode, maxRate=0, decimation=0):
+        if mode not in (KEEP_LATEST, EVERY_NTH, REMOVE):
+            raise ValueError("Invalid rate limit mode " + str(mode))
+        value &= mask
+        subscription = (mask, value, mode, maxRate, decimation)
+        for i, (oldMask, oldValue, *rest) in enumerate(self.subscriptions):
+            if (oldMask, oldValue) == (mask, value):
+                if mode == REMOVE:
+                    del self.subscriptions[i]
+                else:
+                    self.subscriptions[i] = subscription
+                break
+        else:
+            if mode != REMOVE:
+                self.subscriptions.append(subscription)
+        oldLimiters = list(self._limiters.values())
+        self._limiters.clear()
+        return oldLimiters
+
+    def matches(self, id):
+        for mask, value, *rest in self.subscriptions:
+            if id & mask == value:
+                return True
+        return False
+
+    # Returns the limiter for messages with this id, from the first
+    # subscription that matches it, or None if they aren't limited.
+    def limiter(self, id):
+        try:
+            return self._limiters[id]
+        except KeyError:
+            pass
+        limiter = None
+        for mask, value, mode, maxRate, decimation in self.subscriptions:
+            if id & mask == value:
+                if mode == KEEP_LATEST and maxRate > 0:
+                    limiter = KeepLatest(maxRate)
+                elif mode == EVERY_NTH and decimation > 1:
+                    limiter = EveryNth(decimation)
+                break
+        self._limiters[id] = limiter
+        return limiter
+
+    def description(self):
+        items = []
+        for mask, value, mode, maxRate, decimation in self.subscriptions:
+            if mode == KEEP_LATEST:
+                limit = "%g Hz" % maxRate if maxRate > 0 else "no limit"
+            else:
+                limit = "1 in %d" % decimation if decimation > 1 else "no limit"
+            items.append("id & %s == %s at %s" % (hex(mask), hex(value), limit))
+        return ', '.join(items) if items else "none"
@@ -0,0 +1,63 @@
+# Decides which clients each message ID is routed to, based on each client's
+# subscriptions and the server's private subscriptions.
+# Destinations are (client, sendBytes, accept, limiter) tuples, where sendBytes
+# is the client's function to send an already encoded message,
+# sendBytes(payload, id), or None if the client only has sendMsg(), like
+# plugins that translate each message to another header.  accept is None, or a
+# function of the message buffer that's True if the message matches the
+# client's filtered subscriptions (see content_filter.py).  limiter is None, or
+# the client's rate limit for the ID, from its rate limited subscriptions (see
+# rate_limit.py).
+# The list of destinations for an ID is computed the first time a message with
+# that ID is routed, and reused until invalidate() is called, which the server
+# does whenever a connection is added or removed, or any subscription changes.
+# That way the cost of routing a message depends on how many clients want it,
+# not on how many clients are connected.
+class RoutingTable:
+    def __init__(self, clients, privateSubscriptions, rateLimits=None, contentFilters=None):
+        # these are the server's own dictionaries, so the table always sees
+        # the current contents of them
+        self._clients = clients
+        self._privateSubscriptions = privateSubscriptions
+        # RateLimits of each client that has any
+        self._rateLimits = {} if rateLimits is None else rateLimits
+        # ContentFilters of each client that has any
+        self._contentFilters = {} if contentFilters is None else contentFilters
+        self._routes = {}
+
+    def invalidate(self):
+        self._routes.clear()
+
+    def destinations(self, id):
+        try:
+            return self._routes[id]
+        except KeyError:
+            pass
+        dests = []
+        private = self._privateSubscriptions.get(id)
+        for client in self._clients.values():
+            limits = self._rateLimits.get(client)
+            filters = self._contentFilters.get(client)
+            # filtered subscriptions that match the ID take the place of the others
+            filtered = filters is not None and filters.matches(id)
+            if filtered or id in client.subscriptions or (id & client.subMask == client.subValue) or (limits and limits.matches(id)):
+                # if it's a "private" message, only give it to clients that specifically said they want it
+                # or to clients that are a hardware link.
+                if private is None or client in private or client.isHardwareLink:
+                    accept = filters.predicate(id) if filtered else None
+                    limiter = limits.limiter(id) if limits else None
+                    dests.append((client, getattr(client, 'sendBytes', None), accept, limiter))
+        dests = tuple(dests)
+        self._routes[id] = dests
+        return dests
+
+    # Removes a client that's going away from the private subscriptions, rate
+    # limits and filters.
+    def removeClient(self, client):
+        self._rateLimits.pop(client, None)
+        self._contentFilters.pop(client, None)
+        for id in list(self._privateSubscriptions.keys()):
+            subscribers = self._privateSubscriptions[id]
+            if client in subscribers:
+                subscribers.remove(client)
+        self.invalidate()
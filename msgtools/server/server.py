@@ -3,6 +3,7 @@ import os
 import sys
 import argparse
 import datetime
+import time
 import traceback
 import importlib
 
@@ -13,12 +14,20 @@ if __name__ == '__main__':
     srcroot=os.path.abspath(os.path.dirname(os.path.abspath(__file__))+"/../..")
     sys.path.insert(1, srcroot)
 from msgtools.lib.messaging import Messaging, TimestampFixer
+from msgtools.lib.log_writer import LogWriter, LogRotation
 
 from PyQt5 import QtCore, QtGui, QtWidgets, QtNetwork
 
 from msgtools.server.TcpServer import *
 from msgtools.server.WebSocketServer import *
 import msgtools.server.launcher as launcher
+from msgtools.server.router import RoutingTable
+from msgtools.server.outbound_queue import OutboundQueue
+from msgtools.server.metrics import Metrics
+from msgtools.server import rate_limit
+from msgtools.server.content_filter import ContentFilters
+from msgtools.lib import batch
+from msgtools.server.MetricsHttpServer import MetricsHttpServer
 
 DESCRIPTION='''
     MsgServer acts as a central routing hub for one or more message clients.
@@ -44,6 +53,52 @@ TCP and Websockets
 MsgServer always runs a TCP and Websocket server.  The Websocket server
 port is always one greater than the TCP port.  The default ports are
 5678 and 5679 for TCP and Websockets respectively.
+Websocket clients can send Network.BatchLink to have each frame hold all the
+messages queued for them when the event loop runs, instead of one message
+per frame, and optionally compressed with zlib as a Network.Batch message.
+Web apps ask for it with the batch and compress options of
+MessageClient.connect().
+
+Shared Memory
+=============
+The sharedmemory plugin lets clients on the same host connect through rings
+in shared memory (/dev/shm) instead of TCP.  Clients connect to a unix socket,
+by default /dev/shm/msgtools-server, which is also used to wake each side up
+when the other has written to an empty ring.  Pass a different socket path as
+the plugin's parameter.  Clients connect to "shm:" (or "shm://<socket path>"),
+and subscriptions work as they do over TCP.  The rings rely on the CPU keeping
+stores in order, so the plugin is only available on x86 hosts.
+
+Multicast
+=========
+The multicast plugin publishes messages to a UDP multicast group, so any number
+of clients can receive a high-rate stream for the cost of sending it once.
+Its parameter is the group and port, followed by comma separated options and
+the names or IDs of the messages to publish (all of them if none are given):
+    --multicast= 239.255.77.77:5690,batch,ttl=2,Network.MsgMetrics
+batch packs as many messages as fit into each 1472 byte datagram (batch=SIZE
+sets another size), instead of sending one message per datagram.  ttl sets
+how many routers datagrams can pass through (1 keeps them on the local
+network).  Each datagram starts with a sequence number, so receivers can count
+lost datagrams.  Clients receive by connecting to "mcast://group:port".
+These connections are receive-only, so clients can't send messages, or
+subscribe, on them.
+
+Network Bridges
+===============
+The networkbridge plugin connects to another msgserver, and routes messages
+between the two.  Its parameter is the other server, followed by comma
+separated options:
+    --networkbridge= otherhost:5678,zlib,delay=20,tx=TestCase1,rx=Network.Note
+batch packs messages into Network.Batch messages of up to 16384 bytes
+(batch=SIZE sets another size), in both directions, for slow links where
+one message at a time is mostly header overhead.  A batch that isn't full
+is sent delay milliseconds (10 by default) after its first message.  zlib,
+or lz4 if it's installed, compresses the batches.  tx names a message to
+send to the other server and rx one to receive from it, and can be given
+more than once; without them, everything is sent and received.  Batches
+carry the servers they went through, so bridges that form a loop don't send
+messages around it forever.
 
 SPP and RFCOMM
 ==============
@@ -79,6 +134,47 @@ Bluetooth Troubleshooting
 If you can't connect to your device, try pairing it with your PC first.
 Sometimes devices require pairing before allowing an arbitrary connection.
 
+Outbound Queues
+===============
+Messages to each TCP and Websocket client are queued, and written in
+large batches.  When a client can't keep up and its queue reaches the
+high-water mark (--queue-limit, in bytes), the queue's policy decides
+which messages are dropped:
+    block         - wait up to a second for the client to catch up,
+                    then drop new messages until it makes room.
+    drop-oldest   - drop the oldest queued messages (the default).
+    drop-newest   - drop the new message.
+    latest-per-id - replace a queued message with the same ID by the
+                    new one, so the client gets the latest of each.
+The policy of each client can be changed in the client list, which also
+shows its queue depth and drop count.  The same information is sent to
+clients as Network.ClientStatus messages whenever it changes.
+
+Metrics
+=======
+MsgServer counts the messages and bytes it routes for each message ID and
+each client, and keeps moving averages of their rates, and of the time
+taken to route each message ID.  They're shown in the server window, sent
+every second as Network.MsgMetrics (one per active message ID) and
+Network.ClientStatus (one per client) messages to clients that subscribe
+to them, and served as a Prometheus text page on the local host at
+    http://127.0.0.1:<port>/metrics
+where the port is TCP port + 2 (5680 by default), or set by
+--metrics-port.  Use --metrics-port 0 to disable the page.
+
+Log Rotation
+============
+Logs can be split into a new file when the current one reaches a size
+(--log-max-size, in MB), reaches an age (--log-max-duration, in seconds),
+or at wall-clock boundaries (--log-rotate-every, in seconds from
+midnight, like 3600 for every hour on the hour).  The files are named
+like the log with a number added, like 20240101-120000.0000.log, and a
+manifest, 20240101-120000.manifest.json, lists each file's time range,
+size, and count and byte offsets of each message ID.
+Network.StartLog can set the rotation of a log, with the settings it leaves
+at zero taken from the command line, and Network.StopLog with
+NextSegment set starts the next file without stopping the log.
+
 Examples
 ========
     msgserver &
@@ -177,7 +273,7 @@ class MessageServer(QtWidgets.QMainWindow):
             self.setWindowIcon(QtGui.QIcon(str(icon_path)))
         
         self.settings = QtCore.QSettings("MsgTools", "MessageServer")
-        self.logFile = None
+        self.logWriter = None
         self.logFileType = None
         
         parser = argparse.ArgumentParser(description=DESCRIPTION, epilog=EPILOG, 
@@ -202,6 +298,22 @@ class MessageServer(QtWidgets.QMainWindow):
                     message definitions''')
         parser.add_argument('--port', type=int, 
             help='The TCP port to use.  Websockets are always TCP port + 1.')
+        parser.add_argument('--metrics-port', type=int,
+            help='The local HTTP port for Prometheus metrics, 0 to disable.  Defaults to TCP port + 2.')
+        parser.add_argument('--queue-limit', type=int, default=OutboundQueue.defaultHighWaterMark,
+            help='High-water mark in bytes of the outbound queue of each client.')
+        parser.add_argument('--queue-policy', choices=OutboundQueue.POLICIES, default=OutboundQueue.defaultPolicy,
+            help='What to do with messages for a client whose outbound queue is full.')
+        parser.add_argument('--log-flush', type=float, default=LogWriter.defaultFlushInterval,
+            help='Maximum time in seconds that logged data is buffered before being written to the file.')
+        parser.add_argument('--log-fsync', choices=LogWriter.FSYNC_POLICIES, default=LogWriter.defaultFsync,
+            help='When logged data is forced to disk: never, after every flush, or when the log is closed.')
+        parser.add_argument('--log-max-size', type=float, default=0,
+            help='Start a new log file when the current one reaches this many MB.')
+        parser.add_argument('--log-max-duration', type=float, default=0,
+            help='Start a new log file when the current one is this many seconds old.')
+        parser.add_argument('--log-rotate-every', type=float, default=0,
+            help='Start new log files at wall-clock times that are multiples of this many seconds from midnight.')
         parser.add_argument('--debug', action='store_true', help='Set if you want extra error info printed to stdout.')
 
         # if we had plugins before, but no cmdline args now, add simulated
@@ -215,6 +327,12 @@ class MessageServer(QtWidgets.QMainWindow):
         args = parser.parse_args()
         
         Messaging.debug = False if hasattr(args, 'debug') == False else args.debug
+        OutboundQueue.defaultHighWaterMark = args.queue_limit
+        OutboundQueue.defaultPolicy = args.queue_policy
+        LogWriter.defaultFlushInterval = args.log_flush
+        LogWriter.defaultFsync = args.log_fsync
+        # rotation of logs, for settings that aren't given when they're started
+        self.logRotation = LogRotation(int(args.log_max_size*1024*1024), args.log_max_duration, args.log_rotate_every)
         
         try:
             Messaging.LoadAllMessages(searchdir=args.msgdir)
@@ -233,8 +351,51 @@ class MessageServer(QtWidgets.QMainWindow):
         
         self.privateSubscriptions = {}
 
+        # rate limited subscriptions of each client that has any
+        self.rateLimits = {}
+        # filtered subscriptions of each client that has any
+        self.contentFilters = {}
+        # messages held back by KeepLatest rate limits, waiting to be sent
+        # when their interval is up, as (client, sendBytes, id) by limiter
+        self.heldMsgs = {}
+        self.heldMsgTimer = QtCore.QTimer(self)
+        self.heldMsgTimer.setSingleShot(True)
+        self.heldMsgTimer.timeout.connect(self.sendHeldMsgs)
+
+        # counters and rates per message ID and per client
+        self.metrics = Metrics()
+
+        # cached list of destination clients for each message ID
+        self.routingTable = RoutingTable(self.clients, self.privateSubscriptions, self.rateLimits, self.contentFilters)
+
+        # handlers for network control messages, by message ID
+        self.controlHandlers = {}
+        for name, handler in [
+                ('Connect', self.onConnectMsg),
+                ('SubscriptionList', self.onSubscriptionListMsg),
+                ('MaskedSubscription', self.onMaskedSubscriptionMsg),
+                ('RateLimitedSubscription', self.onRateLimitedSubscriptionMsg),
+                ('FilteredSubscription', self.onFilteredSubscriptionMsg),
+                ('Batch', self.onBatchMsg),
+                ('BatchLink', self.onBatchLinkMsg),
+                ('StartLog', self.onStartLogMsg),
+                ('StopLog', self.onStopLogMsg),
+                ('QueryLog', lambda c, hdr: self.queryLog()),
+                # This message was added more for AndroidServer. Plenty of other good ways to delete a log on
+                # a desktop or other more capable machine. That said, silently eat the request - blindly forwarding
+                # this along could be hazardous.
+                ('ClearLogs', lambda c, hdr: None),
+                ('PrivateSubscriptionList', self.onPrivateSubscriptionListMsg)]:
+            if hasattr(self.networkMsgs, name):
+                self.controlHandlers[getattr(self.networkMsgs, name).ID] = handler
+
         self.initializeGui()
 
+        # periodically update metrics, show the state of clients and the log, and report them
+        self.statusTimer = QtCore.QTimer(self)
+        self.statusTimer.timeout.connect(self.onStatusTimer)
+        self.statusTimer.start(1000)
+
         self.pluginPorts = []
         tcpport = 5678
         wsport = 5679
@@ -242,6 +403,7 @@ class MessageServer(QtWidgets.QMainWindow):
         if args.port is not None:
             tcpport = args.port
             wsport = tcpport+1
+        metricsport = tcpport+2 if args.metrics_port is None else args.metrics_port
         
         for entry_point in importlib.metadata.entry_points(group="msgtools.server.plugin"):
             # check for argparse data for the plugin
@@ -283,6 +445,12 @@ class MessageServer(QtWidgets.QMainWindow):
 
         self.tcpServer.start()
         self.wsServer.start()
+
+        self.metricsServer = None
+        if metricsport:
+            self.metricsServer = MetricsHttpServer(metricsport, self.metrics)
+            self.metricsServer.statusUpdate.connect(self.onStatusUpdate)
+            self.metricsServer.start()
         name = self.tcpServer.serverInfo() + "(TCP) and " + str(self.wsServer.portNumber) + "(WebSocket)"
         self.statusBar().addPermanentWidget(QtWidgets.QLabel(name))
         self.readSettings()
@@ -303,9 +471,24 @@ class MessageServer(QtWidgets.QMainWindow):
         self.logButton = QtWidgets.QPushButton("Start Logging")
         self.logButton.pressed.connect(self.onLogButtonClicked)
         vbox.addWidget(self.logButton)
+        self.logStatusLabel = QtWidgets.QLabel()
+        vbox.addWidget(self.logStatusLabel)
 
         self.grid = QtWidgets.QGridLayout()
         vbox.addLayout(self.grid)
+
+        # tables of metrics by message and by client
+        self.metricsTabs = QtWidgets.QTabWidget()
+        self.msgMetricsTable = QtWidgets.QTableWidget(0, 6)
+        self.msgMetricsTable.setHorizontalHeaderLabels(["Message", "ID", "Msgs/s", "KB/s", "Total Msgs", "Route us"])
+        self.metricsTabs.addTab(self.msgMetricsTable, "Messages")
+        self.clientMetricsTable = QtWidgets.QTableWidget(0, 8)
+        self.clientMetricsTable.setHorizontalHeaderLabels(["Client", "Rx Msgs/s", "Rx KB/s", "Tx Msgs/s", "Tx KB/s", "Queued Msgs", "Queued KB", "Dropped"])
+        self.metricsTabs.addTab(self.clientMetricsTable, "Clients")
+        for table in [self.msgMetricsTable, self.clientMetricsTable]:
+            table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+            table.verticalHeader().hide()
+        vbox.addWidget(self.metricsTabs)
         
         self.statusBox = QtWidgets.QPlainTextEdit()
         vbox.addWidget(self.statusBox)
@@ -319,13 +502,10 @@ class MessageServer(QtWidgets.QMainWindow):
         self.setWindowTitle("MessageServer 0.1")
         self.statusBar()
 
-    def startLog(self, log_name):
-        if self.logFile:
-            self.logFile.close()
-            self.logFile = None
-        # hash table of booleans for if each type of message has had it's header
-        # put into this log file already.
-        self.loggedMsgHeader = {}
+    def startLog(self, log_name, rotation=None):
+        if self.logWriter:
+            self.logWriter.close()
+            self.logWriter = None
         if log_name.endswith("json"):
             self.logFileType = "json"
         elif log_name.endswith("csv"):
@@ -334,37 +514,143 @@ class MessageServer(QtWidgets.QMainWindow):
             self.logFileType = "bin"
         else:
             print("ERROR!  Invalid log type " + log_name)
-        self.logFile = QtCore.QFile(log_name)
-        self.logFile.open(QtCore.QIODevice.Append)
+            return
+        # messages are formatted and written on a background thread
+        self.logWriter = LogWriter(log_name, self.logFileType, rotation=rotation or self.logRotation)
         fileInfo = QtCore.QFileInfo(log_name)
         self.settings.setValue("logging/filename", fileInfo.dir().absolutePath())
         self.logButton.setText("Stop " + fileInfo.fileName())
         self.queryLog()
     
     def stopLog(self):
-        if self.logFile != None:
-            self.logFile.close()
-            self.logFile = None
+        if self.logWriter != None:
+            self.logWriter.close()
+            if self.logWriter.droppedMsgs:
+                self.onStatusUpdate("Dropped %d messages from log %s" % (self.logWriter.droppedMsgs, self.logWriter.fileName))
+            self.logWriter = None
             self.logButton.setText("Start Logging")
+            self.updateLogStatus()
             self.queryLog()
 
+    def updateLogStatus(self):
+        if self.logWriter != None:
+            if self.logWriter.error:
+                self.logStatusLabel.setText("Log error: " + str(self.logWriter.error))
+            else:
+                self.logStatusLabel.setText("Log: " + self.logWriter.statusText())
+        else:
+            self.logStatusLabel.setText("")
+
     def queryLog(self):
         if hasattr(self.networkMsgs, 'LogStatus'):
             logStatusMsg = self.networkMsgs.LogStatus()
-            if self.logFile != None:
+            if self.logWriter != None:
                 logStatusMsg.SetLogOpen(1)
-                logStatusMsg.SetLogFileName(self.logFile.fileName())
+                logStatusMsg.SetLogFileName(self.logWriter.fileName)
                 if self.logFileType == "json":
                     logStatusMsg.SetLogFileType("JSON")
                 elif self.logFileType == "csv":
                     logStatusMsg.SetLogFileType("CSV")
                 elif self.logFileType == "bin":
-                    logStatusMsg.SetLogFileType("BIN")
+                    logStatusMsg.SetLogFileType("Binary")
+                if hasattr(logStatusMsg, 'SetQueuedMsgs'):
+                    logStatusMsg.SetQueuedMsgs(min(self.logWriter.queuedMsgs, 0xFFFFFFFF))
+                    logStatusMsg.SetDroppedMsgs(min(self.logWriter.droppedMsgs, 0xFFFFFFFF))
             for client in self.clients.values():
                 client.sendMsg(logStatusMsg.hdr)
 
+    def onStatusTimer(self):
+        self.metrics.sample()
+        self.reportClientStatus()
+        self.reportMsgMetrics()
+        self.updateMetricsView()
+        self.updateLogStatus()
+
+    def reportClientStatus(self):
+        for client in list(self.clients.values()):
+            queue = getattr(client, 'outboundQueue', None)
+            if queue is None:
+                continue
+            client.updateQueueStatus()
+            metrics = self.metrics.clients.get(client)
+            if metrics is None:
+                continue
+            status = (client.name, len(queue), queue.queuedBytes, queue.highWaterMark, queue.policy, queue.droppedMsgs,
+                      metrics.rx.msgRate, metrics.rx.byteRate, metrics.tx.msgRate, metrics.tx.byteRate)
+            if status == getattr(client, 'lastReportedStatus', None):
+                continue
+            client.lastReportedStatus = status
+            if hasattr(self.networkMsgs, 'ClientStatus'):
+                statusMsg = self.networkMsgs.ClientStatus()
+                statusMsg.SetName(client.name)
+                statusMsg.SetQueuedMsgs(min(len(queue), 0xFFFFFFFF))
+                statusMsg.SetQueuedBytes(min(queue.queuedBytes, 0xFFFFFFFF))
+                statusMsg.SetHighWaterMark(min(queue.highWaterMark, 0xFFFFFFFF))
+                statusMsg.SetPolicy(OutboundQueue.POLICIES.index(queue.policy))
+                statusMsg.SetDroppedMsgs(min(queue.droppedMsgs, 0xFFFFFFFF))
+                if hasattr(statusMsg, 'SetRxMsgRate'):
+                    statusMsg.SetRxMsgRate(metrics.rx.msgRate)
+                    statusMsg.SetRxByteRate(metrics.rx.byteRate)
+                    statusMsg.SetTxMsgRate(metrics.tx.msgRate)
+                    statusMsg.SetTxByteRate(metrics.tx.byteRate)
+                for dest, sendBytes, accept, limiter in self.routingTable.destinations(statusMsg.hdr.GetMessageID()):
+                    if accept is None or accept(statusMsg.hdr.rawBuffer()):
+                        dest.sendMsg(statusMsg.hdr)
+
+    def reportMsgMetrics(self):
+        if not hasattr(self.networkMsgs, 'MsgMetrics'):
+            return
+        dests = self.routingTable.destinations(self.networkMsgs.MsgMetrics.ID)
+        if not dests:
+            return
+        for id, counter in sorted(self.metrics.messages.items()):
+            if counter.msgRate == 0:
+                continue
+            metricsMsg = self.networkMsgs.MsgMetrics()
+            metricsMsg.SetMsgID(id)
+            metricsMsg.SetMsgRate(counter.msgRate)
+            metricsMsg.SetByteRate(counter.byteRate)
+            metricsMsg.SetRouteTime(counter.secondsPerMsg*1e6)
+            metricsMsg.SetTotalMsgs(counter.msgs)
+            metricsMsg.SetTotalBytes(counter.bytes)
+            for dest, sendBytes, accept, limiter in dests:
+                if accept is None or accept(metricsMsg.hdr.rawBuffer()):
+                    dest.sendMsg(metricsMsg.hdr)
+
+    def updateMetricsView(self):
+        # only fill in the table that can be seen
+        def setRow(table, row, values):
+            for col, value in enumerate(values):
+                item = table.item(row, col)
+                if item is None:
+                    item = QtWidgets.QTableWidgetItem()
+                    table.setItem(row, col, item)
+                item.setText(value)
+        if self.metricsTabs.currentWidget() == self.msgMetricsTable:
+            table = self.msgMetricsTable
+            messages = sorted(self.metrics.messages.items())
+            table.setRowCount(len(messages))
+            for row, (id, counter) in enumerate(messages):
+                setRow(table, row, [
+                    Messaging.MsgNameFromID.get(hex(id), "Unknown"), hex(id),
+                    "%.1f" % counter.msgRate, "%.1f" % (counter.byteRate/1024),
+                    str(counter.msgs), "%.1f" % (counter.secondsPerMsg*1e6)])
+        else:
+            table = self.clientMetricsTable
+            clients = list(self.metrics.clients.items())
+            table.setRowCount(len(clients))
+            for row, (client, metrics) in enumerate(clients):
+                queue = getattr(client, 'outboundQueue', None)
+                setRow(table, row, [
+                    client.name,
+                    "%.1f" % metrics.rx.msgRate, "%.1f" % (metrics.rx.byteRate/1024),
+                    "%.1f" % metrics.tx.msgRate, "%.1f" % (metrics.tx.byteRate/1024),
+                    str(len(queue)) if queue is not None else "",
+                    str((queue.queuedBytes+1023)//1024) if queue is not None else "",
+                    str(queue.droppedMsgs) if queue is not None else ""])
+
     def onLogButtonClicked(self):
-        if self.logFile != None:
+        if self.logWriter != None:
             self.stopLog()
         else:
             currentDateTime = QtCore.QDateTime.currentDateTime()
@@ -395,7 +681,10 @@ class MessageServer(QtWidgets.QMainWindow):
                 pluginCreatorFn = plugin_entry_point.connect_function
             except AttributeError:
                 pluginCreatorFn = plugin_entry_point
-            pluginPort = pluginCreatorFn()
+            if param is not None:
+                pluginPort = pluginCreatorFn(param)
+            else:
+                pluginPort = pluginCreatorFn()
             pluginPort.plugin_name = plugin_name
         except:
             a,b,c = sys.exc_info()
@@ -423,6 +712,8 @@ class MessageServer(QtWidgets.QMainWindow):
     def onNewConnection(self, newConnection):
         self.onStatusUpdate("adding connection[" + newConnection.name+"]")
         self.clients[newConnection] = newConnection
+        self.metrics.addClient(newConnection)
+        self.routingTable.invalidate()
         newConnection.messagereceived.connect(self.onMessageReceived)
         newConnection.disconnected.connect(self.onConnectionDied)
         clientRow = self.grid.rowCount()
@@ -454,103 +745,232 @@ class MessageServer(QtWidgets.QMainWindow):
             del self.clients[connection]
         else:
             self.onStatusUpdate("cnx not in list!")
+        self.routingTable.removeClient(connection)
+        self.metrics.removeClient(connection)
+        self.dropHeldMsgs(connection)
 
     def logMsg(self, hdr):
         #write to log, if log is open
-        if self.logFile != None:
+        if self.logWriter != None:
+            # the timestamp is fixed now, but formatting and writing happen on
+            # the log writer's thread
             original_timestamp = self.timestamp_fixer.fix_timestamp(hdr)
-            log = ''
-            if self.logFileType == "csv":
-                msg = Messaging.MsgFactory(hdr)
-                if not msg.MsgName() in self.loggedMsgHeader:
-                    self.loggedMsgHeader[msg.MsgName()] = True
-                    log = msg.csvHeader(timeColumn=True)+'\n'
-                log += msg.toCsv(timeColumn=True)+'\n'
-                log = log.encode('utf-8')
-            elif self.logFileType == "json":
-                msg = Messaging.MsgFactory(hdr)
-                if not msg.MsgName() in self.loggedMsgHeader:
-                    self.loggedMsgHeader[msg.MsgName()] = True
-                    log = msg.jsonHeader()
-                log += msg.toJson(includeHeader=True)+'\n'
-                log = log.encode('utf-8')
-            elif self.logFileType == "bin":
-                log = hdr.rawBuffer().raw
-            self.logFile.write(log)
-            self.logFile.flush()
-            self.timestamp_fixer.restore_timestamp(msg.hdr, original_timestamp)
+            self.logWriter.log(hdr.rawBuffer().raw)
+            self.timestamp_fixer.restore_timestamp(hdr, original_timestamp)
+
+    def onConnectMsg(self, c, hdr):
+        connectMsg = self.networkMsgs.Connect(hdr.rawBuffer())
+        c.name = connectMsg.GetName()
+        c.statusLabel.setText(c.name)
+
+    def onSubscriptionListMsg(self, c, hdr):
+        c.subscriptions = {}
+        subListMsg = self.networkMsgs.SubscriptionList(hdr.rawBuffer())
+        for idx in range(0,self.networkMsgs.SubscriptionList.GetIDs.count):
+            id = subListMsg.GetIDs(idx)
+            if id != 0:
+                c.subscriptions[id] = id
+        self.routingTable.invalidate()
+        self.onStatusUpdate("updating subscription for "+c.name+" to " + ', '.join(hex(x) for x in c.subscriptions.keys()))
+
+    def onMaskedSubscriptionMsg(self, c, hdr):
+        subMsg = self.networkMsgs.MaskedSubscription(hdr.rawBuffer())
+        c.subMask = subMsg.GetMask()
+        c.subValue = subMsg.GetValue()
+        self.routingTable.invalidate()
+        self.onStatusUpdate("updating subscription for "+c.name+" to id & " + hex(c.subMask) + " == " + hex(c.subValue))
+
+    def onRateLimitedSubscriptionMsg(self, c, hdr):
+        subMsg = self.networkMsgs.RateLimitedSubscription(hdr.rawBuffer())
+        limits = self.rateLimits.setdefault(c, rate_limit.RateLimits())
+        try:
+            limits.update(subMsg.GetMask(), subMsg.GetValue(), subMsg.GetMode(enumAsInt=True),
+                          subMsg.GetMaxRate(), subMsg.GetDecimation())
+        except ValueError as ex:
+            self.onStatusUpdate("ignoring rate limited subscription from %s: %s" % (c.name, ex))
+            return
+        # messages held for the old limits are dropped
+        self.dropHeldMsgs(c)
+        if not limits:
+            del self.rateLimits[c]
+        self.routingTable.invalidate()
+        self.onStatusUpdate("updating rate limited subscriptions for "+c.name+" to " + limits.description())
+
+    def onFilteredSubscriptionMsg(self, c, hdr):
+        subMsg = self.networkMsgs.FilteredSubscription(hdr.rawBuffer())
+        filters = self.contentFilters.setdefault(c, ContentFilters())
+        try:
+            filters.update(subMsg.GetMask(), subMsg.GetValue(), subMsg.GetFilter())
+        except ValueError as ex:
+            self.onStatusUpdate("ignoring filtered subscription from %s: %s" % (c.name, ex))
+        if not filters:
+            del self.contentFilters[c]
+        self.routingTable.invalidate()
+        self.onStatusUpdate("updating filtered subscriptions for "+c.name+" to " + filters.description())
+
+    def onStartLogMsg(self, c, hdr):
+        startLog = self.networkMsgs.StartLog(hdr.rawBuffer())
+        self.logFileType = startLog.GetLogFileType()
+        logFileName = startLog.GetLogFileName()
+        if not logFileName:
+            logFileName = QtCore.QDateTime.currentDateTime().toString("yyyyMMdd-hhmmss") + ".log"
+        # fields that older clients don't send, with zero meaning use the
+        # server's setting for that field
+        rotation = LogRotation(
+            self.optionalField(startLog, 'RotateSize')*1024*1024,
+            self.optionalField(startLog, 'RotateDuration'),
+            self.optionalField(startLog, 'RotateInterval'))
+        self.startLog(logFileName, rotation.withDefaults(self.logRotation))
+
+    def onStopLogMsg(self, c, hdr):
+        stopLog = self.networkMsgs.StopLog(hdr.rawBuffer())
+        if self.optionalField(stopLog, 'NextSegment') and self.logWriter != None and self.logWriter.rotation:
+            self.logWriter.rotate()
+        else:
+            self.stopLog()
+
+    # Returns the value of a field, or default if the message is too short to
+    # have it, like messages from clients built before the field was added.
+    def optionalField(self, msg, fieldName, default=0):
+        fieldInfo = Messaging.findFieldInfo(type(msg).fields, fieldName)
+        if fieldInfo is None or not fieldInfo.exists(msg):
+            return default
+        return Messaging.get(msg, fieldInfo)
+
+    def onPrivateSubscriptionListMsg(self, c, hdr):
+        subListMsg = self.networkMsgs.PrivateSubscriptionList(hdr.rawBuffer())
+        privateSubs = []
+        for idx in range(0,self.networkMsgs.PrivateSubscriptionList.GetIDs.count):
+            id = subListMsg.GetIDs(idx)
+            if id == 0:
+                break
+            privateSubs.append(id)
+            if id in self.privateSubscriptions:
+                self.privateSubscriptions[id].append(c)
+            else:
+                self.privateSubscriptions[id] = [c]
+        self.routingTable.invalidate()
+        self.onStatusUpdate("adding Private subscription for "+c.name+": " + ', '.join(hex(x) for x in privateSubs))
+
+    def onBatchMsg(self, c, hdr):
+        try:
+            path, hdrs = batch.unpack(hdr.rawBuffer().raw)
+        except ValueError as ex:
+            self.onStatusUpdate("ignoring batch from %s: %s" % (c.name, ex))
+            return
+        # drop it if it came back around a loop of bridges
+        if batch.SERVER_ID in path:
+            return
+        for msgHdr in hdrs:
+            self.routeMsg(c, msgHdr, path)
+
+    def onBatchLinkMsg(self, c, hdr):
+        linkMsg = self.networkMsgs.BatchLink(hdr.rawBuffer())
+        if not hasattr(c, 'setBatching'):
+            self.onStatusUpdate("ignoring batch request from %s, it can't send batches" % c.name)
+            return
+        compression = linkMsg.GetCompression(enumAsInt=True)
+        if not batch.available(compression):
+            self.onStatusUpdate("%s compression isn't available, sending uncompressed batches to %s" % (linkMsg.GetCompression(), c.name))
+            compression = batch.UNCOMPRESSED
+        c.setBatching(linkMsg.GetMaxBytes(), linkMsg.GetMaxDelay(), compression, linkMsg.GetServerID())
+        self.onStatusUpdate("sending %d byte batches to %s, at most %d ms apart" % (linkMsg.GetMaxBytes(), c.name, linkMsg.GetMaxDelay()))
 
     def onMessageReceived(self, hdr):
-        c = self.sender()
+        self.routeMsg(self.sender(), hdr)
+
+    # Routes a message from client c.  path is the IDs of the servers that
+    # routed it before this one, for messages from another server's batch.
+    def routeMsg(self, c, hdr, path=()):
+        start = time.perf_counter()
+        id = hdr.GetMessageID()
+        # count the message, which is all the metrics work done per message
+        size = hdr.SIZE + hdr.GetDataLength()
+        msgMetrics = self.metrics.messages.get(id)
+        if msgMetrics is None:
+            msgMetrics = self.metrics.message(id)
+        msgMetrics.msgs += 1
+        msgMetrics.bytes += size
+        clientMetrics = self.metrics.clients.get(c)
+        if clientMetrics is not None:
+            clientMetrics.rx.msgs += 1
+            clientMetrics.rx.bytes += size
+
         # check for name, subscription, etc.
-        if hasattr(self.networkMsgs, 'Connect') and hdr.GetMessageID() == self.networkMsgs.Connect.ID:
-            connectMsg = self.networkMsgs.Connect(hdr.rawBuffer())
-            c.name = connectMsg.GetName()
-            c.statusLabel.setText(c.name)
-        elif hasattr(self.networkMsgs, 'SubscriptionList') and hdr.GetMessageID() == self.networkMsgs.SubscriptionList.ID:
-            c.subscriptions = {}
-            subListMsg = self.networkMsgs.SubscriptionList(hdr.rawBuffer())
-            for idx in range(0,self.networkMsgs.SubscriptionList.GetIDs.count):
-                id = subListMsg.GetIDs(idx)
-                if id != 0:
-                    c.subscriptions[id] = id
-            self.onStatusUpdate("updating subscription for "+c.name+" to " + ', '.join(hex(x) for x in c.subscriptions.keys()))
-        elif hasattr(self.networkMsgs, 'MaskedSubscription') and hdr.GetMessageID() == self.networkMsgs.MaskedSubscription.ID:
-            subMsg = self.networkMsgs.MaskedSubscription(hdr.rawBuffer())
-            c.subMask = subMsg.GetMask()
-            c.subValue = subMsg.GetValue()
-            self.onStatusUpdate("updating subscription for "+c.name+" to id & " + hex(c.subMask) + " == " + hex(c.subValue))
-        elif hasattr(self.networkMsgs, 'StartLog') and hdr.GetMessageID() == self.networkMsgs.StartLog.ID:
-            startLog = self.networkMsgs.StartLog(hdr.rawBuffer())
-            self.logFileType = startLog.GetLogFileType()
-            logFileName = startLog.GetLogFileName()
-            if not logFileName:
-                logFileName = QtCore.QDateTime.currentDateTime().toString("yyyyMMdd-hhmmss") + ".log"
-            self.startLog(logFileName)
-        elif hasattr(self.networkMsgs, 'StopLog') and hdr.GetMessageID() == self.networkMsgs.StopLog.ID:
-            self.stopLog()
-        elif hasattr(self.networkMsgs, 'QueryLog') and hdr.GetMessageID() == self.networkMsgs.QueryLog.ID:
-            self.queryLog()
-        elif hasattr(self.networkMsgs, 'ClearLogs') and hdr.GetMessageID() == self.networkMsgs.ClearLogs.ID:
-            # This message was added more for AndroidServer. Plenty of other good ways to delete a log on 
-            # a desktop or other more capable machine. That said, silently eat the request - blindly forwarding
-            # this along could be hazardous.
-            pass
+        handler = self.controlHandlers.get(id)
+        if handler:
+            handler(c, hdr)
+            return
 
-        elif hasattr(self.networkMsgs, 'PrivateSubscriptionList') and  hdr.GetMessageID() == self.networkMsgs.PrivateSubscriptionList.ID:
-            subListMsg = self.networkMsgs.PrivateSubscriptionList(hdr.rawBuffer())
-            privateSubs = []
-            for idx in range(0,self.networkMsgs.PrivateSubscriptionList.GetIDs.count):
-                id = subListMsg.GetIDs(idx)
-                if id == 0:
-                    break
-                privateSubs.append(id)
-                if id in self.privateSubscriptions:
-                    self.privateSubscriptions[id].append(c)
-                else:
-                    self.privateSubscriptions[id] = [c]
-            self.onStatusUpdate("adding Private subscription for "+c.name+": " + ', '.join(hex(x) for x in privateSubs))
-        else:
-            # Log the message
-            self.logMsg(hdr)
+        # Log the message
+        self.logMsg(hdr)
+
+        # Route to all clients that want it
+        payload = None
+        for client, sendBytes, accept, limiter in self.routingTable.destinations(id):
+            if client != c:
+                if accept is not None and not accept(hdr.rawBuffer()):
+                    continue
+                if limiter is not None and not limiter.offer(hdr, start):
+                    if limiter.held is not None:
+                        self.holdMsg(client, sendBytes, id, limiter)
+                    continue
+                try:
+                    if sendBytes:
+                        # encode the message once, and give the same immutable
+                        # bytes to every client that can take them
+                        if payload is None:
+                            payload = hdr.rawBuffer().raw
+                        if path and getattr(client, 'batcher', None) is not None:
+                            # the next batch keeps the path, for loop prevention
+                            sendBytes(payload, id, path)
+                        else:
+                            sendBytes(payload, id)
+                    else:
+                        client.sendMsg(hdr)
+                except Exception as ex:
+                    exc = traceback.format_exc()
+                    self.onStatusUpdate("Exception in server.py while sending to client %s:\n%s" % (client.name, exc))
+        msgMetrics.seconds += time.perf_counter() - start
+
+    def holdMsg(self, client, sendBytes, id, limiter):
+        if limiter in self.heldMsgs:
+            return
+        self.heldMsgs[limiter] = (client, sendBytes, id)
+        self.scheduleHeldMsgs()
+
+    def scheduleHeldMsgs(self):
+        if self.heldMsgs:
+            due = min(limiter.nextTime for limiter in self.heldMsgs)
+            msec = max(0, int((due - time.perf_counter()) * 1000 + 0.999))
+            if not self.heldMsgTimer.isActive() or msec < self.heldMsgTimer.remainingTime():
+                self.heldMsgTimer.start(msec)
+
+    # Sends messages held by rate limits whose interval is up.
+    def sendHeldMsgs(self):
+        now = time.perf_counter()
+        for limiter, (client, sendBytes, id) in list(self.heldMsgs.items()):
+            if limiter.held is None:
+                # a newer message was already sent
+                del self.heldMsgs[limiter]
+            elif limiter.due(now):
+                del self.heldMsgs[limiter]
+                hdr = limiter.take(now)
+                try:
+                    if sendBytes:
+                        sendBytes(hdr.rawBuffer().raw, id)
+                    else:
+                        client.sendMsg(hdr)
+                except Exception as ex:
+                    exc = traceback.format_exc()
+                    self.onStatusUpdate("Exception in server.py while sending to client %s:\n%s" % (client.name, exc))
+        self.scheduleHeldMsgs()
+
+    def dropHeldMsgs(self, client):
+        for limiter, held in list(self.heldMsgs.items()):
+            if held[0] is client:
+                del self.heldMsgs[limiter]
 
-            # Route to all clients
-            for client in self.clients.values():
-                if client != c:
-                    id = hdr.GetMessageID()
-                    if id in client.subscriptions or (id & client.subMask == client.subValue):
-                        try:
-                            if id in self.privateSubscriptions:
-                                # if it's a "private" message, only give it to clients that specifically said they want it
-                                # or to clients that are a hardware link.
-                                if client in self.privateSubscriptions[id] or client.isHardwareLink:
-                                    client.sendMsg(hdr)
-                            else:
-                                client.sendMsg(hdr)
-                        except Exception as ex:
-                            a,b,c = sys.exc_info()
-                            exc = ''.join(traceback.format_exception(a,b,c))
-                            self.onStatusUpdate("Exception in server.py while sending to client %s:\n%s" % (client.name, exc))
     def closeEvent(self, event):
         self.settings.setValue("geometry", self.saveGeometry())
         self.settings.setValue("windowState", self.saveState())
@@ -562,6 +982,7 @@ class MessageServer(QtWidgets.QMainWindow):
                 pass
             pluginPort.stop()
         self.settings.setValue("pluginsLoaded", "|".join(pluginNames))
+        self.stopLog()
         super(MessageServer, self).closeEvent(event)
 
     def readSettings(self):
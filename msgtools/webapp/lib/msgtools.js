@@ -18,6 +18,9 @@ if (typeof msgtools !== "undefined") {
     var MessageNameDictionary = new Map();
     var MessageClassTree = Object.create(null);
 
+    // Most bytes of messages the server packs into each websocket frame, when batching
+    const FRAME_SIZE = 64*1024;
+
     // Base messasge directory we load generated messages from
     // You must call load to initialize this method and load all
     // of our dependent messages.
@@ -54,7 +57,7 @@ if (typeof msgtools !== "undefined") {
         // All the messages this module depends on
         let dependencies = ['Network.Connect', 'Network.MaskedSubscription', 
             'Network.StartLog', 'Network.StopLog', 'Network.LogStatus', 'Network.QueryLog', 
-            'Network.ClearLogs', 'Network.Note']
+            'Network.ClearLogs', 'Network.Note', 'Network.Batch', 'Network.BatchLink']
 
         // Create a set of optional messages
         optionalMessages = new Set(dependencies)
@@ -298,6 +301,10 @@ if (typeof msgtools !== "undefined") {
          *  automatically select secure or insecure sockets based on the page source then pass a host window
          *  into the constructor and set secureSocket to false.  Otherwise this option will always override 
          *  the window.  Default false.
+         *  'batch' - Set to true to have the server pack many messages into each websocket frame, which
+         *  is much faster when there are thousands of messages per second.  Default false.
+         *  'compress' - Set to true to also have the server compress each frame, if the browser has
+         *  DecompressionStream.  Implies batch.  Default false.
          */
         connect(options) {
             // Setup defaults...
@@ -306,6 +313,8 @@ if (typeof msgtools !== "undefined") {
             var secureSocket = false
             var serverOption = false
             var portOption = false
+            this.m_batch = false
+            this.m_compress = false
 
             // Override defaults...
             if (options !== undefined && options !== null && options instanceof Map) {
@@ -322,6 +331,8 @@ if (typeof msgtools !== "undefined") {
                 } 
 
                 secureSocket = options.has('secureSocket') ? options.get('secureSocket') : secureSocket
+                this.m_compress = options.has('compress') && options.get('compress') && typeof DecompressionStream === 'function'
+                this.m_batch = (options.has('batch') && options.get('batch')) || this.m_compress
             }
 
             // If we're already connected then disconnect the old socket and let it go...
@@ -346,6 +357,9 @@ if (typeof msgtools !== "undefined") {
                 }
             }
 
+            // batches from the server that are still being decompressed
+            this.m_unpacking = null
+
             try {
                 // Create a new Websocket for our comms...
                 this.m_WebSocket = new WebSocket(protocol + server + ':' + port);
@@ -382,6 +396,16 @@ if (typeof msgtools !== "undefined") {
                     sm.SetValue(this.m_subscriptionValue)
                     this.sendMessage(sm);
                 }
+
+                var BatchLink = MessageNameDictionary.get('Network.BatchLink')
+                if (this.m_batch && BatchLink !== undefined) {
+                    var bm = new BatchLink();
+                    bm.SetMaxBytes(FRAME_SIZE);
+                    // send a frame each time the server's event loop runs
+                    bm.SetMaxDelay(0);
+                    bm.SetCompression(this.m_compress ? 'Zlib' : 'Uncompressed');
+                    this.sendMessage(bm);
+                }
             }
             catch(e) {
                 // Just move on...
@@ -393,18 +417,82 @@ if (typeof msgtools !== "undefined") {
         }
 
         on_ws_message(event) {
-            var msg = null;
-            var hdr = new NetworkHeader(event.data);
-            var id = hdr.GetMessageID();
-            if(MessageDictionary.has(id))
-            {
-                var msgClass = MessageDictionary.get(id);
-                msg = new msgClass(event.data);
+            var frame = event.data;
+            if (this.m_unpacking === null) {
+                this.m_unpacking = this.unpackMessages(frame, 0, frame.byteLength);
             }
             else {
-                msg = new UnknownMsg(event.data);
+                // wait for batches in earlier frames to be decompressed, so messages stay in order
+                this.m_unpacking = this.m_unpacking.then(() => this.unpackMessages(frame, 0, frame.byteLength));
+            }
+            if (this.m_unpacking !== null) {
+                var unpacking = this.m_unpacking.catch((e) => {
+                    if(typeof this.onerror === "function") {
+                        this.onerror(e);
+                    }
+                }).then(() => {
+                    if (this.m_unpacking === unpacking) {
+                        this.m_unpacking = null;
+                    }
+                });
+                this.m_unpacking = unpacking;
+            }
+        }
+
+        /**
+         * Delivers each message from offset to end of buffer, which is a websocket frame holding one
+         * message, or many when batching, or the inside of a Network.Batch message.  The messages are
+         * views of the buffer, found by walking their headers, so nothing is copied.
+         *
+         * @return null when every message was delivered, or a Promise that resolves when they have
+         * been, if it has to wait for a batch to be decompressed.
+         */
+        unpackMessages(buffer, offset, end) {
+            var hdrSize = NetworkHeader.prototype.MSG_SIZE;
+            var Batch = MessageNameDictionary.get('Network.Batch');
+            while (offset + hdrSize <= end) {
+                var hdr = Object.create(NetworkHeader.prototype);
+                hdr.m_data = new DataView(buffer, offset, hdrSize);
+                var next = offset + hdrSize + hdr.GetDataLength();
+                if (next > end) {
+                    break;
+                }
+                var msgClass = MessageDictionary.get(hdr.GetMessageID());
+                if (msgClass === undefined) {
+                    msgClass = UnknownMsg;
+                }
+                var msg = Object.create(msgClass.prototype);
+                msg.hdr = hdr;
+                msg.m_data = new DataView(buffer, offset + hdrSize, next - offset - hdrSize);
+                if (Batch !== undefined && msgClass === Batch) {
+                    var pending = this.unpackBatch(msg, buffer, offset + hdrSize + Batch.prototype.MSG_SIZE, next);
+                    if (pending !== null) {
+                        return pending.then(() => this.unpackMessages(buffer, next, end));
+                    }
+                }
+                else {
+                    this.deliver(msg);
+                }
+                offset = next;
             }
+            return null;
+        }
+
+        // Delivers the messages in a Network.Batch, whose packed messages are from offset to end of buffer.
+        unpackBatch(batch, buffer, offset, end) {
+            var compression = batch.GetCompression(true);
+            if (compression === 0) {
+                return this.unpackMessages(buffer, offset, end);
+            }
+            if (compression !== 1 || typeof DecompressionStream !== 'function') {
+                // lz4 isn't supported in browsers
+                return null;
+            }
+            var stream = new Blob([new Uint8Array(buffer, offset, end - offset)]).stream().pipeThrough(new DecompressionStream('deflate'));
+            return new Response(stream).arrayBuffer().then((raw) => this.unpackMessages(raw, 0, raw.byteLength));
+        }
 
+        deliver(msg) {
             // do message delivery based on message ID
             MessageClient.dispatch.deliver(msg)
                 
@@ -442,8 +530,10 @@ if (typeof msgtools !== "undefined") {
                 try {
                     var buf = msg.m_data.buffer;
                     var lenFromHdr = msg.hdr.MSG_SIZE + msg.hdr.GetDataLength();
-                    if(lenFromHdr < msg.m_data.buffer.byteLength) {
-                        buf = msg.m_data.buffer.slice(0,lenFromHdr);
+                    // received messages can be views of part of a batched frame
+                    var start = msg.hdr.m_data.byteOffset;
+                    if(start > 0 || lenFromHdr < buf.byteLength) {
+                        buf = buf.slice(start, start + lenFromHdr);
                     }
                     this.m_WebSocket.send(buf);                    
                     retVal = true
@@ -64,7 +64,9 @@ setup(name='msgtools',
                                    'bluetoothRFCOMMQt=msgtools.server.BluetoothRFCOMMQt:plugin_info',
                                    'influxdb=msgtools.database.db_msgserver_plugin:influxdb_plugin_info',
                                    'questdb=msgtools.database.db_msgserver_plugin:questdb_plugin_info',
-                                   'can=msgtools.server.CanPlugin:plugin_info'],
+                                   'can=msgtools.server.CanPlugin:plugin_info',
+                                   'sharedmemory=msgtools.server.SharedMemoryPlugin:plugin_info',
+                                   'multicast=msgtools.server.MulticastPlugin:plugin_info'],
         'msgtools.launcher.plugin': ['scope=msgtools.scope.launcher:info',
                                    'script=msgtools.script.launcher:info',
                                    'server=msgtools.server.launcher:info',